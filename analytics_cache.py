@@ -0,0 +1,166 @@
+#!/usr/bin/env python3
+"""
+Общий кеш аналитики с инвалидацией по поколению записи
+
+@st.cache_data(ttl=60) отдавал устаревшие цифры до минуты после оплаты и при
+этом пересчитывал данные раз в минуту, даже если ничего не менялось. Теперь
+результат запроса хранится в памяти процесса (общий для всех сессий) с ключом
+"имя запроса + параметры" вместе с поколением записи БД (схема v7).
+
+Поколение увеличивают триггеры на приемах, услугах приемов и оплатах
+(create_appointment, update_appointment_status, delete_appointment,
+add_payment_to_service, импорт), изменения клиентов, врачей и услуг отражает
+версия справочников (схема v2). Запись устаревает ровно тогда, когда меняется
+одна из них. Объем ограничен числом записей и оценкой памяти (LRU).
+
+Закешированные значения общие для всех сессий - вызывающий их не изменяет.
+"""
+
+import os
+import sys
+import sqlite3
+import threading
+from collections import OrderedDict
+
+ANALYTICS_CACHE_SIZE = int(os.getenv('ANALYTICS_CACHE_SIZE', '64'))
+ANALYTICS_CACHE_MAX_MB = float(os.getenv('ANALYTICS_CACHE_MAX_MB', '256'))
+
+
+def read_generation(conn):
+    """
+    Поколение данных аналитики: (поколение записи, версия справочников)
+
+    None - таблицы версий нет (схемы v2/v7 не применены), кешировать нельзя.
+    """
+    try:
+        return conn.execute('''
+            SELECT (SELECT version FROM _data_version WHERE name = 'analytics'),
+                   (SELECT version FROM _data_version WHERE name = 'reference')
+        ''').fetchone()
+    except sqlite3.OperationalError:
+        return None
+
+
+def generation_migration_statements():
+    """SQL схемы v7: поколение записи данных аналитики и триггеры, которые его увеличивают"""
+    statements = ["INSERT OR IGNORE INTO _data_version (name, version) VALUES ('analytics', 0)"]
+    for table in ('appointments', 'appointment_services', 'appointment_service_payments'):
+        for op, suffix in (('INSERT', 'ins'), ('UPDATE', 'upd'), ('DELETE', 'del')):
+            statements.append(
+                f"CREATE TRIGGER IF NOT EXISTS _dv_analytics_{table}_{suffix} AFTER {op} ON {table} BEGIN "
+                "UPDATE _data_version SET version = version + 1 WHERE name = 'analytics'; END"
+            )
+    return statements
+
+
+def estimate_size(value):
+    """Оценка занимаемой памяти в байтах: DataFrame - по memory_usage, список строк - по выборке"""
+    memory_usage = getattr(value, 'memory_usage', None)
+    if callable(memory_usage):
+        return int(memory_usage(deep=True).sum())
+    if isinstance(value, (list, tuple)) and value:
+        sample = value[:100]
+        per_item = sum(
+            sys.getsizeof(item) + (sum(sys.getsizeof(field) for field in item) if isinstance(item, tuple) else 0)
+            for item in sample
+        ) / len(sample)
+        return sys.getsizeof(value) + int(per_item * len(value))
+    return sys.getsizeof(value)
+
+
+class AnalyticsCache:
+    """
+    LRU-кеш результатов аналитики, общий для всех сессий процесса
+
+    Счетчики: hits - поколение не изменилось, invalidations - запись была, но
+    данные изменились, misses - записи не было; evictions - вытеснено по объему.
+    """
+
+    def __init__(self, max_entries=ANALYTICS_CACHE_SIZE, max_bytes=int(ANALYTICS_CACHE_MAX_MB * 1024 * 1024)):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self.evictions = 0
+        self.generation = None
+
+    @staticmethod
+    def make_key(name, params):
+        return (name,) + tuple(
+            frozenset(value) if isinstance(value, (list, set, frozenset)) else value for value in params
+        )
+
+    def get(self, conn, name, params, loader):
+        """
+        Результат loader() для запроса name с параметрами params
+
+        loader вызывается без аргументов, только если записи нет или поколение изменилось.
+        """
+        key = self.make_key(name, params)
+        generation = read_generation(conn)
+
+        with self._lock:
+            self.generation = generation
+            entry = self._entries.get(key)
+            if entry is not None:
+                if generation is not None and entry[0] == generation:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return entry[1]
+                self._remove(key)
+                self.invalidations += 1
+            else:
+                self.misses += 1
+
+        value = loader()
+        if generation is not None:
+            self._store(key, generation, value)
+        return value
+
+    def _remove(self, key):
+        _, _, size = self._entries.pop(key)
+        self._bytes -= size
+
+    def _store(self, key, generation, value):
+        size = estimate_size(value)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (generation, value, size)
+            self._bytes += size
+            while self._entries and (len(self._entries) > self.max_entries or self._bytes > self.max_bytes):
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self):
+        with self._lock:
+            requests = self.hits + self.misses + self.invalidations
+            return {
+                'entries': len(self._entries),
+                'bytes': self._bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'invalidations': self.invalidations,
+                'evictions': self.evictions,
+                'hit_ratio': self.hits / requests if requests else 0.0,
+                'generation': self.generation,
+            }
+
+
+_cache = AnalyticsCache()
+
+
+def get_analytics_cache():
+    """Общий кеш аналитики процесса"""
+    return _cache
@@ -10,6 +10,10 @@ import plotly.express as px
 import plotly.graph_objects as go
 from datetime import datetime, date, timedelta
 from database import get_connection
+from analytics_rollup import query_rollup, ROLLUP_COLUMNS
+from analytics_kpi import compute_kpis
+from analytics_cache import get_analytics_cache
+from analytics_snapshots import load_analytics_period
 
 def main():
     """Главная функция аналитического дашборда"""
@@ -91,19 +95,34 @@ def main():
             format_func=lambda x: next((f"{d[1]} {d[2]}" for d in doctors if d[0] == x), x),
             key="analytics_doctors"
         )
+        
+        show_analytics_cache_stats()
     
     # Получаем данные
     if len(date_range) == 2:
         start_date, end_date = date_range
-        df = get_analytics_data(start_date, end_date, selected_doctors)
+        # Графики и KPI строятся по дневной сводке (analytics_daily), а не по каждому приему
+        df = get_analytics_summary(start_date, end_date, selected_doctors)
         
-        if df.empty:
+        if df.empty or df['appointments'].sum() == 0:
             st.warning("📭 Нет данных за выбранный период")
             st.info("💡 Попробуйте выбрать другой период или врачей")
             return
         
+        # Предыдущий период той же длины - для сравнения KPI
+        period_length = (end_date - start_date).days
+        previous_end = start_date - timedelta(days=1)
+        previous_start = previous_end - timedelta(days=period_length)
+        
+        # Все KPI и разрезы графиков считаются одним проходом (analytics_kpi)
+        kpis = compute_kpis(
+            df,
+            previous=get_analytics_summary(previous_start, previous_end, selected_doctors),
+            timeline=get_analytics_summary(start_date, end_date, selected_doctors, ('day',)),
+        )
+        
         # KPI метрики
-        show_kpi_metrics(df)
+        show_kpi_metrics(kpis)
         
         st.markdown("---")
         
@@ -111,12 +130,12 @@ def main():
         col1, col2 = st.columns(2)
         
         with col1:
-            show_appointments_by_status(df)
-            show_appointments_by_doctor(df)
+            show_appointments_by_status(kpis)
+            show_appointments_by_doctor(kpis)
         
         with col2:
-            show_revenue_by_doctor(df)
-            show_appointments_timeline(df)
+            show_revenue_by_doctor(kpis)
+            show_appointments_timeline(kpis)
         
         st.markdown("---")
         
@@ -124,15 +143,16 @@ def main():
         col3, col4 = st.columns(2)
         
         with col3:
-            show_patient_sources(df)
+            show_patient_sources(kpis)
         
         with col4:
-            show_payment_methods(df)
+            show_payment_methods(kpis)
         
         st.markdown("---")
         
-        # Детальная таблица
-        show_detailed_table(df)
+        # Детальная таблица - построчные данные читаются только по запросу
+        if st.checkbox("📋 Показать детальную таблицу приемов", key="analytics_show_details"):
+            show_detailed_table(get_analytics_data(start_date, end_date, selected_doctors))
     else:
         st.info("Выберите период дат в боковой панели")
 
@@ -140,149 +160,108 @@ def main():
 def get_all_doctors_for_filter():
     """Получить всех врачей для фильтра"""
     conn = get_connection()
-    cursor = conn.cursor()
-    
-    cursor.execute('''
-        SELECT id, first_name, last_name
-        FROM doctors
-        WHERE is_active = 1
-        ORDER BY last_name, first_name
-    ''')
-    
-    results = cursor.fetchall()
-    conn.close()
-    return results
+    try:
+        cursor = conn.cursor()
+    
+        cursor.execute('''
+            SELECT id, first_name, last_name
+            FROM doctors
+            WHERE is_active = 1
+            ORDER BY last_name, first_name
+        ''')
+    
+        results = cursor.fetchall()
+        return results
+    finally:
+        conn.close()
 
-@st.cache_data(ttl=60)  # Кеш на 1 минуту
-def get_analytics_data(start_date, end_date, doctor_ids):
-    """Получить данные для аналитики"""
+def get_analytics_summary(start_date, end_date, doctor_ids, dimensions=None):
+    """
+    Сводка за период из analytics_daily, свернутая до измерений dimensions
+    
+    По умолчанию строка на врач × источник × статус × метод оплаты (DEFAULT_DIMENSIONS); ('day',) - по дням.
+    Измененные с прошлого чтения дни пересчитываются перед запросом (analytics_rollup).
+    Результат берется из общего кеша, пока в БД не было записи (analytics_cache)
+    """
     conn = get_connection()
+    try:
+        return get_analytics_cache().get(
+            conn, 'summary', (start_date, end_date, doctor_ids, dimensions),
+            lambda: pd.DataFrame(query_rollup(conn, start_date, end_date, doctor_ids, dimensions),
+                                 columns=ROLLUP_COLUMNS)
+        )
+    finally:
+        conn.close()
+
+def get_analytics_data(start_date, end_date, doctor_ids):
+    """
+    Получить построчные данные приемов для аналитики (стоимость - сумма услуг приема)
     
-    query = '''
-        SELECT 
-            a.id as appointment_id,
-            a.appointment_date,
-            a.appointment_time,
-            a.status,
-            a.actual_duration_minutes,
-            c.first_name || ' ' || c.last_name as client_name,
-            d.first_name || ' ' || d.last_name as doctor_name,
-            d.specialization,
-            s.name as service_name,
-            s.price as service_price,
-            COALESCE(s.price, 0) as total_cost,
-            a.source,
-            COALESCE(
-                (SELECT GROUP_CONCAT(asp.payment_method, ', ') 
-                 FROM appointment_services aps 
-                 LEFT JOIN appointment_service_payments asp ON aps.id = asp.appointment_service_id 
-                 WHERE aps.appointment_id = a.id AND asp.payment_method IS NOT NULL), 
-                'Kaspi QR'
-            ) as payment_methods
-        FROM appointments a
-        JOIN clients c ON a.client_id = c.id
-        JOIN doctors d ON a.doctor_id = d.id
-        JOIN services s ON a.service_id = s.id
-        WHERE a.appointment_date BETWEEN ? AND ?
-    '''
-    
-    params = [start_date, end_date]
-    
-    if doctor_ids:
-        placeholders = ','.join(['?' for _ in doctor_ids])
-        query += f' AND a.doctor_id IN ({placeholders})'
-        params.extend(doctor_ids)
-    
-    query += ' ORDER BY a.appointment_date, a.appointment_time'
-    
-    df = pd.read_sql_query(query, conn, params=params)
-    conn.close()
-    
-    return df
+    Закрытые месяцы читаются из снимков Parquet (analytics_snapshots), открытый период - из БД
+    """
+    conn = get_connection()
+    try:
+        return get_analytics_cache().get(
+            conn, 'details', (start_date, end_date, doctor_ids),
+            lambda: load_analytics_period(conn, start_date, end_date, doctor_ids, today=get_local_today())
+        )
+    finally:
+        conn.close()
+
+def show_analytics_cache_stats():
+    """Панель статистики общего кеша аналитики"""
+    cache = get_analytics_cache()
+    stats = cache.stats()
+    with st.expander("📦 Кеш аналитики"):
+        st.caption(
+            f"Записей: {stats['entries']} из {cache.max_entries}, "
+            f"память: {stats['bytes'] / (1024 * 1024):.1f} из {cache.max_bytes / (1024 * 1024):.0f} МБ"
+        )
+        st.caption(
+            f"Из кеша: {stats['hits']}, впервые: {stats['misses']}, после записи в БД: {stats['invalidations']}, "
+            f"вытеснено: {stats['evictions']} (попаданий {stats['hit_ratio']:.0%})"
+        )
+        if stats['generation'] is not None:
+            st.caption(f"Поколение данных: {stats['generation'][0]}, справочники: {stats['generation'][1]}")
+        if st.button("🧹 Очистить кеш", key="analytics_cache_clear"):
+            cache.clear()
+            st.rerun()
 
-def show_kpi_metrics(df):
+def show_kpi_metrics(kpis):
     """Показать KPI метрики с сравнением периодов"""
     st.subheader("📈 Ключевые показатели")
     
-    # Получаем данные для предыдущего периода
-    if 'analytics_date_range' in st.session_state:
-        current_start = st.session_state['analytics_date_range'][0]
-        current_end = st.session_state['analytics_date_range'][1]
-        period_length = (current_end - current_start).days
-        
-        # Вычисляем предыдущий период
-        previous_end = current_start - timedelta(days=1)
-        previous_start = previous_end - timedelta(days=period_length)
-        
-        # Получаем данные предыдущего периода
-        df_previous = get_analytics_data(previous_start, previous_end, 
-                                        st.session_state.get('analytics_doctors', []))
-    else:
-        df_previous = pd.DataFrame()
+    current, deltas = kpis.totals, kpis.deltas
+    
+    def show_metric(label, value, key):
+        if deltas[key] is None:
+            st.metric(label, value)
+        else:
+            st.metric(label, value, delta=f"{deltas[key]:+.1f}%", delta_color="normal")
     
     col1, col2, col3, col4 = st.columns(4)
     
     # Всего приемов
     with col1:
-        total_appointments = len(df)
-        if not df_previous.empty:
-            prev_appointments = len(df_previous)
-            delta_appointments = total_appointments - prev_appointments
-            delta_pct = (delta_appointments / prev_appointments * 100) if prev_appointments > 0 else 0
-            st.metric("Всего приемов", total_appointments, 
-                     delta=f"{delta_pct:+.1f}%", 
-                     delta_color="normal")
-        else:
-            st.metric("Всего приемов", total_appointments)
+        show_metric("Всего приемов", current['appointments'], 'appointments')
     
     # Общая выручка
     with col2:
-        total_revenue = df['total_cost'].sum()
-        if not df_previous.empty:
-            prev_revenue = df_previous['total_cost'].sum()
-            delta_revenue = total_revenue - prev_revenue
-            delta_pct = (delta_revenue / prev_revenue * 100) if prev_revenue > 0 else 0
-            st.metric("Общая выручка", f"{total_revenue:,.0f} ₸", 
-                     delta=f"{delta_pct:+.1f}%",
-                     delta_color="normal")
-        else:
-            st.metric("Общая выручка", f"{total_revenue:,.0f} ₸")
+        show_metric("Общая выручка", f"{current['revenue']:,.0f} ₸", 'revenue')
     
     # Средний чек
     with col3:
-        avg_check = df['total_cost'].mean()
-        if not df_previous.empty:
-            prev_avg_check = df_previous['total_cost'].mean()
-            delta_check = avg_check - prev_avg_check
-            delta_pct = (delta_check / prev_avg_check * 100) if prev_avg_check > 0 else 0
-            st.metric("Средний чек", f"{avg_check:,.0f} ₸", 
-                     delta=f"{delta_pct:+.1f}%",
-                     delta_color="normal")
-        else:
-            st.metric("Средний чек", f"{avg_check:,.0f} ₸")
+        show_metric("Средний чек", f"{current['avg_check']:,.0f} ₸", 'avg_check')
     
-    # Завершенные приемы
+    # Завершенные приемы (дельта - в процентных пунктах)
     with col4:
-        total_appointments = len(df)
-        completed = len(df[df['status'] == 'прием завершен'])
-        completion_rate = (completed / total_appointments * 100) if total_appointments > 0 else 0
-        
-        if not df_previous.empty:
-            prev_total = len(df_previous)
-            prev_completed = len(df_previous[df_previous['status'] == 'прием завершен'])
-            prev_completion_rate = (prev_completed / prev_total * 100) if prev_total > 0 else 0
-            delta_rate = completion_rate - prev_completion_rate
-            st.metric("Завершено", f"{completed} ({completion_rate:.1f}%)", 
-                     delta=f"{delta_rate:+.1f}%",
-                     delta_color="normal")
-        else:
-            st.metric("Завершено", f"{completed} ({completion_rate:.1f}%)")
+        show_metric("Завершено", f"{current['completed']} ({current['completion_rate']:.1f}%)", 'completion_rate')
 
-def show_appointments_by_status(df):
+def show_appointments_by_status(kpis):
     """График приемов по статусам"""
     st.subheader("📊 Приемы по статусам")
     
-    status_counts = df['status'].value_counts()
+    status_counts = kpis.by_status
     
     fig = px.pie(
         values=status_counts.values,
@@ -298,11 +277,11 @@ def show_appointments_by_status(df):
     
     st.plotly_chart(fig, use_container_width=True)
 
-def show_appointments_by_doctor(df):
+def show_appointments_by_doctor(kpis):
     """График приемов по врачам"""
     st.subheader("👨‍⚕️ Приемы по врачам")
     
-    doctor_counts = df['doctor_name'].value_counts()
+    doctor_counts = kpis.by_doctor
     
     fig = px.bar(
         x=doctor_counts.values,
@@ -314,11 +293,11 @@ def show_appointments_by_doctor(df):
     
     st.plotly_chart(fig, use_container_width=True)
 
-def show_revenue_by_doctor(df):
+def show_revenue_by_doctor(kpis):
     """График выручки по врачам"""
     st.subheader("💰 Выручка по врачам")
     
-    revenue_by_doctor = df.groupby('doctor_name')['total_cost'].sum().sort_values(ascending=True)
+    revenue_by_doctor = kpis.revenue_by_doctor
     
     fig = px.bar(
         x=revenue_by_doctor.values,
@@ -330,12 +309,14 @@ def show_revenue_by_doctor(df):
     
     st.plotly_chart(fig, use_container_width=True)
 
-def show_appointments_timeline(df):
+def show_appointments_timeline(kpis):
     """График динамики приемов"""
     st.subheader("📅 Динамика приемов")
     
-    df['appointment_date'] = pd.to_datetime(df['appointment_date'])
-    timeline = df.groupby('appointment_date').size().reset_index(name='count')
+    timeline = pd.DataFrame({
+        'appointment_date': pd.to_datetime(kpis.timeline.index),
+        'count': kpis.timeline.values,
+    })
     
     fig = px.line(
         timeline,
@@ -384,17 +365,18 @@ def show_detailed_table(df):
         avg = display_df['Стоимость'].mean()
         st.info(f"**Средний чек:** {avg:,.0f} KZT")
 
-def show_patient_sources(df):
+def show_patient_sources(kpis):
     """Показать график источников пациентов (v2.7)"""
     st.subheader("🌐 Источники пациентов")
     
-    if 'source' not in df.columns or df['source'].isna().all():
+    # Приемы без источника в разрез не входят
+    sources = kpis.sources
+    if sources.empty:
         st.info("📊 Данные об источниках пациентов отсутствуют")
         return
     
-    # Подсчитываем количество приемов по источникам
-    source_counts = df['source'].value_counts().reset_index()
-    source_counts.columns = ['Источник', 'Количество']
+    # Количество приемов по источникам
+    source_counts = sources['appointments'].rename_axis('Источник').reset_index(name='Количество')
     
     # Создаем круговую диаграмму
     fig = px.pie(
@@ -424,10 +406,7 @@ def show_patient_sources(df):
     st.markdown("**Детальная статистика:**")
     
     # Добавляем процент и выручку
-    source_stats = df.groupby('source').agg({
-        'appointment_id': 'count',
-        'total_cost': 'sum'
-    }).reset_index()
+    source_stats = sources.rename_axis('source').reset_index()
     
     source_stats.columns = ['Источник', 'Количество приемов', 'Общая выручка']
     source_stats['Процент'] = (source_stats['Количество приемов'] / source_stats['Количество приемов'].sum() * 100).round(1)
@@ -453,38 +432,12 @@ def show_patient_sources(df):
         top_count = source_stats.iloc[0]['Количество приемов']
         st.success(f"🏆 **Лучший источник:** {top_source} ({top_count} приемов)")
 
-def show_payment_methods(df):
+def show_payment_methods(kpis):
     """Показать график методов оплаты (v2.7)"""
     st.subheader("💳 Методы оплаты")
     
-    # Получаем данные по оплатам из БД
-    conn = get_connection()
-    cursor = conn.cursor()
-    
-    # Получаем ID приемов из текущего фильтра
-    appointment_ids = tuple(df['appointment_id'].unique().tolist())
-    
-    if not appointment_ids:
-        st.info("📊 Нет данных по оплатам")
-        return
-    
-    # Запрос для получения оплат
-    placeholders = ','.join(['?' for _ in appointment_ids])
-    query = f'''
-        SELECT 
-            asp.payment_method,
-            SUM(asp.amount) as total_amount,
-            COUNT(DISTINCT asrv.appointment_id) as appointment_count
-        FROM appointment_service_payments asp
-        JOIN appointment_services asrv ON asp.appointment_service_id = asrv.id
-        WHERE asrv.appointment_id IN ({placeholders})
-        GROUP BY asp.payment_method
-        ORDER BY total_amount DESC
-    '''
-    
-    cursor.execute(query, appointment_ids)
-    payment_data = cursor.fetchall()
-    conn.close()
+    # Суммы оплат и число оплаченных приемов по методам
+    payment_data = list(kpis.payments.itertuples(name=None))
     
     if not payment_data:
         st.info("📊 Нет данных по оплатам за выбранный период")
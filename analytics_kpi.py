@@ -0,0 +1,152 @@
+#!/usr/bin/env python3
+"""
+Расчет KPI и данных графиков аналитики за один проход
+
+Раньше каждый график дашборда заново фильтровал и группировал одну и ту же
+сводку (df[df['status'] == ...] для обоих периодов и т.д.). compute_kpis
+переводит статус, врача, источник и метод оплаты в категориальные коды и
+считает все суммы np.bincount по этим кодам; графики получают готовый KpiResult.
+
+Вход - сводка analytics_rollup (колонки ROLLUP_COLUMNS): строки без метода
+оплаты несут приемы и выручку, строки с методом оплаты - оплаты, поэтому
+суммы по любому измерению не удваиваются.
+"""
+
+import numpy as np
+import pandas as pd
+
+COMPLETED_STATUS = 'прием завершен'
+
+
+def _codes(values):
+    """Категориальные коды и категории колонки (пустые значения - категория '')"""
+    categorical = pd.Categorical(values)
+    codes, categories = categorical.codes, categorical.categories
+    if (codes < 0).any():
+        codes = np.where(codes < 0, len(categories), codes)
+        categories = categories.append(pd.Index(['']))
+    return codes, categories
+
+
+def _sums(codes, categories, weights):
+    """Суммы weights по категориям одним проходом"""
+    return pd.Series(np.bincount(codes, weights=weights, minlength=len(categories)), index=categories)
+
+
+def _counts(codes, categories, weights):
+    """Количества по категориям (целые)"""
+    return _sums(codes, categories, weights).round().astype(int)
+
+
+def period_totals(df):
+    """Итоги периода: приемы, выручка, средний чек, завершенные"""
+    if df is None or df.empty:
+        appointments = revenue = completed = 0.0
+    else:
+        counts = df['appointments'].to_numpy(dtype=float)
+        appointments = counts.sum()
+        revenue = df['revenue'].to_numpy(dtype=float).sum()
+        completed = counts[(df['status'] == COMPLETED_STATUS).to_numpy()].sum()
+    return {
+        'appointments': int(appointments),
+        'revenue': float(revenue),
+        'avg_check': revenue / appointments if appointments else 0.0,
+        'completed': int(completed),
+        'completion_rate': completed / appointments * 100 if appointments else 0.0,
+    }
+
+
+class KpiResult:
+    """
+    Итоги и разрезы периода для дашборда
+
+    totals / previous - итоги текущего и предыдущего периода (period_totals),
+    deltas - изменение в процентах (None - сравнивать не с чем; для доли
+    завершенных - в процентных пунктах). Разрезы - pandas.Series по категориям,
+    отсортированные по убыванию; sources и payments - DataFrame.
+    """
+
+    def __init__(self, totals, previous, by_status, by_doctor, revenue_by_doctor, sources, payments, timeline):
+        self.totals = totals
+        self.previous = previous
+        self.by_status = by_status
+        self.by_doctor = by_doctor
+        self.revenue_by_doctor = revenue_by_doctor
+        self.sources = sources
+        self.payments = payments
+        self.timeline = timeline
+        self.deltas = self._deltas()
+
+    def _deltas(self):
+        if not self.previous or not self.previous['appointments']:
+            return {key: None for key in self.totals}
+        deltas = {}
+        for key, value in self.totals.items():
+            if key == 'completion_rate':
+                deltas[key] = value - self.previous[key]
+            else:
+                previous = self.previous[key]
+                deltas[key] = (value - previous) / previous * 100 if previous else 0.0
+        return deltas
+
+
+def compute_kpis(df, previous=None, timeline=None):
+    """
+    Все показатели дашборда по сводке периода
+
+    Args:
+        df: сводка текущего периода (без дня или с днем)
+        previous: сводка предыдущего периода - только для итогов и дельт
+        timeline: сводка по дням (dimensions=('day',)); без нее - по колонке day в df
+    """
+    counts = df['appointments'].to_numpy(dtype=float)
+    revenue = df['revenue'].to_numpy(dtype=float)
+    paid = df['paid_amount'].to_numpy(dtype=float)
+    paid_appointments = df['paid_appointments'].to_numpy(dtype=float)
+
+    status_codes, statuses = _codes(df['status'])
+    doctor_codes, doctors = _codes(df['doctor_name'])
+    source_codes, sources = _codes(df['source'])
+    method_codes, methods = _codes(df['payment_method'])
+
+    by_status = _counts(status_codes, statuses, counts)
+    completed = by_status.get(COMPLETED_STATUS, 0)
+    total_appointments = counts.sum()
+    total_revenue = revenue.sum()
+    totals = {
+        'appointments': int(total_appointments),
+        'revenue': float(total_revenue),
+        'avg_check': total_revenue / total_appointments if total_appointments else 0.0,
+        'completed': int(completed),
+        'completion_rate': completed / total_appointments * 100 if total_appointments else 0.0,
+    }
+
+    by_doctor = _counts(doctor_codes, doctors, counts)
+    source_table = pd.DataFrame({
+        'appointments': _counts(source_codes, sources, counts),
+        'revenue': _sums(source_codes, sources, revenue),
+    })
+    payment_table = pd.DataFrame({
+        'total_amount': _sums(method_codes, methods, paid),
+        'appointment_count': _counts(method_codes, methods, paid_appointments),
+    })
+
+    # '' - приемы без источника / строки приемов без метода оплаты
+    source_table = source_table.drop(index='', errors='ignore')
+    payment_table = payment_table.drop(index='', errors='ignore')
+
+    if timeline is None:
+        timeline = df
+    day_codes, days = _codes(timeline['day'])
+    day_counts = _counts(day_codes, days, timeline['appointments'].to_numpy(dtype=float))
+
+    return KpiResult(
+        totals=totals,
+        previous=period_totals(previous) if previous is not None else None,
+        by_status=by_status[by_status > 0].sort_values(ascending=False),
+        by_doctor=by_doctor[by_doctor > 0].sort_values(ascending=False),
+        revenue_by_doctor=_sums(doctor_codes, doctors, revenue).sort_values(),
+        sources=source_table[source_table['appointments'] > 0].sort_values('appointments', ascending=False),
+        payments=payment_table[payment_table['total_amount'] > 0].sort_values('total_amount', ascending=False),
+        timeline=day_counts[day_counts > 0].sort_index(),
+    )
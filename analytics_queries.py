@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+"""
+Построчные запросы аналитики по приемам
+
+Стоимость приема и методы оплаты раньше считались коррелированным подзапросом
+для каждой строки приема. Теперь оплаты агрегируются одним GROUP BY по приемам
+периода и присоединяются к приемам по appointment_id.
+
+Стоимость приема - сумма цен его услуг (appointment_services.price), как в
+форме оплаты, а не цена основной услуги. Начиная со схемы v8 она хранится в
+appointments.total_cost (appointment_balance), отдельный GROUP BY услуг не нужен.
+"""
+
+# Метод оплаты, который показывался для приемов без оплат
+DEFAULT_PAYMENT_METHOD = 'Kaspi QR'
+
+ANALYTICS_COLUMNS = [
+    'appointment_id', 'appointment_date', 'appointment_time', 'status', 'actual_duration_minutes',
+    'client_name', 'doctor_id', 'doctor_name', 'specialization', 'service_name', 'service_price', 'total_cost',
+    'paid_amount', 'source', 'payment_methods',
+]
+
+
+def appointment_payments_sql(appointment_filter):
+    """Подзапрос (appointment_id, paid_amount, payment_methods): оплаты по приемам a, отобранным условием"""
+    return f'''
+        SELECT aps.appointment_id, SUM(asp.amount) AS paid_amount,
+               GROUP_CONCAT(asp.payment_method, ', ') AS payment_methods
+        FROM appointments a
+        JOIN appointment_services aps ON aps.appointment_id = a.id
+        JOIN appointment_service_payments asp ON asp.appointment_service_id = aps.id
+        WHERE {appointment_filter} AND asp.payment_method IS NOT NULL
+        GROUP BY aps.appointment_id
+    '''
+
+
+def fetch_analytics_rows(conn, start_date, end_date, doctor_ids=None):
+    """
+    Приемы за период с клиентом, врачом, стоимостью и оплатами (колонки ANALYTICS_COLUMNS)
+
+    Сортировка по дате и времени приема.
+    """
+    appointment_filter = "a.appointment_date BETWEEN ? AND ?"
+    period = [str(start_date), str(end_date)]
+    if doctor_ids:
+        appointment_filter += f" AND a.doctor_id IN ({', '.join('?' * len(doctor_ids))})"
+        period.extend(doctor_ids)
+
+    query = f'''
+        SELECT
+            a.id,
+            a.appointment_date,
+            a.appointment_time,
+            a.status,
+            a.actual_duration_minutes,
+            c.first_name || ' ' || c.last_name,
+            a.doctor_id,
+            d.first_name || ' ' || d.last_name,
+            d.specialization,
+            s.name,
+            s.price,
+            a.total_cost,
+            COALESCE(p.paid_amount, 0),
+            a.source,
+            COALESCE(p.payment_methods, ?)
+        FROM appointments a
+        JOIN clients c ON a.client_id = c.id
+        JOIN doctors d ON a.doctor_id = d.id
+        JOIN services s ON a.service_id = s.id
+        LEFT JOIN ({appointment_payments_sql(appointment_filter)}) p ON p.appointment_id = a.id
+        WHERE {appointment_filter}
+        ORDER BY a.appointment_date, a.appointment_time
+    '''
+    params = [DEFAULT_PAYMENT_METHOD] + period + period
+    return conn.execute(query, params).fetchall()
@@ -0,0 +1,280 @@
+#!/usr/bin/env python3
+"""
+Материализованная дневная сводка для аналитики
+
+analytics_daily хранит по строке на день × врач × услуга × источник × статус ×
+метод оплаты (услуга - основная услуга приема, appointments.service_id).
+Строки с payment_method = '' несут показатели приемов (количество, выручка -
+сумма услуг приема из appointments.total_cost, длительность), строки с методом
+оплаты - оплаты этим методом (сумма и число приемов). Так сумма appointments
+по любому срезу не удваивается.
+
+Триггеры на приемах, услугах приемов и оплатах только отмечают измененный день
+в _analytics_dirty_days; перед чтением сводки refresh_rollup пересчитывает одним
+GROUP BY только отмеченные дни. query_rollup сворачивает сводку до нужных
+графику измерений в SQL - дашборд получает сотни строк вместо строки на прием.
+"""
+
+import sqlite3
+
+from db_pool import write_transaction
+
+# Весь диапазон пересчитывается (новая схема, ручная пересборка)
+ALL_DAYS = '*'
+
+# Измерения сводки (порядок первичного ключа) и суммируемые показатели
+ROLLUP_DIMENSIONS = ['day', 'doctor_id', 'service_id', 'source', 'status', 'payment_method']
+ROLLUP_MEASURES = ['appointments', 'revenue', 'duration_sum', 'duration_count', 'paid_amount', 'paid_appointments']
+ROLLUP_COLUMNS = ['day', 'doctor_id', 'doctor_name', 'service_id', 'service_name', 'source', 'status',
+                  'payment_method'] + ROLLUP_MEASURES
+
+# Измерения по умолчанию - только те, что читают KPI и графики дашборда (analytics_kpi):
+# разрез по услуге увеличил бы свертку за год с сотен строк до десятков тысяч
+DEFAULT_DIMENSIONS = ['doctor_id', 'source', 'status', 'payment_method']
+
+
+def _dirty_trigger(name, event, table, day_sql):
+    return (
+        f"CREATE TRIGGER IF NOT EXISTS {name} AFTER {event} ON {table} BEGIN "
+        f"INSERT OR IGNORE INTO _analytics_dirty_days (day) SELECT day FROM ({day_sql}) WHERE day IS NOT NULL; END"
+    )
+
+
+def rollup_migration_statements():
+    """SQL схемы: таблица сводки, очередь измененных дней и триггеры"""
+    statements = [
+        '''CREATE TABLE IF NOT EXISTS analytics_daily (
+            day DATE NOT NULL,
+            doctor_id INTEGER NOT NULL,
+            source TEXT NOT NULL,
+            status TEXT NOT NULL,
+            payment_method TEXT NOT NULL,
+            appointments INTEGER NOT NULL DEFAULT 0,
+            revenue REAL NOT NULL DEFAULT 0,
+            duration_sum INTEGER NOT NULL DEFAULT 0,
+            duration_count INTEGER NOT NULL DEFAULT 0,
+            paid_amount REAL NOT NULL DEFAULT 0,
+            paid_appointments INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (day, doctor_id, source, status, payment_method)
+        ) WITHOUT ROWID''',
+        "CREATE TABLE IF NOT EXISTS _analytics_dirty_days (day TEXT PRIMARY KEY) WITHOUT ROWID",
+    ]
+    for event, suffix in (('INSERT', 'ins'), ('UPDATE', 'upd'), ('DELETE', 'del')):
+        rows = [row for row in ('NEW', 'OLD') if not (row == 'NEW' and event == 'DELETE')
+                and not (row == 'OLD' and event == 'INSERT')]
+        statements.append(_dirty_trigger(
+            f"_ad_appointments_{suffix}", event, 'appointments',
+            " UNION ".join(f"SELECT {row}.appointment_date AS day" for row in rows)
+        ))
+        statements.append(_dirty_trigger(
+            f"_ad_appointment_services_{suffix}", event, 'appointment_services',
+            " UNION ".join(
+                f"SELECT appointment_date AS day FROM appointments WHERE id = {row}.appointment_id" for row in rows
+            )
+        ))
+        statements.append(_dirty_trigger(
+            f"_ad_payments_{suffix}", event, 'appointment_service_payments',
+            " UNION ".join(
+                "SELECT a.appointment_date AS day FROM appointment_services aps "
+                f"JOIN appointments a ON a.id = aps.appointment_id WHERE aps.id = {row}.appointment_service_id"
+                for row in rows
+            )
+        ))
+    statements.append(f"INSERT OR IGNORE INTO _analytics_dirty_days (day) VALUES ('{ALL_DAYS}')")
+    return statements
+
+
+def revenue_migration_statements():
+    """
+    SQL схемы v5: выручка - сумма услуг приема (appointment_services.price), а не цена услуги
+
+    Цена в справочнике больше не влияет на сводку, триггер на services не нужен;
+    сводка пересчитывается целиком.
+    """
+    return [
+        "DROP TRIGGER IF EXISTS _ad_services_price",
+        f"INSERT OR IGNORE INTO _analytics_dirty_days (day) VALUES ('{ALL_DAYS}')",
+    ]
+
+
+def month_version_migration_statements():
+    """
+    SQL схемы v6: версии месяцев для снимков закрытых периодов (analytics_snapshots)
+
+    refresh_rollup увеличивает версию месяца каждого пересчитанного дня; строка
+    ALL_DAYS - версия полной пересборки, она меняет ключ всех месяцев сразу.
+    """
+    return [
+        "CREATE TABLE IF NOT EXISTS _analytics_month_versions ("
+        "month TEXT PRIMARY KEY, version INTEGER NOT NULL DEFAULT 0) WITHOUT ROWID",
+        f"INSERT OR IGNORE INTO _analytics_month_versions (month, version) VALUES ('{ALL_DAYS}', 0)",
+    ]
+
+
+def service_migration_statements():
+    """
+    SQL схемы v9: услуга приема - измерение сводки
+
+    Первичный ключ таблицы WITHOUT ROWID не меняется через ALTER, поэтому таблица
+    пересоздается и пересчитывается целиком. Смену услуги приема отмечают уже
+    существующие триггеры _ad_appointments_upd (любое изменение строки приема).
+    """
+    return [
+        "DROP TABLE IF EXISTS analytics_daily",
+        '''CREATE TABLE analytics_daily (
+            day DATE NOT NULL,
+            doctor_id INTEGER NOT NULL,
+            service_id INTEGER NOT NULL,
+            source TEXT NOT NULL,
+            status TEXT NOT NULL,
+            payment_method TEXT NOT NULL,
+            appointments INTEGER NOT NULL DEFAULT 0,
+            revenue REAL NOT NULL DEFAULT 0,
+            duration_sum INTEGER NOT NULL DEFAULT 0,
+            duration_count INTEGER NOT NULL DEFAULT 0,
+            paid_amount REAL NOT NULL DEFAULT 0,
+            paid_appointments INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (day, doctor_id, service_id, source, status, payment_method)
+        ) WITHOUT ROWID''',
+        f"INSERT OR IGNORE INTO _analytics_dirty_days (day) VALUES ('{ALL_DAYS}')",
+    ]
+
+
+def _bump_month_versions(conn, all_days):
+    """Новые версии месяцев пересчитанных дней (если таблица версий есть)"""
+    if all_days:
+        sql = (f"INSERT INTO _analytics_month_versions (month, version) VALUES ('{ALL_DAYS}', 1) "
+               "ON CONFLICT (month) DO UPDATE SET version = version + 1")
+    else:
+        sql = ("INSERT INTO _analytics_month_versions (month, version) "
+               "SELECT DISTINCT substr(day, 1, 7), 1 FROM _analytics_dirty_days WHERE true "
+               "ON CONFLICT (month) DO UPDATE SET version = version + 1")
+    try:
+        conn.execute(sql)
+    except sqlite3.OperationalError as e:
+        if 'no such table' not in str(e):
+            raise
+
+
+def _refresh_days(conn, day_filter, params=()):
+    """Пересчитать строки сводки для дней, выбранных условием day_filter по a.appointment_date"""
+    conn.execute(f"DELETE FROM analytics_daily WHERE {day_filter.replace('a.appointment_date', 'day')}", params)
+    conn.execute(f'''
+        INSERT INTO analytics_daily (day, doctor_id, service_id, source, status, payment_method,
+                                     appointments, revenue, duration_sum, duration_count)
+        SELECT a.appointment_date, a.doctor_id, COALESCE(a.service_id, 0), COALESCE(a.source, ''),
+               COALESCE(a.status, ''), '',
+               COUNT(*), SUM(a.total_cost),
+               SUM(COALESCE(a.actual_duration_minutes, 0)), COUNT(a.actual_duration_minutes)
+        FROM appointments a
+        WHERE {day_filter}
+        GROUP BY a.appointment_date, a.doctor_id, COALESCE(a.service_id, 0), COALESCE(a.source, ''),
+                 COALESCE(a.status, '')
+    ''', params)
+    conn.execute(f'''
+        INSERT INTO analytics_daily (day, doctor_id, service_id, source, status, payment_method,
+                                     paid_amount, paid_appointments)
+        SELECT a.appointment_date, a.doctor_id, COALESCE(a.service_id, 0), COALESCE(a.source, ''),
+               COALESCE(a.status, ''), asp.payment_method, SUM(asp.amount), COUNT(DISTINCT a.id)
+        FROM appointments a
+        JOIN appointment_services aps ON aps.appointment_id = a.id
+        JOIN appointment_service_payments asp ON asp.appointment_service_id = aps.id
+        WHERE {day_filter} AND asp.payment_method <> ''
+        GROUP BY a.appointment_date, a.doctor_id, COALESCE(a.service_id, 0), COALESCE(a.source, ''),
+                 COALESCE(a.status, ''), asp.payment_method
+    ''', params)
+
+
+def refresh_rollup(conn):
+    """
+    Пересчитать дни, измененные с прошлого обновления
+
+    Returns:
+        int: количество пересчитанных дней (-1 - пересчитана вся сводка)
+    """
+    try:
+        dirty = [row[0] for row in conn.execute("SELECT day FROM _analytics_dirty_days")]
+    except sqlite3.OperationalError:
+        return 0
+    if not dirty:
+        return 0
+
+    # Одна транзакция: новые отметки, появившиеся после чтения очереди, не будут потеряны -
+    # запись в БД в это время ждет (один писатель). Внутри чужой транзакции - точка сохранения
+    with write_transaction(conn, 'refresh_rollup'):
+        dirty = [row[0] for row in conn.execute("SELECT day FROM _analytics_dirty_days")]
+        _bump_month_versions(conn, ALL_DAYS in dirty)
+        if ALL_DAYS in dirty:
+            conn.execute("DELETE FROM analytics_daily")
+            _refresh_days(conn, "1 = 1")
+            refreshed = -1
+        else:
+            _refresh_days(conn, "a.appointment_date IN (SELECT day FROM _analytics_dirty_days)")
+            refreshed = len(dirty)
+        conn.execute("DELETE FROM _analytics_dirty_days")
+    return refreshed
+
+
+def rebuild_rollup(conn):
+    """Пересобрать сводку целиком"""
+    conn.execute(f"INSERT OR IGNORE INTO _analytics_dirty_days (day) VALUES ('{ALL_DAYS}')")
+    conn.commit()
+    return refresh_rollup(conn)
+
+
+def month_version(conn, month):
+    """
+    Версия данных месяца 'YYYY-MM': (версия месяца, версия полной пересборки)
+
+    Сначала досчитываются измененные дни. None - таблицы версий нет (схема v6 не применена).
+    """
+    refresh_rollup(conn)
+    try:
+        return conn.execute('''
+            SELECT (SELECT COALESCE(MAX(version), 0) FROM _analytics_month_versions WHERE month = ?),
+                   (SELECT COALESCE(MAX(version), 0) FROM _analytics_month_versions WHERE month = ?)
+        ''', (month, ALL_DAYS)).fetchone()
+    except sqlite3.OperationalError:
+        return None
+
+
+def query_rollup(conn, start_date, end_date, doctor_ids=None, dimensions=None):
+    """
+    Сводка за период (колонки ROLLUP_COLUMNS), свернутая до измерений dimensions
+
+    Измерения не из dimensions возвращаются как None, показатели по ним суммируются;
+    по умолчанию - DEFAULT_DIMENSIONS. Сначала досчитываются измененные дни,
+    поэтому данные всегда актуальны.
+    """
+    if dimensions is None:
+        dimensions = DEFAULT_DIMENSIONS
+    unknown = set(dimensions) - set(ROLLUP_DIMENSIONS)
+    if unknown:
+        raise ValueError(f"Неизвестные измерения сводки: {sorted(unknown)}")
+
+    refresh_rollup(conn)
+    group_by = [name for name in ROLLUP_DIMENSIONS if name in dimensions]
+    select = [f"r.{name}" if name in group_by else f"NULL AS {name}" for name in ROLLUP_DIMENSIONS]
+    inner = f'''
+        SELECT {', '.join(select)}, {', '.join(f'SUM(r.{name}) AS {name}' for name in ROLLUP_MEASURES)}
+        FROM analytics_daily r
+        WHERE r.day BETWEEN ? AND ?
+    '''
+    params = [str(start_date), str(end_date)]
+    if doctor_ids:
+        inner += f" AND r.doctor_id IN ({', '.join('?' * len(doctor_ids))})"
+        params.extend(doctor_ids)
+    if group_by:
+        inner += f" GROUP BY {', '.join(f'r.{name}' for name in group_by)}"
+
+    # Имена врачей и услуг подставляются уже после свертки
+    query = f'''
+        SELECT g.day, g.doctor_id, d.first_name || ' ' || d.last_name, g.service_id, s.name,
+               g.source, g.status, g.payment_method,
+               {', '.join(f'g.{name}' for name in ROLLUP_MEASURES)}
+        FROM ({inner}) g
+        LEFT JOIN doctors d ON d.id = g.doctor_id
+        LEFT JOIN services s ON s.id = g.service_id
+        ORDER BY g.day, g.doctor_id
+    '''
+    return conn.execute(query, params).fetchall()
@@ -0,0 +1,172 @@
+#!/usr/bin/env python3
+"""
+Колоночные снимки аналитики закрытых месяцев (Parquet)
+
+Прошедшие месяцы почти не меняются, а построчные данные приемов за них
+перечитывались из SQLite при каждом истечении кеша дашборда. Теперь каждый
+закрытый месяц хранится файлом Parquet (zstd, текстовые колонки - categorical),
+а из SQLite читается только открытый период.
+
+Снимок месяца действителен, пока не изменились версия месяца (analytics_rollup,
+схема v6), версия полной пересборки сводки и версия справочников (схема v2).
+Иначе месяц перечитывается и файл перезаписывается.
+
+Без pandas/pyarrow снимки отключены - данные читаются из SQLite, как раньше.
+"""
+
+import os
+import glob
+import sqlite3
+from datetime import date, timedelta
+
+from analytics_queries import fetch_analytics_rows, ANALYTICS_COLUMNS
+from analytics_rollup import month_version
+
+try:
+    import pandas as pd
+except ImportError:
+    pd = None
+
+try:
+    import pyarrow  # noqa: F401 - движок Parquet для pandas
+    SNAPSHOTS_AVAILABLE = pd is not None
+except ImportError:
+    SNAPSHOTS_AVAILABLE = False
+
+ANALYTICS_SNAPSHOT_DIR = os.getenv('ANALYTICS_SNAPSHOT_DIR', 'analytics_snapshots')
+SNAPSHOT_COMPRESSION = os.getenv('ANALYTICS_SNAPSHOT_COMPRESSION', 'zstd')
+
+# Колонки с небольшим числом повторяющихся значений
+CATEGORICAL_COLUMNS = ['status', 'client_name', 'doctor_name', 'specialization', 'service_name', 'source',
+                       'payment_methods']
+
+
+def month_start(day):
+    return day.replace(day=1)
+
+
+def next_month(day):
+    return (day.replace(day=1) + timedelta(days=32)).replace(day=1)
+
+
+def split_period(start_date, end_date, today=None):
+    """
+    Разбить период на закрытые месяцы и открытый хвост
+
+    Returns:
+        tuple: (список первых дней закрытых месяцев, пересекающих период,
+                (начало, конец) открытой части или None)
+    """
+    today = today or date.today()
+    open_from = month_start(today)
+    months = []
+    month = month_start(start_date)
+    while month < open_from and month <= end_date:
+        months.append(month)
+        month = next_month(month)
+    live = (max(start_date, open_from), end_date) if end_date >= open_from else None
+    return months, live
+
+
+def snapshot_key(conn, month):
+    """
+    Ключ данных месяца: (версия месяца, версия пересборки, версия справочников)
+
+    None - версии не ведутся (схемы v2/v6 не применены), снимок использовать нельзя.
+    """
+    versions = month_version(conn, month.strftime('%Y-%m'))
+    if versions is None:
+        return None
+    try:
+        reference = conn.execute("SELECT version FROM _data_version WHERE name = 'reference'").fetchone()
+    except sqlite3.OperationalError:
+        return None
+    if reference is None:
+        return None
+    return tuple(versions) + (reference[0],)
+
+
+def snapshot_path(month, key, snapshot_dir=ANALYTICS_SNAPSHOT_DIR):
+    return os.path.join(
+        snapshot_dir, f"analytics_{month.strftime('%Y-%m')}_m{key[0]}_e{key[1]}_r{key[2]}.parquet"
+    )
+
+
+def to_frame(rows):
+    """DataFrame построчной аналитики с categorical-колонками"""
+    df = pd.DataFrame(rows, columns=ANALYTICS_COLUMNS)
+    for column in CATEGORICAL_COLUMNS:
+        df[column] = df[column].astype('category')
+    return df
+
+
+def load_month(conn, month, snapshot_dir=ANALYTICS_SNAPSHOT_DIR):
+    """
+    Данные закрытого месяца: из снимка, если он актуален, иначе из SQLite с записью нового снимка
+
+    Returns:
+        tuple: (DataFrame, True - прочитан снимок)
+    """
+    key = snapshot_key(conn, month)
+    if key is None:
+        return to_frame(fetch_analytics_rows(conn, month, next_month(month) - timedelta(days=1))), False
+
+    path = snapshot_path(month, key, snapshot_dir)
+    if os.path.exists(path):
+        try:
+            return pd.read_parquet(path), True
+        except Exception as e:
+            print(f"⚠️ Снимок аналитики {path} не читается, месяц перечитывается: {e}")
+
+    df = to_frame(fetch_analytics_rows(conn, month, next_month(month) - timedelta(days=1)))
+    os.makedirs(snapshot_dir, exist_ok=True)
+    # Устаревшие снимки месяца удаляются, новый пишется атомарно
+    for stale in glob.glob(os.path.join(snapshot_dir, f"analytics_{month.strftime('%Y-%m')}_*.parquet")):
+        if stale != path:
+            os.remove(stale)
+    tmp_path = path + '.tmp'
+    try:
+        df.to_parquet(tmp_path, compression=SNAPSHOT_COMPRESSION, index=False)
+        os.replace(tmp_path, path)
+    except Exception as e:
+        print(f"⚠️ Не удалось записать снимок аналитики {path}: {e}")
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    return df, False
+
+
+def load_analytics_period(conn, start_date, end_date, doctor_ids=None, snapshot_dir=ANALYTICS_SNAPSHOT_DIR,
+                          today=None):
+    """
+    Построчная аналитика за период (колонки ANALYTICS_COLUMNS): закрытые месяцы из снимков,
+    открытый период из SQLite
+
+    Снимок хранит месяц целиком по всем врачам, период и врачи отбираются после чтения.
+    """
+    if not SNAPSHOTS_AVAILABLE:
+        return pd.DataFrame(fetch_analytics_rows(conn, start_date, end_date, doctor_ids), columns=ANALYTICS_COLUMNS)
+
+    months, live = split_period(start_date, end_date, today)
+    frames = []
+    for month in months:
+        df, _ = load_month(conn, month, snapshot_dir)
+        frames.append(df)
+    if live is not None:
+        frames.append(to_frame(fetch_analytics_rows(conn, live[0], live[1], doctor_ids)))
+
+    df = pd.concat(frames, ignore_index=True) if frames else to_frame([])
+    mask = (df['appointment_date'] >= str(start_date)) & (df['appointment_date'] <= str(end_date))
+    if doctor_ids:
+        mask &= df['doctor_id'].isin(list(doctor_ids))
+    df = df[mask].reset_index(drop=True)
+    # После concat категории разных месяцев сливаются в object - восстанавливаем
+    for column in CATEGORICAL_COLUMNS:
+        if df[column].dtype != 'category':
+            df[column] = df[column].astype('category')
+    return df
+
+
+def snapshot_stats(snapshot_dir=ANALYTICS_SNAPSHOT_DIR):
+    """Число снимков и их общий размер в байтах"""
+    files = glob.glob(os.path.join(snapshot_dir, 'analytics_*.parquet'))
+    return {'files': len(files), 'bytes': sum(os.path.getsize(path) for path in files)}
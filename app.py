@@ -15,6 +15,24 @@ import import_manager
 import user_management
 from database import init_database, create_default_users, create_default_data, migrate_old_appointments
 
+def show_sync_indicator():
+    """Неблокирующий индикатор синхронизации с Git (читает только счетчики фонового worker)"""
+    try:
+        from git_sync import GIT_SYNC_ENABLED, get_sync_metrics
+    except ImportError:
+        return
+    if not GIT_SYNC_ENABLED:
+        return
+    
+    metrics = get_sync_metrics()
+    pending = max(metrics['queue_depth'], metrics['journal_pending'])
+    if pending and metrics['last_error'] and metrics['last_error'] > (metrics['last_success'] or 0):
+        st.caption(f"⚠️ Ожидает синхронизации с Git: {pending} (повтор, задержка {metrics['lag_seconds']:.0f} с)")
+    elif pending:
+        st.caption(f"🔄 Ожидает синхронизации с Git: {pending}")
+    else:
+        st.caption("✅ Данные синхронизированы с Git")
+
 def main():
     """Главная функция приложения версии 2.0"""
     st.set_page_config(
@@ -113,6 +131,7 @@ def main():
         
         # Показываем информацию о пользователе
         show_user_info()
+        show_sync_indicator()
     
     # Главное меню
     st.title("Jardem - Система CRM и управления данными Медицинского центра")
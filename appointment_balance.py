@@ -0,0 +1,167 @@
+#!/usr/bin/env python3
+"""
+Стоимость, оплачено и статус оплаты прямо в строке приема
+
+Остаток приема каждый раз пересчитывался SUM по appointment_services и
+JOIN/GROUP BY по appointment_service_payments. Теперь appointments хранит
+total_cost, total_paid и payment_status (схема v8), их поддерживают триггеры на
+услугах приема и оплатах: после каждой записи итоги приема пересчитываются по
+его строкам (несколько строк по индексу), поэтому порядок каскадного удаления
+и смена appointment_id у строки не нарушают итогов. Чтение остатка - одна
+строка приема; список неоплаченных приемов читается из частичного индекса.
+
+check_balances сверяет колонки с пересчетом и при repair=True исправляет расхождения.
+"""
+
+# Правило статуса как в payments.payment_status_for (допуск 0.005)
+BALANCE_EPSILON = 0.005
+
+UNPAID_CONDITION = f"total_cost - total_paid > {BALANCE_EPSILON}"
+
+BALANCE_COLUMNS = ('total_cost', 'total_paid')
+
+_COST_SQL = "(SELECT COALESCE(SUM(price), 0) FROM appointment_services WHERE appointment_id = {id})"
+_PAID_SQL = '''(SELECT COALESCE(SUM(asp.amount), 0)
+    FROM appointment_service_payments asp
+    JOIN appointment_services aps ON asp.appointment_service_id = aps.id
+    WHERE aps.appointment_id = {id})'''
+_STATUS_SQL = f'''CASE WHEN total_paid = 0 THEN 'не оплачено'
+    WHEN total_paid >= total_cost - {BALANCE_EPSILON} THEN 'оплачено'
+    ELSE 'частично оплачено' END'''
+
+
+def _recompute_sql(appointment_id_sql, condition=''):
+    """
+    UPDATE итогов приема appointment_id_sql по его строкам
+
+    Статус считается вторым присваиванием: в SQLite SET видит старые значения колонок.
+    """
+    where = f"id = {appointment_id_sql}" + (f" AND {condition}" if condition else '')
+    return (
+        f"UPDATE appointments SET total_cost = {_COST_SQL.format(id=appointment_id_sql)}, "
+        f"total_paid = {_PAID_SQL.format(id=appointment_id_sql)} WHERE {where}; "
+        f"UPDATE appointments SET payment_status = {_STATUS_SQL} WHERE {where};"
+    )
+
+
+def add_balance_columns(conn):
+    """Колонки итогов приема; уже существующие пропускаются (миграция может выполняться повторно)"""
+    existing = {row[1] for row in conn.execute("PRAGMA table_info(appointments)")}
+    for column in BALANCE_COLUMNS:
+        if column not in existing:
+            conn.execute(f"ALTER TABLE appointments ADD COLUMN {column} REAL NOT NULL DEFAULT 0")
+
+
+def balance_migration_statements():
+    """Шаги схемы v8: колонки итогов приема, заполнение, триггеры и индекс неоплаченных"""
+    line_of = "(SELECT appointment_id FROM appointment_services WHERE id = {row}.appointment_service_id)"
+    statements = [
+        add_balance_columns,
+        f"UPDATE appointments SET total_cost = {_COST_SQL.format(id='appointments.id')}, "
+        f"total_paid = {_PAID_SQL.format(id='appointments.id')}",
+        f"UPDATE appointments SET payment_status = {_STATUS_SQL}",
+        "CREATE TRIGGER IF NOT EXISTS _bal_appointment_services_ins AFTER INSERT ON appointment_services BEGIN "
+        f"{_recompute_sql('NEW.appointment_id')} END",
+        "CREATE TRIGGER IF NOT EXISTS _bal_appointment_services_upd "
+        "AFTER UPDATE OF price, appointment_id ON appointment_services BEGIN "
+        f"{_recompute_sql('NEW.appointment_id')} "
+        f"{_recompute_sql('OLD.appointment_id', 'OLD.appointment_id <> NEW.appointment_id')} END",
+        "CREATE TRIGGER IF NOT EXISTS _bal_appointment_services_del AFTER DELETE ON appointment_services BEGIN "
+        f"{_recompute_sql('OLD.appointment_id')} END",
+        "CREATE TRIGGER IF NOT EXISTS _bal_payments_ins AFTER INSERT ON appointment_service_payments BEGIN "
+        f"{_recompute_sql(line_of.format(row='NEW'))} END",
+        "CREATE TRIGGER IF NOT EXISTS _bal_payments_upd "
+        "AFTER UPDATE OF amount, appointment_service_id ON appointment_service_payments BEGIN "
+        f"{_recompute_sql(line_of.format(row='NEW'))} "
+        f"{_recompute_sql(line_of.format(row='OLD'), 'OLD.appointment_service_id <> NEW.appointment_service_id')} END",
+        "CREATE TRIGGER IF NOT EXISTS _bal_payments_del AFTER DELETE ON appointment_service_payments BEGIN "
+        f"{_recompute_sql(line_of.format(row='OLD'))} END",
+        # Неоплаченные приемы: индекс содержит только строки с остатком
+        "CREATE INDEX IF NOT EXISTS idx_appointments_unpaid ON appointments (appointment_date, appointment_time) "
+        f"WHERE {UNPAID_CONDITION}",
+    ]
+    return statements
+
+
+def fetch_unpaid(conn, limit=50, before=None):
+    """
+    Приемы с остатком к оплате по частичному индексу, новые сначала
+
+    Returns:
+        list: (id, appointment_date, appointment_time, status, client_name, total_cost, total_paid, remaining)
+    """
+    query = f'''
+        SELECT a.id, a.appointment_date, a.appointment_time, a.status,
+               c.first_name || ' ' || c.last_name, a.total_cost, a.total_paid, a.total_cost - a.total_paid
+        FROM appointments a
+        JOIN clients c ON c.id = a.client_id
+        WHERE {UNPAID_CONDITION.replace('total_', 'a.total_')}
+    '''
+    params = []
+    if before is not None:
+        query += " AND a.appointment_date <= ?"
+        params.append(str(before))
+    query += " ORDER BY a.appointment_date DESC, a.appointment_time DESC LIMIT ?"
+    params.append(limit)
+    return conn.execute(query, params).fetchall()
+
+
+def check_balances(conn, repair=False):
+    """
+    Сверить total_cost / total_paid / payment_status приемов с пересчетом по строкам
+
+    Args:
+        repair: исправить расхождения (одной транзакцией)
+
+    Returns:
+        list: [(appointment_id, (хранимые значения), (пересчитанные значения)), ...] - расхождения
+    """
+    rows = conn.execute(f'''
+        SELECT id, total_cost, total_paid, payment_status, cost, paid,
+               CASE WHEN paid = 0 THEN 'не оплачено'
+                    WHEN paid >= cost - {BALANCE_EPSILON} THEN 'оплачено'
+                    ELSE 'частично оплачено' END
+        FROM (
+            SELECT a.id, a.total_cost, a.total_paid, a.payment_status,
+                   COALESCE(t.cost, 0) AS cost, COALESCE(p.paid, 0) AS paid
+            FROM appointments a
+            LEFT JOIN (SELECT appointment_id, SUM(price) AS cost FROM appointment_services
+                       GROUP BY appointment_id) t ON t.appointment_id = a.id
+            LEFT JOIN (SELECT aps.appointment_id, SUM(asp.amount) AS paid
+                       FROM appointment_service_payments asp
+                       JOIN appointment_services aps ON asp.appointment_service_id = aps.id
+                       GROUP BY aps.appointment_id) p ON p.appointment_id = a.id
+        )
+    ''').fetchall()
+
+    mismatches = [
+        (row[0], tuple(row[1:4]), tuple(row[4:7])) for row in rows
+        if abs(row[1] - row[4]) > BALANCE_EPSILON or abs(row[2] - row[5]) > BALANCE_EPSILON or row[3] != row[6]
+    ]
+    if repair and mismatches:
+        try:
+            conn.executemany(
+                "UPDATE appointments SET total_cost = ?, total_paid = ?, payment_status = ? WHERE id = ?",
+                [fixed + (appointment_id,) for appointment_id, _, fixed in mismatches]
+            )
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+    return mismatches
+
+
+if __name__ == "__main__":
+    import sys
+    from db_pool import DB_FILE, get_pool
+
+    repair = '--repair' in sys.argv
+    with get_pool(DB_FILE).connection() as conn:
+        mismatches = check_balances(conn, repair=repair)
+    if not mismatches:
+        print("✅ Итоги приемов совпадают с услугами и оплатами")
+    for appointment_id, stored, actual in mismatches[:20]:
+        print(f"⚠️ Прием {appointment_id}: хранится {stored}, по строкам {actual}")
+    if mismatches:
+        print(f"{'🔧 Исправлено' if repair else '❌ Расхождений'}: {len(mismatches)}"
+              + ('' if repair else " (запустите с --repair для исправления)"))
@@ -0,0 +1,176 @@
+#!/usr/bin/env python3
+"""
+Данные формы редактирования приема одной загрузкой
+
+Форма приема вызывала get_appointment_by_id, get_appointment_services (дважды),
+get_total_appointment_cost (дважды), get_appointment_payments_summary,
+get_all_doctors, get_services_by_doctor и get_all_services - каждая функция со
+своим соединением. load_appointment_details читает все это на одном соединении
+в одной транзакции чтения (согласованный снимок) и возвращает AppointmentDetails,
+по которому форма отрисовывается. Число запросов не зависит от числа услуг приема.
+
+QueryCounter считает выполненные запросы через sqlite3 set_trace_callback.
+"""
+
+import time
+from collections import namedtuple
+
+from calendar_index import AppointmentRow
+
+# Услуга приема (индексы как у строки get_appointment_services)
+ServiceLine = namedtuple('ServiceLine', [
+    'id', 'service_id', 'name', 'description', 'price', 'base_price', 'duration_minutes',
+    'doctor_first_name', 'doctor_last_name',
+])
+
+# Оплаты приема по методу (как строка get_appointment_payments_summary)
+PaymentTotal = namedtuple('PaymentTotal', ['payment_method', 'amount'])
+
+# Справочники формы (как строки get_all_doctors / get_services_by_doctor / get_all_services)
+DoctorRow = namedtuple('DoctorRow', ['id', 'first_name', 'last_name', 'specialization', 'phone', 'email'])
+DoctorServiceRow = namedtuple('DoctorServiceRow', ['id', 'name', 'description', 'price', 'duration_minutes'])
+ServiceRow = namedtuple('ServiceRow', [
+    'id', 'name', 'description', 'price', 'duration_minutes',
+    'doctor_first_name', 'doctor_last_name', 'doctor_specialization',
+])
+
+# Управление транзакцией не считается запросом
+TRANSACTION_STATEMENTS = {'BEGIN', 'COMMIT', 'ROLLBACK', 'SAVEPOINT', 'RELEASE', 'END'}
+
+
+class QueryCounter:
+    """
+    Счетчик запросов соединения: with QueryCounter(conn) as counter: ...
+
+    statements - выполненные SQL (без BEGIN/COMMIT), elapsed - время блока в секундах.
+    На время блока заменяет trace callback соединения и снимает его на выходе.
+    """
+
+    def __init__(self, conn):
+        self.conn = conn
+        self.statements = []
+        self.elapsed = 0.0
+        self._started = None
+
+    def _trace(self, statement):
+        words = statement.split(None, 1)
+        if words and words[0].upper() not in TRANSACTION_STATEMENTS:
+            self.statements.append(statement)
+
+    def __enter__(self):
+        self._started = time.perf_counter()
+        self.conn.set_trace_callback(self._trace)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.conn.set_trace_callback(None)
+        self.elapsed = time.perf_counter() - self._started
+        return False
+
+    @property
+    def count(self):
+        return len(self.statements)
+
+
+class AppointmentDetails:
+    """
+    Все данные формы редактирования приема
+
+    appointment - AppointmentRow; services - услуги приема (ServiceLine);
+    payments - оплаты по методам (PaymentTotal); total_cost / total_paid /
+    remaining - итоги; doctors, doctor_services (услуги врача приема),
+    all_services - справочники выпадающих списков. query_count / load_ms -
+    сколько запросов и времени заняла загрузка.
+    """
+
+    def __init__(self, appointment, services, payments, doctors, doctor_services, all_services,
+                 query_count=0, load_ms=0.0):
+        self.appointment = appointment
+        self.services = services
+        self.payments = payments
+        self.doctors = doctors
+        self.doctor_services = doctor_services
+        self.all_services = all_services
+        self.total_cost = sum(line.price for line in services)
+        self.total_paid = sum(payment.amount for payment in payments)
+        self.remaining = self.total_cost - self.total_paid
+        self.query_count = query_count
+        self.load_ms = load_ms
+
+
+def load_appointment_details(conn, appointment_id):
+    """
+    Прием, его услуги, оплаты и справочники формы за одну транзакцию чтения
+
+    Returns:
+        AppointmentDetails или None, если приема нет
+    """
+    with QueryCounter(conn) as counter:
+        own_transaction = not conn.in_transaction
+        if own_transaction:
+            conn.execute("BEGIN")
+        try:
+            row = conn.execute('''
+                SELECT a.id, a.client_id, a.doctor_id, a.service_id, a.appointment_date,
+                       a.appointment_time, a.status, a.notes, a.start_time, a.end_time,
+                       c.first_name, c.last_name, c.phone,
+                       d.first_name, d.last_name, d.specialization,
+                       s.name, s.price, s.duration_minutes
+                FROM appointments a
+                JOIN clients c ON a.client_id = c.id
+                JOIN doctors d ON a.doctor_id = d.id
+                JOIN services s ON a.service_id = s.id
+                WHERE a.id = ?
+            ''', (appointment_id,)).fetchone()
+            if row is None:
+                return None
+            appointment = AppointmentRow(*row)
+
+            services = [ServiceLine(*line) for line in conn.execute('''
+                SELECT aps.id, s.id, s.name, s.description, aps.price, s.price,
+                       s.duration_minutes, d.first_name, d.last_name
+                FROM appointment_services aps
+                JOIN services s ON aps.service_id = s.id
+                JOIN doctors d ON s.doctor_id = d.id
+                WHERE aps.appointment_id = ?
+                ORDER BY s.name
+            ''', (appointment_id,))]
+
+            payments = [PaymentTotal(*payment) for payment in conn.execute('''
+                SELECT asp.payment_method, SUM(asp.amount)
+                FROM appointment_service_payments asp
+                JOIN appointment_services aps ON asp.appointment_service_id = aps.id
+                WHERE aps.appointment_id = ?
+                GROUP BY asp.payment_method
+            ''', (appointment_id,))]
+
+            doctors = [DoctorRow(*doctor) for doctor in conn.execute('''
+                SELECT id, first_name, last_name, specialization, phone, email
+                FROM doctors
+                WHERE is_active = 1
+                ORDER BY last_name, first_name
+            ''')]
+
+            # Услуги врача приема и все активные услуги - одним запросом
+            doctor_services, all_services = [], []
+            for service in conn.execute('''
+                SELECT s.id, s.name, s.description, s.price, s.duration_minutes,
+                       d.first_name, d.last_name, d.specialization, s.doctor_id, d.is_active
+                FROM services s
+                JOIN doctors d ON s.doctor_id = d.id
+                WHERE s.is_active = 1 AND (d.is_active = 1 OR s.doctor_id = ?)
+                ORDER BY d.last_name, d.first_name, s.name
+            ''', (appointment.doctor_id,)):
+                if service[8] == appointment.doctor_id:
+                    doctor_services.append(DoctorServiceRow(*service[:5]))
+                if service[9] == 1:
+                    all_services.append(ServiceRow(*service[:8]))
+            doctor_services.sort(key=lambda service: service.name)
+        finally:
+            if own_transaction and conn.in_transaction:
+                conn.commit()
+
+    return AppointmentDetails(
+        appointment, services, payments, doctors, doctor_services, all_services,
+        query_count=counter.count, load_ms=counter.elapsed * 1000,
+    )
@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+"""
+Серия повторяющихся приемов (курс лечения) одной транзакцией
+
+Курс из 10 сеансов означал 10 вызовов create_appointment: 10 проверок
+конфликтов, 10 commit и 10 синхронных git push. expand_recurrence раскрывает
+правило повторения в даты, create_series_rows проверяет все даты одним
+индексированным запросом занятости врача за период серии (availability),
+вставляет приемы и их услуги одной транзакцией и возвращает конфликты по
+каждой дате. Синхронизация - одна на серию (database.create_appointment_series).
+"""
+
+from datetime import datetime, timedelta
+
+from availability import load_availability, service_duration
+from db_pool import write_transaction
+
+# Ограничение длины серии
+MAX_SERIES_OCCURRENCES = 100
+
+# Правила повторения: каждые interval дней / недель (weekly - по дням недели weekdays)
+RECURRENCE_FREQUENCIES = ('daily', 'weekly')
+
+
+def expand_recurrence(start_date, count=None, frequency='weekly', interval=1, weekdays=None, until=None):
+    """
+    Даты серии по правилу повторения
+
+    Args:
+        start_date: первая дата (входит в серию, если подходит под weekdays)
+        count: число приемов; until: последняя допустимая дата (нужно хотя бы одно из двух)
+        frequency: 'daily' - каждые interval дней, 'weekly' - каждые interval недель
+        weekdays: для 'weekly' - дни недели (0 - понедельник); по умолчанию день start_date
+
+    Returns:
+        list: даты приемов (не больше MAX_SERIES_OCCURRENCES)
+    """
+    if frequency not in RECURRENCE_FREQUENCIES:
+        raise ValueError(f"Неизвестное правило повторения: {frequency}")
+    if interval < 1:
+        raise ValueError("Интервал повторения должен быть не меньше 1")
+    if count is None and until is None:
+        raise ValueError("Укажите число приемов или дату окончания серии")
+    if isinstance(start_date, str):
+        start_date = datetime.strptime(start_date, '%Y-%m-%d').date()
+    if isinstance(until, str):
+        until = datetime.strptime(until, '%Y-%m-%d').date()
+    limit = min(count or MAX_SERIES_OCCURRENCES, MAX_SERIES_OCCURRENCES)
+
+    dates = []
+    if frequency == 'daily':
+        day = start_date
+        while len(dates) < limit and (until is None or day <= until):
+            dates.append(day)
+            day += timedelta(days=interval)
+        return dates
+
+    weekdays = sorted(set(weekdays)) if weekdays else [start_date.weekday()]
+    week_start = start_date - timedelta(days=start_date.weekday())
+    while len(dates) < limit:
+        for weekday in weekdays:
+            day = week_start + timedelta(days=weekday)
+            if day < start_date:
+                continue
+            if until is not None and day > until:
+                return dates
+            dates.append(day)
+            if len(dates) >= limit:
+                break
+        week_start += timedelta(weeks=interval)
+    return dates
+
+
+def create_series_rows(conn, client_id, doctor_id, service_id, dates, appointment_time, notes=None,
+                       source='Повторное посещение', skip_conflicts=False):
+    """
+    Проверить и создать приемы серии одной транзакцией
+
+    Все даты проверяются одной выборкой занятости врача за период серии; приемы
+    серии проверяются и друг с другом.
+
+    Args:
+        skip_conflicts: False - при любом конфликте не создается ничего,
+                        True - создаются только свободные даты
+
+    Returns:
+        dict: created - [(appointment_id, дата)],
+              conflicts - [(дата, id мешающего приема; None - другой прием этой же серии)]
+    """
+    if not dates:
+        return {'created': [], 'conflicts': []}
+    if hasattr(appointment_time, 'strftime'):
+        appointment_time = appointment_time.strftime('%H:%M:%S')
+
+    # Блокировка записи: между проверкой и вставкой никто не займет эти окна
+    with write_transaction(conn, 'create_series'):
+        duration = service_duration(conn, service_id)
+        availability = load_availability(conn, min(dates), max(dates), doctor_ids=[doctor_id])
+        free, conflicts = [], []
+        for day in dates:
+            if availability.is_free(doctor_id, day, appointment_time, duration):
+                free.append(day)
+                availability.add(doctor_id, day, appointment_time, duration)
+            else:
+                # None - пересечение с другим приемом этой же серии
+                conflicts.append((day, availability.conflict(doctor_id, day, appointment_time, duration)))
+
+        if conflicts and not skip_conflicts:
+            return {'created': [], 'conflicts': conflicts}
+
+        price = conn.execute("SELECT price FROM services WHERE id = ?", (service_id,)).fetchone()
+        created = []
+        for day in free:
+            cursor = conn.execute('''
+                INSERT INTO appointments (client_id, doctor_id, service_id, appointment_date, appointment_time,
+                                          notes, source)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+            ''', (client_id, doctor_id, service_id, day.isoformat(), appointment_time, notes, source))
+            created.append((cursor.lastrowid, day))
+        if price is not None:
+            conn.executemany(
+                "INSERT INTO appointment_services (appointment_id, service_id, price) VALUES (?, ?, ?)",
+                [(appointment_id, service_id, price[0]) for appointment_id, _ in created]
+            )
+    return {'created': created, 'conflicts': conflicts}
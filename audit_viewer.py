@@ -71,25 +71,26 @@ def main():
 def get_all_users():
     """Получить всех пользователей"""
     conn = get_connection()
-    cursor = conn.cursor()
-    
-    cursor.execute('''
-        SELECT id, name, username
-        FROM users
-        ORDER BY name
-    ''')
-    
-    results = cursor.fetchall()
-    conn.close()
-    return results
+    try:
+        cursor = conn.cursor()
+    
+        cursor.execute('''
+            SELECT id, name, username
+            FROM users
+            ORDER BY name
+        ''')
+    
+        results = cursor.fetchall()
+        return results
+    finally:
+        conn.close()
 
 def get_audit_data(start_date, end_date, user_ids, actions):
     """Получить данные аудита"""
-    conn = get_connection()
-    
-    # Конвертируем даты в datetime для сравнения
-    start_datetime = datetime.combine(start_date, datetime.min.time())
-    end_datetime = datetime.combine(end_date, datetime.max.time())
+    # Полуинтервал [начало дня; начало следующего дня) - сравнение колонки напрямую,
+    # чтобы использовался индекс idx_audit_log_timestamp (DATE(timestamp) его отключает)
+    start_bound = start_date.strftime('%Y-%m-%d')
+    end_bound = (end_date + timedelta(days=1)).strftime('%Y-%m-%d')
     
     query = '''
         SELECT 
@@ -104,10 +105,10 @@ def get_audit_data(start_date, end_date, user_ids, actions):
             u.username
         FROM audit_log al
         LEFT JOIN users u ON al.user_id = u.id
-        WHERE DATE(al.timestamp) BETWEEN DATE(?) AND DATE(?)
+        WHERE al.timestamp >= ? AND al.timestamp < ?
     '''
     
-    params = [start_date, end_date]
+    params = [start_bound, end_bound]
     
     if user_ids:
         placeholders = ','.join(['?' for _ in user_ids])
@@ -121,10 +122,11 @@ def get_audit_data(start_date, end_date, user_ids, actions):
     
     query += ' ORDER BY al.timestamp DESC'
     
-    df = pd.read_sql_query(query, conn, params=params)
-    conn.close()
-    
-    return df
+    conn = get_connection()
+    try:
+        return pd.read_sql_query(query, conn, params=params)
+    finally:
+        conn.close()
 
 def show_audit_statistics(df):
     """Показать статистику аудита"""
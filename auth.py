@@ -76,16 +76,18 @@ def login_page():
 def authenticate_user(username, password):
     """Аутентификация пользователя"""
     conn = get_connection()
-    cursor = conn.cursor()
-    
-    cursor.execute('''
-        SELECT id, username, password_hash, name, access_level
-        FROM users
-        WHERE username = ?
-    ''', (username,))
-    
-    user = cursor.fetchone()
-    conn.close()
+    try:
+        cursor = conn.cursor()
+    
+        cursor.execute('''
+            SELECT id, username, password_hash, name, access_level
+            FROM users
+            WHERE username = ?
+        ''', (username,))
+    
+        user = cursor.fetchone()
+    finally:
+        conn.close()
     
     if user and user[2] and bcrypt.checkpw(password.encode('utf-8'), user[2].encode('utf-8')):
         # Сохраняем данные пользователя в session_state
@@ -0,0 +1,252 @@
+#!/usr/bin/env python3
+"""
+Свободное время врачей: занятые интервалы с учетом длительности услуг
+
+create_appointment отклонял только точное совпадение (врач, дата, время) и не
+учитывал services.duration_minutes - пересекающиеся приемы проходили, а
+свободное окно искали глазами по календарю.
+
+BusyIntervals хранит занятые интервалы врача отсортированными массивами начал
+и концов (в минутах от начала эпохи) и префиксный максимум концов. Пересечение
+с [начало, конец) - один bisect: среди интервалов, начавшихся раньше конца
+запроса, самый поздний конец должен быть не позже начала запроса. Поиск окна
+перепрыгивает сразу за мешающий интервал, поэтому каждый шаг - O(log n).
+
+Длительность приема - длительность его основной услуги; отмененные приемы и
+неявки время не занимают (как в прежней проверке конфликтов).
+"""
+
+from bisect import bisect_left, bisect_right
+from datetime import date, datetime, timedelta
+
+from calendar_index import CALENDAR_SLOT_MINUTES, CALENDAR_DAY_START, CALENDAR_DAY_END
+
+# Статусы, которые не занимают время врача
+FREE_STATUSES = ('отменен', 'не явился')
+
+# Длительность, если у услуги она не указана
+DEFAULT_DURATION_MINUTES = 30
+
+# Как далеко вперед искать свободные окна
+SEARCH_HORIZON_DAYS = 90
+
+MINUTES_PER_DAY = 24 * 60
+
+
+def to_minutes(day, appointment_time):
+    """Дата и время приема -> минуты от начала эпохи (date.toordinal)"""
+    if isinstance(day, str):
+        day = datetime.strptime(day, '%Y-%m-%d').date()
+    if isinstance(appointment_time, str):
+        hours, minutes = appointment_time.split(':')[:2]
+        clock = int(hours) * 60 + int(minutes)
+    else:
+        clock = appointment_time.hour * 60 + appointment_time.minute
+    return day.toordinal() * MINUTES_PER_DAY + clock
+
+
+def from_minutes(value):
+    """Минуты от начала эпохи -> datetime"""
+    day, clock = divmod(value, MINUTES_PER_DAY)
+    return datetime.combine(date.fromordinal(day), datetime.min.time()) + timedelta(minutes=clock)
+
+
+class BusyIntervals:
+    """
+    Занятые интервалы одного врача
+
+    starts / ends / ids - интервалы [start, end) по возрастанию начала;
+    reach[i] - индекс интервала с самым поздним концом среди первых i + 1.
+    """
+
+    def __init__(self, intervals=()):
+        intervals = sorted(intervals)
+        self.starts = [interval[0] for interval in intervals]
+        self.ends = [interval[1] for interval in intervals]
+        self.ids = [interval[2] for interval in intervals]
+        self.reach = []
+        self._rebuild_reach(0)
+
+    def __len__(self):
+        return len(self.starts)
+
+    def _rebuild_reach(self, position):
+        del self.reach[position:]
+        for index in range(position, len(self.ends)):
+            if index and self.ends[self.reach[index - 1]] >= self.ends[index]:
+                self.reach.append(self.reach[index - 1])
+            else:
+                self.reach.append(index)
+
+    def add(self, start, end, appointment_id=None):
+        """Добавить интервал (перестраивает префиксный максимум с места вставки)"""
+        position = bisect_right(self.starts, start)
+        self.starts.insert(position, start)
+        self.ends.insert(position, end)
+        self.ids.insert(position, appointment_id)
+        self._rebuild_reach(position)
+
+    def blocking(self, start, end):
+        """
+        Интервал, пересекающийся с [start, end), с самым поздним концом
+
+        Returns:
+            int: его позиция или None, если промежуток свободен
+        """
+        count = bisect_left(self.starts, end)
+        if not count:
+            return None
+        index = self.reach[count - 1]
+        return index if self.ends[index] > start else None
+
+    def is_free(self, start, end):
+        return self.blocking(start, end) is None
+
+
+class AvailabilityEngine:
+    """
+    Занятость врачей и поиск свободных окон по сетке календаря
+
+    Окна начинаются на границах слотов (slot_minutes от начала рабочего дня) и
+    целиком помещаются в рабочие часы day_start..day_end.
+    """
+
+    def __init__(self, doctors=None, slot_minutes=None, day_start=None, day_end=None):
+        self.doctors = dict(doctors or {})  # doctor_id -> специализация
+        self.busy = {}  # doctor_id -> BusyIntervals
+        self.slot_minutes = slot_minutes or CALENDAR_SLOT_MINUTES
+        self.day_start = (CALENDAR_DAY_START if day_start is None else day_start) * 60
+        self.day_end = (CALENDAR_DAY_END if day_end is None else day_end) * 60
+
+    @classmethod
+    def from_rows(cls, rows, doctors=None, **grid):
+        """rows: (appointment_id, doctor_id, appointment_date, appointment_time, duration_minutes)"""
+        engine = cls(doctors, **grid)
+        intervals = {}
+        for appointment_id, doctor_id, day, appointment_time, duration in rows:
+            start = to_minutes(day, appointment_time)
+            intervals.setdefault(doctor_id, []).append(
+                (start, start + (duration or DEFAULT_DURATION_MINUTES), appointment_id)
+            )
+        engine.busy = {doctor_id: BusyIntervals(items) for doctor_id, items in intervals.items()}
+        return engine
+
+    def add(self, doctor_id, day, appointment_time, duration_minutes, appointment_id=None):
+        start = to_minutes(day, appointment_time)
+        self.busy.setdefault(doctor_id, BusyIntervals()).add(
+            start, start + (duration_minutes or DEFAULT_DURATION_MINUTES), appointment_id
+        )
+
+    def conflict(self, doctor_id, day, appointment_time, duration_minutes):
+        """ID приема, с которым пересекается запрошенный интервал, или None"""
+        busy = self.busy.get(doctor_id)
+        if not busy:
+            return None
+        start = to_minutes(day, appointment_time)
+        index = busy.blocking(start, start + (duration_minutes or DEFAULT_DURATION_MINUTES))
+        return None if index is None else busy.ids[index]
+
+    def is_free(self, doctor_id, day, appointment_time, duration_minutes):
+        return self.conflict(doctor_id, day, appointment_time, duration_minutes) is None
+
+    def _align(self, value, duration):
+        """Ближайшее начало слота не раньше value, при котором прием помещается в рабочий день"""
+        day, clock = divmod(value, MINUTES_PER_DAY)
+        if clock < self.day_start:
+            clock = self.day_start
+        else:
+            offset = (clock - self.day_start) % self.slot_minutes
+            if offset:
+                clock += self.slot_minutes - offset
+        if clock + duration > self.day_end:
+            day, clock = day + 1, self.day_start
+        return day * MINUTES_PER_DAY + clock
+
+    def _free_starts(self, doctor_id, duration, after, until):
+        """Генератор свободных начал окон врача в минутах от начала эпохи"""
+        busy = self.busy.get(doctor_id) or BusyIntervals()
+        if self.day_start + duration > self.day_end:
+            return
+        current = self._align(after, duration)
+        while current < until:
+            index = busy.blocking(current, current + duration)
+            if index is None:
+                yield current
+                current = self._align(current + self.slot_minutes, duration)
+            else:
+                # Сразу за мешающий интервал: все слоты до его конца заняты
+                current = self._align(busy.ends[index], duration)
+
+    def next_free_slots(self, doctor_id, duration_minutes, after, count=5, horizon_days=SEARCH_HORIZON_DAYS):
+        """
+        Ближайшие count свободных окон врача для приема длительностью duration_minutes
+
+        Returns:
+            list: datetime начала окон
+        """
+        duration = duration_minutes or DEFAULT_DURATION_MINUTES
+        start = to_minutes(after.date(), after.time()) if isinstance(after, datetime) else to_minutes(after, '00:00')
+        until = start + horizon_days * MINUTES_PER_DAY
+        slots = []
+        for value in self._free_starts(doctor_id, duration, start, until):
+            slots.append(from_minutes(value))
+            if len(slots) >= count:
+                break
+        return slots
+
+    def first_free_slot(self, specialization, duration_minutes, after, horizon_days=SEARCH_HORIZON_DAYS):
+        """
+        Первое свободное окно среди врачей специализации
+
+        Returns:
+            tuple: (datetime, doctor_id) или None
+        """
+        best = None
+        for doctor_id, doctor_specialization in self.doctors.items():
+            if doctor_specialization != specialization:
+                continue
+            slots = self.next_free_slots(doctor_id, duration_minutes, after, count=1, horizon_days=horizon_days)
+            if slots and (best is None or slots[0] < best[0]):
+                best = (slots[0], doctor_id)
+        return best
+
+
+def load_availability(conn, start_date, end_date, doctor_ids=None, specialization=None, **grid):
+    """
+    Занятость активных врачей за период из БД
+
+    doctor_ids / specialization: None - без фильтра. Приемы в статусах FREE_STATUSES не учитываются.
+    """
+    doctor_filter = ''
+    doctor_params = []
+    if doctor_ids:
+        doctor_filter += f" AND id IN ({', '.join('?' * len(doctor_ids))})"
+        doctor_params.extend(doctor_ids)
+    if specialization is not None:
+        doctor_filter += " AND specialization = ?"
+        doctor_params.append(specialization)
+    doctors = dict(conn.execute(
+        f"SELECT id, specialization FROM doctors WHERE is_active = 1{doctor_filter}", doctor_params
+    ).fetchall())
+
+    query = f'''
+        SELECT a.id, a.doctor_id, a.appointment_date, a.appointment_time, s.duration_minutes
+        FROM appointments a
+        LEFT JOIN services s ON s.id = a.service_id
+        WHERE a.appointment_date BETWEEN ? AND ?
+          AND a.status NOT IN ({', '.join('?' * len(FREE_STATUSES))})
+    '''
+    params = [str(start_date), str(end_date)] + list(FREE_STATUSES)
+    if doctor_ids:
+        query += f" AND a.doctor_id IN ({', '.join('?' * len(doctor_ids))})"
+        params.extend(doctor_ids)
+    if specialization is not None:
+        query += " AND a.doctor_id IN (SELECT id FROM doctors WHERE specialization = ?)"
+        params.append(specialization)
+    return AvailabilityEngine.from_rows(conn.execute(query, params), doctors, **grid)
+
+
+def service_duration(conn, service_id):
+    """Длительность услуги в минутах (DEFAULT_DURATION_MINUTES, если не указана)"""
+    row = conn.execute("SELECT duration_minutes FROM services WHERE id = ?", (service_id,)).fetchone()
+    return (row[0] if row else None) or DEFAULT_DURATION_MINUTES
@@ -5,10 +5,25 @@
 
 import streamlit as st
 import os
-import shutil
-import sqlite3
 from datetime import datetime
 from database import get_connection
+from backup_store import (
+    create_backup_file, restore_backup_file, list_backup_files, delete_backup_file, verify_backup,
+    create_snapshot, restore_snapshot, list_snapshots, delete_snapshots, storage_stats,
+    get_backup_scheduler, RETENTION_POLICY, BACKUP_INTERVAL
+)
+
+# Снимки из хранилища блоков адресуются как snapshot:<id>
+SNAPSHOT_PREFIX = 'snapshot:'
+SNAPSHOT_KINDS = {'manual': 'ручной', 'auto': 'автоматический', 'before_restore': 'перед восстановлением'}
+
+# Журнал изменений и синхронизация с Git (опционально)
+try:
+    from git_sync import PERSISTENCE_BACKEND, sync_database_to_git_async
+    from change_log import rebase_log_on_database
+    GIT_SYNC_AVAILABLE = True
+except ImportError:
+    GIT_SYNC_AVAILABLE = False
 
 def main():
     """Главная функция управления резервными копиями"""
@@ -44,18 +59,24 @@ def show_create_backup():
             placeholder="Например: Резервная копия перед обновлением",
             key="backup_description"
         )
+        as_file = st.checkbox(
+            "Сохранить отдельным файлом (gzip, для переноса)",
+            value=False,
+            key="backup_as_file",
+            help="По умолчанию копия сохраняется снимком в хранилище с дедупликацией"
+        )
     
     with col2:
         if st.button("🚀 Создать резервную копию", use_container_width=True):
             with st.spinner("Создание резервной копии..."):
                 try:
-                    backup_path = create_backup()
+                    backup_path = create_backup(as_file=as_file, description=backup_description or None)
                     if backup_path:
                         st.success(f"✅ Резервная копия создана успешно!")
                         st.code(backup_path)
                         
                         # Показываем размер файла
-                        if os.path.exists(backup_path):
+                        if not backup_path.startswith(SNAPSHOT_PREFIX) and os.path.exists(backup_path):
                             size_mb = os.path.getsize(backup_path) / (1024 * 1024)
                             st.info(f"📊 Размер файла: {size_mb:.2f} МБ")
                     else:
@@ -84,6 +105,9 @@ def show_create_backup():
         with col3:
             st.write("**Файл:**")
             st.write(latest['filename'])
+        
+        if latest['manifest']:
+            show_manifest(latest['manifest'])
 
 def show_restore_backup():
     """Восстановление из резервной копии"""
@@ -146,8 +170,14 @@ def show_manage_backups():
     
     st.write(f"**Всего копий:** {len(backups)}")
     
-    total_size = sum(b['size_mb'] for b in backups)
-    st.write(f"**Общий размер:** {total_size:.2f} МБ")
+    stats = storage_stats()
+    files_size = sum(b['size_mb'] for b in backups if not b['path'].startswith(SNAPSHOT_PREFIX))
+    st.write(f"**Занято на диске:** {files_size + stats['stored_bytes'] / (1024 * 1024):.2f} МБ")
+    if stats['snapshots']:
+        st.write(
+            f"**Снимки:** {stats['snapshots']} · {stats['logical_bytes'] / (1024 * 1024):.2f} МБ данных хранятся в "
+            f"{stats['stored_bytes'] / (1024 * 1024):.2f} МБ (дедупликация ×{stats['dedup_ratio']:.1f})"
+        )
     
     st.markdown("---")
     
@@ -168,6 +198,17 @@ def show_manage_backups():
                 st.write("**Путь:**")
                 st.code(backup['path'], language=None)
             
+            if backup['manifest']:
+                show_manifest(backup['manifest'])
+                if not backup['path'].startswith(SNAPSHOT_PREFIX) and st.button(
+                    "🔍 Проверить контрольную сумму", key=f"verify_backup_{i}"
+                ):
+                    ok, message = verify_backup(backup['path'])
+                    if ok:
+                        st.success(f"✅ {message}")
+                    else:
+                        st.error(f"❌ {message}")
+            
             # Кнопка удаления
             if st.button(f"🗑️ Удалить эту копию", key=f"delete_backup_{i}"):
                 with st.spinner("Удаление..."):
@@ -182,47 +223,67 @@ def show_manage_backups():
     
     st.markdown("---")
     
-    # Автоматическое копирование (будущая функция)
+    # Автоматическое копирование
     st.subheader("🤖 Автоматическое копирование")
-    st.info("⏳ Функция автоматического копирования будет добавлена в следующей версии")
-    
-    # Настройки
-    # st.checkbox("Включить автоматическое копирование", disabled=True)
-    # st.number_input("Создавать копию каждые N дней:", min_value=1, max_value=30, value=7, disabled=True)
-    # st.number_input("Хранить последние N копий:", min_value=1, max_value=100, value=10, disabled=True)
+    scheduler = get_backup_scheduler()
+    if scheduler is None:
+        st.info("⏸️ Автоматическое копирование выключено (BACKUP_SCHEDULER_ENABLED)")
+    else:
+        st.write(f"**Интервал:** {BACKUP_INTERVAL // 60} мин (снимок создается, только если данные изменились)")
+        st.write(
+            f"**Хранение:** почасовые - {RETENTION_POLICY['hourly']}, ежедневные - {RETENTION_POLICY['daily']}, "
+            f"еженедельные - {RETENTION_POLICY['weekly']}"
+        )
+        if scheduler.last_run:
+            st.write(f"**Последний запуск:** {scheduler.last_run.strftime('%Y-%m-%d %H:%M:%S')}")
+        if scheduler.last_error:
+            st.error(f"❌ Последняя ошибка: {scheduler.last_error}")
 
 # ==================== ФУНКЦИИ РЕЗЕРВНОГО КОПИРОВАНИЯ ====================
 
-def create_backup():
-    """Создать резервную копию базы данных"""
+def show_manifest(manifest):
+    """Данные манифеста копии: контрольная сумма и количество строк"""
+    details = f"SHA-256: `{manifest.get('sha256', manifest['db_sha256'])[:16]}…`"
+    if manifest.get('compressed'):
+        details += f" · сжато из {manifest['db_size'] / (1024 * 1024):.2f} МБ"
+    if 'stored_bytes' in manifest:
+        details += f" · новых данных {manifest['stored_bytes'] / 1024:.0f} КБ"
+    if manifest.get('description'):
+        details += f" · {manifest['description']}"
+    st.caption(details)
+    row_counts = manifest.get('row_counts', {})
+    if row_counts:
+        st.caption(" · ".join(f"{table}: {count}" for table, count in row_counts.items()))
+
+def create_backup(as_file=False, description=None):
+    """
+    Создать резервную копию базы данных (онлайн, через sqlite3 backup API)
+    
+    По умолчанию - снимок в хранилище блоков с дедупликацией, as_file - отдельный gzip-файл
+    """
     try:
-        # Создаем папку для бэкапов если её нет
-        backup_dir = "backups"
-        if not os.path.exists(backup_dir):
-            os.makedirs(backup_dir)
-        
-        # Генерируем имя файла с датой и временем
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        backup_filename = f"medical_center_backup_{timestamp}.db"
-        backup_path = os.path.join(backup_dir, backup_filename)
-        
-        # Копируем базу данных
-        shutil.copy2("medical_center.db", backup_path)
-        
-        return backup_path
+        if as_file:
+            return create_backup_file(compress=True, description=description)
+        snapshot = create_snapshot(kind='manual', description=description)
+        return f"{SNAPSHOT_PREFIX}{snapshot['id']}"
     except Exception as e:
         st.error(f"Ошибка при создании резервной копии: {e}")
         return None
 
 def restore_backup(backup_path):
-    """Восстановить базу данных из резервной копии"""
+    """Восстановить базу данных из резервной копии (атомарно, текущая БД сохраняется копией)"""
     try:
-        # Создаем резервную копию текущей БД
-        current_backup = f"medical_center_backup_before_restore_{datetime.now().strftime('%Y%m%d_%H%M%S')}.db"
-        shutil.copy2("medical_center.db", current_backup)
+        if backup_path.startswith(SNAPSHOT_PREFIX):
+            restore_snapshot(backup_path[len(SNAPSHOT_PREFIX):])
+        else:
+            restore_backup_file(backup_path)
         
-        # Восстанавливаем из резервной копии
-        shutil.copy2(backup_path, "medical_center.db")
+        # Восстановленная БД становится новым снимком журнала изменений,
+        # иначе при следующем старте дельты из Git будут применены поверх нее
+        if GIT_SYNC_AVAILABLE and PERSISTENCE_BACKEND == 'changelog':
+            rebase_log_on_database()
+        if GIT_SYNC_AVAILABLE:
+            sync_database_to_git_async("Auto-commit: Restored database from backup")
         
         return True
     except Exception as e:
@@ -230,25 +291,20 @@ def restore_backup(backup_path):
         return False
 
 def list_backups():
-    """Получить список всех резервных копий"""
+    """Получить список всех резервных копий: снимки из индекса и отдельные файлы"""
     try:
-        backup_dir = "backups"
-        if not os.path.exists(backup_dir):
-            return []
-        
-        backups = []
-        for filename in os.listdir(backup_dir):
-            if filename.endswith('.db'):
-                file_path = os.path.join(backup_dir, filename)
-                file_stat = os.stat(file_path)
-                backups.append({
-                    'filename': filename,
-                    'path': file_path,
-                    'size': file_stat.st_size,
-                    'created': datetime.fromtimestamp(file_stat.st_ctime)
-                })
-        
-        # Сортируем по дате создания (новые сверху)
+        backups = list_backup_files()
+        for snapshot in list_snapshots():
+            created = datetime.fromisoformat(snapshot['created'])
+            backups.append({
+                'filename': f"снимок {snapshot['id']} ({SNAPSHOT_KINDS.get(snapshot['kind'], snapshot['kind'])})",
+                'path': f"{SNAPSHOT_PREFIX}{snapshot['id']}",
+                'size': snapshot['db_size'],
+                'size_mb': snapshot['db_size'] / (1024 * 1024),
+                'created': created,
+                'date': created.strftime('%Y-%m-%d %H:%M:%S'),
+                'manifest': snapshot,
+            })
         backups.sort(key=lambda x: x['created'], reverse=True)
         return backups
     except Exception as e:
@@ -258,7 +314,10 @@ def list_backups():
 def delete_backup(backup_path):
     """Удалить резервную копию"""
     try:
-        os.remove(backup_path)
+        if backup_path.startswith(SNAPSHOT_PREFIX):
+            delete_snapshots([backup_path[len(SNAPSHOT_PREFIX):]])
+        else:
+            delete_backup_file(backup_path)
         return True
     except Exception as e:
         st.error(f"Ошибка при удалении копии: {e}")
@@ -0,0 +1,604 @@
+#!/usr/bin/env python3
+"""
+Резервные копии базы данных через sqlite3 backup API
+
+Копия снимается с работающей БД постранично (Connection.backup с pages/sleep),
+поэтому писатели не блокируются надолго, а копия согласована.
+Рядом с копией пишется манифест: контрольная сумма, размер, количество строк по таблицам.
+Восстановление атомарное: временный файл проверяется и переименовывается поверх БД.
+"""
+
+import gzip
+import hashlib
+import json
+import os
+import shutil
+import sqlite3
+import tempfile
+import threading
+import zlib
+from datetime import datetime, timedelta
+
+from db_pool import DB_FILE, checkpoint_database, reset_pool
+
+BACKUP_DIR = 'backups'
+MANIFEST_SUFFIX = '.manifest.json'
+
+# Страниц за шаг backup API и пауза между шагами (писатели получают окно между шагами)
+BACKUP_PAGES_PER_STEP = int(os.getenv('BACKUP_PAGES_PER_STEP', '256'))
+BACKUP_STEP_SLEEP = float(os.getenv('BACKUP_STEP_SLEEP', '0.005'))
+# Если запись в источник постоянно перезапускает копирование - копируем за один шаг
+BACKUP_MAX_RESTARTS = 3
+
+# Хранилище снимков: файл БД режется на блоки, блоки хранятся по SHA-256 (одинаковые - один раз).
+# Размер блока кратен размеру страницы SQLite, поэтому неизмененные страницы дают те же блоки
+CHUNK_SIZE = int(os.getenv('BACKUP_CHUNK_SIZE', str(64 * 1024)))
+CHUNKS_SUBDIR = 'chunks'
+INDEX_FILENAME = 'index.json'
+
+# Автоматические снимки: интервал и сколько хранить почасовых/ежедневных/еженедельных
+BACKUP_INTERVAL = int(os.getenv('BACKUP_INTERVAL', '3600'))
+BACKUP_SCHEDULER_ENABLED = os.getenv('BACKUP_SCHEDULER_ENABLED', 'true').lower() == 'true'
+RETENTION_POLICY = {
+    'hourly': int(os.getenv('BACKUP_KEEP_HOURLY', '24')),
+    'daily': int(os.getenv('BACKUP_KEEP_DAILY', '7')),
+    'weekly': int(os.getenv('BACKUP_KEEP_WEEKLY', '4')),
+}
+
+# Таблицы, для которых в манифест пишется количество строк
+MANIFEST_TABLES = [
+    'users', 'clients', 'doctors', 'services', 'appointments',
+    'appointment_services', 'appointment_service_payments', 'audit_log', 'settings'
+]
+
+
+def _sha256_file(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class _BackupRestarting(Exception):
+    pass
+
+
+def online_backup(source_path, dest_path, pages=BACKUP_PAGES_PER_STEP, sleep=BACKUP_STEP_SLEEP):
+    """
+    Постраничная копия работающей БД в dest_path
+
+    Returns:
+        int: количество перезапусков копирования из-за записи в источник
+    """
+    restarts = [0]
+    last_remaining = [None]
+
+    def progress(status, remaining, total):
+        # Запись в источник другим соединением перезапускает backup - remaining снова растет
+        if last_remaining[0] is not None and remaining > last_remaining[0]:
+            restarts[0] += 1
+            if restarts[0] > BACKUP_MAX_RESTARTS:
+                raise _BackupRestarting()
+        last_remaining[0] = remaining
+
+    source = sqlite3.connect(source_path, timeout=10)
+    target = sqlite3.connect(dest_path)
+    try:
+        try:
+            source.backup(target, pages=pages, progress=progress, sleep=sleep)
+        except _BackupRestarting:
+            # Под постоянной записью страницы копируются одним шагом (короткая блокировка чтения)
+            source.backup(target, pages=-1)
+        target.execute("PRAGMA journal_mode = DELETE")
+    finally:
+        target.close()
+        source.close()
+    return restarts[0]
+
+
+def _database_stats(db_path):
+    conn = sqlite3.connect(db_path)
+    try:
+        integrity = conn.execute("PRAGMA quick_check").fetchone()[0]
+        tables = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+        row_counts = {
+            table: conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+            for table in MANIFEST_TABLES if table in tables
+        }
+        return {
+            'integrity': integrity,
+            'row_counts': row_counts,
+            'page_size': conn.execute("PRAGMA page_size").fetchone()[0],
+            'page_count': conn.execute("PRAGMA page_count").fetchone()[0],
+            'schema_version': conn.execute("PRAGMA user_version").fetchone()[0],
+        }
+    finally:
+        conn.close()
+
+
+def manifest_path(backup_path):
+    return backup_path + MANIFEST_SUFFIX
+
+
+def read_manifest(backup_path):
+    path = manifest_path(backup_path)
+    if not os.path.exists(path):
+        return None
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def _write_json_atomic(path, data):
+    directory = os.path.dirname(os.path.abspath(path))
+    handle, tmp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    with os.fdopen(handle, 'w', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False, indent=2)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+def create_backup_file(db_path=DB_FILE, backup_dir=BACKUP_DIR, compress=False, description=None, label='backup'):
+    """
+    Создать резервную копию с манифестом
+
+    Returns:
+        str: путь к файлу копии
+    """
+    os.makedirs(backup_dir, exist_ok=True)
+    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    extension = '.db.gz' if compress else '.db'
+    backup_filename = f"medical_center_{label}_{timestamp}{extension}"
+    counter = 1
+    while os.path.exists(os.path.join(backup_dir, backup_filename)):
+        counter += 1
+        backup_filename = f"medical_center_{label}_{timestamp}_{counter}{extension}"
+    backup_path = os.path.join(backup_dir, backup_filename)
+
+    handle, tmp_db = tempfile.mkstemp(dir=backup_dir, suffix='.db.tmp')
+    os.close(handle)
+    try:
+        restarts = online_backup(db_path, tmp_db)
+        stats = _database_stats(tmp_db)
+        if stats['integrity'] != 'ok':
+            raise sqlite3.DatabaseError(f"Backup integrity check failed: {stats['integrity']}")
+        db_sha256 = _sha256_file(tmp_db)
+        db_size = os.path.getsize(tmp_db)
+
+        if compress:
+            tmp_stored = tmp_db + '.gz'
+            with open(tmp_db, 'rb') as src, gzip.open(tmp_stored, 'wb', compresslevel=6) as dst:
+                shutil.copyfileobj(src, dst, 1024 * 1024)
+            os.unlink(tmp_db)
+        else:
+            tmp_stored = tmp_db
+
+        manifest = {
+            'file': backup_filename,
+            'created': datetime.now().isoformat(timespec='seconds'),
+            'description': description,
+            'compressed': compress,
+            'size': os.path.getsize(tmp_stored),
+            'sha256': _sha256_file(tmp_stored),
+            'db_size': db_size,
+            'db_sha256': db_sha256,
+            'restarts': restarts,
+            **stats,
+        }
+        os.replace(tmp_stored, backup_path)
+        _write_json_atomic(manifest_path(backup_path), manifest)
+        print(f"💾 Резервная копия создана: {backup_path} ({manifest['size'] / 1024:.0f} КБ)")
+        return backup_path
+    finally:
+        for path in (tmp_db, tmp_db + '.gz'):
+            if os.path.exists(path):
+                os.unlink(path)
+
+
+def verify_backup(backup_path):
+    """Проверить копию по манифесту: (bool, сообщение)"""
+    manifest = read_manifest(backup_path)
+    if manifest is None:
+        return True, "Манифест отсутствует (копия старого формата)"
+    if os.path.getsize(backup_path) != manifest['size']:
+        return False, "Размер файла не совпадает с манифестом"
+    if _sha256_file(backup_path) != manifest['sha256']:
+        return False, "Контрольная сумма не совпадает с манифестом"
+    return True, "Копия соответствует манифесту"
+
+
+def restore_backup_file(backup_path, db_path=DB_FILE, keep_current=True):
+    """
+    Атомарно восстановить БД из копии
+
+    Копия распаковывается во временный файл рядом с БД, проверяется (контрольная сумма,
+    quick_check) и переименовывается поверх БД. Текущая БД предварительно сохраняется копией.
+    """
+    ok, message = verify_backup(backup_path)
+    if not ok:
+        raise ValueError(message)
+    manifest = read_manifest(backup_path) or {}
+
+    directory = os.path.dirname(os.path.abspath(db_path))
+    handle, tmp_path = tempfile.mkstemp(dir=directory, suffix='.restore.db')
+    os.close(handle)
+    try:
+        opener = gzip.open if backup_path.endswith('.gz') else open
+        with opener(backup_path, 'rb') as src, open(tmp_path, 'wb') as dst:
+            shutil.copyfileobj(src, dst, 1024 * 1024)
+            dst.flush()
+            os.fsync(dst.fileno())
+
+        def save_current():
+            create_backup_file(db_path, os.path.dirname(backup_path) or BACKUP_DIR, label='before_restore')
+
+        _install_database(tmp_path, db_path, manifest.get('db_sha256'), save_current if keep_current else None)
+        print(f"✅ БД восстановлена из {backup_path}")
+        return True
+    finally:
+        if os.path.exists(tmp_path):
+            os.unlink(tmp_path)
+
+
+def _install_database(tmp_path, db_path, expected_sha256, save_current=None):
+    """Проверить собранный временный файл и атомарно заменить им БД"""
+    if expected_sha256 and _sha256_file(tmp_path) != expected_sha256:
+        raise ValueError("Контрольная сумма распакованной БД не совпадает с манифестом")
+    integrity = _database_stats(tmp_path)['integrity']
+    if integrity != 'ok':
+        raise sqlite3.DatabaseError(f"Restore integrity check failed: {integrity}")
+
+    if save_current is not None and os.path.exists(db_path):
+        save_current()
+
+    # Старый WAL не должен примениться к восстановленному файлу
+    checkpoint_database(db_path)
+    reset_pool(db_path)
+    os.replace(tmp_path, db_path)
+    for suffix in ('-wal', '-shm'):
+        if os.path.exists(db_path + suffix):
+            os.unlink(db_path + suffix)
+
+
+def list_backup_files(backup_dir=BACKUP_DIR):
+    """Список копий (новые сверху) с данными манифеста"""
+    if not os.path.exists(backup_dir):
+        return []
+
+    backups = []
+    for filename in os.listdir(backup_dir):
+        if not (filename.endswith('.db') or filename.endswith('.db.gz')):
+            continue
+        file_path = os.path.join(backup_dir, filename)
+        manifest = read_manifest(file_path)
+        if manifest:
+            created = datetime.fromisoformat(manifest['created'])
+            size = manifest['size']
+        else:
+            file_stat = os.stat(file_path)
+            created = datetime.fromtimestamp(file_stat.st_mtime)
+            size = file_stat.st_size
+        backups.append({
+            'filename': filename,
+            'path': file_path,
+            'size': size,
+            'size_mb': size / (1024 * 1024),
+            'created': created,
+            'date': created.strftime('%Y-%m-%d %H:%M:%S'),
+            'manifest': manifest,
+        })
+
+    backups.sort(key=lambda x: x['created'], reverse=True)
+    return backups
+
+
+def delete_backup_file(backup_path):
+    os.remove(backup_path)
+    if os.path.exists(manifest_path(backup_path)):
+        os.remove(manifest_path(backup_path))
+
+
+# ==================== СНИМКИ С ДЕДУПЛИКАЦИЕЙ ====================
+
+_index_lock = threading.RLock()
+_index_cache = {}
+
+
+def _index_path(backup_dir):
+    return os.path.join(backup_dir, INDEX_FILENAME)
+
+
+def _chunk_path(backup_dir, digest):
+    return os.path.join(backup_dir, CHUNKS_SUBDIR, digest[:2], digest[2:])
+
+
+def load_index(backup_dir=BACKUP_DIR):
+    """
+    Индекс снимков (кешируется в памяти, перечитывается только при изменении файла)
+
+    {'snapshots': [...], 'chunks': {sha: [ссылок, байт на диске]}}
+    """
+    path = _index_path(backup_dir)
+    with _index_lock:
+        try:
+            mtime = os.stat(path).st_mtime_ns
+        except FileNotFoundError:
+            return {'snapshots': [], 'chunks': {}}
+        cached = _index_cache.get(path)
+        if cached and cached[0] == mtime:
+            return cached[1]
+        with open(path, 'r', encoding='utf-8') as f:
+            index = json.load(f)
+        _index_cache[path] = (mtime, index)
+        return index
+
+
+def _save_index(backup_dir, index):
+    path = _index_path(backup_dir)
+    _write_json_atomic(path, index)
+    _index_cache[path] = (os.stat(path).st_mtime_ns, index)
+
+
+def _store_chunks(backup_dir, db_file, chunks_ref):
+    """Разрезать файл на блоки и сохранить новые; вернуть (список SHA, записано байт)"""
+    digests = []
+    written = 0
+    with open(db_file, 'rb') as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+            digest = hashlib.sha256(chunk).hexdigest()
+            digests.append(digest)
+            if digest in chunks_ref:
+                chunks_ref[digest][0] += 1
+                continue
+            path = _chunk_path(backup_dir, digest)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            data = zlib.compress(chunk, 6)
+            tmp_path = path + '.tmp'
+            with open(tmp_path, 'wb') as out:
+                out.write(data)
+            os.replace(tmp_path, path)
+            chunks_ref[digest] = [1, len(data)]
+            written += len(data)
+    return digests, written
+
+
+def create_snapshot(db_path=DB_FILE, backup_dir=BACKUP_DIR, kind='manual', description=None, skip_unchanged=False):
+    """
+    Создать снимок в хранилище блоков
+
+    Args:
+        kind: 'manual', 'auto' (планировщик) или 'before_restore'
+        skip_unchanged: не создавать снимок, если БД не изменилась с последнего снимка
+
+    Returns:
+        dict | None: запись индекса о снимке (None - БД не изменилась)
+    """
+    os.makedirs(backup_dir, exist_ok=True)
+    handle, tmp_db = tempfile.mkstemp(dir=backup_dir, suffix='.db.tmp')
+    os.close(handle)
+    try:
+        restarts = online_backup(db_path, tmp_db)
+        stats = _database_stats(tmp_db)
+        if stats['integrity'] != 'ok':
+            raise sqlite3.DatabaseError(f"Backup integrity check failed: {stats['integrity']}")
+        db_sha256 = _sha256_file(tmp_db)
+
+        with _index_lock:
+            index = load_index(backup_dir)
+            index = {'snapshots': list(index['snapshots']), 'chunks': {k: list(v) for k, v in index['chunks'].items()}}
+            if skip_unchanged and index['snapshots'] and index['snapshots'][0]['db_sha256'] == db_sha256:
+                return None
+
+            chunks, written = _store_chunks(backup_dir, tmp_db, index['chunks'])
+            created = datetime.now()
+            snapshot = {
+                'id': created.strftime('%Y%m%d_%H%M%S_%f'),
+                'created': created.isoformat(timespec='seconds'),
+                'kind': kind,
+                'description': description,
+                'db_size': os.path.getsize(tmp_db),
+                'db_sha256': db_sha256,
+                'stored_bytes': written,
+                'chunks': chunks,
+                'restarts': restarts,
+                **stats,
+            }
+            index['snapshots'].insert(0, snapshot)
+            _save_index(backup_dir, index)
+        print(f"💾 Снимок {snapshot['id']} ({kind}): новых данных {written / 1024:.0f} КБ из {snapshot['db_size'] / 1024:.0f} КБ")
+        return snapshot
+    finally:
+        if os.path.exists(tmp_db):
+            os.unlink(tmp_db)
+
+
+def list_snapshots(backup_dir=BACKUP_DIR):
+    """Снимки из индекса (новые сверху) без обращения к файлам блоков"""
+    return load_index(backup_dir)['snapshots']
+
+
+def _find_snapshot(backup_dir, snapshot_id):
+    for snapshot in load_index(backup_dir)['snapshots']:
+        if snapshot['id'] == snapshot_id:
+            return snapshot
+    raise ValueError(f"Снимок {snapshot_id} не найден")
+
+
+def restore_snapshot(snapshot_id, db_path=DB_FILE, backup_dir=BACKUP_DIR, keep_current=True):
+    """Атомарно восстановить БД из снимка (сборка из блоков во временный файл и rename)"""
+    snapshot = _find_snapshot(backup_dir, snapshot_id)
+    directory = os.path.dirname(os.path.abspath(db_path))
+    handle, tmp_path = tempfile.mkstemp(dir=directory, suffix='.restore.db')
+    try:
+        with os.fdopen(handle, 'wb') as dst:
+            for digest in snapshot['chunks']:
+                with open(_chunk_path(backup_dir, digest), 'rb') as src:
+                    chunk = zlib.decompress(src.read())
+                if hashlib.sha256(chunk).hexdigest() != digest:
+                    raise ValueError(f"Блок {digest[:12]} поврежден")
+                dst.write(chunk)
+            dst.flush()
+            os.fsync(dst.fileno())
+
+        def save_current():
+            create_snapshot(db_path, backup_dir, kind='before_restore')
+
+        _install_database(tmp_path, db_path, snapshot['db_sha256'], save_current if keep_current else None)
+        print(f"✅ БД восстановлена из снимка {snapshot_id}")
+        return True
+    finally:
+        if os.path.exists(tmp_path):
+            os.unlink(tmp_path)
+
+
+def delete_snapshots(snapshot_ids, backup_dir=BACKUP_DIR):
+    """Удалить снимки и блоки, на которые больше никто не ссылается"""
+    snapshot_ids = set(snapshot_ids)
+    with _index_lock:
+        index = load_index(backup_dir)
+        chunks_ref = {k: list(v) for k, v in index['chunks'].items()}
+        remaining = []
+        for snapshot in index['snapshots']:
+            if snapshot['id'] not in snapshot_ids:
+                remaining.append(snapshot)
+                continue
+            for digest in snapshot['chunks']:
+                chunks_ref[digest][0] -= 1
+
+        orphaned = [digest for digest, (refs, _) in chunks_ref.items() if refs <= 0]
+        for digest in orphaned:
+            del chunks_ref[digest]
+        # Сначала индекс, потом файлы: при сбое остаются лишние блоки, но не битые ссылки
+        _save_index(backup_dir, {'snapshots': remaining, 'chunks': chunks_ref})
+        for digest in orphaned:
+            path = _chunk_path(backup_dir, digest)
+            if os.path.exists(path):
+                os.unlink(path)
+    return len(index['snapshots']) - len(remaining)
+
+
+def select_expired(snapshots, policy=None, now=None):
+    """
+    ID автоматических снимков, не попадающих в политику хранения
+
+    Сохраняется самый новый снимок в каждом из последних N часов, дней и недель
+    (снимок может закрывать сразу несколько уровней). Ручные снимки не удаляются.
+    """
+    policy = policy or RETENTION_POLICY
+    now = now or datetime.now()
+    buckets = {
+        'hourly': lambda t: t.strftime('%Y-%m-%d %H'),
+        'daily': lambda t: t.strftime('%Y-%m-%d'),
+        'weekly': lambda t: '%d-W%02d' % t.isocalendar()[:2],
+    }
+    windows = {
+        'hourly': timedelta(hours=policy['hourly']),
+        'daily': timedelta(days=policy['daily']),
+        'weekly': timedelta(weeks=policy['weekly']),
+    }
+
+    keep = set()
+    auto = sorted(
+        (s for s in snapshots if s['kind'] == 'auto'),
+        key=lambda s: s['created'], reverse=True
+    )
+    for level, bucket_of in buckets.items():
+        seen = set()
+        for snapshot in auto:
+            created = datetime.fromisoformat(snapshot['created'])
+            if now - created > windows[level]:
+                break
+            bucket = bucket_of(created)
+            if bucket not in seen and len(seen) < policy[level]:
+                seen.add(bucket)
+                keep.add(snapshot['id'])
+    return [s['id'] for s in auto if s['id'] not in keep]
+
+
+def apply_retention(backup_dir=BACKUP_DIR, policy=None, now=None):
+    """Удалить автоматические снимки вне политики хранения"""
+    expired = select_expired(list_snapshots(backup_dir), policy, now)
+    if expired:
+        delete_snapshots(expired, backup_dir)
+        print(f"🧹 Удалено снимков по политике хранения: {len(expired)}")
+    return expired
+
+
+def storage_stats(backup_dir=BACKUP_DIR):
+    """Объем хранилища и коэффициент дедупликации (логический объем / занятый на диске)"""
+    index = load_index(backup_dir)
+    logical = sum(s['db_size'] for s in index['snapshots'])
+    stored = sum(size for _, size in index['chunks'].values())
+    return {
+        'snapshots': len(index['snapshots']),
+        'chunks': len(index['chunks']),
+        'logical_bytes': logical,
+        'stored_bytes': stored,
+        'dedup_ratio': logical / stored if stored else 0.0,
+    }
+
+
+class BackupScheduler:
+    """
+    Фоновые автоматические снимки
+
+    Раз в interval секунд создается снимок (если БД изменилась), затем применяется
+    политика хранения (почасовые, ежедневные, еженедельные).
+    """
+
+    def __init__(self, db_path=DB_FILE, backup_dir=BACKUP_DIR, interval=BACKUP_INTERVAL, policy=None):
+        self.db_path = db_path
+        self.backup_dir = backup_dir
+        self.interval = interval
+        self.policy = policy or RETENTION_POLICY
+        self._stop = threading.Event()
+        self._thread = None
+        self.last_run = None
+        self.last_error = None
+
+    def run_once(self):
+        try:
+            snapshot = create_snapshot(self.db_path, self.backup_dir, kind='auto', skip_unchanged=True)
+            apply_retention(self.backup_dir, self.policy)
+            self.last_run = datetime.now()
+            self.last_error = None
+            return snapshot
+        except Exception as e:
+            self.last_error = str(e)
+            print(f"⚠️ Ошибка автоматического снимка: {e}")
+            return None
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.run_once()
+
+    def start(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='backup-scheduler', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+
+
+_scheduler = None
+
+
+def start_backup_scheduler(db_path=DB_FILE):
+    """Запустить планировщик автоматических снимков (один на процесс)"""
+    global _scheduler
+    if not BACKUP_SCHEDULER_ENABLED:
+        return None
+    if _scheduler is None:
+        _scheduler = BackupScheduler(db_path)
+        _scheduler.start()
+    return _scheduler
+
+
+def get_backup_scheduler():
+    return _scheduler
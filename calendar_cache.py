@@ -0,0 +1,173 @@
+#!/usr/bin/env python3
+"""
+Общий кеш недели календаря с инкрементальным обновлением
+
+Каждый перезапуск скрипта Streamlit раньше заново читал все приемы недели.
+Теперь неделя (ключ - период, набор врачей, статусы) хранится в памяти процесса
+вместе с водяным знаком данных (migrate_database, схема v2):
+- водяной знак не изменился - сетка берется из кеша без чтения приемов;
+- изменились только приемы - дочитываются строки, измененные после водяного знака;
+- изменились справочники или журнал изменений обрезан - неделя читается заново.
+"""
+
+import os
+import sqlite3
+import threading
+from collections import OrderedDict
+
+from calendar_index import CalendarIndex, fetch_appointments
+
+CALENDAR_CACHE_SIZE = int(os.getenv('CALENDAR_CACHE_SIZE', '32'))
+# Если изменилось больше приемов, дешевле перечитать неделю целиком
+INCREMENTAL_MAX_CHANGES = 500
+
+
+def read_watermark(conn):
+    """
+    Водяной знак данных календаря: (последнее изменение приемов, версия справочников)
+
+    None - таблиц версий нет (схема v2 не применена), кешировать нельзя.
+    """
+    try:
+        return conn.execute('''
+            SELECT (SELECT COALESCE(MAX(seq), 0) FROM _appointment_changes),
+                   (SELECT version FROM _data_version WHERE name = 'reference')
+        ''').fetchone()
+    except sqlite3.OperationalError:
+        return None
+
+
+def changed_appointment_ids(conn, since_seq):
+    """
+    ID приемов, измененных после since_seq
+
+    None - часть журнала после since_seq уже обрезана, инкрементальное обновление невозможно.
+    """
+    oldest = conn.execute("SELECT MIN(seq) FROM _appointment_changes").fetchone()[0]
+    if oldest is not None and oldest > since_seq + 1:
+        return None
+    return {row[0] for row in conn.execute(
+        "SELECT DISTINCT appointment_id FROM _appointment_changes WHERE seq > ?", (since_seq,)
+    )}
+
+
+class _WeekEntry:
+    """Приемы недели на момент водяного знака и построенные по ним сетки"""
+
+    def __init__(self, watermark, rows):
+        self.watermark = watermark
+        self.rows = rows
+        self.grids = {}
+
+    def grid(self, slot_minutes):
+        if slot_minutes not in self.grids:
+            self.grids[slot_minutes] = CalendarIndex(self.rows, slot_minutes=slot_minutes)
+        return self.grids[slot_minutes]
+
+
+class CalendarCache:
+    """
+    LRU-кеш недель календаря, общий для всех сессий процесса
+
+    Счетчики: hits - водяной знак не изменился, refreshes - дочитаны измененные
+    приемы, misses - неделя прочитана целиком.
+    """
+
+    def __init__(self, max_entries=CALENDAR_CACHE_SIZE):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.refreshes = 0
+        self.misses = 0
+
+    @staticmethod
+    def make_key(start_date, end_date, doctor_ids=None, statuses=None):
+        return (
+            str(start_date), str(end_date),
+            None if doctor_ids is None else frozenset(doctor_ids),
+            None if statuses is None else frozenset(statuses),
+        )
+
+    def get_week(self, conn, start_date, end_date, doctor_ids=None, statuses=None,
+                 slot_minutes=None, force=False):
+        """
+        Сетка недели (CalendarIndex) с учетом изменений после прошлого чтения
+
+        force - сбросить кеш для этой недели (кнопка обновления в сессии пользователя).
+        """
+        key = self.make_key(start_date, end_date, doctor_ids, statuses)
+        watermark = read_watermark(conn)
+
+        with self._lock:
+            entry = None if force else self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+
+        if watermark is not None and entry is not None:
+            if entry.watermark == watermark:
+                with self._lock:
+                    self.hits += 1
+                return entry.grid(slot_minutes)
+
+            entry = self._refresh(conn, entry, watermark, start_date, end_date, doctor_ids, statuses)
+            if entry is not None:
+                self._store(key, entry)
+                with self._lock:
+                    self.refreshes += 1
+                return entry.grid(slot_minutes)
+
+        rows = fetch_appointments(conn, start_date, end_date, doctor_ids=doctor_ids, statuses=statuses)
+        entry = _WeekEntry(watermark, rows)
+        if watermark is not None:
+            self._store(key, entry)
+        with self._lock:
+            self.misses += 1
+        return entry.grid(slot_minutes)
+
+    def _refresh(self, conn, entry, watermark, start_date, end_date, doctor_ids, statuses):
+        """Новая запись недели: старые строки плюс перечитанные измененные приемы"""
+        (old_seq, old_reference), (new_seq, new_reference) = entry.watermark, watermark
+        # Справочники изменились или БД пересобрана (счетчики начались заново)
+        if new_reference != old_reference or new_seq < old_seq:
+            return None
+        changed = changed_appointment_ids(conn, old_seq)
+        if changed is None or len(changed) > INCREMENTAL_MAX_CHANGES:
+            return None
+
+        fresh = fetch_appointments(
+            conn, start_date, end_date, doctor_ids=doctor_ids, statuses=statuses, appointment_ids=changed
+        ) if changed else []
+        rows = [row for row in entry.rows if row.id not in changed] + fresh
+        rows.sort(key=lambda row: (row.appointment_date, row.appointment_time))
+        return _WeekEntry(watermark, rows)
+
+    def _store(self, key, entry):
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            requests = self.hits + self.refreshes + self.misses
+            return {
+                'entries': len(self._entries),
+                'hits': self.hits,
+                'refreshes': self.refreshes,
+                'misses': self.misses,
+                'hit_ratio': (self.hits + self.refreshes) / requests if requests else 0.0,
+            }
+
+
+_cache = CalendarCache()
+
+
+def get_calendar_cache():
+    """Общий кеш календаря процесса"""
+    return _cache
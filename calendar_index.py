@@ -0,0 +1,165 @@
+#!/usr/bin/env python3
+"""
+Индекс календаря: приемы по ячейкам (дата, слот)
+
+Время приема разбирается один раз при построении индекса; отрисовка ячейки -
+один поиск в словаре вместо перебора всех приемов дня с datetime.strptime.
+"""
+
+import os
+from collections import namedtuple
+from datetime import date, time
+from functools import lru_cache
+
+# Сетка календаря (шаг в минутах и рабочие часы)
+CALENDAR_SLOT_MINUTES = int(os.getenv('CALENDAR_SLOT_MINUTES', '15'))
+CALENDAR_DAY_START = int(os.getenv('CALENDAR_DAY_START', '9'))
+CALENDAR_DAY_END = int(os.getenv('CALENDAR_DAY_END', '18'))
+SLOT_MINUTE_OPTIONS = (10, 15, 20, 30, 60)
+
+# Строка приема для календаря: кортеж (индексы как раньше) с именованными полями
+AppointmentRow = namedtuple('AppointmentRow', [
+    'id', 'client_id', 'doctor_id', 'service_id', 'appointment_date',
+    'appointment_time', 'status', 'notes', 'start_time', 'end_time',
+    'client_first_name', 'client_last_name', 'client_phone',
+    'doctor_first_name', 'doctor_last_name', 'doctor_specialization',
+    'service_name', 'service_price', 'service_duration',
+])
+
+# Позиции полей в строке get_appointments_by_date_range
+DATE_FIELD = 4
+TIME_FIELD = 5
+
+APPOINTMENTS_QUERY = '''
+    SELECT a.id, a.client_id, a.doctor_id, a.service_id, a.appointment_date,
+           a.appointment_time, a.status, a.notes, a.start_time, a.end_time,
+           c.first_name, c.last_name, c.phone,
+           d.first_name, d.last_name, d.specialization,
+           s.name, s.price, s.duration_minutes
+    FROM appointments a
+    JOIN clients c ON a.client_id = c.id
+    JOIN doctors d ON a.doctor_id = d.id
+    JOIN services s ON a.service_id = s.id
+    WHERE a.appointment_date BETWEEN ? AND ?
+'''
+
+
+# До скольких выбранных врачей фильтр идет через индекс врача
+DOCTOR_INDEX_MAX_IDS = 10
+
+
+def _as_date_str(value):
+    return value.strftime('%Y-%m-%d') if hasattr(value, 'strftime') else str(value)
+
+
+def fetch_appointments(conn, start_date, end_date, doctor_ids=None, statuses=None, appointment_ids=None):
+    """
+    Приемы за период с фильтрами врачей и статусов на стороне SQL
+
+    doctor_ids/statuses/appointment_ids: None - без фильтра, пустой набор - ничего не найдено.
+    Несколько врачей ищутся через idx_appointments_doctor_date_time (doctor_id IN ...
+    AND appointment_date BETWEEN ...), большой набор - по индексу даты с фильтром
+    по списку. Строки приходят как AppointmentRow.
+    """
+    query = APPOINTMENTS_QUERY
+    params = [_as_date_str(start_date), _as_date_str(end_date)]
+
+    filters = (('a.id', appointment_ids), ('a.doctor_id', doctor_ids), ('a.status', statuses))
+    for column, values in filters:
+        if values is None:
+            continue
+        # Отсортированный список - одинаковый текст запроса для одного набора (кеш выражений sqlite3)
+        values = sorted(set(values))
+        if not values:
+            return []
+        if column == 'a.doctor_id' and len(values) > DOCTOR_INDEX_MAX_IDS:
+            # Врачей выбрано много: поиск по индексу врача (проба на каждого + сортировка)
+            # дороже, чем пройти неделю по индексу даты и отсеять врачей по списку
+            column = '+' + column
+        query += f" AND {column} IN ({', '.join('?' * len(values))})"
+        params.extend(values)
+
+    query += ' ORDER BY a.appointment_date, a.appointment_time'
+    cursor = conn.execute(query, params)
+    return [AppointmentRow._make(row) for row in cursor]
+
+
+def build_time_slots(slot_minutes=None, day_start=None, day_end=None):
+    """Начала слотов рабочего дня с заданным шагом"""
+    slot_minutes = CALENDAR_SLOT_MINUTES if slot_minutes is None else slot_minutes
+    day_start = CALENDAR_DAY_START if day_start is None else day_start
+    day_end = CALENDAR_DAY_END if day_end is None else day_end
+    if slot_minutes <= 0:
+        raise ValueError(f"Шаг сетки должен быть положительным: {slot_minutes}")
+    return [
+        time(minute // 60, minute % 60)
+        for minute in range(day_start * 60, day_end * 60, slot_minutes)
+    ]
+
+
+@lru_cache(maxsize=2048)
+def parse_time(value):
+    """Время приема из строки 'HH:MM:SS' или 'HH:MM' (различных значений немного - кешируем)"""
+    return time.fromisoformat(value)
+
+
+@lru_cache(maxsize=512)
+def parse_date(value):
+    """Дата приема из строки 'YYYY-MM-DD'"""
+    return date.fromisoformat(value)
+
+
+def slot_start(value, slot_minutes=None, day_start=None):
+    """Начало слота, в который попадает время (округление вниз до шага сетки от начала дня)"""
+    slot_minutes = slot_minutes or CALENDAR_SLOT_MINUTES
+    origin = (CALENDAR_DAY_START if day_start is None else day_start) * 60
+    minutes = value.hour * 60 + value.minute
+    minutes -= (minutes - origin) % slot_minutes
+    return time(minutes // 60, minutes % 60)
+
+
+class CalendarIndex:
+    """
+    Приемы, разложенные по ячейкам (дата, начало слота)
+
+    Прием не на границе сетки (например, 09:10 при шаге 15 минут) попадает
+    в слот, внутри которого начинается. Приемы вне рабочих часов не теряются
+    молча - они собраны в outside_hours.
+    """
+
+    def __init__(self, appointments, slot_minutes=None, day_start=None, day_end=None):
+        self.slot_minutes = slot_minutes or CALENDAR_SLOT_MINUTES
+        self.day_start = CALENDAR_DAY_START if day_start is None else day_start
+        self.time_slots = build_time_slots(self.slot_minutes, day_start, day_end)
+        self.cells = {}
+        self.days = {}
+        self.outside_hours = []
+        self.total = 0
+
+        first_slot, last_slot = self.time_slots[0], self.time_slots[-1]
+        for appointment in appointments:
+            apt_date = appointment[DATE_FIELD]
+            if isinstance(apt_date, str):
+                apt_date = parse_date(apt_date)
+            apt_time = appointment[TIME_FIELD]
+            if isinstance(apt_time, str):
+                apt_time = parse_time(apt_time)
+
+            slot = slot_start(apt_time, self.slot_minutes, self.day_start)
+            self.total += 1
+            if slot < first_slot or slot > last_slot:
+                self.outside_hours.append(appointment)
+                continue
+            self.cells.setdefault((apt_date, slot), []).append(appointment)
+            self.days[apt_date] = self.days.get(apt_date, 0) + 1
+
+    def get(self, day, slot):
+        """Приемы в ячейке (пустой список, если ячейка свободна)"""
+        return self.cells.get((day, slot), [])
+
+    def count_for_day(self, day):
+        """Количество приемов в сетке за день"""
+        return self.days.get(day, 0)
+
+    def __len__(self):
+        return self.total
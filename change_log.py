@@ -0,0 +1,611 @@
+#!/usr/bin/env python3
+"""
+Журнал изменений строк для синхронизации базы данных через Git
+
+Вместо коммита всего бинарного medical_center.db триггеры записывают изменения строк
+в таблицу _change_log. При синхронизации они выгружаются компактными дельтами
+(sync/changes/*.jsonl.gz), периодически сворачиваемыми в снимок (sync/snapshot.json.gz).
+При старте база собирается из снимка и дельт.
+"""
+
+import gzip
+import json
+import os
+import sqlite3
+import tempfile
+
+from db_pool import DB_FILE, get_pool, reset_pool, checkpoint_database
+from migrate_database import apply_schema_migrations, get_schema_version
+
+SYNC_DIR = 'sync'
+DELTAS_DIR = os.path.join(SYNC_DIR, 'changes')
+SNAPSHOT_FILE = os.path.join(SYNC_DIR, 'snapshot.json.gz')
+
+# Сколько файлов дельт накапливать до свертки в новый снимок
+SNAPSHOT_EVERY = int(os.getenv('CHANGE_LOG_SNAPSHOT_EVERY', '50'))
+
+# Таблицы, изменения которых отслеживаются (порядок важен при сборке из снимка)
+TRACKED_TABLES = [
+    'users',
+    'clients',
+    'doctors',
+    'services',
+    'appointments',
+    'appointment_services',
+    'appointment_service_payments',
+    'audit_log',
+    'settings',
+]
+
+# Таблицы самого журнала: пересоздаются install_change_tracking, в снимок не входят
+LOG_TABLES = ('_change_log', '_change_log_state')
+
+# Порядок создания производных объектов при сборке из снимка
+DERIVED_ORDER = {'table': 0, 'index': 1, 'view': 2, 'trigger': 3}
+
+
+# ==================== ОТСЛЕЖИВАНИЕ ИЗМЕНЕНИЙ ====================
+
+def _create_log_tables(conn):
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS _change_log (
+            seq INTEGER PRIMARY KEY AUTOINCREMENT,
+            table_name TEXT NOT NULL,
+            op TEXT NOT NULL,
+            row_id INTEGER NOT NULL,
+            row_data TEXT
+        )
+    ''')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS _change_log_state (
+            key TEXT PRIMARY KEY,
+            value TEXT
+        )
+    ''')
+
+
+def _table_columns(conn, table):
+    return [row[1] for row in conn.execute(f"PRAGMA table_info({table})")]
+
+
+def _existing_tables(conn):
+    rows = conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'").fetchall()
+    return {row[0] for row in rows}
+
+
+def _drop_triggers(conn):
+    for table in TRACKED_TABLES:
+        for suffix in ('ins', 'upd', 'del'):
+            conn.execute(f"DROP TRIGGER IF EXISTS _cl_{table}_{suffix}")
+
+
+def install_change_tracking(conn):
+    """
+    Создать таблицы журнала и триггеры на отслеживаемых таблицах
+
+    Триггеры пересоздаются при каждом вызове, чтобы учесть новые колонки.
+    """
+    _create_log_tables(conn)
+    _drop_triggers(conn)
+    existing = _existing_tables(conn)
+
+    for table in TRACKED_TABLES:
+        if table not in existing:
+            continue
+        columns = _table_columns(conn, table)
+        row_json = 'json_object(' + ', '.join(f"'{col}', NEW.{col}" for col in columns) + ')'
+
+        conn.execute(f'''
+            CREATE TRIGGER _cl_{table}_ins AFTER INSERT ON {table}
+            BEGIN
+                INSERT INTO _change_log (table_name, op, row_id, row_data)
+                VALUES ('{table}', 'U', NEW.id, {row_json});
+            END
+        ''')
+        conn.execute(f'''
+            CREATE TRIGGER _cl_{table}_upd AFTER UPDATE ON {table}
+            BEGIN
+                INSERT INTO _change_log (table_name, op, row_id, row_data)
+                VALUES ('{table}', 'U', NEW.id, {row_json});
+            END
+        ''')
+        conn.execute(f'''
+            CREATE TRIGGER _cl_{table}_del AFTER DELETE ON {table}
+            BEGIN
+                INSERT INTO _change_log (table_name, op, row_id, row_data)
+                VALUES ('{table}', 'D', OLD.id, NULL);
+            END
+        ''')
+    conn.commit()
+
+
+def _get_state(conn, key, default=0):
+    row = conn.execute("SELECT value FROM _change_log_state WHERE key = ?", (key,)).fetchone()
+    return int(row[0]) if row else default
+
+
+def _set_state(conn, key, value):
+    conn.execute('''
+        INSERT INTO _change_log_state (key, value) VALUES (?, ?)
+        ON CONFLICT(key) DO UPDATE SET value = excluded.value
+    ''', (key, str(value)))
+
+
+def pending_changes_count(db_path=DB_FILE):
+    """Количество изменений, еще не выгруженных в дельты"""
+    with get_pool(db_path).connection() as conn:
+        if '_change_log' not in _existing_tables(conn):
+            return 0
+        return conn.execute("SELECT COUNT(*) FROM _change_log").fetchone()[0]
+
+
+# ==================== ФАЙЛЫ ДЕЛЬТ И СНИМКОВ ====================
+
+def _atomic_write_gzip(path, lines):
+    """Записать gzip-файл через временный файл и rename"""
+    directory = os.path.dirname(path)
+    os.makedirs(directory, exist_ok=True)
+    handle, tmp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    try:
+        with os.fdopen(handle, 'wb') as raw:
+            with gzip.GzipFile(fileobj=raw, mode='wb', mtime=0) as gz:
+                for line in lines:
+                    gz.write(line.encode('utf-8'))
+                    gz.write(b'\n')
+            raw.flush()
+            os.fsync(raw.fileno())
+        os.replace(tmp_path, path)
+    except Exception:
+        if os.path.exists(tmp_path):
+            os.unlink(tmp_path)
+        raise
+
+
+def _delta_files():
+    """Файлы дельт: [(first_seq, last_seq, path)] по возрастанию"""
+    if not os.path.isdir(DELTAS_DIR):
+        return []
+    files = []
+    for filename in os.listdir(DELTAS_DIR):
+        if not filename.endswith('.jsonl.gz'):
+            continue
+        try:
+            first, last = filename[:-len('.jsonl.gz')].split('-')
+            files.append((int(first), int(last), os.path.join(DELTAS_DIR, filename)))
+        except ValueError:
+            continue
+    return sorted(files)
+
+
+def _read_delta(path):
+    with gzip.open(path, 'rt', encoding='utf-8') as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+
+def _read_snapshot():
+    if not os.path.exists(SNAPSHOT_FILE):
+        return None
+    with gzip.open(SNAPSHOT_FILE, 'rt', encoding='utf-8') as f:
+        return json.loads(f.read())
+
+
+def latest_log_seq():
+    """Последний номер изменения в снимке и дельтах"""
+    snapshot_seq = 0
+    snapshot = _read_snapshot()
+    if snapshot:
+        snapshot_seq = snapshot['seq']
+    deltas = _delta_files()
+    return max([snapshot_seq] + [last for _, last, _ in deltas])
+
+
+def _derived_objects(conn):
+    """
+    Производная схема миграций: индексы, триггеры и служебные таблицы (сводки, FTS, версии)
+
+    Триггеры журнала (_cl_*) пересоздает install_change_tracking, теневые таблицы
+    FTS создаются вместе со своей виртуальной таблицей.
+
+    Returns:
+        list: [(type, name, sql)] в порядке создания
+    """
+    rows = conn.execute(
+        "SELECT type, name, sql FROM sqlite_master WHERE sql IS NOT NULL AND name NOT LIKE 'sqlite_%'"
+    ).fetchall()
+    virtual = [name for type_, name, sql in rows
+               if type_ == 'table' and sql.upper().startswith('CREATE VIRTUAL TABLE')]
+    objects = []
+    for type_, name, sql in rows:
+        if type_ == 'table' and (name in TRACKED_TABLES or name in LOG_TABLES
+                                 or any(name.startswith(f"{table}_") for table in virtual)):
+            continue
+        if type_ == 'trigger' and name.startswith('_cl_'):
+            continue
+        objects.append((type_, name, sql))
+    return sorted(objects, key=lambda item: DERIVED_ORDER.get(item[0], len(DERIVED_ORDER)))
+
+
+def _derived_columns(conn, name, sql):
+    # У виртуальной таблицы (FTS) rowid - ключ строки, у обычных он входит в колонки
+    columns = _table_columns(conn, name)
+    return ['rowid'] + columns if sql.upper().startswith('CREATE VIRTUAL TABLE') else columns
+
+
+def write_snapshot(conn, seq):
+    """
+    Записать снимок на момент изменения seq
+
+    Кроме отслеживаемых таблиц в снимок входят версия схемы (user_version) и
+    производная схема миграций с данными служебных таблиц: собранная из снимка БД
+    не зависит от повторного выполнения миграций.
+    """
+    existing = _existing_tables(conn)
+    schema = {}
+    tables = {}
+    for table in TRACKED_TABLES:
+        if table not in existing:
+            continue
+        schema[table] = conn.execute(
+            "SELECT sql FROM sqlite_master WHERE type = 'table' AND name = ?", (table,)
+        ).fetchone()[0]
+        columns = _table_columns(conn, table)
+        rows = conn.execute(f"SELECT {', '.join(columns)} FROM {table} ORDER BY id").fetchall()
+        tables[table] = {'columns': columns, 'rows': [list(row) for row in rows]}
+
+    derived = _derived_objects(conn)
+    derived_tables = {}
+    for type_, name, sql in derived:
+        if type_ == 'table':
+            columns = _derived_columns(conn, name, sql)
+            rows = conn.execute(f"SELECT {', '.join(columns)} FROM {name}").fetchall()
+            derived_tables[name] = {'columns': columns, 'rows': [list(row) for row in rows]}
+
+    snapshot = {
+        'seq': seq, 'schema': schema, 'tables': tables,
+        'user_version': get_schema_version(conn),
+        'derived': [list(item) for item in derived], 'derived_tables': derived_tables,
+    }
+    _atomic_write_gzip(SNAPSHOT_FILE, [json.dumps(snapshot, ensure_ascii=False, separators=(',', ':'))])
+    return SNAPSHOT_FILE
+
+
+def ship_changes(db_path=DB_FILE):
+    """
+    Выгрузить накопленные изменения в файл дельты
+
+    Returns:
+        list: измененные пути в SYNC_DIR (пустой список - выгружать нечего)
+    """
+    with get_pool(db_path).connection() as conn:
+        _create_log_tables(conn)
+
+        # Первая выгрузка: снимок текущего состояния БД
+        if not os.path.exists(SNAPSHOT_FILE):
+            last_seq = conn.execute("SELECT COALESCE(MAX(seq), 0) FROM _change_log").fetchone()[0]
+            last_seq = max(last_seq, _get_state(conn, 'shipped_seq'))
+            write_snapshot(conn, last_seq)
+            conn.execute("DELETE FROM _change_log WHERE seq <= ?", (last_seq,))
+            _set_state(conn, 'shipped_seq', last_seq)
+            _set_state(conn, 'applied_seq', last_seq)
+            conn.commit()
+            print(f"📸 Создан начальный снимок БД (seq {last_seq})")
+            return [SNAPSHOT_FILE]
+
+        rows = conn.execute('''
+            SELECT seq, table_name, op, row_id, row_data
+            FROM _change_log
+            ORDER BY seq
+        ''').fetchall()
+        if not rows:
+            return []
+
+        first_seq, last_seq = rows[0][0], rows[-1][0]
+        delta_path = os.path.join(DELTAS_DIR, f"{first_seq:012d}-{last_seq:012d}.jsonl.gz")
+        _atomic_write_gzip(delta_path, (
+            json.dumps({
+                'seq': seq,
+                't': table_name,
+                'op': op,
+                'id': row_id,
+                'row': json.loads(row_data) if row_data else None
+            }, ensure_ascii=False, separators=(',', ':'))
+            for seq, table_name, op, row_id, row_data in rows
+        ))
+
+        conn.execute("DELETE FROM _change_log WHERE seq <= ?", (last_seq,))
+        _set_state(conn, 'shipped_seq', last_seq)
+        _set_state(conn, 'applied_seq', last_seq)
+        conn.commit()
+        changed = [delta_path]
+
+        # Периодическая свертка дельт в снимок
+        deltas = _delta_files()
+        if len(deltas) >= SNAPSHOT_EVERY:
+            changed.extend(compact_snapshot(conn, last_seq))
+
+        print(f"📤 Выгружено изменений: {len(rows)} (seq {first_seq}-{last_seq})")
+        return changed
+
+
+def compact_snapshot(conn, seq):
+    """Записать новый снимок и удалить вошедшие в него дельты"""
+    write_snapshot(conn, seq)
+    changed = [SNAPSHOT_FILE]
+    for _, last, path in _delta_files():
+        if last <= seq:
+            os.unlink(path)
+            changed.append(path)
+    print(f"🗜️ Дельты свернуты в снимок (seq {seq})")
+    return changed
+
+
+# ==================== ВОССТАНОВЛЕНИЕ ====================
+
+def _apply_record(conn, record, columns_cache):
+    table = record['t']
+    if table not in columns_cache:
+        columns_cache[table] = set(_table_columns(conn, table))
+    table_columns = columns_cache[table]
+    if not table_columns:
+        return
+
+    if record['op'] == 'D':
+        conn.execute(f"DELETE FROM {table} WHERE id = ?", (record['id'],))
+        return
+
+    row = {key: value for key, value in record['row'].items() if key in table_columns}
+    columns = list(row)
+    # UPDATE, затем INSERT вместо UPSERT: политика ON CONFLICT ... DO UPDATE переопределяет
+    # INSERT OR IGNORE в производных триггерах, и повторная отметка дня падала бы на UNIQUE
+    updates = [col for col in columns if col != 'id']
+    if updates:
+        cursor = conn.execute(
+            f"UPDATE {table} SET {', '.join(f'{col} = ?' for col in updates)} WHERE id = ?",
+            [row[col] for col in updates] + [row['id']]
+        )
+        if cursor.rowcount:
+            return
+    elif conn.execute(f"SELECT 1 FROM {table} WHERE id = ?", (row['id'],)).fetchone():
+        return
+    conn.execute(
+        f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({', '.join('?' for _ in columns)})",
+        [row[col] for col in columns]
+    )
+
+
+def _replay(conn, records):
+    """Применить записи журнала без повторного логирования"""
+    columns_cache = {}
+    last_seq = None
+    conn.execute("PRAGMA foreign_keys = OFF")
+    try:
+        _drop_triggers(conn)
+        for record in records:
+            _apply_record(conn, record, columns_cache)
+            last_seq = record.get('seq', last_seq)
+        conn.commit()
+    finally:
+        install_change_tracking(conn)
+        conn.execute("PRAGMA foreign_keys = ON")
+    return last_seq
+
+
+def _records_after(seq):
+    for first, last, path in _delta_files():
+        if last <= seq:
+            continue
+        for record in _read_delta(path):
+            if record['seq'] > seq:
+                yield record
+
+
+def _bump_sequence(conn, seq):
+    """Новые локальные изменения должны получать номера больше уже примененных"""
+    updated = conn.execute(
+        "UPDATE sqlite_sequence SET seq = MAX(seq, ?) WHERE name = '_change_log'", (seq,)
+    ).rowcount
+    if not updated:
+        conn.execute("INSERT INTO sqlite_sequence (name, seq) VALUES ('_change_log', ?)", (seq,))
+
+
+def _local_unshipped(conn):
+    if '_change_log' not in _existing_tables(conn):
+        return []
+    rows = conn.execute("SELECT seq, table_name, op, row_id, row_data FROM _change_log ORDER BY seq").fetchall()
+    return [
+        {'seq': seq, 't': table_name, 'op': op, 'id': row_id, 'row': json.loads(row_data) if row_data else None}
+        for seq, table_name, op, row_id, row_data in rows
+    ]
+
+
+def _restore_derived(conn, snapshot):
+    """
+    Производная схема из снимка: служебные таблицы с данными, затем индексы и триггеры
+
+    Триггеры создаются после загрузки данных, чтобы не сработать на ней. Снимок старого
+    формата (без производной схемы) достраивается миграциями с нулевой версии.
+    """
+    if 'derived' not in snapshot:
+        conn.commit()
+        apply_schema_migrations(conn)
+        return
+    for type_, name, sql in snapshot['derived']:
+        conn.execute(sql)
+        data = snapshot['derived_tables'].get(name) if type_ == 'table' else None
+        if data and data['rows']:
+            conn.executemany(
+                f"INSERT INTO {name} ({', '.join(data['columns'])}) "
+                f"VALUES ({', '.join('?' for _ in data['columns'])})",
+                data['rows']
+            )
+    conn.execute(f"PRAGMA user_version = {int(snapshot['user_version'])}")
+    conn.commit()
+
+
+def rebuild_database(db_path=DB_FILE, extra_records=None):
+    """Собрать БД заново из снимка и дельт и атомарно заменить файл"""
+    snapshot = _read_snapshot()
+    if snapshot is None:
+        return False
+
+    directory = os.path.dirname(os.path.abspath(db_path))
+    handle, tmp_path = tempfile.mkstemp(dir=directory, suffix='.rebuild.db')
+    os.close(handle)
+    try:
+        conn = sqlite3.connect(tmp_path)
+        try:
+            for table in TRACKED_TABLES:
+                if table not in snapshot['tables']:
+                    continue
+                conn.execute(snapshot['schema'][table])
+                data = snapshot['tables'][table]
+                if data['rows']:
+                    conn.executemany(
+                        f"INSERT INTO {table} ({', '.join(data['columns'])}) "
+                        f"VALUES ({', '.join('?' for _ in data['columns'])})",
+                        data['rows']
+                    )
+            conn.commit()
+            _restore_derived(conn, snapshot)
+            install_change_tracking(conn)
+
+            last_seq = _replay(conn, _records_after(snapshot['seq'])) or snapshot['seq']
+            _set_state(conn, 'shipped_seq', last_seq)
+            _set_state(conn, 'applied_seq', last_seq)
+            _bump_sequence(conn, last_seq)
+            conn.commit()
+
+            # Локальные изменения, не успевшие уйти в Git, переносим в новую БД
+            if extra_records:
+                _replay(conn, extra_records)
+                conn.executemany(
+                    "INSERT INTO _change_log (table_name, op, row_id, row_data) VALUES (?, ?, ?, ?)",
+                    [(r['t'], r['op'], r['id'], json.dumps(r['row'], ensure_ascii=False) if r['row'] else None)
+                     for r in extra_records]
+                )
+                conn.commit()
+        finally:
+            conn.close()
+
+        # Старый WAL не должен примениться к новому файлу
+        checkpoint_database(db_path)
+        reset_pool(db_path)
+        os.replace(tmp_path, db_path)
+        for suffix in ('-wal', '-shm'):
+            if os.path.exists(db_path + suffix):
+                os.unlink(db_path + suffix)
+        print(f"✅ БД собрана из снимка и дельт (seq {last_seq})")
+        return True
+    except Exception:
+        if os.path.exists(tmp_path):
+            os.unlink(tmp_path)
+        raise
+
+
+def restore_database_from_log(db_path=DB_FILE):
+    """
+    Привести локальную БД к состоянию из журнала в Git (вызывается после git pull)
+
+    - нет локальной БД или она без журнала (старый бинарный файл) - сборка из снимка
+    - журнал ушел вперед, а нужные дельты еще есть - применяются только новые дельты
+    - дельты уже свернуты в снимок - сборка из снимка с переносом локальных изменений
+    """
+    snapshot = _read_snapshot()
+    if snapshot is None:
+        return False
+
+    if not os.path.exists(db_path):
+        return rebuild_database(db_path)
+
+    with get_pool(db_path).connection() as conn:
+        if '_change_log_state' not in _existing_tables(conn):
+            applied_seq = None
+        else:
+            applied_seq = _get_state(conn, 'applied_seq')
+
+        if applied_seq is None:
+            local_records = []
+        else:
+            if latest_log_seq() <= applied_seq:
+                return False
+            if applied_seq >= snapshot['seq']:
+                # Дельты после applied_seq на месте - применяем только их
+                last_seq = _replay(conn, _records_after(applied_seq))
+                if last_seq is not None:
+                    _set_state(conn, 'applied_seq', last_seq)
+                    _set_state(conn, 'shipped_seq', last_seq)
+                    _bump_sequence(conn, last_seq)
+                    conn.commit()
+                    print(f"✅ Применены новые изменения из Git (до seq {last_seq})")
+                return last_seq is not None
+            local_records = _local_unshipped(conn)
+
+    return rebuild_database(db_path, extra_records=local_records)
+
+
+def log_files():
+    """Состояние журнала в рабочей копии (seq снимка, пути дельт) - запоминается перед git pull"""
+    snapshot = _read_snapshot()
+    return (snapshot['seq'] if snapshot else None, {path for _, _, path in _delta_files()})
+
+
+def apply_pulled_changes(known, db_path=DB_FILE):
+    """
+    Применить к локальной БД журнал, пришедший с git pull после отклоненного push
+
+    Номера изменений разных экземпляров могут пересекаться, поэтому применяются все
+    записи новых файлов дельт (known - log_files() до pull), а не только после applied_seq.
+    Если pull принес новый снимок, БД собирается из него; локальные дельты, которых в
+    нем нет (не свернуты удаленной стороной), и невыгруженные изменения переносятся.
+
+    Returns:
+        bool: локальная БД изменена
+    """
+    known_seq, known_paths = known
+    snapshot = _read_snapshot()
+    if snapshot is None:
+        return False
+
+    if snapshot['seq'] != known_seq:
+        orphaned = [
+            record
+            for _, last, path in _delta_files() if path in known_paths and last <= snapshot['seq']
+            for record in _read_delta(path)
+        ]
+        with get_pool(db_path).connection() as conn:
+            local_records = _local_unshipped(conn) if '_change_log' in _existing_tables(conn) else []
+        return rebuild_database(db_path, extra_records=orphaned + local_records)
+
+    new_paths = [path for _, _, path in _delta_files() if path not in known_paths]
+    if not new_paths:
+        return False
+    records = sorted((record for path in new_paths for record in _read_delta(path)), key=lambda r: r['seq'])
+    with get_pool(db_path).connection() as conn:
+        _replay(conn, records)
+        last_seq = max(latest_log_seq(), _get_state(conn, 'applied_seq'))
+        _set_state(conn, 'applied_seq', last_seq)
+        _set_state(conn, 'shipped_seq', last_seq)
+        _bump_sequence(conn, last_seq)
+        conn.commit()
+    print(f"✅ Применены изменения из Git после отклоненного push: {len(records)} (файлов {len(new_paths)})")
+    return True
+
+
+def rebase_log_on_database(db_path=DB_FILE):
+    """
+    Сделать текущую БД новым снимком журнала (после восстановления из резервной копии)
+
+    Иначе при следующем старте дельты из Git были бы применены поверх восстановленных данных.
+    """
+    with get_pool(db_path).connection() as conn:
+        install_change_tracking(conn)
+        local_seq = conn.execute("SELECT COALESCE(MAX(seq), 0) FROM _change_log").fetchone()[0]
+        seq = max(latest_log_seq(), local_seq, _get_state(conn, 'shipped_seq')) + 1
+        conn.execute("DELETE FROM _change_log")
+        _set_state(conn, 'shipped_seq', seq)
+        _set_state(conn, 'applied_seq', seq)
+        _bump_sequence(conn, seq)
+        conn.commit()
+        return compact_snapshot(conn, seq)
@@ -63,14 +63,16 @@ def verify_current_password(username, password):
     """Проверить текущий пароль пользователя"""
     try:
         conn = get_connection()
-        cursor = conn.cursor()
+        try:
+            cursor = conn.cursor()
         
-        cursor.execute('''
-            SELECT password_hash FROM users WHERE username = ?
-        ''', (username,))
+            cursor.execute('''
+                SELECT password_hash FROM users WHERE username = ?
+            ''', (username,))
         
-        result = cursor.fetchone()
-        conn.close()
+            result = cursor.fetchone()
+        finally:
+            conn.close()
         
         if result:
             stored_hash = result[0]
@@ -0,0 +1,242 @@
+#!/usr/bin/env python3
+"""
+Поиск клиентов по полнотекстовому индексу SQLite FTS5 (токенизатор trigram)
+
+Индекс clients_fts (migrate_database, схема v3) хранит "имя фамилия" и цифры
+телефона и поддерживается триггерами на clients. Поиск по подстроке из 3+
+символов идет по индексу триграмм вместо LIKE '%...%' по всей таблице.
+
+Транслитерация выполняется на стороне запроса: "ivan" ищет и "ivan", и "иван",
+"айгерим" - и "aigerim"; данные в индексе хранятся как есть.
+"""
+
+import os
+import re
+import sqlite3
+from itertools import product
+
+# Trigram ищет подстроки не короче 3 символов
+MIN_TRIGRAM_LENGTH = 3
+# Не больше вариантов транслитерации на слово
+MAX_VARIANTS = 4
+SEARCH_LIMIT = 10
+# Сколько совпадений из индекса ранжируется (при большем числе - первые по порядку индекса)
+RANK_WINDOW = int(os.getenv('CLIENT_SEARCH_RANK_WINDOW', '2000'))
+
+# Кириллица (русский и казахский алфавиты) -> латиница; для неоднозначных букв несколько вариантов
+CYRILLIC_TO_LATIN = {
+    'а': ('a',), 'б': ('b',), 'в': ('v',), 'г': ('g',), 'д': ('d',), 'е': ('e',), 'ё': ('e', 'yo'),
+    'ж': ('zh',), 'з': ('z',), 'и': ('i',), 'й': ('i', 'y'), 'к': ('k',), 'л': ('l',), 'м': ('m',),
+    'н': ('n',), 'о': ('o',), 'п': ('p',), 'р': ('r',), 'с': ('s',), 'т': ('t',), 'у': ('u',),
+    'ф': ('f',), 'х': ('kh', 'h'), 'ц': ('ts',), 'ч': ('ch',), 'ш': ('sh',), 'щ': ('shch',),
+    'ъ': ('',), 'ы': ('y',), 'ь': ('',), 'э': ('e',), 'ю': ('yu',), 'я': ('ya',),
+    'ә': ('a',), 'ғ': ('g',), 'қ': ('k', 'q'), 'ң': ('n',), 'ө': ('o',), 'ұ': ('u',), 'ү': ('u',),
+    'һ': ('h',), 'і': ('i',),
+}
+
+# Латиница -> кириллица: сначала самые длинные сочетания
+LATIN_TO_CYRILLIC = [
+    ('shch', 'щ'), ('sch', 'щ'), ('zh', 'ж'), ('kh', 'х'), ('ts', 'ц'), ('ch', 'ч'), ('sh', 'ш'),
+    ('yu', 'ю'), ('ya', 'я'), ('yo', 'ё'), ('ye', 'е'),
+    ('a', 'а'), ('b', 'б'), ('v', 'в'), ('g', 'г'), ('d', 'д'), ('e', 'е'), ('z', 'з'), ('i', 'и'),
+    ('y', 'й'), ('k', 'к'), ('l', 'л'), ('m', 'м'), ('n', 'н'), ('o', 'о'), ('p', 'п'), ('r', 'р'),
+    ('s', 'с'), ('t', 'т'), ('u', 'у'), ('f', 'ф'), ('h', 'х'), ('c', 'к'), ('q', 'к'), ('w', 'в'),
+    ('x', 'кс'), ('j', 'дж'),
+]
+
+_CYRILLIC = re.compile('[а-яёәғқңөұүһі]')
+_LATIN = re.compile('[a-z]')
+_WORD = re.compile(r"[^\W_]+(?:[-'][^\W_]+)*")
+
+# Нормализация телефона в триггерах: только цифры
+PHONE_DIGITS_SQL = (
+    "replace(replace(replace(replace(replace(replace(COALESCE({phone}, ''), "
+    "' ', ''), '-', ''), '(', ''), ')', ''), '+', ''), '.', '')"
+)
+NAME_SQL = "trim(COALESCE({first}, '') || ' ' || COALESCE({last}, ''))"
+
+
+def fts_migration_statements():
+    """SQL схемы v3: таблица clients_fts, триггеры синхронизации и заполнение по текущим данным"""
+    insert_values = "NEW.id, {name}, {digits}".format(
+        name=NAME_SQL.format(first='NEW.first_name', last='NEW.last_name'),
+        digits=PHONE_DIGITS_SQL.format(phone='NEW.phone'),
+    )
+    return [
+        "CREATE VIRTUAL TABLE IF NOT EXISTS clients_fts USING fts5(name, phone_digits, tokenize = 'trigram')",
+        "CREATE TRIGGER IF NOT EXISTS _fts_clients_ins AFTER INSERT ON clients BEGIN "
+        f"INSERT INTO clients_fts (rowid, name, phone_digits) VALUES ({insert_values}); END",
+        "CREATE TRIGGER IF NOT EXISTS _fts_clients_upd AFTER UPDATE OF first_name, last_name, phone ON clients BEGIN "
+        "DELETE FROM clients_fts WHERE rowid = OLD.id; "
+        f"INSERT INTO clients_fts (rowid, name, phone_digits) VALUES ({insert_values}); END",
+        "CREATE TRIGGER IF NOT EXISTS _fts_clients_del AFTER DELETE ON clients BEGIN "
+        "DELETE FROM clients_fts WHERE rowid = OLD.id; END",
+        "DELETE FROM clients_fts",
+        "INSERT INTO clients_fts (rowid, name, phone_digits) SELECT id, {name}, {digits} FROM clients".format(
+            name=NAME_SQL.format(first='first_name', last='last_name'),
+            digits=PHONE_DIGITS_SQL.format(phone='phone'),
+        ),
+    ]
+
+
+def to_latin_variants(word):
+    """Варианты записи кириллического слова латиницей"""
+    options = [CYRILLIC_TO_LATIN.get(char, (char,)) for char in word]
+    variants = []
+    for combination in product(*options):
+        variant = ''.join(combination)
+        if variant not in variants:
+            variants.append(variant)
+        if len(variants) >= MAX_VARIANTS:
+            break
+    return variants
+
+
+def to_cyrillic(word):
+    """Запись латинского слова кириллицей (жадно, по самым длинным сочетаниям)"""
+    result = []
+    i = 0
+    while i < len(word):
+        for latin, cyrillic in LATIN_TO_CYRILLIC:
+            if word.startswith(latin, i):
+                result.append(cyrillic)
+                i += len(latin)
+                break
+        else:
+            result.append(word[i])
+            i += 1
+    return ''.join(result)
+
+
+def word_variants(word):
+    """Слово запроса и его транслитерации"""
+    word = word.lower()
+    variants = [word]
+    if _CYRILLIC.search(word):
+        variants += to_latin_variants(word)
+    elif _LATIN.search(word):
+        variants.append(to_cyrillic(word))
+    unique = []
+    for variant in variants:
+        if variant not in unique:
+            unique.append(variant)
+    return unique[:MAX_VARIANTS + 1]
+
+
+def normalize_phone_query(query):
+    """
+    Цифры телефона из запроса
+
+    У полного номера (+7 / 8 и 10 цифр) код страны отбрасывается: в базе встречаются
+    обе записи, а 10 цифр номера совпадают с любой из них как подстрока.
+    """
+    digits = re.sub(r'\D', '', query)
+    if len(digits) == 11 and digits[0] in '78':
+        digits = digits[1:]
+    return digits
+
+
+def _phrase(text):
+    return '"' + text.replace('"', '""') + '"'
+
+
+def build_match_expression(query):
+    """
+    Выражение MATCH для запроса или None, если по индексу искать нельзя
+
+    Номер телефона (цифры с разделителями) ищется в phone_digits, слова - в name
+    с вариантами транслитерации; все слова должны найтись (AND). None - в запросе
+    нет ни одного фрагмента из 3+ символов, тогда поиск идет без индекса.
+    """
+    query = (query or '').strip()
+    if not query:
+        return None
+
+    if re.fullmatch(r'[\d\s()+\-.]+', query):
+        digits = normalize_phone_query(query)
+        if len(digits) < MIN_TRIGRAM_LENGTH:
+            return None
+        return f"phone_digits : {_phrase(digits)}"
+
+    terms = []
+    for word in _WORD.findall(query):
+        if word.isdigit():
+            if len(word) >= MIN_TRIGRAM_LENGTH:
+                terms.append(f"phone_digits : {_phrase(word)}")
+            continue
+        variants = [v for v in word_variants(word) if len(v) >= MIN_TRIGRAM_LENGTH]
+        if variants:
+            terms.append("name : (" + " OR ".join(_phrase(v) for v in variants) + ")")
+    return " AND ".join(terms) if terms else None
+
+
+def _rank_key(row, variants):
+    """
+    Ключ ранжирования: имя или фамилия совпадает со словом запроса целиком,
+    начинается с него, содержит его; затем более короткое полное имя (запрос
+    покрывает большую его часть), затем по алфавиту
+    """
+    first, last = (row[1] or '').casefold(), (row[2] or '').casefold()
+    if first in variants or last in variants:
+        level = 0
+    elif first.startswith(variants) or last.startswith(variants):
+        level = 1
+    else:
+        level = 2
+    return (level, len(first) + len(last), last, first)
+
+
+def search_client_rows(conn, query, limit=SEARCH_LIMIT, active_only=False, offset=0):
+    """
+    Клиенты по запросу, лучшие совпадения первыми
+
+    Кандидаты берутся из индекса (не больше RANK_WINDOW) и ранжируются в Python:
+    lower() в SQLite не знает кириллицу, а bm25 по всем совпадениям короткого
+    запроса ("ива" - десятки тысяч клиентов) стоит дороже полного сканирования.
+    Если совпадений больше окна, ранжируются первые RANK_WINDOW - следующая
+    буква запроса сужает выборку.
+    Если индекса нет (схема v3 не применена) или запрос короче 3 символов -
+    поиск LIKE по clients, как раньше.
+    """
+    expression = build_match_expression(query)
+    active_filter = " AND c.is_active = 1" if active_only else ""
+    if expression is not None:
+        try:
+            rows = conn.execute(f'''
+                SELECT c.id, c.first_name, c.last_name, c.birth_date, c.phone, c.email
+                FROM clients_fts f
+                JOIN clients c ON c.id = f.rowid
+                WHERE clients_fts MATCH ?{active_filter}
+                LIMIT ?
+            ''', (expression, max(RANK_WINDOW, limit + offset))).fetchall()
+        except sqlite3.OperationalError as e:
+            if 'no such table' not in str(e):
+                raise
+        else:
+            words = _WORD.findall(query)
+            variants = tuple(word_variants(words[0])) if words else ('',)
+            rows.sort(key=lambda row: _rank_key(row, variants))
+            return rows[offset:offset + limit]
+
+    pattern = f"%{(query or '').strip()}%"
+    return conn.execute(f'''
+        SELECT c.id, c.first_name, c.last_name, c.birth_date, c.phone, c.email
+        FROM clients c
+        WHERE (c.first_name LIKE ? OR c.last_name LIKE ? OR c.phone LIKE ?){active_filter}
+        ORDER BY c.last_name, c.first_name
+        LIMIT ? OFFSET ?
+    ''', (pattern, pattern, pattern, limit, offset)).fetchall()
+
+
+def matching_client_ids_sql(query):
+    """
+    Условие отбора клиентов по запросу для произвольного запроса к clients
+
+    Returns:
+        tuple: (SQL-условие для clients, параметры)
+    """
+    expression = build_match_expression(query)
+    if expression is not None:
+        return "id IN (SELECT rowid FROM clients_fts WHERE clients_fts MATCH ?)", [expression]
+    pattern = f"%{(query or '').strip()}%"
+    return "(first_name LIKE ? OR last_name LIKE ? OR phone LIKE ?)", [pattern, pattern, pattern]
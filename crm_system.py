@@ -7,6 +7,7 @@ import streamlit as st
 import pandas as pd
 from datetime import datetime, date, time, timedelta
 import hashlib
+import logging
 
 # Импорт утилит для работы с часовым поясом
 try:
@@ -18,15 +19,28 @@ except ImportError:
     get_local_now = datetime.now
     USE_TIMEZONE = False
 from database import (
-    get_connection, search_clients, create_client, get_client_by_id,
-    get_all_doctors, get_services_by_doctor, get_all_services, create_appointment,
-    get_appointment_by_id, update_appointment_status, get_appointments_by_date_range,
+    get_connection, search_clients, create_client,
+    get_all_doctors, get_services_by_doctor, create_appointment,
+    get_appointment_details, update_appointment_status, get_calendar_week,
     delete_appointment, log_audit_action,
     add_service_to_appointment, remove_service_from_appointment,
-    get_appointment_services, get_total_appointment_cost,
-    add_payment_to_service, get_appointment_payments_summary, update_appointment_payment_status
+    post_payment, get_unpaid_appointments, get_free_slots, get_first_free_slot, create_appointment_series,
+    get_data_generation
 )
 from auth import get_status_color, get_status_emoji
+from calendar_index import CALENDAR_SLOT_MINUTES, SLOT_MINUTE_OPTIONS
+from calendar_cache import get_calendar_cache
+from appointment_series import expand_recurrence, MAX_SERIES_OCCURRENCES
+
+logger = logging.getLogger(__name__)
+
+# Правила повторения курса: подпись -> (frequency, interval) для expand_recurrence
+SERIES_RULES = {
+    "Каждую неделю": ('weekly', 1),
+    "Каждый день": ('daily', 1),
+    "Через день": ('daily', 2),
+    "Раз в две недели": ('weekly', 2),
+}
 
 def get_doctor_color(doctor_name):
     """Генерация уникального ЯРКОГО и ЗАМЕТНОГО цвета для врача"""
@@ -64,17 +78,158 @@ def get_initials(full_name):
         return f"{parts[0][0].upper()}. {parts[1]}"
     return full_name
 
+# Выбор пациента: поиск по индексу, первые N результатов, недавно выбранные в сессии
+CLIENT_PICKER_PAGE_SIZE = 20
+CLIENT_PICKER_MAX_PAGES = 5
+RECENT_CLIENTS_LIMIT = 8
+CLIENT_SEARCH_CACHE_SIZE = 20
+
+def format_client_option(client):
+    """Подпись пациента в списке: строка search_clients (id, имя, фамилия, дата рождения, телефон, email)"""
+    return f"{client[1]} {client[2] or ''} ({client[4]})".replace("  ", " ")
+
+def remember_recent_client(client_id, label):
+    """Запомнить выбранного пациента в начале списка недавних (в пределах сессии)"""
+    recent = [item for item in st.session_state.get('recent_clients', []) if item[0] != client_id]
+    st.session_state['recent_clients'] = [(client_id, label)] + recent[:RECENT_CLIENTS_LIMIT - 1]
+
+def search_clients_cached(query, limit):
+    """
+    Поиск пациентов с кешем последних запросов сессии
+    
+    Streamlit перезапускает форму при каждом изменении любого поля - одинаковый
+    запрос не должен каждый раз идти в БД
+    """
+    cache = st.session_state.setdefault('client_search_cache', {})
+    key = (query.strip().lower(), limit)
+    if key in cache:
+        cache[key] = cache.pop(key)  # наверх как самый свежий
+        return cache[key]
+    results = search_clients(query, limit=limit)
+    cache[key] = results
+    while len(cache) > CLIENT_SEARCH_CACHE_SIZE:
+        cache.pop(next(iter(cache)))
+    return results
+
+def show_client_picker():
+    """
+    Выбор пациента: поиск на сервере по мере ввода
+    
+    В список попадают только первые CLIENT_PICKER_PAGE_SIZE совпадений (кнопка
+    "Показать еще" добавляет страницу), без запроса - недавно выбранные пациенты.
+    Время и память не зависят от размера базы клиентов.
+    
+    Returns:
+        int|None: ID выбранного пациента
+    """
+    query = st.text_input(
+        "👤 Поиск пациента:",
+        key="client_search_query",
+        placeholder="Имя, фамилия или телефон (можно латиницей)",
+        help="Минимум 2 символа"
+    )
+    
+    # Новый запрос - снова первая страница
+    if st.session_state.get('client_search_last_query') != query:
+        st.session_state['client_search_last_query'] = query
+        st.session_state['client_search_pages'] = 1
+    pages = st.session_state.get('client_search_pages', 1)
+    
+    if query and len(query.strip()) >= 2:
+        limit = CLIENT_PICKER_PAGE_SIZE * pages
+        found = search_clients_cached(query, limit)
+        options = [(client[0], format_client_option(client)) for client in found]
+        if not options:
+            st.info("🔍 Пациенты не найдены - создайте нового ниже")
+        has_more = len(found) >= limit and pages < CLIENT_PICKER_MAX_PAGES
+    else:
+        options = st.session_state.get('recent_clients', [])
+        has_more = False
+        if options:
+            st.caption("🕘 Недавно выбранные пациенты")
+    
+    placeholder = (None, "-- Выберите пациента --")
+    selected = st.selectbox(
+        "Пациент:",
+        options=[placeholder] + options,
+        format_func=lambda option: option[1],
+        key="client_select_dropdown",
+        label_visibility="collapsed"
+    )
+    
+    if has_more and st.button("⬇️ Показать еще", key="client_search_more"):
+        st.session_state['client_search_pages'] = pages + 1
+        st.rerun()
+    
+    if selected and selected[0]:
+        selected_client_id = selected[0]
+        if st.session_state.get('selected_client_id') != selected_client_id:
+            remember_recent_client(selected_client_id, selected[1])
+        st.session_state['selected_client_id'] = selected_client_id
+        st.success(f"✅ Выбран: {selected[1]}")
+        return selected_client_id
+    
+    return st.session_state.get('selected_client_id')
+
+def load_free_slots(doctor_id, service_id, specialization, duration_minutes, now):
+    """
+    Окна врача и первое окно специализации из session_state
+
+    Форма перезапускается на каждое изменение виджета, а поиск окон - два чтения
+    занятости на SEARCH_HORIZON_DAYS. Результат пересчитывается, только если в БД
+    была запись (поколение данных) или одно из окон уже прошло.
+    """
+    generation = get_data_generation()
+    key = (doctor_id, service_id, specialization, duration_minutes)
+    cached = st.session_state.get('free_slots_cache')
+    if cached and generation is not None and cached[0] == key and cached[1] == generation:
+        slots, first = cached[2], cached[3]
+        if (not slots or slots[0] > now) and (not first or first[0] > now):
+            return slots, first
+
+    slots = get_free_slots(doctor_id, service_id, after=now, count=5)
+    first = get_first_free_slot(specialization, duration_minutes, after=now) if specialization else None
+    st.session_state['free_slots_cache'] = (key, generation, slots, first)
+    return slots, first
+
+def show_free_slots(doctor_id, service_id, doctors, specialization=None, duration_minutes=None):
+    """Ближайшие свободные окна врача; кнопка окна переносит дату и время в форму приема"""
+    slots, first = load_free_slots(doctor_id, service_id, specialization, duration_minutes, get_local_now())
+    if slots:
+        st.caption("🕐 Ближайшие свободные окна:")
+        cols = st.columns(len(slots))
+        for col, slot in zip(cols, slots):
+            with col:
+                if st.button(slot.strftime('%d.%m %H:%M'), key=f"free_slot_{slot:%Y%m%d%H%M}"):
+                    st.session_state['new_appointment_date'] = slot.date()
+                    st.session_state['new_appointment_time'] = slot.time()
+                    # Виджеты даты и времени берут значение заново
+                    st.session_state.pop('appointment_date', None)
+                    st.session_state.pop('appointment_time', None)
+                    st.rerun()
+    else:
+        st.caption("🕐 Свободных окон у врача в ближайшие дни нет")
+    
+    if first and (not slots or first[0] < slots[0]):
+        doctor_name = next((f"{doc[1]} {doc[2]}" for doc in doctors if doc[0] == first[1]), "")
+        st.caption(f"⚡ Раньше свободен другой специалист ({specialization}): "
+                   f"{doctor_name}, {first[0].strftime('%d.%m %H:%M')}")
+
 def show_appointment_form(appointment_id=None, selected_date=None, selected_time=None, selected_doctor_id=None):
     """Форма регистрации/редактирования приема"""
     st.subheader("📝 Регистрация приема" if not appointment_id else "✏️ Редактирование приема")
     
-    # Получаем данные приема если редактируем
+    # Получаем данные приема если редактируем: прием, услуги, оплаты и справочники одной загрузкой
     appointment_data = None
+    details = None
     if appointment_id:
-        appointment_data = get_appointment_by_id(appointment_id)
-        if not appointment_data:
+        details = get_appointment_details(appointment_id)
+        if not details:
             st.error("❌ Прием не найден")
             return
+        appointment_data = details.appointment
+        logger.debug("Загрузка приема %s: %d запросов к БД, %.1f мс",
+                     appointment_id, details.query_count, details.load_ms)
     
     col1, col2 = st.columns(2)
     
@@ -85,36 +240,7 @@ def show_appointment_form(appointment_id=None, selected_date=None, selected_time
             selected_client_id = appointment_data[1]
             st.info(f"👤 Пациент: {appointment_data[10]} {appointment_data[11]} ({appointment_data[12]})")
         else:
-            # Получаем всех клиентов для выпадающего списка
-            conn = get_connection()
-            cursor = conn.cursor()
-            cursor.execute('SELECT id, first_name, last_name, phone FROM clients ORDER BY last_name, first_name')
-            all_clients = cursor.fetchall()
-            conn.close()
-            
-            client_options = ["-- Выберите пациента или начните печатать --"] + [
-                f"{client[1]} {client[2]} ({client[3]})" for client in all_clients
-            ]
-            client_ids = {f"{client[1]} {client[2]} ({client[3]})": client[0] for client in all_clients}
-            
-            # Выпадающий список с поиском
-            selected_client_option = st.selectbox(
-                "👤 Выберите пациента:",
-                options=client_options,
-                key="client_select_dropdown",
-                help="Начните печатать для поиска пациента"
-            )
-            
-            if selected_client_option != "-- Выберите пациента или начните печатать --":
-                selected_client_id = client_ids[selected_client_option]
-                st.session_state['selected_client_id'] = selected_client_id
-                
-                # Показываем выбранного пациента
-                client_data = get_client_by_id(selected_client_id)
-                if client_data:
-                    st.success(f"✅ Выбран: {client_data[1]} {client_data[2]} ({client_data[4]})")
-            else:
-                selected_client_id = st.session_state.get('selected_client_id')
+            selected_client_id = show_client_picker()
         
         # Форма создания нового пациента
         if not selected_client_id and not appointment_data:
@@ -138,6 +264,9 @@ def show_appointment_form(appointment_id=None, selected_date=None, selected_time
                         if client_id:
                             st.success("✅ Пациент создан!")
                             st.session_state['selected_client_id'] = client_id
+                            remember_recent_client(client_id, f"{new_first_name} {new_last_name} ({new_phone})")
+                            # Новый пациент должен находиться поиском сразу
+                            st.session_state.pop('client_search_cache', None)
                             st.rerun()
                         else:
                             st.error("❌ Ошибка создания пациента (возможно, телефон уже существует)")
@@ -146,7 +275,7 @@ def show_appointment_form(appointment_id=None, selected_date=None, selected_time
         
     with col2:
         # Выбор врача
-        doctors = get_all_doctors()
+        doctors = details.doctors if details else get_all_doctors()
         doctor_options = {f"{doc[1]} {doc[2]}": doc[0] for doc in doctors}
         doctor_options_list = list(doctor_options.keys())
         
@@ -173,7 +302,7 @@ def show_appointment_form(appointment_id=None, selected_date=None, selected_time
         
         # Выбор услуги
         if selected_doctor_id:
-            services = get_services_by_doctor(selected_doctor_id)
+            services = details.doctor_services if details else get_services_by_doctor(selected_doctor_id)
             service_options = {f"{srv[1]} ({srv[3]} KZT)": srv[0] for srv in services}
             service_options_list = list(service_options.keys())
             
@@ -198,6 +327,12 @@ def show_appointment_form(appointment_id=None, selected_date=None, selected_time
                     selected_service_id = service_options.get(selected_service_name)
                     # Сохраняем в session_state
                     st.session_state['selected_service_id'] = selected_service_id
+                    
+                    # Ближайшие свободные окна с учетом длительности услуги
+                    if selected_service_id:
+                        specialization = next((doc[3] for doc in doctors if doc[0] == selected_doctor_id), None)
+                        duration = next((srv[4] for srv in services if srv[0] == selected_service_id), None)
+                        show_free_slots(selected_doctor_id, selected_service_id, doctors, specialization, duration)
                 else:
                     st.warning("У этого врача нет доступных услуг")
                     selected_service_id = None
@@ -269,6 +404,27 @@ def show_appointment_form(appointment_id=None, selected_date=None, selected_time
             help="Источник, из которого пациент узнал о клинике"
         )
         
+        # Курс лечения: серия приемов в то же время (только для создания)
+        series_count = 1
+        if not appointment_data:
+            col_series1, col_series2 = st.columns(2)
+            with col_series1:
+                series_count = st.number_input(
+                    "🔁 Приемов в курсе:",
+                    min_value=1,
+                    max_value=MAX_SERIES_OCCURRENCES,
+                    value=1,
+                    step=1,
+                    key="series_count",
+                    help="Больше 1 - серия приемов в то же время по правилу повторения"
+                )
+            with col_series2:
+                series_rule = st.selectbox(
+                    "Повторять:",
+                    options=list(SERIES_RULES.keys()),
+                    key="series_rule"
+                )
+        
         # Кнопки
         if appointment_id:
             # Для редактирования - три кнопки
@@ -303,7 +459,36 @@ def show_appointment_form(appointment_id=None, selected_date=None, selected_time
                     doctor_id_to_use = selected_doctor_id or st.session_state.get('selected_doctor_id')
                     service_id_to_use = selected_service_id or st.session_state.get('selected_service_id')
                     
-                    if client_id_to_use and doctor_id_to_use and service_id_to_use:
+                    if client_id_to_use and doctor_id_to_use and service_id_to_use and series_count > 1:
+                        # Серия: все даты проверяются и создаются одной транзакцией
+                        frequency, interval = SERIES_RULES[series_rule]
+                        series_dates = expand_recurrence(appointment_date, count=int(series_count),
+                                                         frequency=frequency, interval=interval)
+                        result = create_appointment_series(
+                            client_id_to_use, doctor_id_to_use, service_id_to_use,
+                            series_dates, appointment_time, notes, source
+                        )
+                        if result and result['conflicts']:
+                            st.error("❌ Врач занят в эти даты, курс не создан: " + ", ".join(
+                                day.strftime('%d.%m.%Y') for day, _ in result['conflicts']
+                            ))
+                            st.session_state['saving_appointment'] = False
+                        elif result and result['created']:
+                            created_ids = [appointment_id for appointment_id, _ in result['created']]
+                            st.success(f"✅ Создан курс из {len(created_ids)} приемов!")
+                            log_audit_action(st.session_state['user_id'], 'CREATE', 'appointments', created_ids[0],
+                                             new_values={'series': created_ids})
+                            
+                            for key in ['selected_client_id', 'selected_doctor_id', 'selected_service_id',
+                                       'new_appointment_date', 'new_appointment_time', 'edit_appointment_id', 'saving_appointment']:
+                                if key in st.session_state:
+                                    del st.session_state[key]
+                            
+                            st.rerun()
+                        else:
+                            st.error("❌ Ошибка создания курса приемов")
+                            st.session_state['saving_appointment'] = False
+                    elif client_id_to_use and doctor_id_to_use and service_id_to_use:
                         new_appointment_id = create_appointment(
                             client_id_to_use, doctor_id_to_use, service_id_to_use,
                             appointment_date, appointment_time, notes, source
@@ -389,7 +574,7 @@ def show_appointment_form(appointment_id=None, selected_date=None, selected_time
         st.subheader("🏥 Управление услугами")
         
         # Показываем текущие услуги с редактируемой ценой (v2.7)
-        current_services = get_appointment_services(appointment_id)
+        current_services = details.services
         if current_services:
             st.write("**Текущие услуги:**")
             
@@ -426,14 +611,15 @@ def show_appointment_form(appointment_id=None, selected_date=None, selected_time
                             if new_price != actual_price:
                                 # Обновляем цену в БД
                                 conn = get_connection()
-                                cursor = conn.cursor()
-                                cursor.execute('''
-                                    UPDATE appointment_services 
-                                    SET price = ? 
-                                    WHERE id = ?
-                                ''', (new_price, appointment_service_id))
-                                conn.commit()
-                                conn.close()
+                                try:
+                                    conn.execute('''
+                                        UPDATE appointment_services 
+                                        SET price = ? 
+                                        WHERE id = ?
+                                    ''', (new_price, appointment_service_id))
+                                    conn.commit()
+                                finally:
+                                    conn.close()
                                 
                                 # Логируем изменение цены
                                 log_audit_action(
@@ -455,7 +641,7 @@ def show_appointment_form(appointment_id=None, selected_date=None, selected_time
                                 st.rerun()
             
             # Показываем общую стоимость
-            total_cost = get_total_appointment_cost(appointment_id)
+            total_cost = details.total_cost
             st.info(f"💰 **Общая стоимость:** {total_cost} KZT")
         else:
             st.info("Услуги еще не добавлены")
@@ -464,7 +650,7 @@ def show_appointment_form(appointment_id=None, selected_date=None, selected_time
         st.markdown("**Добавить услугу:**")
         
         # Получаем все доступные услуги
-        all_services = get_all_services()
+        all_services = details.all_services
         if all_services:
             service_options = {
                 f"{srv[1]} - {srv[5]} {srv[6]} ({srv[3]} KZT)": (srv[0], srv[3]) 
@@ -494,19 +680,17 @@ def show_appointment_form(appointment_id=None, selected_date=None, selected_time
     
     # Секция оплаты (v2.7) - ВЫНЕСЕНА ИЗ БЛОКА УПРАВЛЕНИЯ УСЛУГАМИ
     if appointment_id:
-        current_services = get_appointment_services(appointment_id)
+        current_services = details.services
         
         st.markdown("---")
         st.subheader("💳 Управление оплатой")
         
         if current_services:
-            # Получаем общую стоимость
-            total_cost = get_total_appointment_cost(appointment_id)
-            
-            # Получаем сводку по оплатам
-            payments_summary = get_appointment_payments_summary(appointment_id)
-            total_paid = sum([p[1] for p in payments_summary]) if payments_summary else 0.0
-            remaining = total_cost - total_paid
+            # Стоимость и сводка по оплатам - из загруженных данных приема
+            total_cost = details.total_cost
+            payments_summary = details.payments
+            total_paid = details.total_paid
+            remaining = details.remaining
             
             # Показываем статус оплаты
             col_pay1, col_pay2, col_pay3 = st.columns(3)
@@ -595,43 +779,21 @@ def show_appointment_form(appointment_id=None, selected_date=None, selected_time
                         elif total_payment_input == 0:
                             st.warning("Укажите сумму оплаты")
                         else:
-                            # Сохраняем платежи для каждой услуги
-                            success_count = 0
-                            for service in current_services:
-                                appointment_service_id = service[0]  # ID из таблицы appointment_services
-                                service_price = service[4]  # Фактическая цена услуги
-                                service_proportion = service_price / total_cost
+                            # Вся оплата (все методы по всем услугам) и статус оплаты - одной транзакцией
+                            result = post_payment(appointment_id, payment_amounts)
+                            if result:
+                                # Логируем действие
+                                log_audit_action(st.session_state['user_id'], 'CREATE', 'appointment_service_payments', appointment_id)
                                 
-                                # Распределяем каждый метод оплаты пропорционально
-                                for method, total_method_amount in payment_amounts.items():
-                                    if total_method_amount > 0:
-                                        service_payment_amount = total_method_amount * service_proportion
-                                        
-                                        payment_success = add_payment_to_service(appointment_service_id, method, service_payment_amount)
-                                        if payment_success:
-                                            success_count += 1
-                            
-                            if success_count > 0:
-                                # Обновляем статус оплаты приема
-                                new_total_paid = total_paid + total_payment_input
+                                # ВАЖНО: Сохраняем appointment_id перед rerun
+                                # чтобы форма снова открылась с обновленными данными
+                                st.session_state['edit_appointment_id'] = appointment_id
                                 
-                                if update_appointment_payment_status(appointment_id, new_total_paid, total_cost):
-                                    # Логируем действие
-                                    log_audit_action(st.session_state['user_id'], 'CREATE', 'appointment_service_payments', appointment_id)
-                                    
-                                    # ВАЖНО: Сохраняем appointment_id перед rerun
-                                    # чтобы форма снова открылась с обновленными данными
-                                    st.session_state['edit_appointment_id'] = appointment_id
-                                    
-                                    # Успешное сообщение
-                                    st.success(f"Оплата {total_payment_input:,.0f} ₸ успешно добавлена! Новый баланс: {new_total_paid:,.0f} ₸ из {total_cost:,.0f} ₸")
-                                    
-                                    # Перезагружаем страницу для обновления данных
-                                    st.rerun()
-                                else:
-                                    st.error("❌ Ошибка обновления статуса оплаты")
-                            else:
-                                st.error(f"❌ Ошибка при сохранении оплаты")
+                                # Успешное сообщение
+                                st.success(f"Оплата {result['paid']:,.0f} ₸ успешно добавлена! Новый баланс: {result['total_paid']:,.0f} ₸ из {result['total_cost']:,.0f} ₸")
+                                
+                                # Перезагружаем страницу для обновления данных
+                                st.rerun()
             else:
                 if remaining == 0:
                     st.success("✅ Прием полностью оплачен!")
@@ -640,6 +802,16 @@ def show_appointment_form(appointment_id=None, selected_date=None, selected_time
         else:
             st.info("Добавьте услуги для управления оплатой")
 
+def show_calendar_cache_stats():
+    """Панель статистики общего кеша календаря"""
+    cache = get_calendar_cache()
+    stats = cache.stats()
+    with st.expander("📦 Кеш календаря"):
+        st.caption(
+            f"Записей: {stats['entries']} из {cache.max_entries}, из кеша: {stats['hits']}, "
+            f"дочитано: {stats['refreshes']}, прочитано заново: {stats['misses']} (попаданий {stats['hit_ratio']:.0%})"
+        )
+
 def show_calendar_view():
     """Календарное представление с кликабельными ячейками"""
     st.subheader("📅 Календарь приемов")
@@ -699,7 +871,13 @@ def show_calendar_view():
         )
     
     with col_filter2:
-        st.markdown("<br>", unsafe_allow_html=True)  # Выравнивание по вертикали
+        slot_options = sorted(set(SLOT_MINUTE_OPTIONS) | {CALENDAR_SLOT_MINUTES})
+        slot_minutes = st.selectbox(
+            "⏱️ Шаг сетки, мин:",
+            options=slot_options,
+            index=slot_options.index(CALENDAR_SLOT_MINUTES),
+            key="calendar_slot_minutes"
+        )
         color_coding_enabled = st.checkbox(
             "🎨 Цветовое кодирование",
             value=False,
@@ -768,47 +946,33 @@ def show_calendar_view():
         end_date = week_start + timedelta(days=6)
         st.subheader(f"📅 Неделя с {start_date.strftime('%d.%m.%Y')} по {end_date.strftime('%d.%m.%Y')}")
     
-    # Получаем приемы
-    appointments = get_appointments_by_date_range(start_date, end_date)
-    
-    # Фильтруем по врачам
-    if selected_doctor_ids:
-        appointments = [apt for apt in appointments if apt[2] in selected_doctor_ids]
+    # Сетка (дата, слот) -> приемы из общего кеша: при неизменных данных приемы не перечитываются
+    # (фильтр по врачам - в SQL; пустой выбор - все врачи)
+    force_refresh = st.session_state.pop('calendar_force_refresh', False)
+    calendar_index = get_calendar_week(
+        start_date, end_date, doctor_ids=set(selected_doctor_ids) or None,
+        slot_minutes=slot_minutes, force=force_refresh
+    )
     
-    # Создаем словарь приемов по дате и времени
-    appointments_dict = {}
-    for apt in appointments:
-        # Конвертируем строку даты в объект date
-        if isinstance(apt[4], str):
-            apt_date = datetime.strptime(apt[4], '%Y-%m-%d').date()
-        else:
-            apt_date = apt[4]
-        
-        apt_time = apt[5]
-        
-        if apt_date not in appointments_dict:
-            appointments_dict[apt_date] = {}
-        
-        # Храним список приемов для каждого времени
-        if apt_time not in appointments_dict[apt_date]:
-            appointments_dict[apt_date][apt_time] = []
-        
-        appointments_dict[apt_date][apt_time].append(apt)
+    col_info, col_refresh = st.columns([4, 1])
+    with col_info:
+        show_calendar_cache_stats()
+    with col_refresh:
+        if st.button("🔄 Обновить", key="calendar_refresh"):
+            st.session_state['calendar_force_refresh'] = True
+            st.rerun()
     
-    # Временные слоты (15-минутные интервалы)
-    time_slots = []
-    for hour in range(9, 18):
-        for minute in [0, 15, 30, 45]:
-            time_slots.append(time(hour, minute))
+    if calendar_index.outside_hours:
+        st.caption(f"ℹ️ Приемов вне рабочих часов: {len(calendar_index.outside_hours)}")
     
     if view_mode == 'today':
         # Показываем только сегодня
-        show_day_appointments(today, appointments_dict, time_slots, color_coding_enabled)
+        show_day_appointments(today, calendar_index, color_coding_enabled)
     else:
         # Показываем неделю
-        show_week_appointments(start_date, appointments_dict, time_slots, today, color_coding_enabled)
+        show_week_appointments(start_date, calendar_index, today, color_coding_enabled)
 
-def show_day_appointments(day, appointments_dict, time_slots, color_coding_enabled=True):
+def show_day_appointments(day, calendar_index, color_coding_enabled=True):
     """Показать записи за день"""
     st.markdown("---")
     
@@ -827,18 +991,11 @@ def show_day_appointments(day, appointments_dict, time_slots, color_coding_enabl
     st.markdown(f"### {day_names.get(day_name, day_name)} {day.strftime('%d.%m.%Y')}")
     
     # Показываем временные слоты
-    for time_slot in time_slots:
+    for time_slot in calendar_index.time_slots:
         time_str = time_slot.strftime('%H:%M')
         
-        # Ищем приемы в этом временном слоте
-        day_appointments = appointments_dict.get(day, {})
-        slot_appointments = []
-        
-        for apt_time, appointment_list in day_appointments.items():
-            apt_time_obj = datetime.strptime(apt_time, '%H:%M:%S').time()
-            if apt_time_obj == time_slot:
-                # appointment_list теперь список приемов
-                slot_appointments.extend(appointment_list)
+        # Приемы в этом временном слоте
+        slot_appointments = calendar_index.get(day, time_slot)
         
         # Создаем кликабельную ячейку
         if slot_appointments:
@@ -973,7 +1130,7 @@ def show_day_appointments(day, appointments_dict, time_slots, color_coding_enabl
             """
             st.markdown(empty_card_html, unsafe_allow_html=True)
 
-def show_week_appointments(start_date, appointments_dict, time_slots, today, color_coding_enabled=True):
+def show_week_appointments(start_date, calendar_index, today, color_coding_enabled=True):
     """Показать записи за неделю"""
     st.markdown("---")
     
@@ -1025,7 +1182,7 @@ def show_week_appointments(start_date, appointments_dict, time_slots, today, col
                 """, unsafe_allow_html=True)
     
     # Показываем временные слоты
-    for time_slot in time_slots:
+    for time_slot in calendar_index.time_slots:
         time_str = time_slot.strftime('%H:%M')
         cols = st.columns([0.7, 1, 1, 1, 1, 1, 1, 1])
         
@@ -1048,16 +1205,10 @@ def show_week_appointments(start_date, appointments_dict, time_slots, today, col
         # Колонки с днями
         for i, col in enumerate(cols[1:], start=0):
             current_day = start_date + timedelta(days=i)
-            day_appointments = appointments_dict.get(current_day, {})
             
             with col:
-                # Ищем приемы в этом временном слоте
-                slot_appointments = []
-                for apt_time, appointment_list in day_appointments.items():
-                    apt_time_obj = datetime.strptime(apt_time, '%H:%M:%S').time()
-                    if apt_time_obj == time_slot:
-                        # appointment_list теперь список приемов
-                        slot_appointments.extend(appointment_list)
+                # Приемы в этом временном слоте
+                slot_appointments = calendar_index.get(current_day, time_slot)
                 
                 if slot_appointments:
                     # Есть приемы - объединяем в одну карточку если их несколько
@@ -1178,6 +1329,25 @@ def show_week_appointments(start_date, appointments_dict, time_slots, today, col
                     </div>
                     """, unsafe_allow_html=True)
 
+def show_unpaid_appointments():
+    """Приемы с остатком к оплате: итоги хранятся в строке приема, список читается по индексу"""
+    with st.expander("💳 Неоплаченные приемы"):
+        unpaid = get_unpaid_appointments(limit=50)
+        if not unpaid:
+            st.success("✅ Неоплаченных приемов нет")
+            return
+        for appointment_id, appointment_date, appointment_time, status, client_name, total_cost, total_paid, remaining in unpaid:
+            col_info, col_open = st.columns([5, 1])
+            with col_info:
+                st.write(
+                    f"{get_status_emoji(status)} {appointment_date} {str(appointment_time)[:5]} · {client_name} · "
+                    f"оплачено {total_paid:,.0f} из {total_cost:,.0f} ₸ · **остаток {remaining:,.0f} ₸**"
+                )
+            with col_open:
+                if st.button("Открыть", key=f"open_unpaid_{appointment_id}"):
+                    st.session_state['edit_appointment_id'] = appointment_id
+                    st.rerun()
+
 def main():
     """Основная функция CRM системы версии 2.0"""
     st.set_page_config(
@@ -1239,6 +1409,7 @@ def main():
     else:
         # Показываем календарь
         show_calendar_view()
+        show_unpaid_appointments()
 
 if __name__ == "__main__":
     main()
@@ -6,10 +6,23 @@
 
 import sqlite3
 import bcrypt
-from datetime import datetime
+from datetime import datetime, timedelta
 import streamlit as st
 import os
 import json
+from db_pool import get_pool, reset_pool, apply_database_profile, start_checkpoint_scheduler, write_transaction
+from migrate_database import apply_schema_migrations
+from change_log import install_change_tracking
+from backup_store import start_backup_scheduler
+from calendar_index import fetch_appointments
+from calendar_cache import get_calendar_cache
+from client_search import search_client_rows
+from appointment_details import load_appointment_details
+from payments import post_payment_rows, payment_status_for
+from appointment_balance import fetch_unpaid
+from availability import load_availability, service_duration, SEARCH_HORIZON_DAYS
+from appointment_series import create_series_rows
+from analytics_cache import read_generation
 from validators import (
     validate_search_query, validate_phone, validate_email,
     validate_date, validate_name, validate_notes, ValidationError
@@ -17,14 +30,22 @@ from validators import (
 
 # Импорт Git синхронизации (опционально)
 try:
-    from git_sync import sync_database_to_git_async, sync_database_to_git_sync, pull_database_from_git
+    from git_sync import (
+        sync_database_to_git_async, sync_database_to_git_sync, sync_database_to_git_durable,
+        pull_database_from_git, resume_pending_sync, PERSISTENCE_BACKEND
+    )
     GIT_SYNC_AVAILABLE = True
 except ImportError:
     GIT_SYNC_AVAILABLE = False
+    PERSISTENCE_BACKEND = 'database_file'
     def sync_database_to_git_async(*args, **kwargs):
         pass
     def sync_database_to_git_sync(*args, **kwargs):
         return False
+    def sync_database_to_git_durable(*args, **kwargs):
+        return False
+    def resume_pending_sync():
+        return 0
     def pull_database_from_git():
         return False
 
@@ -36,10 +57,35 @@ def init_database():
             pull_database_from_git()
         except Exception as e:
             print(f"Could not pull database from Git: {e}")
+        # Файл БД мог быть заменен - старые соединения пула больше не актуальны
+        reset_pool()
+    
+    conn = get_connection()
+    try:
+        _init_schema(conn)
+    finally:
+        conn.close()
+    
+    # Фоновый checkpoint WAL, чтобы журнал не рос бесконечно
+    start_checkpoint_scheduler()
     
-    conn = sqlite3.connect('medical_center.db')
+    # Автоматические снимки с политикой хранения
+    start_backup_scheduler()
+    
+    # Запросы синхронизации, не дошедшие до Git до перезапуска
+    if GIT_SYNC_AVAILABLE:
+        try:
+            resume_pending_sync()
+        except Exception as e:
+            print(f"Could not resume pending Git sync: {e}")
+
+def _init_schema(conn):
+    """Таблицы, колонки и версионированные миграции схемы"""
     cursor = conn.cursor()
     
+    # Профиль производительности (WAL и т.д.), сохраняется в файле БД
+    apply_database_profile(conn)
+    
     # Таблица пользователей системы
     cursor.execute('''
         CREATE TABLE IF NOT EXISTS users (
@@ -222,65 +268,72 @@ def init_database():
         pass
     
     conn.commit()
-    conn.close()
+    
+    # Версионированные миграции схемы (индексы и т.д.)
+    apply_schema_migrations(conn)
+    
+    # Триггеры журнала изменений (пересоздаются с учетом новых колонок)
+    if GIT_SYNC_AVAILABLE and PERSISTENCE_BACKEND == 'changelog':
+        install_change_tracking(conn)
 
 def create_default_users():
     """Создание пользователей по умолчанию с паролями из переменных окружения"""
-    conn = sqlite3.connect('medical_center.db')
-    cursor = conn.cursor()
+    conn = get_connection()
+    try:
+        cursor = conn.cursor()
     
-    # Проверяем, есть ли уже пользователи
-    cursor.execute('SELECT COUNT(*) FROM users')
-    if cursor.fetchone()[0] > 0:
-        conn.close()
-        return
-    
-    # Получаем пароли из переменных окружения
-    # ⚠️ В продакшене ОБЯЗАТЕЛЬНО установите переменные окружения!
-    # Для локальной разработки можно использовать значения по умолчанию
-    is_production = os.getenv('ENVIRONMENT', '').lower() == 'production'
-    
-    if is_production:
-        # В production требуем переменные окружения
-        owner_password = os.getenv('OWNER_PASSWORD')
-        admin_password = os.getenv('ADMIN_PASSWORD')
-        crm_password = os.getenv('CRM_PASSWORD')
-        
-        if not owner_password or not admin_password or not crm_password:
-            error_msg = "❌ SECURITY ERROR: Production passwords not set! Set OWNER_PASSWORD, ADMIN_PASSWORD, CRM_PASSWORD environment variables."
-            if hasattr(st, 'error'):
-                st.error(error_msg)
-            print(error_msg)
-            raise ValueError("Production passwords must be set via environment variables")
-    else:
-        # Для разработки используем безопасные пароли по умолчанию
-        owner_password = os.getenv('OWNER_PASSWORD', 'Owner@Secure2024!Dev')
-        admin_password = os.getenv('ADMIN_PASSWORD', 'Admin@Secure2024!Dev')
-        crm_password = os.getenv('CRM_PASSWORD', 'Crm@Secure2024!Dev')
-        
-        if os.getenv('OWNER_PASSWORD') is None:
-            if hasattr(st, 'warning'):
-                st.warning("⚠️ ВНИМАНИЕ: Используются пароли по умолчанию для разработки! В production установите переменные окружения.")
-            print("⚠️ SECURITY WARNING: Using default development passwords! Set environment variables in production!")
-    
-    # Создаем пользователей
-    users = [
-        ('owner', owner_password, 'Владелец системы', 'owner'),
-        ('admin', admin_password, 'Администратор', 'admin'),
-        ('crm_user', crm_password, 'CRM Пользователь', 'crm')
-    ]
-    
-    for username, password, name, access_level in users:
-        salt = bcrypt.gensalt()
-        password_hash = bcrypt.hashpw(password.encode('utf-8'), salt).decode('utf-8')
-        
-        cursor.execute('''
-            INSERT INTO users (username, password_hash, name, access_level)
-            VALUES (?, ?, ?, ?)
-        ''', (username, password_hash, name, access_level))
+        # Проверяем, есть ли уже пользователи
+        cursor.execute('SELECT COUNT(*) FROM users')
+        if cursor.fetchone()[0] > 0:
+            return
+    
+        # Получаем пароли из переменных окружения
+        # ⚠️ В продакшене ОБЯЗАТЕЛЬНО установите переменные окружения!
+        # Для локальной разработки можно использовать значения по умолчанию
+        is_production = os.getenv('ENVIRONMENT', '').lower() == 'production'
+    
+        if is_production:
+            # В production требуем переменные окружения
+            owner_password = os.getenv('OWNER_PASSWORD')
+            admin_password = os.getenv('ADMIN_PASSWORD')
+            crm_password = os.getenv('CRM_PASSWORD')
+        
+            if not owner_password or not admin_password or not crm_password:
+                error_msg = "❌ SECURITY ERROR: Production passwords not set! Set OWNER_PASSWORD, ADMIN_PASSWORD, CRM_PASSWORD environment variables."
+                if hasattr(st, 'error'):
+                    st.error(error_msg)
+                print(error_msg)
+                raise ValueError("Production passwords must be set via environment variables")
+        else:
+            # Для разработки используем безопасные пароли по умолчанию
+            owner_password = os.getenv('OWNER_PASSWORD', 'Owner@Secure2024!Dev')
+            admin_password = os.getenv('ADMIN_PASSWORD', 'Admin@Secure2024!Dev')
+            crm_password = os.getenv('CRM_PASSWORD', 'Crm@Secure2024!Dev')
+        
+            if os.getenv('OWNER_PASSWORD') is None:
+                if hasattr(st, 'warning'):
+                    st.warning("⚠️ ВНИМАНИЕ: Используются пароли по умолчанию для разработки! В production установите переменные окружения.")
+                print("⚠️ SECURITY WARNING: Using default development passwords! Set environment variables in production!")
+    
+        # Создаем пользователей
+        users = [
+            ('owner', owner_password, 'Владелец системы', 'owner'),
+            ('admin', admin_password, 'Администратор', 'admin'),
+            ('crm_user', crm_password, 'CRM Пользователь', 'crm')
+        ]
+    
+        for username, password, name, access_level in users:
+            salt = bcrypt.gensalt()
+            password_hash = bcrypt.hashpw(password.encode('utf-8'), salt).decode('utf-8')
+        
+            cursor.execute('''
+                INSERT INTO users (username, password_hash, name, access_level)
+                VALUES (?, ?, ?, ?)
+            ''', (username, password_hash, name, access_level))
     
-    conn.commit()
-    conn.close()
+        conn.commit()
+    finally:
+        conn.close()
 
 def migrate_old_appointments():
     """Миграция старых приемов в новую структуру с appointment_services"""
@@ -313,89 +366,91 @@ def migrate_old_appointments():
             print(f"✅ Миграция завершена: добавлено {len(missing)} записей")
         else:
             print("✅ Миграция не требуется: все приемы имеют услуги")
-        
-        conn.close()
     except Exception as e:
-        conn.close()
         print(f"❌ Ошибка миграции: {e}")
+    finally:
+        conn.close()
 
 def create_default_data():
     """Создание тестовых данных"""
-    conn = sqlite3.connect('medical_center.db')
-    cursor = conn.cursor()
+    conn = get_connection()
+    try:
+        cursor = conn.cursor()
     
-    # Проверяем, есть ли уже данные
-    cursor.execute('SELECT COUNT(*) FROM doctors')
-    if cursor.fetchone()[0] > 0:
-        conn.close()
-        return
-    
-    # Создаем врачей
-    doctors = [
-        ('Айгуль', 'Нурланова', 'Терапевт', '+7 777 123 4567', 'aigul@clinic.kz'),
-        ('Марат', 'Ахметов', 'Кардиолог', '+7 777 234 5678', 'marat@clinic.kz'),
-        ('Айша', 'Калиева', 'Невролог', '+7 777 345 6789', 'aisha@clinic.kz'),
-        ('Данияр', 'Сериков', 'Ортопед', '+7 777 456 7890', 'daniyar@clinic.kz'),
-        ('Жанар', 'Тулеуова', 'Гинеколог', '+7 777 567 8901', 'zhanar@clinic.kz')
-    ]
-    
-    for first_name, last_name, specialization, phone, email in doctors:
-        cursor.execute('''
-            INSERT INTO doctors (first_name, last_name, specialization, phone, email)
-            VALUES (?, ?, ?, ?, ?)
-        ''', (first_name, last_name, specialization, phone, email))
-    
-    # Создаем услуги
-    services = [
-        ('Консультация терапевта', 'Первичная консультация терапевта', 5000, 30, 1),
-        ('ЭКГ', 'Электрокардиограмма', 3000, 15, 2),
-        ('УЗИ сердца', 'Ультразвуковое исследование сердца', 8000, 45, 2),
-        ('Консультация невролога', 'Первичная консультация невролога', 6000, 40, 3),
-        ('Рентген позвоночника', 'Рентгенологическое исследование позвоночника', 4000, 20, 4),
-        ('Консультация гинеколога', 'Первичная консультация гинеколога', 7000, 35, 5),
-        ('УЗИ органов малого таза', 'Ультразвуковое исследование', 6000, 30, 5)
-    ]
-    
-    for name, description, price, duration, doctor_id in services:
-        cursor.execute('''
-            INSERT INTO services (name, description, price, duration_minutes, doctor_id)
-            VALUES (?, ?, ?, ?, ?)
-        ''', (name, description, price, duration, doctor_id))
-    
-    # Создаем тестовых клиентов
-    clients = [
-        ('Айжан', 'Нурланова', '1990-05-15', '+7 701 111 1111', 'aizhan@email.com'),
-        ('Марат', 'Ахметов', '1985-03-22', '+7 701 222 2222', 'marat@email.com'),
-        ('Айша', 'Калиева', '1992-07-10', '+7 701 333 3333', 'aisha@email.com'),
-        ('Данияр', 'Сериков', '1988-11-05', '+7 701 444 4444', 'daniyar@email.com'),
-        ('Жанар', 'Тулеуова', '1995-09-18', '+7 701 555 5555', 'zhanar@email.com'),
-        ('Асхат', 'Ибрагимов', '1987-12-03', '+7 701 666 6666', 'askhat@email.com'),
-        ('Гульнара', 'Сейтжанова', '1991-04-25', '+7 701 777 7777', 'gulnara@email.com'),
-        ('Ерлан', 'Куанов', '1989-08-14', '+7 701 888 8888', 'erlan@email.com')
-    ]
-    
-    for first_name, last_name, birth_date, phone, email in clients:
-        cursor.execute('''
-            INSERT INTO clients (first_name, last_name, birth_date, phone, email)
-            VALUES (?, ?, ?, ?, ?)
-        ''', (first_name, last_name, birth_date, phone, email))
+        # Проверяем, есть ли уже данные
+        cursor.execute('SELECT COUNT(*) FROM doctors')
+        if cursor.fetchone()[0] > 0:
+            return
+    
+        # Создаем врачей
+        doctors = [
+            ('Айгуль', 'Нурланова', 'Терапевт', '+7 777 123 4567', 'aigul@clinic.kz'),
+            ('Марат', 'Ахметов', 'Кардиолог', '+7 777 234 5678', 'marat@clinic.kz'),
+            ('Айша', 'Калиева', 'Невролог', '+7 777 345 6789', 'aisha@clinic.kz'),
+            ('Данияр', 'Сериков', 'Ортопед', '+7 777 456 7890', 'daniyar@clinic.kz'),
+            ('Жанар', 'Тулеуова', 'Гинеколог', '+7 777 567 8901', 'zhanar@clinic.kz')
+        ]
+    
+        for first_name, last_name, specialization, phone, email in doctors:
+            cursor.execute('''
+                INSERT INTO doctors (first_name, last_name, specialization, phone, email)
+                VALUES (?, ?, ?, ?, ?)
+            ''', (first_name, last_name, specialization, phone, email))
+    
+        # Создаем услуги
+        services = [
+            ('Консультация терапевта', 'Первичная консультация терапевта', 5000, 30, 1),
+            ('ЭКГ', 'Электрокардиограмма', 3000, 15, 2),
+            ('УЗИ сердца', 'Ультразвуковое исследование сердца', 8000, 45, 2),
+            ('Консультация невролога', 'Первичная консультация невролога', 6000, 40, 3),
+            ('Рентген позвоночника', 'Рентгенологическое исследование позвоночника', 4000, 20, 4),
+            ('Консультация гинеколога', 'Первичная консультация гинеколога', 7000, 35, 5),
+            ('УЗИ органов малого таза', 'Ультразвуковое исследование', 6000, 30, 5)
+        ]
+    
+        for name, description, price, duration, doctor_id in services:
+            cursor.execute('''
+                INSERT INTO services (name, description, price, duration_minutes, doctor_id)
+                VALUES (?, ?, ?, ?, ?)
+            ''', (name, description, price, duration, doctor_id))
+    
+        # Создаем тестовых клиентов
+        clients = [
+            ('Айжан', 'Нурланова', '1990-05-15', '+7 701 111 1111', 'aizhan@email.com'),
+            ('Марат', 'Ахметов', '1985-03-22', '+7 701 222 2222', 'marat@email.com'),
+            ('Айша', 'Калиева', '1992-07-10', '+7 701 333 3333', 'aisha@email.com'),
+            ('Данияр', 'Сериков', '1988-11-05', '+7 701 444 4444', 'daniyar@email.com'),
+            ('Жанар', 'Тулеуова', '1995-09-18', '+7 701 555 5555', 'zhanar@email.com'),
+            ('Асхат', 'Ибрагимов', '1987-12-03', '+7 701 666 6666', 'askhat@email.com'),
+            ('Гульнара', 'Сейтжанова', '1991-04-25', '+7 701 777 7777', 'gulnara@email.com'),
+            ('Ерлан', 'Куанов', '1989-08-14', '+7 701 888 8888', 'erlan@email.com')
+        ]
+    
+        for first_name, last_name, birth_date, phone, email in clients:
+            cursor.execute('''
+                INSERT INTO clients (first_name, last_name, birth_date, phone, email)
+                VALUES (?, ?, ?, ?, ?)
+            ''', (first_name, last_name, birth_date, phone, email))
     
-    conn.commit()
-    conn.close()
+        conn.commit()
+    finally:
+        conn.close()
 
 def get_connection():
-    """Получить соединение с базой данных с обработкой ошибок"""
+    """
+    Получить соединение с базой данных из пула с обработкой ошибок
+    
+    PRAGMA (foreign_keys и т.д.) настраиваются пулом один раз при открытии соединения.
+    conn.close() возвращает соединение в пул.
+    """
     try:
-        conn = sqlite3.connect('medical_center.db', timeout=10)
-        # Включаем foreign key constraints
-        conn.execute("PRAGMA foreign_keys = ON")
-        return conn
+        return get_pool().acquire()
     except sqlite3.Error as e:
         if hasattr(st, 'error'):
             st.error(f"❌ Ошибка подключения к базе данных: {e}")
         raise RuntimeError(f"Не удалось подключиться к БД: {e}")
 
-def search_clients(query):
+def search_clients(query, limit=10, offset=0):
     """Поиск клиентов по имени, фамилии или телефону с валидацией"""
     try:
         # Валидация поискового запроса
@@ -405,38 +460,29 @@ def search_clients(query):
             st.warning(f"⚠️ {str(e)}")
         return []
     
+    # Полнотекстовый индекс с транслитерацией, лучшие совпадения первыми
     conn = get_connection()
-    cursor = conn.cursor()
-    
-    search_term = f"%{query}%"
-    cursor.execute('''
-        SELECT id, first_name, last_name, birth_date, phone, email
-        FROM clients
-        WHERE first_name LIKE ? OR last_name LIKE ? OR phone LIKE ?
-        ORDER BY last_name, first_name
-        LIMIT 10
-    ''', (search_term, search_term, search_term))
-    
-    results = cursor.fetchall()
-    conn.close()
-    
-    return results
+    try:
+        return search_client_rows(conn, query, limit=limit, offset=offset)
+    finally:
+        conn.close()
 
 def get_client_by_id(client_id):
     """Получить клиента по ID"""
     conn = get_connection()
-    cursor = conn.cursor()
-    
-    cursor.execute('''
-        SELECT id, first_name, last_name, birth_date, phone, email
-        FROM clients
-        WHERE id = ?
-    ''', (client_id,))
+    try:
+        cursor = conn.cursor()
     
-    result = cursor.fetchone()
-    conn.close()
+        cursor.execute('''
+            SELECT id, first_name, last_name, birth_date, phone, email
+            FROM clients
+            WHERE id = ?
+        ''', (client_id,))
     
-    return result
+        result = cursor.fetchone()
+        return result
+    finally:
+        conn.close()
 
 def create_client(first_name, last_name, birth_date, phone, email=None):
     """Создать нового клиента с валидацией"""
@@ -462,84 +508,87 @@ def create_client(first_name, last_name, birth_date, phone, email=None):
         
         client_id = cursor.lastrowid
         conn.commit()
-        conn.close()
-        
-        # Синхронизируем с Git (синхронно для надежности)
-        if GIT_SYNC_AVAILABLE:
-            try:
-                result = sync_database_to_git_sync("Auto-commit: Added new client", push=True)
-                if not result:
-                    print("⚠️ Git sync failed for new client - data may be lost on restart")
-            except Exception as e:
-                print(f"⚠️ Git sync error for new client: {e}")
-        
-        return client_id
     except sqlite3.IntegrityError as e:
-        conn.close()
         if hasattr(st, 'error'):
             st.error(f"❌ Телефон уже существует в базе данных")
         return None
     except sqlite3.Error as e:
-        conn.close()
         if hasattr(st, 'error'):
             st.error(f"❌ Ошибка создания клиента: {e}")
         return None
+    finally:
+        conn.close()
+
+    # Синхронизируем с Git (режим GIT_SYNC_DURABILITY: в async запись не ждет push,
+    # запрос сохраняется в локальный журнал и гарантированно дойдет до Git)
+    if GIT_SYNC_AVAILABLE:
+        try:
+            result = sync_database_to_git_durable("Auto-commit: Added new client", push=True)
+            if not result:
+                print("⚠️ Git sync failed for new client - data may be lost on restart")
+        except Exception as e:
+            print(f"⚠️ Git sync error for new client: {e}")
+
+    return client_id
 
 @st.cache_data(ttl=300)  # Кеш на 5 минут
 def get_all_doctors():
     """Получить всех врачей"""
     conn = get_connection()
-    cursor = conn.cursor()
-    
-    cursor.execute('''
-        SELECT id, first_name, last_name, specialization, phone, email
-        FROM doctors
-        WHERE is_active = 1
-        ORDER BY last_name, first_name
-    ''')
+    try:
+        cursor = conn.cursor()
     
-    results = cursor.fetchall()
-    conn.close()
+        cursor.execute('''
+            SELECT id, first_name, last_name, specialization, phone, email
+            FROM doctors
+            WHERE is_active = 1
+            ORDER BY last_name, first_name
+        ''')
     
-    return results
+        results = cursor.fetchall()
+        return results
+    finally:
+        conn.close()
 
 @st.cache_data(ttl=300)  # Кеш на 5 минут
 def get_services_by_doctor(doctor_id):
     """Получить услуги по врачу"""
     conn = get_connection()
-    cursor = conn.cursor()
-    
-    cursor.execute('''
-        SELECT id, name, description, price, duration_minutes
-        FROM services
-        WHERE doctor_id = ? AND is_active = 1
-        ORDER BY name
-    ''', (doctor_id,))
-    
-    results = cursor.fetchall()
-    conn.close()
+    try:
+        cursor = conn.cursor()
     
-    return results
+        cursor.execute('''
+            SELECT id, name, description, price, duration_minutes
+            FROM services
+            WHERE doctor_id = ? AND is_active = 1
+            ORDER BY name
+        ''', (doctor_id,))
+    
+        results = cursor.fetchall()
+        return results
+    finally:
+        conn.close()
 
 @st.cache_data(ttl=300)  # Кеш на 5 минут
 def get_all_services():
     """Получить все активные услуги"""
     conn = get_connection()
-    cursor = conn.cursor()
-    
-    cursor.execute('''
-        SELECT s.id, s.name, s.description, s.price, s.duration_minutes, 
-               d.first_name, d.last_name, d.specialization
-        FROM services s
-        JOIN doctors d ON s.doctor_id = d.id
-        WHERE s.is_active = 1 AND d.is_active = 1
-        ORDER BY d.last_name, d.first_name, s.name
-    ''')
+    try:
+        cursor = conn.cursor()
     
-    results = cursor.fetchall()
-    conn.close()
+        cursor.execute('''
+            SELECT s.id, s.name, s.description, s.price, s.duration_minutes, 
+                   d.first_name, d.last_name, d.specialization
+            FROM services s
+            JOIN doctors d ON s.doctor_id = d.id
+            WHERE s.is_active = 1 AND d.is_active = 1
+            ORDER BY d.last_name, d.first_name, s.name
+        ''')
     
-    return results
+        results = cursor.fetchall()
+        return results
+    finally:
+        conn.close()
 
 def add_service_to_appointment(appointment_id, service_id, price):
     """Добавить услугу к приему"""
@@ -553,17 +602,16 @@ def add_service_to_appointment(appointment_id, service_id, price):
         ''', (appointment_id, service_id, price))
         
         conn.commit()
-        conn.close()
         return True
     except sqlite3.IntegrityError:
         # Услуга уже добавлена
-        conn.close()
         return False
     except sqlite3.Error as e:
-        conn.close()
         if hasattr(st, 'error'):
             st.error(f"❌ Ошибка добавления услуги: {e}")
         return False
+    finally:
+        conn.close()
 
 def remove_service_from_appointment(appointment_id, service_id):
     """Удалить услугу из приема"""
@@ -578,49 +626,51 @@ def remove_service_from_appointment(appointment_id, service_id):
         
         affected = cursor.rowcount
         conn.commit()
-        conn.close()
         return affected > 0
     except sqlite3.Error as e:
-        conn.close()
         if hasattr(st, 'error'):
             st.error(f"❌ Ошибка удаления услуги: {e}")
         return False
+    finally:
+        conn.close()
 
 def get_appointment_services(appointment_id):
     """Получить все услуги приема"""
     conn = get_connection()
-    cursor = conn.cursor()
-    
-    cursor.execute('''
-        SELECT aps.id, s.id, s.name, s.description, aps.price, s.price as base_price,
-               s.duration_minutes, d.first_name, d.last_name
-        FROM appointment_services aps
-        JOIN services s ON aps.service_id = s.id
-        JOIN doctors d ON s.doctor_id = d.id
-        WHERE aps.appointment_id = ?
-        ORDER BY s.name
-    ''', (appointment_id,))
-    
-    results = cursor.fetchall()
-    conn.close()
+    try:
+        cursor = conn.cursor()
     
-    return results
+        cursor.execute('''
+            SELECT aps.id, s.id, s.name, s.description, aps.price, s.price as base_price,
+                   s.duration_minutes, d.first_name, d.last_name
+            FROM appointment_services aps
+            JOIN services s ON aps.service_id = s.id
+            JOIN doctors d ON s.doctor_id = d.id
+            WHERE aps.appointment_id = ?
+            ORDER BY s.name
+        ''', (appointment_id,))
+    
+        results = cursor.fetchall()
+        return results
+    finally:
+        conn.close()
 
 def get_total_appointment_cost(appointment_id):
     """Получить общую стоимость приема"""
     conn = get_connection()
-    cursor = conn.cursor()
-    
-    cursor.execute('''
-        SELECT COALESCE(SUM(price), 0)
-        FROM appointment_services
-        WHERE appointment_id = ?
-    ''', (appointment_id,))
-    
-    total = cursor.fetchone()[0]
-    conn.close()
+    try:
+        cursor = conn.cursor()
     
-    return total
+        cursor.execute('''
+            SELECT COALESCE(SUM(price), 0)
+            FROM appointment_services
+            WHERE appointment_id = ?
+        ''', (appointment_id,))
+    
+        total = cursor.fetchone()[0]
+        return total
+    finally:
+        conn.close()
 
 def create_appointment(client_id, doctor_id, service_id, appointment_date, appointment_time, notes=None, source='Повторное посещение', skip_date_validation=False):
     """Создать новый прием с проверкой конфликтов времени
@@ -655,196 +705,281 @@ def create_appointment(client_id, doctor_id, service_id, appointment_date, appoi
         else:
             appointment_time_str = str(appointment_time)
         
-        # КРИТИЧЕСКИ ВАЖНО: Проверка конфликтов времени
-        cursor.execute('''
-            SELECT a.id, c.first_name, c.last_name 
-            FROM appointments a
-            JOIN clients c ON a.client_id = c.id
-            WHERE a.doctor_id = ? 
-            AND a.appointment_date = ? 
-            AND a.appointment_time = ?
-            AND a.status NOT IN ('отменен', 'не явился')
-        ''', (doctor_id, appointment_date, appointment_time_str))
-        
-        existing = cursor.fetchone()
-        if existing:
-            conn.close()
-            if hasattr(st, 'error'):
-                st.error(f"❌ Врач уже занят в это время! Пациент: {existing[1]} {existing[2]}")
-            return None
-        
-        # Вставляем прием
-        cursor.execute('''
-            INSERT INTO appointments (client_id, doctor_id, service_id, appointment_date, appointment_time, notes, source)
-            VALUES (?, ?, ?, ?, ?, ?, ?)
-        ''', (client_id, doctor_id, service_id, appointment_date, appointment_time_str, notes, source))
-        
-        appointment_id = cursor.lastrowid
-        
-        # КРИТИЧЕСКИ ВАЖНО: Автоматически добавляем первую услугу в appointment_services
-        if service_id:  # Только если service_id был предоставлен
-            cursor.execute('SELECT price FROM services WHERE id = ?', (service_id,))
-            service = cursor.fetchone()
-            if service:
+        # Блокировка записи: между проверкой конфликтов и вставкой никто не займет это окно
+        with write_transaction(conn, 'create_appointment'):
+            # КРИТИЧЕСКИ ВАЖНО: Проверка конфликтов времени - пересечение интервалов с учетом длительности услуг
+            duration = service_duration(conn, service_id)
+            availability = load_availability(conn, appointment_date, appointment_date, doctor_ids=[doctor_id])
+            conflict_id = availability.conflict(doctor_id, appointment_date, appointment_time_str, duration)
+            if conflict_id:
                 cursor.execute('''
-                    INSERT INTO appointment_services (appointment_id, service_id, price)
-                    VALUES (?, ?, ?)
-                ''', (appointment_id, service_id, service[0]))
-        
-        conn.commit()
-        conn.close()
-        
-        # Синхронизируем с Git (синхронно для надежности - критическая операция!)
-        if GIT_SYNC_AVAILABLE:
-            try:
-                result = sync_database_to_git_sync("Auto-commit: Created new appointment", push=True)
-                if not result:
-                    print("⚠️ Git sync failed for new appointment - data may be lost on restart")
-            except Exception as e:
-                print(f"⚠️ Git sync error for new appointment: {e}")
-        
-        return appointment_id
+                    SELECT c.first_name, c.last_name, a.appointment_time
+                    FROM appointments a
+                    JOIN clients c ON a.client_id = c.id
+                    WHERE a.id = ?
+                ''', (conflict_id,))
+                existing = cursor.fetchone()
+                if hasattr(st, 'error'):
+                    st.error(f"❌ Врач уже занят в это время! Пациент: {existing[0]} {existing[1]} ({existing[2][:5]})")
+                return None
+
+            # Вставляем прием
+            cursor.execute('''
+                INSERT INTO appointments (client_id, doctor_id, service_id, appointment_date, appointment_time, notes, source)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+            ''', (client_id, doctor_id, service_id, appointment_date, appointment_time_str, notes, source))
+
+            appointment_id = cursor.lastrowid
+
+            # КРИТИЧЕСКИ ВАЖНО: Автоматически добавляем первую услугу в appointment_services
+            if service_id:  # Только если service_id был предоставлен
+                cursor.execute('SELECT price FROM services WHERE id = ?', (service_id,))
+                service = cursor.fetchone()
+                if service:
+                    cursor.execute('''
+                        INSERT INTO appointment_services (appointment_id, service_id, price)
+                        VALUES (?, ?, ?)
+                    ''', (appointment_id, service_id, service[0]))
     except sqlite3.IntegrityError as e:
-        conn.close()
         if hasattr(st, 'error'):
             st.error(f"❌ Ошибка целостности данных: {e}")
         return None
     except sqlite3.Error as e:
-        conn.close()
         if hasattr(st, 'error'):
             st.error(f"❌ Ошибка создания приема: {e}")
         return None
+    finally:
+        conn.close()
+
+    # Синхронизируем с Git (критическая операция - режим GIT_SYNC_DURABILITY)
+    if GIT_SYNC_AVAILABLE:
+        try:
+            result = sync_database_to_git_durable("Auto-commit: Created new appointment", push=True)
+            if not result:
+                print("⚠️ Git sync failed for new appointment - data may be lost on restart")
+        except Exception as e:
+            print(f"⚠️ Git sync error for new appointment: {e}")
+
+    return appointment_id
+
+def create_appointment_series(client_id, doctor_id, service_id, dates, appointment_time, notes=None,
+                              source='Повторное посещение', skip_conflicts=False):
+    """
+    Создать серию приемов (курс лечения) на даты dates в одно время
+
+    Все даты проверяются на пересечения одним запросом и создаются одной транзакцией;
+    при конфликтах без skip_conflicts не создается ни один прием. Одна синхронизация с Git.
+
+    Args:
+        dates: даты серии (appointment_series.expand_recurrence)
+
+    Returns:
+        dict: created - [(appointment_id, дата)], conflicts - [(дата, id мешающего приема)] или None при ошибке
+    """
+    try:
+        dates = [validate_date(day) for day in dates]
+        notes = validate_notes(notes) if notes else None
+    except ValidationError as e:
+        if hasattr(st, 'error'):
+            st.error(f"❌ Ошибка валидации: {e}")
+        return None
+
+    conn = get_connection()
+    try:
+        result = create_series_rows(conn, client_id, doctor_id, service_id, dates, appointment_time,
+                                    notes=notes, source=source, skip_conflicts=skip_conflicts)
+    except sqlite3.Error as e:
+        if hasattr(st, 'error'):
+            st.error(f"❌ Ошибка создания серии приемов: {e}")
+        return None
+    finally:
+        conn.close()
+
+    # Синхронизируем с Git (критическая операция - режим GIT_SYNC_DURABILITY), один раз на серию
+    if result['created'] and GIT_SYNC_AVAILABLE:
+        try:
+            if not sync_database_to_git_durable(f"Auto-commit: Created appointment series ({len(result['created'])})",
+                                                push=True):
+                print("⚠️ Git sync failed for appointment series - data may be lost on restart")
+        except Exception as e:
+            print(f"⚠️ Git sync error for appointment series: {e}")
+
+    return result
+
+def get_free_slots(doctor_id, service_id, after=None, count=5):
+    """Ближайшие свободные окна врача для услуги (список datetime)"""
+    after = after or datetime.now()
+    conn = get_connection()
+    try:
+        duration = service_duration(conn, service_id)
+        start = after.date() if isinstance(after, datetime) else after
+        availability = load_availability(conn, start, start + timedelta(days=SEARCH_HORIZON_DAYS),
+                                         doctor_ids=[doctor_id])
+        return availability.next_free_slots(doctor_id, duration, after, count=count)
+    finally:
+        conn.close()
+
+def get_first_free_slot(specialization, duration_minutes, after=None):
+    """Первое свободное окно среди врачей специализации: (datetime, doctor_id) или None"""
+    after = after or datetime.now()
+    conn = get_connection()
+    try:
+        start = after.date() if isinstance(after, datetime) else after
+        availability = load_availability(conn, start, start + timedelta(days=SEARCH_HORIZON_DAYS),
+                                         specialization=specialization)
+        return availability.first_free_slot(specialization, duration_minutes, after)
+    finally:
+        conn.close()
+
+def get_data_generation():
+    """
+    Поколение записи приемов и версия справочников (analytics_cache.read_generation)
+
+    Ключ результатов, которые форма хранит в session_state между перезапусками;
+    None - схема без версий, результат не кешируется.
+    """
+    conn = get_connection()
+    try:
+        return read_generation(conn)
+    finally:
+        conn.close()
 
 def get_appointment_by_id(appointment_id):
     """Получить прием по ID"""
     conn = get_connection()
-    cursor = conn.cursor()
+    try:
+        cursor = conn.cursor()
     
-    cursor.execute('''
-        SELECT a.id, a.client_id, a.doctor_id, a.service_id, a.appointment_date, 
-               a.appointment_time, a.status, a.notes, a.start_time, a.end_time,
-               c.first_name, c.last_name, c.phone,
-               d.first_name, d.last_name, d.specialization,
-               s.name, s.price, s.duration_minutes
-        FROM appointments a
-        JOIN clients c ON a.client_id = c.id
-        JOIN doctors d ON a.doctor_id = d.id
-        JOIN services s ON a.service_id = s.id
-        WHERE a.id = ?
-    ''', (appointment_id,))
-    
-    result = cursor.fetchone()
-    conn.close()
+        cursor.execute('''
+            SELECT a.id, a.client_id, a.doctor_id, a.service_id, a.appointment_date, 
+                   a.appointment_time, a.status, a.notes, a.start_time, a.end_time,
+                   c.first_name, c.last_name, c.phone,
+                   d.first_name, d.last_name, d.specialization,
+                   s.name, s.price, s.duration_minutes
+            FROM appointments a
+            JOIN clients c ON a.client_id = c.id
+            JOIN doctors d ON a.doctor_id = d.id
+            JOIN services s ON a.service_id = s.id
+            WHERE a.id = ?
+        ''', (appointment_id,))
     
-    return result
+        result = cursor.fetchone()
+        return result
+    finally:
+        conn.close()
+
+def get_appointment_details(appointment_id):
+    """
+    Все данные формы редактирования приема одной загрузкой (AppointmentDetails или None)
+
+    Прием, услуги, оплаты и справочники читаются на одном соединении в одной транзакции.
+    """
+    conn = get_connection()
+    try:
+        return load_appointment_details(conn, appointment_id)
+    finally:
+        conn.close()
 
 def update_appointment_status(appointment_id, status, start_time=None, end_time=None):
     """Обновить статус приема"""
     conn = get_connection()
-    cursor = conn.cursor()
+    try:
+        cursor = conn.cursor()
     
-    # Вычисляем длительность приема если есть start_time и end_time
-    actual_duration = None
-    if start_time and end_time:
-        start_dt = datetime.fromisoformat(start_time)
-        end_dt = datetime.fromisoformat(end_time)
-        actual_duration = int((end_dt - start_dt).total_seconds() / 60)
+        # Вычисляем длительность приема если есть start_time и end_time
+        actual_duration = None
+        if start_time and end_time:
+            start_dt = datetime.fromisoformat(start_time)
+            end_dt = datetime.fromisoformat(end_time)
+            actual_duration = int((end_dt - start_dt).total_seconds() / 60)
     
-    cursor.execute('''
-        UPDATE appointments 
-        SET status = ?, start_time = ?, end_time = ?, actual_duration_minutes = ?, updated_at = CURRENT_TIMESTAMP
-        WHERE id = ?
-    ''', (status, start_time, end_time, actual_duration, appointment_id))
+        cursor.execute('''
+            UPDATE appointments 
+            SET status = ?, start_time = ?, end_time = ?, actual_duration_minutes = ?, updated_at = CURRENT_TIMESTAMP
+            WHERE id = ?
+        ''', (status, start_time, end_time, actual_duration, appointment_id))
     
-    conn.commit()
-    conn.close()
+        conn.commit()
+    finally:
+        conn.close()
 
-def get_appointments_by_date_range(start_date, end_date, doctor_id=None):
-    """Получить приемы по диапазону дат"""
-    conn = get_connection()
-    cursor = conn.cursor()
-    
-    # Конвертируем даты в строки для SQLite
-    if hasattr(start_date, 'strftime'):
-        start_date_str = start_date.strftime('%Y-%m-%d')
-    else:
-        start_date_str = str(start_date)
-    
-    if hasattr(end_date, 'strftime'):
-        end_date_str = end_date.strftime('%Y-%m-%d')
-    else:
-        end_date_str = str(end_date)
-    
-    query = '''
-        SELECT a.id, a.client_id, a.doctor_id, a.service_id, a.appointment_date, 
-               a.appointment_time, a.status, a.notes, a.start_time, a.end_time,
-               c.first_name, c.last_name, c.phone,
-               d.first_name, d.last_name, d.specialization,
-               s.name, s.price, s.duration_minutes
-        FROM appointments a
-        JOIN clients c ON a.client_id = c.id
-        JOIN doctors d ON a.doctor_id = d.id
-        JOIN services s ON a.service_id = s.id
-        WHERE a.appointment_date BETWEEN ? AND ?
-    '''
-    
-    params = [start_date_str, end_date_str]
+def get_appointments_by_date_range(start_date, end_date, doctor_id=None, doctor_ids=None, statuses=None):
+    """
+    Получить приемы по диапазону дат
     
+    doctor_ids (набор ID врачей) и statuses фильтруются в SQL; строки - AppointmentRow
+    (обычный кортеж с именованными полями)
+    """
     if doctor_id:
-        query += ' AND a.doctor_id = ?'
-        params.append(doctor_id)
-    
-    query += ' ORDER BY a.appointment_date, a.appointment_time'
+        doctor_ids = {doctor_id}
     
-    cursor.execute(query, params)
-    results = cursor.fetchall()
-    conn.close()
+    conn = get_connection()
+    try:
+        return fetch_appointments(conn, start_date, end_date, doctor_ids=doctor_ids, statuses=statuses)
+    finally:
+        conn.close()
+
+def get_calendar_week(start_date, end_date, doctor_ids=None, statuses=None, slot_minutes=None, force=False):
+    """
+    Сетка календаря (CalendarIndex) за период из общего кеша
     
-    return results
+    Пока данные не менялись, приемы не перечитываются; после записи дочитываются
+    только измененные приемы. force - перечитать неделю целиком.
+    """
+    conn = get_connection()
+    try:
+        return get_calendar_cache().get_week(
+            conn, start_date, end_date, doctor_ids=doctor_ids, statuses=statuses,
+            slot_minutes=slot_minutes, force=force
+        )
+    finally:
+        conn.close()
 
 def delete_appointment(appointment_id):
     """Удалить прием"""
     conn = get_connection()
-    cursor = conn.cursor()
-    
-    # Сначала получаем информацию о приеме для логирования
-    cursor.execute('SELECT * FROM appointments WHERE id = ?', (appointment_id,))
-    appointment = cursor.fetchone()
-    
-    if appointment:
+    try:
+        cursor = conn.cursor()
+
+        # Сначала получаем информацию о приеме для логирования
+        cursor.execute('SELECT * FROM appointments WHERE id = ?', (appointment_id,))
+        appointment = cursor.fetchone()
+        if not appointment:
+            return False
+
         # Удаляем прием
         cursor.execute('DELETE FROM appointments WHERE id = ?', (appointment_id,))
         conn.commit()
+    finally:
         conn.close()
-        
-        # Синхронизируем с Git (асинхронно)
-        if GIT_SYNC_AVAILABLE:
-            sync_database_to_git_async("Auto-commit: Deleted appointment")
-        
-        return True
-    else:
-        conn.close()
-        return False
+
+    # Синхронизируем с Git (асинхронно)
+    if GIT_SYNC_AVAILABLE:
+        sync_database_to_git_async("Auto-commit: Deleted appointment")
+
+    return True
 
 def log_audit_action(user_id, action, table_name=None, record_id=None, old_values=None, new_values=None):
     """Логирование действий пользователя с детальной информацией"""
     try:
         conn = get_connection()
-        cursor = conn.cursor()
+        try:
+            cursor = conn.cursor()
         
-        # Конвертируем словари в JSON если нужно
-        if isinstance(old_values, dict):
-            old_values = json.dumps(old_values, ensure_ascii=False)
-        if isinstance(new_values, dict):
-            new_values = json.dumps(new_values, ensure_ascii=False)
+            # Конвертируем словари в JSON если нужно
+            if isinstance(old_values, dict):
+                old_values = json.dumps(old_values, ensure_ascii=False)
+            if isinstance(new_values, dict):
+                new_values = json.dumps(new_values, ensure_ascii=False)
         
-        cursor.execute('''
-            INSERT INTO audit_log (user_id, action, table_name, record_id, old_values, new_values)
-            VALUES (?, ?, ?, ?, ?, ?)
-        ''', (user_id, action, table_name, record_id, old_values, new_values))
+            cursor.execute('''
+                INSERT INTO audit_log (user_id, action, table_name, record_id, old_values, new_values)
+                VALUES (?, ?, ?, ?, ?, ?)
+            ''', (user_id, action, table_name, record_id, old_values, new_values))
         
-        conn.commit()
-        conn.close()
+            conn.commit()
+        finally:
+            conn.close()
     except Exception as e:
         # Логирование не должно ломать основную функциональность
         print(f"Ошибка логирования: {e}")
@@ -853,16 +988,18 @@ def add_payment_to_service(appointment_service_id, payment_method, amount):
     """Добавить оплату к услуге приема (v2.7)"""
     try:
         conn = get_connection()
-        cursor = conn.cursor()
+        try:
+            cursor = conn.cursor()
         
-        cursor.execute('''
-            INSERT INTO appointment_service_payments (appointment_service_id, payment_method, amount)
-            VALUES (?, ?, ?)
-        ''', (appointment_service_id, payment_method, amount))
+            cursor.execute('''
+                INSERT INTO appointment_service_payments (appointment_service_id, payment_method, amount)
+                VALUES (?, ?, ?)
+            ''', (appointment_service_id, payment_method, amount))
         
-        conn.commit()
-        payment_id = cursor.lastrowid
-        conn.close()
+            conn.commit()
+            payment_id = cursor.lastrowid
+        finally:
+            conn.close()
         
         # Синхронизируем с Git (асинхронно)
         if GIT_SYNC_AVAILABLE:
@@ -874,67 +1011,105 @@ def add_payment_to_service(appointment_service_id, payment_method, amount):
             st.error(f"❌ Ошибка добавления оплаты: {e}")
         return None
 
+def post_payment(appointment_id, amounts):
+    """
+    Провести оплату приема несколькими методами {метод: сумма} (атомарно)
+
+    Сумма каждого метода раскладывается по услугам пропорционально цене, все строки
+    оплат и payment_status приема записываются одной транзакцией; остаток проверяется
+    под блокировкой записи, поэтому параллельные кассиры не проведут переплату.
+    После записи - одна синхронизация с Git.
+
+    Returns:
+        dict: paid, total_paid, total_cost, remaining, payment_status, rows или None при ошибке
+    """
+    conn = get_connection()
+    try:
+        result = post_payment_rows(conn, appointment_id, amounts)
+    except ValidationError as e:
+        if hasattr(st, 'error'):
+            st.error(f"❌ {e}")
+        return None
+    except sqlite3.Error as e:
+        if hasattr(st, 'error'):
+            st.error(f"❌ Ошибка добавления оплаты: {e}")
+        return None
+    finally:
+        conn.close()
+
+    # Синхронизируем с Git (асинхронно) - один раз на всю оплату
+    if GIT_SYNC_AVAILABLE:
+        sync_database_to_git_async("Auto-commit: Added payment")
+
+    return result
+
+def get_unpaid_appointments(limit=50):
+    """Приемы с остатком к оплате (по частичному индексу), новые сначала"""
+    conn = get_connection()
+    try:
+        return fetch_unpaid(conn, limit=limit)
+    finally:
+        conn.close()
+
 def get_service_payments(appointment_service_id):
     """Получить все оплаты для конкретной услуги приема"""
     conn = get_connection()
-    cursor = conn.cursor()
-    
-    cursor.execute('''
-        SELECT id, payment_method, amount, created_at
-        FROM appointment_service_payments
-        WHERE appointment_service_id = ?
-        ORDER BY created_at
-    ''', (appointment_service_id,))
-    
-    results = cursor.fetchall()
-    conn.close()
+    try:
+        cursor = conn.cursor()
     
-    return results
+        cursor.execute('''
+            SELECT id, payment_method, amount, created_at
+            FROM appointment_service_payments
+            WHERE appointment_service_id = ?
+            ORDER BY created_at
+        ''', (appointment_service_id,))
+    
+        results = cursor.fetchall()
+        return results
+    finally:
+        conn.close()
 
 def get_appointment_payments_summary(appointment_id):
     """Получить сводку по всем оплатам приема"""
     conn = get_connection()
-    cursor = conn.cursor()
-    
-    cursor.execute('''
-        SELECT 
-            asp.payment_method,
-            SUM(asp.amount) as total_amount
-        FROM appointment_service_payments asp
-        JOIN appointment_services asrv ON asp.appointment_service_id = asrv.id
-        WHERE asrv.appointment_id = ?
-        GROUP BY asp.payment_method
-    ''', (appointment_id,))
-    
-    results = cursor.fetchall()
-    conn.close()
+    try:
+        cursor = conn.cursor()
     
-    return results
+        cursor.execute('''
+            SELECT 
+                asp.payment_method,
+                SUM(asp.amount) as total_amount
+            FROM appointment_service_payments asp
+            JOIN appointment_services asrv ON asp.appointment_service_id = asrv.id
+            WHERE asrv.appointment_id = ?
+            GROUP BY asp.payment_method
+        ''', (appointment_id,))
+    
+        results = cursor.fetchall()
+        return results
+    finally:
+        conn.close()
 
 def update_appointment_payment_status(appointment_id, total_paid, total_cost):
     """Обновить статус оплаты приема"""
     try:
         conn = get_connection()
-        cursor = conn.cursor()
+        try:
+            cursor = conn.cursor()
         
-        # Определяем статус оплаты
-        if total_paid == 0:
-            payment_status = 'не оплачено'
-        elif total_paid >= total_cost:
-            payment_status = 'оплачено'
-        else:
-            payment_status = 'частично оплачено'
+            # Определяем статус оплаты
+            payment_status = payment_status_for(total_paid, total_cost)
         
-        cursor.execute('''
-            UPDATE appointments 
-            SET payment_status = ?
-            WHERE id = ?
-        ''', (payment_status, appointment_id))
+            cursor.execute('''
+                UPDATE appointments 
+                SET payment_status = ?
+                WHERE id = ?
+            ''', (payment_status, appointment_id))
         
-        conn.commit()
-        conn.close()
-        
-        return True
+            conn.commit()
+            return True
+        finally:
+            conn.close()
     except Exception as e:
         if hasattr(st, 'error'):
             st.error(f"❌ Ошибка обновления статуса оплаты: {e}")
@@ -944,14 +1119,15 @@ def delete_service_payment(payment_id):
     """Удалить оплату"""
     try:
         conn = get_connection()
-        cursor = conn.cursor()
+        try:
+            cursor = conn.cursor()
         
-        cursor.execute('DELETE FROM appointment_service_payments WHERE id = ?', (payment_id,))
+            cursor.execute('DELETE FROM appointment_service_payments WHERE id = ?', (payment_id,))
         
-        conn.commit()
-        conn.close()
-        
-        return True
+            conn.commit()
+            return True
+        finally:
+            conn.close()
     except Exception as e:
         if hasattr(st, 'error'):
             st.error(f"❌ Ошибка удаления оплаты: {e}")
@@ -963,18 +1139,19 @@ def get_all_users():
     """Получить всех пользователей системы"""
     try:
         conn = get_connection()
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-            SELECT id, username, access_level, created_at, last_login
-            FROM users 
-            ORDER BY created_at DESC
-        ''')
+        try:
+            cursor = conn.cursor()
         
-        users = cursor.fetchall()
-        conn.close()
+            cursor.execute('''
+                SELECT id, username, access_level, created_at, last_login
+                FROM users 
+                ORDER BY created_at DESC
+            ''')
         
-        return users
+            users = cursor.fetchall()
+            return users
+        finally:
+            conn.close()
     except Exception as e:
         if hasattr(st, 'error'):
             st.error(f"❌ Ошибка получения пользователей: {e}")
@@ -993,25 +1170,25 @@ def create_user(username, password, access_level, name=None):
             name = username
         
         conn = get_connection()
-        cursor = conn.cursor()
-        
-        # Проверяем, не существует ли пользователь
-        cursor.execute('SELECT id FROM users WHERE username = ?', (username,))
-        if cursor.fetchone():
-            conn.close()
-            return False, "Пользователь с таким именем уже существует"
+        try:
+            cursor = conn.cursor()
         
-        # Создаем пользователя
-        cursor.execute('''
-            INSERT INTO users (username, password_hash, name, access_level, created_at)
-            VALUES (?, ?, ?, ?, datetime('now'))
-        ''', (username, hashed_password, name, access_level))
+            # Проверяем, не существует ли пользователь
+            cursor.execute('SELECT id FROM users WHERE username = ?', (username,))
+            if cursor.fetchone():
+                return False, "Пользователь с таким именем уже существует"
         
-        conn.commit()
-        user_id = cursor.lastrowid
-        conn.close()
+            # Создаем пользователя
+            cursor.execute('''
+                INSERT INTO users (username, password_hash, name, access_level, created_at)
+                VALUES (?, ?, ?, ?, datetime('now'))
+            ''', (username, hashed_password, name, access_level))
         
-        return True, f"Пользователь {username} успешно создан (ID: {user_id})"
+            conn.commit()
+            user_id = cursor.lastrowid
+            return True, f"Пользователь {username} успешно создан (ID: {user_id})"
+        finally:
+            conn.close()
     except Exception as e:
         if hasattr(st, 'error'):
             st.error(f"❌ Ошибка создания пользователя: {e}")
@@ -1026,25 +1203,25 @@ def update_user_password(username, new_password):
         hashed_password = bcrypt.hashpw(new_password.encode('utf-8'), bcrypt.gensalt()).decode('utf-8')
         
         conn = get_connection()
-        cursor = conn.cursor()
-        
-        # Проверяем, существует ли пользователь
-        cursor.execute('SELECT id FROM users WHERE username = ?', (username,))
-        if not cursor.fetchone():
-            conn.close()
-            return False, "Пользователь не найден"
+        try:
+            cursor = conn.cursor()
         
-        # Обновляем пароль
-        cursor.execute('''
-            UPDATE users 
-            SET password_hash = ?, updated_at = datetime('now')
-            WHERE username = ?
-        ''', (hashed_password, username))
+            # Проверяем, существует ли пользователь
+            cursor.execute('SELECT id FROM users WHERE username = ?', (username,))
+            if not cursor.fetchone():
+                return False, "Пользователь не найден"
         
-        conn.commit()
-        conn.close()
+            # Обновляем пароль
+            cursor.execute('''
+                UPDATE users 
+                SET password_hash = ?, updated_at = datetime('now')
+                WHERE username = ?
+            ''', (hashed_password, username))
         
-        return True, f"Пароль пользователя {username} успешно обновлен"
+            conn.commit()
+            return True, f"Пароль пользователя {username} успешно обновлен"
+        finally:
+            conn.close()
     except Exception as e:
         if hasattr(st, 'error'):
             st.error(f"❌ Ошибка обновления пароля: {e}")
@@ -1054,25 +1231,25 @@ def update_user_access_level(username, new_access_level):
     """Обновить уровень доступа пользователя"""
     try:
         conn = get_connection()
-        cursor = conn.cursor()
-        
-        # Проверяем, существует ли пользователь
-        cursor.execute('SELECT id FROM users WHERE username = ?', (username,))
-        if not cursor.fetchone():
-            conn.close()
-            return False, "Пользователь не найден"
+        try:
+            cursor = conn.cursor()
         
-        # Обновляем уровень доступа
-        cursor.execute('''
-            UPDATE users 
-            SET access_level = ?, updated_at = datetime('now')
-            WHERE username = ?
-        ''', (new_access_level, username))
+            # Проверяем, существует ли пользователь
+            cursor.execute('SELECT id FROM users WHERE username = ?', (username,))
+            if not cursor.fetchone():
+                return False, "Пользователь не найден"
         
-        conn.commit()
-        conn.close()
+            # Обновляем уровень доступа
+            cursor.execute('''
+                UPDATE users 
+                SET access_level = ?, updated_at = datetime('now')
+                WHERE username = ?
+            ''', (new_access_level, username))
         
-        return True, f"Уровень доступа пользователя {username} обновлен на {new_access_level}"
+            conn.commit()
+            return True, f"Уровень доступа пользователя {username} обновлен на {new_access_level}"
+        finally:
+            conn.close()
     except Exception as e:
         if hasattr(st, 'error'):
             st.error(f"❌ Ошибка обновления уровня доступа: {e}")
@@ -1082,30 +1259,29 @@ def delete_user(username):
     """Удалить пользователя"""
     try:
         conn = get_connection()
-        cursor = conn.cursor()
+        try:
+            cursor = conn.cursor()
         
-        # Проверяем, существует ли пользователь
-        cursor.execute('SELECT id FROM users WHERE username = ?', (username,))
-        user = cursor.fetchone()
-        if not user:
-            conn.close()
-            return False, "Пользователь не найден"
+            # Проверяем, существует ли пользователь
+            cursor.execute('SELECT id FROM users WHERE username = ?', (username,))
+            user = cursor.fetchone()
+            if not user:
+                return False, "Пользователь не найден"
         
-        # Нельзя удалить последнего владельца
-        cursor.execute('SELECT COUNT(*) FROM users WHERE access_level = "owner"', ())
-        owner_count = cursor.fetchone()[0]
+            # Нельзя удалить последнего владельца
+            cursor.execute('SELECT COUNT(*) FROM users WHERE access_level = "owner"', ())
+            owner_count = cursor.fetchone()[0]
         
-        if user[0] == 1 and owner_count == 1:  # Предполагаем, что ID 1 - это владелец
-            conn.close()
-            return False, "Нельзя удалить последнего владельца системы"
+            if user[0] == 1 and owner_count == 1:  # Предполагаем, что ID 1 - это владелец
+                return False, "Нельзя удалить последнего владельца системы"
         
-        # Удаляем пользователя
-        cursor.execute('DELETE FROM users WHERE username = ?', (username,))
+            # Удаляем пользователя
+            cursor.execute('DELETE FROM users WHERE username = ?', (username,))
         
-        conn.commit()
-        conn.close()
-        
-        return True, f"Пользователь {username} успешно удален"
+            conn.commit()
+            return True, f"Пользователь {username} успешно удален"
+        finally:
+            conn.close()
     except Exception as e:
         if hasattr(st, 'error'):
             st.error(f"❌ Ошибка удаления пользователя: {e}")
@@ -0,0 +1,538 @@
+#!/usr/bin/env python3
+"""
+Пул соединений SQLite для Jardem Medical Center
+Одно соединение на поток на время работы, PRAGMA настраиваются один раз при открытии,
+простаивающие соединения переиспользуются, проверяются и закрываются по таймауту
+"""
+
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+DB_FILE = 'medical_center.db'
+
+# Профили PRAGMA. journal_mode сохраняется в файле БД и применяется в init_database(),
+# остальные параметры действуют на соединение и применяются при его открытии.
+PRAGMA_PROFILES = {
+    'default': {
+        'journal_mode': 'DELETE',
+        'busy_timeout': 10000,
+    },
+    'performance': {
+        'journal_mode': 'WAL',
+        'synchronous': 'NORMAL',
+        'mmap_size': 268435456,  # 256 МБ
+        'cache_size': -20000,  # ~20 МБ
+        'temp_store': 'MEMORY',
+        'busy_timeout': 10000,
+    },
+}
+
+SQLITE_PROFILE = os.getenv('SQLITE_PROFILE', 'performance')
+
+# Фоновый checkpoint WAL (секунды / байты)
+CHECKPOINT_INTERVAL = int(os.getenv('SQLITE_CHECKPOINT_INTERVAL', '60'))
+CHECKPOINT_TRUNCATE_BYTES = int(os.getenv('SQLITE_CHECKPOINT_TRUNCATE_BYTES', str(16 * 1024 * 1024)))
+
+# Размер пула и таймауты (секунды)
+POOL_MAX_SIZE = 8
+POOL_IDLE_TIMEOUT = 300
+POOL_HEALTH_CHECK_INTERVAL = 60
+POOL_ACQUIRE_TIMEOUT = 10
+
+
+def get_pragma_profile(name=None):
+    """
+    Получить профиль PRAGMA
+    
+    Отдельные значения переопределяются переменными окружения SQLITE_PRAGMA_<ИМЯ>,
+    например SQLITE_PRAGMA_MMAP_SIZE=0
+    """
+    name = name or SQLITE_PROFILE
+    if name not in PRAGMA_PROFILES:
+        print(f"⚠️ Неизвестный профиль SQLite '{name}', используется 'default'")
+        name = 'default'
+    
+    profile = dict(PRAGMA_PROFILES[name])
+    for key in list(profile):
+        override = os.getenv(f'SQLITE_PRAGMA_{key.upper()}')
+        if override:
+            profile[key] = override
+    return profile
+
+
+def apply_database_profile(conn, profile=None):
+    """Применить к файлу БД постоянные настройки профиля (journal_mode)"""
+    profile = profile if profile is not None else get_pragma_profile()
+    journal_mode = profile.get('journal_mode')
+    if journal_mode:
+        mode = conn.execute(f"PRAGMA journal_mode = {journal_mode}").fetchone()[0]
+        if mode.upper() != str(journal_mode).upper():
+            print(f"⚠️ Не удалось включить journal_mode={journal_mode}, текущий режим: {mode}")
+        return mode
+    return None
+
+
+class PooledConnection(sqlite3.Connection):
+    """
+    Соединение из пула: close() возвращает его в пул вместо закрытия
+
+    Вложенный acquire() внутри открытой транзакции работает в точке сохранения:
+    commit() / rollback() вложенного вызова фиксируют или откатывают только его
+    изменения, транзакция внешнего вызывающего завершается его собственным commit().
+    """
+
+    _pool = None
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._scopes = []  # вложенные acquire(): (точка сохранения или None, row_factory вызывающего)
+
+    def _savepoint(self):
+        return self._scopes[-1][0] if self._scopes else None
+
+    def commit(self):
+        savepoint = self._savepoint()
+        if savepoint is None:
+            sqlite3.Connection.commit(self)
+        else:
+            self.execute(f"RELEASE SAVEPOINT {savepoint}")
+            self.execute(f"SAVEPOINT {savepoint}")
+
+    def rollback(self):
+        savepoint = self._savepoint()
+        if savepoint is None:
+            sqlite3.Connection.rollback(self)
+        else:
+            self.execute(f"ROLLBACK TO SAVEPOINT {savepoint}")
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        # with conn: вызывает commit/rollback в обход переопределенных методов
+        if self._savepoint() is None:
+            return sqlite3.Connection.__exit__(self, exc_type, exc_value, traceback)
+        if exc_type is None:
+            self.commit()
+        else:
+            self.rollback()
+        return False
+
+    def close(self):
+        pool = self._pool
+        if pool is None:
+            sqlite3.Connection.close(self)
+        else:
+            pool.release(self)
+
+    def discard(self):
+        """Действительно закрыть соединение"""
+        self._pool = None
+        sqlite3.Connection.close(self)
+
+
+class ConnectionPool:
+    """
+    Пул соединений с одной БД
+
+    Поток получает одно и то же соединение при вложенных вызовах acquire(),
+    в пул оно возвращается, когда закрыт последний вложенный вызов. Вложенный
+    вызов внутри транзакции изолирован точкой сохранения (PooledConnection).
+    При каждой выдаче незавершенная транзакция откатывается, а соединения
+    завершившихся потоков возвращаются в пул.
+    """
+
+    def __init__(self, database=DB_FILE, max_size=POOL_MAX_SIZE, idle_timeout=POOL_IDLE_TIMEOUT,
+                 health_check_interval=POOL_HEALTH_CHECK_INTERVAL, acquire_timeout=POOL_ACQUIRE_TIMEOUT,
+                 profile=None):
+        self.database = database
+        self.profile = profile if profile is not None else get_pragma_profile()
+        self.max_size = max_size
+        self.idle_timeout = idle_timeout
+        self.health_check_interval = health_check_interval
+        self.acquire_timeout = acquire_timeout
+
+        self._lock = threading.Condition(threading.Lock())
+        self._local = threading.local()
+        self._idle = []  # [(conn, released_at)]
+        self._in_use = {}  # conn -> поток-владелец
+        self._closed = False
+
+        self._stats = {
+            'opens': 0,
+            'reuses': 0,
+            'waits': 0,
+            'wait_time': 0.0,
+            'evictions': 0,
+            'health_check_failures': 0,
+            'reclaimed': 0,
+        }
+
+    # ---------- открытие и настройка соединений ----------
+
+    def _open(self):
+        conn = sqlite3.connect(
+            self.database,
+            timeout=10,
+            check_same_thread=False,
+            factory=PooledConnection
+        )
+        self._setup(conn)
+        conn._pool = self
+        self._stats['opens'] += 1
+        return conn
+
+    def _setup(self, conn):
+        """PRAGMA выполняются один раз при открытии соединения"""
+        conn.execute("PRAGMA foreign_keys = ON")
+        for key, value in self.profile.items():
+            if key != 'journal_mode':
+                conn.execute(f"PRAGMA {key} = {value}")
+
+    def _is_healthy(self, conn):
+        try:
+            conn.execute("SELECT 1").fetchone()
+            return True
+        except sqlite3.Error:
+            return False
+
+    # ---------- выдача и возврат ----------
+
+    def acquire(self):
+        """Получить соединение для текущего потока"""
+        local = self._local
+        conn = getattr(local, 'conn', None)
+        if conn is not None:
+            local.depth += 1
+            savepoint = None
+            if conn.in_transaction:
+                savepoint = f"_pool_scope_{local.depth}"
+                conn.execute(f"SAVEPOINT {savepoint}")
+            conn._scopes.append((savepoint, conn.row_factory))
+            return conn
+
+        conn = self._checkout()
+        local.conn = conn
+        local.depth = 1
+        return conn
+
+    def _checkout(self):
+        deadline = None
+        wait_started = None
+
+        with self._lock:
+            if self._closed:
+                raise sqlite3.OperationalError("Пул соединений закрыт")
+
+            # Соединения, забытые завершившимися потоками, возвращаем в пул сразу,
+            # а не только когда пул исчерпан: их транзакции держат блокировку записи
+            self._reclaim_dead_locked()
+
+            while True:
+                self._evict_idle_locked()
+
+                # Берем самое свежее простаивающее соединение
+                while self._idle:
+                    conn, released_at = self._idle.pop()
+                    if time.monotonic() - released_at >= self.health_check_interval and not self._is_healthy(conn):
+                        self._stats['health_check_failures'] += 1
+                        self._discard_locked(conn)
+                        continue
+                    self._reset(conn)
+                    self._in_use[conn] = threading.current_thread()
+                    self._stats['reuses'] += 1
+                    self._finish_wait(wait_started)
+                    return conn
+
+                if len(self._in_use) < self.max_size:
+                    break
+
+                # Поток мог завершиться, пока мы ждали
+                if self._reclaim_dead_locked():
+                    continue
+
+                if wait_started is None:
+                    wait_started = time.monotonic()
+                    deadline = wait_started + self.acquire_timeout
+                    self._stats['waits'] += 1
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self._finish_wait(wait_started)
+                    raise sqlite3.OperationalError(
+                        f"Пул соединений исчерпан ({self.max_size}), ожидание {self.acquire_timeout} с"
+                    )
+                self._lock.wait(remaining)
+
+            # Резервируем место до открытия, чтобы не превысить max_size
+            placeholder = object()
+            self._in_use[placeholder] = threading.current_thread()
+            self._finish_wait(wait_started)
+
+        try:
+            conn = self._open()
+        except Exception:
+            with self._lock:
+                del self._in_use[placeholder]
+                self._lock.notify()
+            raise
+
+        with self._lock:
+            del self._in_use[placeholder]
+            self._in_use[conn] = threading.current_thread()
+        return conn
+
+    def _finish_wait(self, wait_started):
+        if wait_started is not None:
+            self._stats['wait_time'] += time.monotonic() - wait_started
+
+    def release(self, conn):
+        """Вернуть соединение (вызывается из conn.close())"""
+        local = self._local
+        if getattr(local, 'conn', None) is not conn:
+            # Повторный close() или соединение чужого потока - игнорируем
+            return
+
+        local.depth -= 1
+        if local.depth > 0:
+            self._close_scope(conn)
+            return
+
+        local.conn = None
+        self._reset(conn)
+
+        with self._lock:
+            self._in_use.pop(conn, None)
+            if self._closed:
+                conn.discard()
+            else:
+                self._idle.append((conn, time.monotonic()))
+                self._evict_idle_locked()
+            self._lock.notify()
+
+    def _close_scope(self, conn):
+        """Конец вложенного вызова: незафиксированные им изменения откатываются"""
+        savepoint, row_factory = conn._scopes.pop()
+        try:
+            if savepoint is not None:
+                conn.execute(f"ROLLBACK TO SAVEPOINT {savepoint}")
+                conn.execute(f"RELEASE SAVEPOINT {savepoint}")
+            elif conn.in_transaction:
+                # Внешний вызов был вне транзакции - она начата вложенным
+                sqlite3.Connection.rollback(conn)
+        except sqlite3.Error:
+            pass
+        conn.row_factory = row_factory
+
+    def _reset(self, conn):
+        """Незавершенная транзакция откатывается, как при обычном закрытии"""
+        try:
+            conn._scopes.clear()
+            if conn.in_transaction:
+                sqlite3.Connection.rollback(conn)
+            if conn.row_factory is not None:
+                conn.row_factory = None
+        except sqlite3.Error:
+            pass
+
+    @contextmanager
+    def connection(self):
+        """Контекстный менеджер: with pool.connection() as conn: ..."""
+        conn = self.acquire()
+        try:
+            yield conn
+        finally:
+            self.release(conn)
+
+    # ---------- обслуживание ----------
+
+    def _evict_idle_locked(self):
+        now = time.monotonic()
+        keep = []
+        for conn, released_at in self._idle:
+            if now - released_at > self.idle_timeout:
+                self._discard_locked(conn)
+                self._stats['evictions'] += 1
+            else:
+                keep.append((conn, released_at))
+        self._idle = keep
+
+    def _reclaim_dead_locked(self):
+        reclaimed = False
+        for conn, owner in list(self._in_use.items()):
+            if isinstance(conn, PooledConnection) and not owner.is_alive():
+                del self._in_use[conn]
+                self._reset(conn)
+                self._idle.append((conn, time.monotonic()))
+                self._stats['reclaimed'] += 1
+                reclaimed = True
+        return reclaimed
+
+    def _discard_locked(self, conn):
+        try:
+            conn.discard()
+        except sqlite3.Error:
+            pass
+
+    def evict_idle(self):
+        """Закрыть соединения, простаивающие дольше idle_timeout"""
+        with self._lock:
+            self._evict_idle_locked()
+
+    def close_all(self):
+        """
+        Закрыть все простаивающие соединения.
+        Нужно после замены файла БД (git pull, восстановление из копии).
+        Занятые соединения закроются при возврате.
+        """
+        with self._lock:
+            for conn, _ in self._idle:
+                self._discard_locked(conn)
+            self._idle = []
+            for conn in list(self._in_use):
+                if isinstance(conn, PooledConnection):
+                    conn._pool = None
+            self._in_use.clear()
+            self._lock.notify_all()
+        self._local = threading.local()
+
+    def stats(self):
+        """Счетчики пула"""
+        with self._lock:
+            stats = dict(self._stats)
+            stats['in_use'] = len(self._in_use)
+            stats['idle'] = len(self._idle)
+            stats['max_size'] = self.max_size
+        return stats
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool(database=DB_FILE):
+    """Общий пул для файла БД (один на процесс)"""
+    with _pools_lock:
+        pool = _pools.get(database)
+        if pool is None:
+            pool = ConnectionPool(database)
+            _pools[database] = pool
+        return pool
+
+
+def reset_pool(database=DB_FILE):
+    """Сбросить соединения пула после замены файла БД"""
+    with _pools_lock:
+        pool = _pools.get(database)
+    if pool is not None:
+        pool.close_all()
+
+
+def get_pool_stats(database=DB_FILE):
+    """Счетчики общего пула"""
+    return get_pool(database).stats()
+
+
+@contextmanager
+def write_transaction(conn, name):
+    """
+    Транзакция записи: BEGIN IMMEDIATE или точка сохранения внутри чужой транзакции
+
+    Если вызывающий уже открыл транзакцию (вложенный acquire(), внешний блок записи),
+    BEGIN упал бы с ошибкой: блок выполняется в SAVEPOINT name, при исключении
+    откатывается только он, а фиксирует все вызывающий.
+    """
+    if not conn.in_transaction:
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield conn
+            conn.commit()
+        except BaseException:
+            conn.rollback()
+            raise
+        return
+
+    conn.execute(f"SAVEPOINT {name}")
+    try:
+        yield conn
+    except BaseException:
+        conn.execute(f"ROLLBACK TO SAVEPOINT {name}")
+        conn.execute(f"RELEASE SAVEPOINT {name}")
+        raise
+    conn.execute(f"RELEASE SAVEPOINT {name}")
+
+
+def checkpoint_database(database=DB_FILE, mode='TRUNCATE'):
+    """
+    Перенести содержимое WAL в основной файл БД
+    
+    Нужно перед тем, как файл БД копируется или коммитится в Git целиком.
+    Возвращает (busy, log_frames, checkpointed_frames) или None.
+    """
+    if not os.path.exists(database):
+        return None
+    try:
+        with get_pool(database).connection() as conn:
+            return tuple(conn.execute(f"PRAGMA wal_checkpoint({mode})").fetchone())
+    except sqlite3.Error as e:
+        print(f"⚠️ Ошибка checkpoint WAL: {e}")
+        return None
+
+
+class CheckpointScheduler:
+    """
+    Фоновый checkpoint WAL
+    
+    Раз в interval секунд выполняет PASSIVE checkpoint (не блокирует читателей и писателей).
+    Если WAL вырос больше truncate_bytes, выполняется TRUNCATE, чтобы файл не рос бесконечно.
+    """
+
+    def __init__(self, database=DB_FILE, interval=CHECKPOINT_INTERVAL, truncate_bytes=CHECKPOINT_TRUNCATE_BYTES):
+        self.database = database
+        self.interval = interval
+        self.truncate_bytes = truncate_bytes
+        self.checkpoints = 0
+        self.last_result = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name='sqlite-checkpoint', daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+
+    def run_once(self):
+        wal_path = f"{self.database}-wal"
+        wal_size = os.path.getsize(wal_path) if os.path.exists(wal_path) else 0
+        if wal_size == 0:
+            return None
+        mode = 'TRUNCATE' if wal_size > self.truncate_bytes else 'PASSIVE'
+        self.last_result = checkpoint_database(self.database, mode)
+        self.checkpoints += 1
+        return self.last_result
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.run_once()
+            except Exception as e:
+                print(f"⚠️ Ошибка фонового checkpoint: {e}")
+
+
+_checkpoint_schedulers = {}
+
+
+def start_checkpoint_scheduler(database=DB_FILE):
+    """Запустить фоновый checkpoint (один на файл БД, только в режиме WAL)"""
+    if str(get_pool(database).profile.get('journal_mode', '')).upper() != 'WAL':
+        return None
+    with _pools_lock:
+        scheduler = _checkpoint_schedulers.get(database)
+        if scheduler is None:
+            scheduler = CheckpointScheduler(database)
+            _checkpoint_schedulers[database] = scheduler
+    return scheduler.start()
@@ -8,6 +8,7 @@ import streamlit as st
 import pandas as pd
 from datetime import datetime, date
 from database import get_connection, log_audit_action
+from client_search import matching_client_ids_sql
 from auth import check_access
 
 # Импорт Git синхронизации (опционально)
@@ -649,56 +650,62 @@ def show_doctors_table():
 def get_clients(search_query=None, show_active_only=True):
     """Получить список клиентов"""
     conn = get_connection()
-    cursor = conn.cursor()
-    
-    query = """
-        SELECT id, first_name, last_name, birth_date, phone, email, is_active, created_at
-        FROM clients
-        WHERE 1=1
-    """
-    params = []
+    try:
+        cursor = conn.cursor()
     
-    if search_query:
-        query += " AND (first_name LIKE ? OR last_name LIKE ? OR phone LIKE ?)"
-        search_pattern = f"%{search_query}%"
-        params.extend([search_pattern, search_pattern, search_pattern])
+        query = """
+            SELECT id, first_name, last_name, birth_date, phone, email, is_active, created_at
+            FROM clients
+            WHERE 1=1
+        """
+        params = []
     
-    if show_active_only:
-        query += " AND is_active = 1"
+        if search_query:
+            # По индексу clients_fts (имя, фамилия, цифры телефона, транслитерация)
+            condition, condition_params = matching_client_ids_sql(search_query)
+            query += f" AND {condition}"
+            params.extend(condition_params)
     
-    query += " ORDER BY first_name, last_name"
+        if show_active_only:
+            query += " AND is_active = 1"
     
-    cursor.execute(query, params)
-    clients = cursor.fetchall()
-    conn.close()
+        query += " ORDER BY first_name, last_name"
     
-    return clients
+        cursor.execute(query, params)
+        clients = cursor.fetchall()
+        return clients
+    finally:
+        conn.close()
 
 def get_client_by_id(client_id):
     """Получить клиента по ID"""
     conn = get_connection()
-    cursor = conn.cursor()
-    cursor.execute("""
-        SELECT id, first_name, last_name, birth_date, phone, email, is_active, created_at
-        FROM clients
-        WHERE id = ?
-    """, (client_id,))
-    client = cursor.fetchone()
-    conn.close()
-    return client
+    try:
+        cursor = conn.cursor()
+        cursor.execute("""
+            SELECT id, first_name, last_name, birth_date, phone, email, is_active, created_at
+            FROM clients
+            WHERE id = ?
+        """, (client_id,))
+        client = cursor.fetchone()
+        return client
+    finally:
+        conn.close()
 
 def add_client(first_name, last_name, birth_date, phone, email):
     """Добавить нового клиента"""
     try:
         conn = get_connection()
-        cursor = conn.cursor()
-        cursor.execute("""
-            INSERT INTO clients (first_name, last_name, birth_date, phone, email)
-            VALUES (?, ?, ?, ?, ?)
-        """, (first_name, last_name, birth_date, phone, email))
-        client_id = cursor.lastrowid
-        conn.commit()
-        conn.close()
+        try:
+            cursor = conn.cursor()
+            cursor.execute("""
+                INSERT INTO clients (first_name, last_name, birth_date, phone, email)
+                VALUES (?, ?, ?, ?, ?)
+            """, (first_name, last_name, birth_date, phone, email))
+            client_id = cursor.lastrowid
+            conn.commit()
+        finally:
+            conn.close()
         
         # Логируем действие
         log_audit_action(st.session_state['user_id'], 'CREATE', 'clients', client_id)
@@ -716,14 +723,16 @@ def update_client(client_id, first_name, last_name, birth_date, phone, email):
     """Обновить данные клиента"""
     try:
         conn = get_connection()
-        cursor = conn.cursor()
-        cursor.execute("""
-            UPDATE clients
-            SET first_name = ?, last_name = ?, birth_date = ?, phone = ?, email = ?, updated_at = CURRENT_TIMESTAMP
-            WHERE id = ?
-        """, (first_name, last_name, birth_date, phone, email, client_id))
-        conn.commit()
-        conn.close()
+        try:
+            cursor = conn.cursor()
+            cursor.execute("""
+                UPDATE clients
+                SET first_name = ?, last_name = ?, birth_date = ?, phone = ?, email = ?, updated_at = CURRENT_TIMESTAMP
+                WHERE id = ?
+            """, (first_name, last_name, birth_date, phone, email, client_id))
+            conn.commit()
+        finally:
+            conn.close()
         
         # Логируем действие
         log_audit_action(st.session_state['user_id'], 'UPDATE', 'clients', client_id)
@@ -741,14 +750,16 @@ def deactivate_client(client_id):
     """Деактивировать клиента"""
     try:
         conn = get_connection()
-        cursor = conn.cursor()
-        cursor.execute("""
-            UPDATE clients
-            SET is_active = 0, updated_at = CURRENT_TIMESTAMP
-            WHERE id = ?
-        """, (client_id,))
-        conn.commit()
-        conn.close()
+        try:
+            cursor = conn.cursor()
+            cursor.execute("""
+                UPDATE clients
+                SET is_active = 0, updated_at = CURRENT_TIMESTAMP
+                WHERE id = ?
+            """, (client_id,))
+            conn.commit()
+        finally:
+            conn.close()
         
         # Логируем действие
         log_audit_action(st.session_state['user_id'], 'UPDATE', 'clients', client_id)
@@ -765,75 +776,82 @@ def deactivate_client(client_id):
 def get_active_doctors():
     """Получить список активных врачей"""
     conn = get_connection()
-    cursor = conn.cursor()
-    cursor.execute("""
-        SELECT id, first_name, last_name
-        FROM doctors
-        WHERE is_active = 1
-        ORDER BY first_name, last_name
-    """)
-    doctors = cursor.fetchall()
-    conn.close()
-    return doctors
+    try:
+        cursor = conn.cursor()
+        cursor.execute("""
+            SELECT id, first_name, last_name
+            FROM doctors
+            WHERE is_active = 1
+            ORDER BY first_name, last_name
+        """)
+        doctors = cursor.fetchall()
+        return doctors
+    finally:
+        conn.close()
 
 def get_services(search_query=None, doctor_filter="Все", show_active_only=True):
     """Получить список услуг"""
     conn = get_connection()
-    cursor = conn.cursor()
-    
-    query = """
-        SELECT s.id, s.name, s.description, s.doctor_id, s.price, s.duration_minutes, s.is_active, s.created_at, d.first_name, d.last_name
-        FROM services s
-        JOIN doctors d ON s.doctor_id = d.id
-        WHERE 1=1
-    """
-    params = []
+    try:
+        cursor = conn.cursor()
     
-    if search_query:
-        query += " AND s.name LIKE ?"
-        params.append(f"%{search_query}%")
+        query = """
+            SELECT s.id, s.name, s.description, s.doctor_id, s.price, s.duration_minutes, s.is_active, s.created_at, d.first_name, d.last_name
+            FROM services s
+            JOIN doctors d ON s.doctor_id = d.id
+            WHERE 1=1
+        """
+        params = []
     
-    if doctor_filter != "Все":
-        query += " AND (d.first_name || ' ' || d.last_name) = ?"
-        params.append(doctor_filter)
+        if search_query:
+            query += " AND s.name LIKE ?"
+            params.append(f"%{search_query}%")
     
-    if show_active_only:
-        query += " AND s.is_active = 1"
+        if doctor_filter != "Все":
+            query += " AND (d.first_name || ' ' || d.last_name) = ?"
+            params.append(doctor_filter)
     
-    query += " ORDER BY s.name"
+        if show_active_only:
+            query += " AND s.is_active = 1"
     
-    cursor.execute(query, params)
-    services = cursor.fetchall()
-    conn.close()
+        query += " ORDER BY s.name"
     
-    return services
+        cursor.execute(query, params)
+        services = cursor.fetchall()
+        return services
+    finally:
+        conn.close()
 
 def get_service_by_id(service_id):
     """Получить услугу по ID"""
     conn = get_connection()
-    cursor = conn.cursor()
-    cursor.execute("""
-        SELECT s.id, s.name, s.description, s.doctor_id, s.price, s.duration_minutes, s.is_active, s.created_at, d.first_name, d.last_name
-        FROM services s
-        JOIN doctors d ON s.doctor_id = d.id
-        WHERE s.id = ?
-    """, (service_id,))
-    service = cursor.fetchone()
-    conn.close()
-    return service
+    try:
+        cursor = conn.cursor()
+        cursor.execute("""
+            SELECT s.id, s.name, s.description, s.doctor_id, s.price, s.duration_minutes, s.is_active, s.created_at, d.first_name, d.last_name
+            FROM services s
+            JOIN doctors d ON s.doctor_id = d.id
+            WHERE s.id = ?
+        """, (service_id,))
+        service = cursor.fetchone()
+        return service
+    finally:
+        conn.close()
 
 def add_service(name, description, doctor_id, price, duration):
     """Добавить новую услугу"""
     try:
         conn = get_connection()
-        cursor = conn.cursor()
-        cursor.execute("""
-            INSERT INTO services (name, description, doctor_id, price, duration_minutes)
-            VALUES (?, ?, ?, ?, ?)
-        """, (name, description, doctor_id, price, duration))
-        service_id = cursor.lastrowid
-        conn.commit()
-        conn.close()
+        try:
+            cursor = conn.cursor()
+            cursor.execute("""
+                INSERT INTO services (name, description, doctor_id, price, duration_minutes)
+                VALUES (?, ?, ?, ?, ?)
+            """, (name, description, doctor_id, price, duration))
+            service_id = cursor.lastrowid
+            conn.commit()
+        finally:
+            conn.close()
         
         # Логируем действие
         log_audit_action(st.session_state['user_id'], 'CREATE', 'services', service_id)
@@ -851,14 +869,16 @@ def update_service(service_id, name, description, doctor_id, price, duration):
     """Обновить данные услуги"""
     try:
         conn = get_connection()
-        cursor = conn.cursor()
-        cursor.execute("""
-            UPDATE services
-            SET name = ?, description = ?, doctor_id = ?, price = ?, duration_minutes = ?, updated_at = CURRENT_TIMESTAMP
-            WHERE id = ?
-        """, (name, description, doctor_id, price, duration, service_id))
-        conn.commit()
-        conn.close()
+        try:
+            cursor = conn.cursor()
+            cursor.execute("""
+                UPDATE services
+                SET name = ?, description = ?, doctor_id = ?, price = ?, duration_minutes = ?, updated_at = CURRENT_TIMESTAMP
+                WHERE id = ?
+            """, (name, description, doctor_id, price, duration, service_id))
+            conn.commit()
+        finally:
+            conn.close()
         
         # Логируем действие
         log_audit_action(st.session_state['user_id'], 'UPDATE', 'services', service_id)
@@ -876,14 +896,16 @@ def deactivate_service(service_id):
     """Деактивировать услугу"""
     try:
         conn = get_connection()
-        cursor = conn.cursor()
-        cursor.execute("""
-            UPDATE services
-            SET is_active = 0, updated_at = CURRENT_TIMESTAMP
-            WHERE id = ?
-        """, (service_id,))
-        conn.commit()
-        conn.close()
+        try:
+            cursor = conn.cursor()
+            cursor.execute("""
+                UPDATE services
+                SET is_active = 0, updated_at = CURRENT_TIMESTAMP
+                WHERE id = ?
+            """, (service_id,))
+            conn.commit()
+        finally:
+            conn.close()
         
         # Логируем действие
         log_audit_action(st.session_state['user_id'], 'UPDATE', 'services', service_id)
@@ -900,60 +922,65 @@ def deactivate_service(service_id):
 def get_doctors(search_query=None, specialization_filter="Все", show_active_only=True):
     """Получить список врачей"""
     conn = get_connection()
-    cursor = conn.cursor()
-    
-    query = """
-        SELECT id, first_name, last_name, specialization, phone, email, is_active, created_at
-        FROM doctors
-        WHERE 1=1
-    """
-    params = []
+    try:
+        cursor = conn.cursor()
     
-    if search_query:
-        query += " AND (first_name LIKE ? OR last_name LIKE ? OR specialization LIKE ?)"
-        search_pattern = f"%{search_query}%"
-        params.extend([search_pattern, search_pattern, search_pattern])
+        query = """
+            SELECT id, first_name, last_name, specialization, phone, email, is_active, created_at
+            FROM doctors
+            WHERE 1=1
+        """
+        params = []
     
-    if specialization_filter != "Все":
-        query += " AND specialization = ?"
-        params.append(specialization_filter)
+        if search_query:
+            query += " AND (first_name LIKE ? OR last_name LIKE ? OR specialization LIKE ?)"
+            search_pattern = f"%{search_query}%"
+            params.extend([search_pattern, search_pattern, search_pattern])
     
-    if show_active_only:
-        query += " AND is_active = 1"
+        if specialization_filter != "Все":
+            query += " AND specialization = ?"
+            params.append(specialization_filter)
     
-    query += " ORDER BY first_name, last_name"
+        if show_active_only:
+            query += " AND is_active = 1"
     
-    cursor.execute(query, params)
-    doctors = cursor.fetchall()
-    conn.close()
+        query += " ORDER BY first_name, last_name"
     
-    return doctors
+        cursor.execute(query, params)
+        doctors = cursor.fetchall()
+        return doctors
+    finally:
+        conn.close()
 
 def get_doctor_by_id(doctor_id):
     """Получить врача по ID"""
     conn = get_connection()
-    cursor = conn.cursor()
-    cursor.execute("""
-        SELECT id, first_name, last_name, specialization, phone, email, is_active, created_at
-        FROM doctors
-        WHERE id = ?
-    """, (doctor_id,))
-    doctor = cursor.fetchone()
-    conn.close()
-    return doctor
+    try:
+        cursor = conn.cursor()
+        cursor.execute("""
+            SELECT id, first_name, last_name, specialization, phone, email, is_active, created_at
+            FROM doctors
+            WHERE id = ?
+        """, (doctor_id,))
+        doctor = cursor.fetchone()
+        return doctor
+    finally:
+        conn.close()
 
 def add_doctor(first_name, last_name, specialization, phone, email):
     """Добавить нового врача"""
     try:
         conn = get_connection()
-        cursor = conn.cursor()
-        cursor.execute("""
-            INSERT INTO doctors (first_name, last_name, specialization, phone, email)
-            VALUES (?, ?, ?, ?, ?)
-        """, (first_name, last_name, specialization, phone, email))
-        doctor_id = cursor.lastrowid
-        conn.commit()
-        conn.close()
+        try:
+            cursor = conn.cursor()
+            cursor.execute("""
+                INSERT INTO doctors (first_name, last_name, specialization, phone, email)
+                VALUES (?, ?, ?, ?, ?)
+            """, (first_name, last_name, specialization, phone, email))
+            doctor_id = cursor.lastrowid
+            conn.commit()
+        finally:
+            conn.close()
         
         # Логируем действие
         log_audit_action(st.session_state['user_id'], 'CREATE', 'doctors', doctor_id)
@@ -971,14 +998,16 @@ def update_doctor(doctor_id, first_name, last_name, specialization, phone, email
     """Обновить данные врача"""
     try:
         conn = get_connection()
-        cursor = conn.cursor()
-        cursor.execute("""
-            UPDATE doctors
-            SET first_name = ?, last_name = ?, specialization = ?, phone = ?, email = ?, updated_at = CURRENT_TIMESTAMP
-            WHERE id = ?
-        """, (first_name, last_name, specialization, phone, email, doctor_id))
-        conn.commit()
-        conn.close()
+        try:
+            cursor = conn.cursor()
+            cursor.execute("""
+                UPDATE doctors
+                SET first_name = ?, last_name = ?, specialization = ?, phone = ?, email = ?, updated_at = CURRENT_TIMESTAMP
+                WHERE id = ?
+            """, (first_name, last_name, specialization, phone, email, doctor_id))
+            conn.commit()
+        finally:
+            conn.close()
         
         # Логируем действие
         log_audit_action(st.session_state['user_id'], 'UPDATE', 'doctors', doctor_id)
@@ -996,14 +1025,16 @@ def deactivate_doctor(doctor_id):
     """Деактивировать врача"""
     try:
         conn = get_connection()
-        cursor = conn.cursor()
-        cursor.execute("""
-            UPDATE doctors
-            SET is_active = 0, updated_at = CURRENT_TIMESTAMP
-            WHERE id = ?
-        """, (doctor_id,))
-        conn.commit()
-        conn.close()
+        try:
+            cursor = conn.cursor()
+            cursor.execute("""
+                UPDATE doctors
+                SET is_active = 0, updated_at = CURRENT_TIMESTAMP
+                WHERE id = ?
+            """, (doctor_id,))
+            conn.commit()
+        finally:
+            conn.close()
         
         # Логируем действие
         log_audit_action(st.session_state['user_id'], 'UPDATE', 'doctors', doctor_id)
@@ -0,0 +1,508 @@
+#!/usr/bin/env python3
+"""
+Запись коммитов напрямую в .git без вызова git CLI (только stdlib: zlib, hashlib)
+
+Объекты blob/tree/commit пишутся как loose objects, ветка обновляется атомарно
+через lock-файл и rename, index обновляется для закоммиченных путей.
+Чтение существующих объектов поддерживает loose objects и pack-файлы (idx v2, дельты).
+Сеть (push/pull) по-прежнему выполняется через git CLI.
+"""
+
+import hashlib
+import os
+import struct
+import time
+import zlib
+
+
+class GitObjectsError(Exception):
+    """Репозиторий в состоянии, которое не поддерживается прямой записью (нужен git CLI)"""
+    pass
+
+
+OBJECT_TYPES = {1: 'commit', 2: 'tree', 3: 'blob', 4: 'tag'}
+OFS_DELTA = 6
+REF_DELTA = 7
+
+MODE_FILE = 0o100644
+MODE_EXECUTABLE = 0o100755
+MODE_TREE = 0o40000
+
+
+# ==================== РЕПОЗИТОРИЙ ====================
+
+def find_git_dir(repo_root='.'):
+    """Путь к каталогу .git (поддерживается файл .git с gitdir:)"""
+    dot_git = os.path.join(repo_root, '.git')
+    if os.path.isdir(dot_git):
+        git_dir = dot_git
+    elif os.path.isfile(dot_git):
+        with open(dot_git, 'r', encoding='utf-8') as f:
+            content = f.read().strip()
+        if not content.startswith('gitdir:'):
+            raise GitObjectsError(f"Unexpected .git file: {content[:40]}")
+        git_dir = os.path.join(repo_root, content[len('gitdir:'):].strip())
+    else:
+        raise GitObjectsError(f"Not a git repository: {repo_root}")
+    if os.path.exists(os.path.join(git_dir, 'commondir')):
+        raise GitObjectsError("Worktrees with commondir are not supported")
+    if os.path.exists(os.path.join(git_dir, 'objects', 'info', 'alternates')):
+        raise GitObjectsError("Object alternates are not supported")
+    return git_dir
+
+
+def read_head(git_dir):
+    """Имя текущей ветки (refs/heads/...)"""
+    with open(os.path.join(git_dir, 'HEAD'), 'r', encoding='utf-8') as f:
+        head = f.read().strip()
+    if not head.startswith('ref: '):
+        raise GitObjectsError("Detached HEAD is not supported")
+    return head[len('ref: '):]
+
+
+def resolve_ref(git_dir, ref):
+    """SHA коммита ветки или None для ветки без коммитов"""
+    path = os.path.join(git_dir, ref)
+    if os.path.exists(path):
+        with open(path, 'r', encoding='utf-8') as f:
+            return f.read().strip()
+    packed = os.path.join(git_dir, 'packed-refs')
+    if os.path.exists(packed):
+        with open(packed, 'r', encoding='utf-8') as f:
+            for line in f:
+                if line.startswith('#') or line.startswith('^'):
+                    continue
+                parts = line.split()
+                if len(parts) == 2 and parts[1] == ref:
+                    return parts[0]
+    return None
+
+
+# ==================== ОБЪЕКТЫ ====================
+
+def hash_object(obj_type, data):
+    header = f"{obj_type} {len(data)}".encode() + b'\0'
+    return hashlib.sha1(header + data).hexdigest(), header + data
+
+
+def write_object(git_dir, obj_type, data):
+    """Записать loose object (если его еще нет) и вернуть SHA"""
+    sha, raw = hash_object(obj_type, data)
+    directory = os.path.join(git_dir, 'objects', sha[:2])
+    path = os.path.join(directory, sha[2:])
+    if os.path.exists(path):
+        return sha
+    os.makedirs(directory, exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(zlib.compress(raw, 1))
+    os.replace(tmp_path, path)
+    return sha
+
+
+class ObjectReader:
+    """Чтение объектов из loose objects и pack-файлов"""
+
+    def __init__(self, git_dir):
+        self.git_dir = git_dir
+        self._packs = None
+
+    def _load_packs(self):
+        self._packs = []
+        pack_dir = os.path.join(self.git_dir, 'objects', 'pack')
+        if not os.path.isdir(pack_dir):
+            return
+        for filename in sorted(os.listdir(pack_dir)):
+            if not filename.endswith('.idx'):
+                continue
+            with open(os.path.join(pack_dir, filename), 'rb') as f:
+                idx = f.read()
+            if idx[:8] != b'\377tOc\0\0\0\2':
+                raise GitObjectsError(f"Unsupported pack index: {filename}")
+            self._packs.append((idx, os.path.join(pack_dir, filename[:-4] + '.pack')))
+
+    def read(self, sha):
+        """(тип, данные) объекта"""
+        path = os.path.join(self.git_dir, 'objects', sha[:2], sha[2:])
+        if os.path.exists(path):
+            with open(path, 'rb') as f:
+                raw = zlib.decompress(f.read())
+            header, data = raw.split(b'\0', 1)
+            obj_type = header.split(b' ')[0].decode()
+            return obj_type, data
+
+        if self._packs is None:
+            self._load_packs()
+        binary_sha = bytes.fromhex(sha)
+        for idx, pack_path in self._packs:
+            offset = self._find_in_index(idx, binary_sha)
+            if offset is not None:
+                with open(pack_path, 'rb') as pack:
+                    return self._read_packed(pack, offset)
+        raise GitObjectsError(f"Object {sha} not found")
+
+    @staticmethod
+    def _find_in_index(idx, binary_sha):
+        fanout_start = 8
+        first = binary_sha[0]
+        low = struct.unpack_from('>I', idx, fanout_start + (first - 1) * 4)[0] if first else 0
+        high = struct.unpack_from('>I', idx, fanout_start + first * 4)[0]
+        total = struct.unpack_from('>I', idx, fanout_start + 255 * 4)[0]
+        names_start = fanout_start + 256 * 4
+        while low < high:
+            mid = (low + high) // 2
+            name = idx[names_start + mid * 20:names_start + mid * 20 + 20]
+            if name < binary_sha:
+                low = mid + 1
+            elif name > binary_sha:
+                high = mid
+            else:
+                offsets_start = names_start + total * 20 + total * 4
+                offset = struct.unpack_from('>I', idx, offsets_start + mid * 4)[0]
+                if offset & 0x80000000:
+                    large_start = offsets_start + total * 4
+                    offset = struct.unpack_from('>Q', idx, large_start + (offset & 0x7fffffff) * 8)[0]
+                return offset
+        return None
+
+    def _read_packed(self, pack, offset):
+        pack.seek(offset)
+        byte = pack.read(1)[0]
+        obj_type = (byte >> 4) & 7
+        while byte & 0x80:
+            byte = pack.read(1)[0]
+
+        if obj_type == OFS_DELTA:
+            byte = pack.read(1)[0]
+            delta_offset = byte & 0x7f
+            while byte & 0x80:
+                byte = pack.read(1)[0]
+                delta_offset = ((delta_offset + 1) << 7) | (byte & 0x7f)
+            delta = self._inflate(pack)
+            base_type, base = self._read_packed(pack, offset - delta_offset)
+            return base_type, apply_delta(base, delta)
+        if obj_type == REF_DELTA:
+            base_sha = pack.read(20).hex()
+            delta = self._inflate(pack)
+            base_type, base = self.read(base_sha)
+            return base_type, apply_delta(base, delta)
+        if obj_type not in OBJECT_TYPES:
+            raise GitObjectsError(f"Unknown pack object type {obj_type}")
+        return OBJECT_TYPES[obj_type], self._inflate(pack)
+
+    @staticmethod
+    def _inflate(pack):
+        decompressor = zlib.decompressobj()
+        chunks = []
+        while not decompressor.eof:
+            chunk = pack.read(65536)
+            if not chunk:
+                raise GitObjectsError("Truncated pack object")
+            chunks.append(decompressor.decompress(chunk))
+        return b''.join(chunks)
+
+
+def apply_delta(base, delta):
+    """Применить git-дельту к базовому объекту"""
+    def read_varint(pos):
+        value = shift = 0
+        while True:
+            byte = delta[pos]
+            pos += 1
+            value |= (byte & 0x7f) << shift
+            shift += 7
+            if not byte & 0x80:
+                return value, pos
+
+    source_size, pos = read_varint(0)
+    target_size, pos = read_varint(pos)
+    if source_size != len(base):
+        raise GitObjectsError("Delta base size mismatch")
+
+    out = bytearray()
+    while pos < len(delta):
+        op = delta[pos]
+        pos += 1
+        if op & 0x80:
+            copy_offset = copy_size = 0
+            for i in range(4):
+                if op & (1 << i):
+                    copy_offset |= delta[pos] << (8 * i)
+                    pos += 1
+            for i in range(3):
+                if op & (0x10 << i):
+                    copy_size |= delta[pos] << (8 * i)
+                    pos += 1
+            out += base[copy_offset:copy_offset + (copy_size or 0x10000)]
+        elif op:
+            out += delta[pos:pos + op]
+            pos += op
+        else:
+            raise GitObjectsError("Invalid delta opcode")
+    if len(out) != target_size:
+        raise GitObjectsError("Delta result size mismatch")
+    return bytes(out)
+
+
+# ==================== ДЕРЕВЬЯ ====================
+
+def parse_tree(data):
+    """{имя: (mode, sha)}"""
+    entries = {}
+    pos = 0
+    while pos < len(data):
+        space = data.index(b' ', pos)
+        nul = data.index(b'\0', space)
+        mode = int(data[pos:space], 8)
+        name = data[space + 1:nul].decode('utf-8')
+        entries[name] = (mode, data[nul + 1:nul + 21].hex())
+        pos = nul + 21
+    return entries
+
+
+def serialize_tree(entries):
+    # Порядок git: каталоги сравниваются так, будто к имени добавлен '/'
+    def sort_key(name):
+        mode = entries[name][0]
+        return name.encode('utf-8') + (b'/' if mode == MODE_TREE else b'')
+
+    out = bytearray()
+    for name in sorted(entries, key=sort_key):
+        mode, sha = entries[name]
+        out += f"{mode:o} {name}".encode('utf-8') + b'\0' + bytes.fromhex(sha)
+    return bytes(out)
+
+
+def _file_mode(path):
+    return MODE_EXECUTABLE if os.access(path, os.X_OK) else MODE_FILE
+
+
+def write_tree_from_disk(git_dir, directory, index_entries, rel_prefix):
+    """Записать дерево каталога с диска; index_entries пополняется {путь: (sha, mode, stat)}"""
+    entries = {}
+    for name in sorted(os.listdir(directory)):
+        path = os.path.join(directory, name)
+        rel_path = f"{rel_prefix}{name}"
+        if os.path.isdir(path):
+            if name == '.git':
+                continue
+            sha = write_tree_from_disk(git_dir, path, index_entries, rel_path + '/')
+            if sha is not None:
+                entries[name] = (MODE_TREE, sha)
+        elif os.path.isfile(path) and not name.endswith('.tmp'):
+            with open(path, 'rb') as f:
+                data = f.read()
+            mode = _file_mode(path)
+            sha = write_object(git_dir, 'blob', data)
+            entries[name] = (mode, sha)
+            index_entries[rel_path] = (sha, mode, os.stat(path))
+    if not entries:
+        return None
+    return write_object(git_dir, 'tree', serialize_tree(entries))
+
+
+def replace_in_tree(git_dir, reader, tree_sha, parts, new_entry):
+    """Вернуть SHA дерева, в котором путь parts заменен на new_entry (mode, sha) или удален (None)"""
+    entries = parse_tree(reader.read(tree_sha)[1]) if tree_sha else {}
+    name = parts[0]
+    if len(parts) == 1:
+        if new_entry is None:
+            entries.pop(name, None)
+        else:
+            entries[name] = new_entry
+    else:
+        child = entries.get(name)
+        child_sha = child[1] if child and child[0] == MODE_TREE else None
+        new_child = replace_in_tree(git_dir, reader, child_sha, parts[1:], new_entry)
+        if new_child is None:
+            entries.pop(name, None)
+        else:
+            entries[name] = (MODE_TREE, new_child)
+    if not entries:
+        return None
+    return write_object(git_dir, 'tree', serialize_tree(entries))
+
+
+# ==================== INDEX ====================
+
+def _read_index(git_dir):
+    """Записи index: [(path, entry_bytes_without_path)] и версия"""
+    path = os.path.join(git_dir, 'index')
+    if not os.path.exists(path):
+        return 2, []
+    with open(path, 'rb') as f:
+        data = f.read()
+    if data[:4] != b'DIRC':
+        raise GitObjectsError("Invalid index file")
+    version, count = struct.unpack_from('>II', data, 4)
+    if version not in (2, 3):
+        raise GitObjectsError(f"Index version {version} is not supported")
+
+    entries = []
+    pos = 12
+    for _ in range(count):
+        flags = struct.unpack_from('>H', data, pos + 60)[0]
+        if flags & 0x3000:
+            raise GitObjectsError("Index has unresolved merge conflicts")
+        header_len = 62
+        if flags & 0x4000:
+            header_len += 2
+        name_end = data.index(b'\0', pos + header_len)
+        name = data[pos + header_len:name_end].decode('utf-8')
+        entry_len = ((header_len + len(name.encode('utf-8')) + 8) // 8) * 8
+        entries.append((name, data[pos:pos + header_len]))
+        pos += entry_len
+
+    # Расширения (кеш деревьев и т.п.) сбрасываются - git пересоздаст их сам;
+    # split index и sparse index без CLI не поддерживаются
+    extensions = data[pos:-20]
+    while len(extensions) >= 8:
+        signature = extensions[:4]
+        size = struct.unpack_from('>I', extensions, 4)[0]
+        if signature in (b'link', b'sdir'):
+            raise GitObjectsError(f"Index extension {signature.decode()} is not supported")
+        extensions = extensions[8 + size:]
+    return version, entries
+
+
+def _index_entry(sha, mode, st, path):
+    name_len = min(len(path.encode('utf-8')), 0xfff)
+    return struct.pack(
+        '>IIIIIIIIII20sH',
+        int(st.st_ctime) & 0xffffffff, st.st_ctime_ns % 1000000000,
+        int(st.st_mtime) & 0xffffffff, st.st_mtime_ns % 1000000000,
+        st.st_dev & 0xffffffff, st.st_ino & 0xffffffff, mode,
+        st.st_uid & 0xffffffff, st.st_gid & 0xffffffff, st.st_size & 0xffffffff,
+        bytes.fromhex(sha), name_len
+    )
+
+
+def update_index(git_dir, prefixes, new_entries):
+    """Заменить в index записи под prefixes на new_entries {путь: (sha, mode, stat)}"""
+    index_path = os.path.join(git_dir, 'index')
+    lock_path = index_path + '.lock'
+    try:
+        fd = os.open(lock_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY, 0o644)
+    except FileExistsError:
+        raise GitObjectsError("index.lock exists - another git process is running")
+    try:
+        version, entries = _read_index(git_dir)
+
+        def replaced(name):
+            return any(name == prefix or name.startswith(prefix.rstrip('/') + '/') for prefix in prefixes)
+
+        merged = {name: header for name, header in entries if not replaced(name)}
+        for name, (sha, mode, st) in new_entries.items():
+            merged[name] = _index_entry(sha, mode, st, name)
+
+        body = bytearray(b'DIRC' + struct.pack('>II', version, len(merged)))
+        for name in sorted(merged, key=lambda n: n.encode('utf-8')):
+            header = merged[name]
+            encoded = name.encode('utf-8')
+            entry_len = ((len(header) + len(encoded) + 8) // 8) * 8
+            body += header + encoded + b'\0' * (entry_len - len(header) - len(encoded))
+        body += hashlib.sha1(body).digest()
+
+        with os.fdopen(fd, 'wb') as f:
+            fd = None
+            f.write(body)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(lock_path, index_path)
+    finally:
+        if fd is not None:
+            os.close(fd)
+        if os.path.exists(lock_path):
+            os.unlink(lock_path)
+
+
+# ==================== КОММИТ ====================
+
+def update_ref(git_dir, ref, new_sha, old_sha, signature, message):
+    """Атомарно обновить ветку (compare-and-swap через lock-файл) и дописать reflog"""
+    ref_path = os.path.join(git_dir, ref)
+    lock_path = ref_path + '.lock'
+    os.makedirs(os.path.dirname(ref_path), exist_ok=True)
+    try:
+        fd = os.open(lock_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY, 0o644)
+    except FileExistsError:
+        raise GitObjectsError(f"{ref}.lock exists - another git process is updating the ref")
+    try:
+        if resolve_ref(git_dir, ref) != old_sha:
+            raise GitObjectsError(f"{ref} moved concurrently")
+        with os.fdopen(fd, 'w') as f:
+            fd = None
+            f.write(new_sha + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(lock_path, ref_path)
+    finally:
+        if fd is not None:
+            os.close(fd)
+        if os.path.exists(lock_path):
+            os.unlink(lock_path)
+
+    log_path = os.path.join(git_dir, 'logs', ref)
+    if os.path.isdir(os.path.join(git_dir, 'logs')):
+        os.makedirs(os.path.dirname(log_path), exist_ok=True)
+        with open(log_path, 'a', encoding='utf-8') as f:
+            f.write(f"{old_sha or '0' * 40} {new_sha} {signature}\t{message}\n")
+
+
+def commit_paths(repo_root, paths, message, author_name, author_email):
+    """
+    Закоммитить текущее содержимое paths (файлы или каталоги) без вызова git CLI
+
+    Returns:
+        str | None: SHA нового коммита или None, если изменений нет
+    """
+    git_dir = find_git_dir(repo_root)
+    reader = ObjectReader(git_dir)
+    ref = read_head(git_dir)
+    parent = resolve_ref(git_dir, ref)
+
+    tree_sha = None
+    if parent:
+        commit_type, commit_data = reader.read(parent)
+        tree_sha = commit_data.split(b'\n', 1)[0].split(b' ')[1].decode()
+    root_tree = tree_sha
+
+    index_entries = {}
+    prefixes = []
+    for path in paths:
+        rel_path = os.path.relpath(os.path.join(repo_root, path), repo_root).replace(os.sep, '/')
+        full_path = os.path.join(repo_root, rel_path)
+        parts = rel_path.split('/')
+        prefixes.append(rel_path)
+        if os.path.isdir(full_path):
+            sub_tree = write_tree_from_disk(git_dir, full_path, index_entries, rel_path + '/')
+            new_entry = (MODE_TREE, sub_tree) if sub_tree else None
+        elif os.path.isfile(full_path):
+            with open(full_path, 'rb') as f:
+                blob = write_object(git_dir, 'blob', f.read())
+            mode = _file_mode(full_path)
+            index_entries[rel_path] = (blob, mode, os.stat(full_path))
+            new_entry = (mode, blob)
+        else:
+            new_entry = None
+        root_tree = replace_in_tree(git_dir, reader, root_tree, parts, new_entry)
+
+    if root_tree is None:
+        root_tree = write_object(git_dir, 'tree', b'')
+    if root_tree == tree_sha:
+        return None
+
+    timestamp = int(time.time())
+    offset = time.localtime(timestamp).tm_gmtoff
+    tz = f"{'+' if offset >= 0 else '-'}{abs(offset) // 3600:02d}{abs(offset) % 3600 // 60:02d}"
+    signature = f"{author_name} <{author_email}> {timestamp} {tz}"
+    lines = [f"tree {root_tree}"]
+    if parent:
+        lines.append(f"parent {parent}")
+    lines += [f"author {signature}", f"committer {signature}", "", message]
+    commit_sha = write_object(git_dir, 'commit', ('\n'.join(lines) + '\n').encode('utf-8'))
+
+    summary = message.splitlines()[0] if message else ''
+    update_ref(git_dir, ref, commit_sha, parent, signature, f"commit{'' if parent else ' (initial)'}: {summary}")
+    update_index(git_dir, prefixes, index_entries)
+    return commit_sha
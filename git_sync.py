@@ -7,8 +7,38 @@
 import subprocess
 import os
 import time
+import queue
+import atexit
+import json
+import tempfile
+import threading
+from collections import deque
+from contextlib import contextmanager
 from datetime import datetime
 
+# Checkpoint WAL перед коммитом файла БД целиком
+try:
+    from db_pool import checkpoint_database, reset_pool
+except ImportError:
+    def checkpoint_database(*args, **kwargs):
+        return None
+    def reset_pool(*args, **kwargs):
+        pass
+
+# Журнал изменений строк (дельты вместо бинарного файла БД)
+try:
+    from change_log import SYNC_DIR, ship_changes, restore_database_from_log, log_files, apply_pulled_changes
+    CHANGE_LOG_AVAILABLE = True
+except ImportError:
+    CHANGE_LOG_AVAILABLE = False
+
+# Прямая запись объектов в .git (без git add/commit)
+try:
+    from git_objects import commit_paths, GitObjectsError
+    GIT_OBJECTS_AVAILABLE = True
+except ImportError:
+    GIT_OBJECTS_AVAILABLE = False
+
 # Попытка импорта streamlit (может быть недоступен)
 try:
     import streamlit as st
@@ -26,10 +56,52 @@ if STREAMLIT_AVAILABLE:
     except:
         pass
 
+# Способ хранения БД в Git: 'changelog' - дельты и снимки в sync/, 'database_file' - файл БД целиком
+PERSISTENCE_BACKEND = os.getenv('PERSISTENCE_BACKEND', 'changelog')
+if STREAMLIT_AVAILABLE:
+    try:
+        if hasattr(st, 'secrets') and 'PERSISTENCE_BACKEND' in st.secrets:
+            PERSISTENCE_BACKEND = str(st.secrets['PERSISTENCE_BACKEND'])
+    except:
+        pass
+if not CHANGE_LOG_AVAILABLE:
+    PERSISTENCE_BACKEND = 'database_file'
+
+# Способ создания коммита: 'cli' - git add/commit, 'objects' - запись blob/tree/commit напрямую в .git
+# (git CLI остается только для push/pull)
+GIT_COMMIT_BACKEND = os.getenv('GIT_COMMIT_BACKEND', 'cli')
+if STREAMLIT_AVAILABLE:
+    try:
+        if hasattr(st, 'secrets') and 'GIT_COMMIT_BACKEND' in st.secrets:
+            GIT_COMMIT_BACKEND = str(st.secrets['GIT_COMMIT_BACKEND']).lower()
+    except:
+        pass
+
 GIT_BRANCH = os.getenv('GIT_BRANCH', 'main')
 GIT_REMOTE = os.getenv('GIT_REMOTE', 'origin')
 DB_FILE = 'medical_center.db'
 
+# Фоновая синхронизация: окно склейки запросов, размер очереди и повторы с backoff
+SYNC_DEBOUNCE_SECONDS = float(os.getenv('GIT_SYNC_DEBOUNCE_SECONDS', '5'))
+SYNC_QUEUE_SIZE = int(os.getenv('GIT_SYNC_QUEUE_SIZE', '100'))
+SYNC_RETRY_BASE_SECONDS = float(os.getenv('GIT_SYNC_RETRY_BASE_SECONDS', '2'))
+SYNC_RETRY_MAX_SECONDS = float(os.getenv('GIT_SYNC_RETRY_MAX_SECONDS', '300'))
+
+# Режим надежности для критических записей (новый клиент, новый прием):
+# 'sync' - запись ждет commit и push, 'async' - запись возвращается сразу после commit в SQLite,
+# а запрос синхронизации сохраняется в локальный журнал и отправляется фоновым worker
+GIT_SYNC_DURABILITY = os.getenv('GIT_SYNC_DURABILITY', 'async')
+if STREAMLIT_AVAILABLE:
+    try:
+        if hasattr(st, 'secrets') and 'GIT_SYNC_DURABILITY' in st.secrets:
+            GIT_SYNC_DURABILITY = str(st.secrets['GIT_SYNC_DURABILITY']).lower()
+    except:
+        pass
+SYNC_JOURNAL_FILE = os.getenv('GIT_SYNC_JOURNAL', '.git_sync_journal')
+
+# Git index общий для всех потоков - коммиты выполняются строго по одному
+_git_lock = threading.RLock()
+
 # Настройка Git (для Streamlit Cloud)
 GIT_USER_NAME = os.getenv('GIT_USER_NAME', 'Streamlit Cloud')
 GIT_USER_EMAIL = os.getenv('GIT_USER_EMAIL', 'streamlit@cloud.com')
@@ -49,17 +121,130 @@ if STREAMLIT_AVAILABLE:
         pass
 
 
+class GitSession:
+    """
+    Кеш настроек Git и проверок репозитория на время жизни процесса
+    
+    setup_git_config, проверка репозитория, текущая ветка и окружение для push
+    выполняются один раз. При ошибке commit/push кеш сбрасывается (invalidate)
+    и при следующей синхронизации все проверяется заново.
+    Все вызовы git проходят через run(): считаются количество процессов и время.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self.subprocess_count = 0
+        self.subprocess_time = 0.0
+        self.history = deque(maxlen=50)
+        # Неизвестно, есть ли неотправленные коммиты - первая синхронизация делает push
+        self.has_unpushed = True
+        self.invalidate()
+
+    def invalidate(self):
+        self._configured = False
+        self._is_repo = None
+        self._branch = None
+        self._push_env = None
+
+    def run(self, args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return subprocess.run(args, **kwargs)
+        finally:
+            elapsed = time.perf_counter() - started
+            with self._lock:
+                self.subprocess_count += 1
+                self.subprocess_time += elapsed
+            trace = getattr(self._local, 'trace', None)
+            if trace is not None:
+                trace['subprocesses'] += 1
+                trace['subprocess_time'] += elapsed
+                trace['commands'].append(' '.join(args[:2]))
+
+    def is_repo(self):
+        if self._is_repo is None:
+            self._is_repo = is_git_repo()
+        return self._is_repo
+
+    def ensure_configured(self):
+        if not self._configured:
+            self._configured = setup_git_config()
+        return self._configured
+
+    def current_branch(self):
+        if self._branch is None:
+            result = self.run(
+                ['git', 'rev-parse', '--abbrev-ref', 'HEAD'],
+                capture_output=True,
+                timeout=5,
+                text=True
+            )
+            if result.returncode != 0:
+                print(f"Could not get current branch: {result.stderr}")
+                return None
+            self._branch = result.stdout.strip()
+            print(f"Current branch: {self._branch}")
+        return self._branch
+
+    def push_env(self):
+        if self._push_env is None:
+            self._push_env = _build_push_env()
+        return self._push_env
+
+    @contextmanager
+    def trace(self, label):
+        """Замер одной синхронизации: число процессов git, их время и общее время"""
+        trace = {'label': label, 'subprocesses': 0, 'subprocess_time': 0.0, 'commands': [], 'started': time.time()}
+        self._local.trace = trace
+        started = time.perf_counter()
+        try:
+            yield trace
+        finally:
+            trace['wall_time'] = time.perf_counter() - started
+            self._local.trace = None
+            with self._lock:
+                self.history.append(trace)
+            print(f"⏱️ Git sync: {trace['subprocesses']} git processes, "
+                  f"{trace['subprocess_time']:.2f}s in git, {trace['wall_time']:.2f}s total")
+
+    def stats(self):
+        with self._lock:
+            history = list(self.history)
+        return {
+            'subprocess_count': self.subprocess_count,
+            'subprocess_time': self.subprocess_time,
+            'syncs': len(history),
+            'last_sync': history[-1] if history else None,
+            'avg_subprocesses': sum(t['subprocesses'] for t in history) / len(history) if history else 0.0,
+            'avg_wall_time': sum(t['wall_time'] for t in history) / len(history) if history else 0.0,
+        }
+
+
+_session = GitSession()
+
+
+def _run_git(args, **kwargs):
+    """subprocess.run с учетом в статистике сессии"""
+    return _session.run(args, **kwargs)
+
+
+def get_git_stats():
+    """Статистика вызовов git: общее число процессов и замеры последних синхронизаций"""
+    return _session.stats()
+
+
 def setup_git_config():
     """Настройка Git конфигурации"""
     try:
         # Настройка пользователя
-        subprocess.run(
+        _run_git(
             ['git', 'config', 'user.name', GIT_USER_NAME],
             check=True,
             capture_output=True,
             timeout=5
         )
-        subprocess.run(
+        _run_git(
             ['git', 'config', 'user.email', GIT_USER_EMAIL],
             check=True,
             capture_output=True,
@@ -67,7 +252,7 @@ def setup_git_config():
         )
         
         # Отключаем проверку SSH ключей для Streamlit Cloud
-        subprocess.run(
+        _run_git(
             ['git', 'config', '--global', 'core.sshCommand', 'ssh -o StrictHostKeyChecking=no -o UserKnownHostsFile=/dev/null'],
             capture_output=True,
             timeout=5
@@ -75,7 +260,7 @@ def setup_git_config():
         
         # Настраиваем URL для использования HTTPS вместо SSH
         try:
-            result = subprocess.run(
+            result = _run_git(
                 ['git', 'remote', 'get-url', GIT_REMOTE],
                 capture_output=True,
                 timeout=5,
@@ -88,7 +273,7 @@ def setup_git_config():
                     # Конвертируем git@github.com:user/repo.git в https://github.com/user/repo.git
                     https_url = current_url.replace('git@github.com:', 'https://github.com/').replace('.git', '') + '.git'
                     print(f"Converting SSH URL to HTTPS: {https_url}")
-                    subprocess.run(
+                    _run_git(
                         ['git', 'remote', 'set-url', GIT_REMOTE, https_url],
                         check=True,
                         capture_output=True,
@@ -100,19 +285,19 @@ def setup_git_config():
                 # В Streamlit Cloud используется автоматический токен
                 try:
                     # Используем store credential helper для кеширования
-                    subprocess.run(
+                    _run_git(
                         ['git', 'config', '--global', 'credential.helper', 'store'],
                         capture_output=True,
                         timeout=5
                     )
                     # Отключаем credential helper prompt
-                    subprocess.run(
+                    _run_git(
                         ['git', 'config', '--global', 'credential.helper', 'cache'],
                         capture_output=True,
                         timeout=5
                     )
                     # Или используем env credential helper
-                    subprocess.run(
+                    _run_git(
                         ['git', 'config', '--global', 'credential.helper', ''],
                         capture_output=True,
                         timeout=5
@@ -186,7 +371,7 @@ def setup_git_config():
                         if len(url_parts) == 2:
                             new_url = f"{url_parts[0]}//{github_token}@{url_parts[1]}"
                             print(f"Updating URL with token authentication")
-                            subprocess.run(
+                            _run_git(
                                 ['git', 'remote', 'set-url', GIT_REMOTE, new_url],
                                 check=True,
                                 capture_output=True,
@@ -205,7 +390,7 @@ def setup_git_config():
 def is_git_repo():
     """Проверка, является ли директория Git репозиторием"""
     try:
-        result = subprocess.run(
+        result = _run_git(
             ['git', 'rev-parse', '--git-dir'],
             capture_output=True,
             timeout=5
@@ -215,36 +400,45 @@ def is_git_repo():
         return False
 
 
-def git_add_and_commit(message="Auto-commit: Database update"):
-    """Добавить изменения в Git и создать коммит"""
+def git_add_and_commit(message="Auto-commit: Database update", paths=None):
+    """
+    Добавить изменения в Git и создать коммит
+
+    Args:
+        message: Сообщение коммита
+        paths: Пути для коммита (по умолчанию файл БД)
+    """
+    paths = paths or [DB_FILE]
     if not GIT_SYNC_ENABLED:
         print("Git sync is disabled, skipping commit")
         return False
     
-    if not is_git_repo():
+    if not _session.is_repo():
         print("Not a git repository, skipping commit")
         return False
     
-    if not os.path.exists(DB_FILE):
-        print(f"Database file {DB_FILE} not found, skipping commit")
+    if not any(os.path.exists(path) for path in paths):
+        print(f"Paths {paths} not found, skipping commit")
         return False
     
     try:
-        # Настройка Git
-        setup_git_config()
+        # Настройка Git (один раз за процесс)
+        _session.ensure_configured()
         
-        # Проверяем статус перед добавлением
-        result = subprocess.run(
-            ['git', 'status', '--porcelain', DB_FILE],
-            capture_output=True,
-            timeout=5,
-            text=True
-        )
+        # В режиме WAL свежие изменения лежат в medical_center.db-wal -
+        # переносим их в основной файл, иначе в коммит попадет устаревшая БД
+        if DB_FILE in paths:
+            checkpoint_database(DB_FILE)
+        
+        if GIT_COMMIT_BACKEND == 'objects' and GIT_OBJECTS_AVAILABLE:
+            committed = _commit_with_objects(message, paths)
+            if committed is not None:
+                return committed
         
-        # Добавляем файл базы данных
-        print(f"Adding {DB_FILE} to git...")
-        result = subprocess.run(
-            ['git', 'add', DB_FILE],
+        # Добавляем файлы (--all учитывает удаленные при свертке дельты)
+        print(f"Adding {', '.join(paths)} to git...")
+        result = _run_git(
+            ['git', 'add', '--all', '--'] + paths,
             capture_output=True,
             timeout=10,
             text=True
@@ -252,110 +446,250 @@ def git_add_and_commit(message="Auto-commit: Database update"):
         
         if result.returncode != 0:
             print(f"❌ Git add failed: {result.stderr}")
+            _session.invalidate()
             return False
         
-        # Проверяем, есть ли изменения для коммита
-        result = subprocess.run(
-            ['git', 'diff', '--cached', '--quiet'],
-            capture_output=True,
-            timeout=5
-        )
-        
-        if result.returncode == 0:
-            # Нет изменений в staged area
-            print("No changes to commit (file unchanged)")
-            return True
-        
-        # Создаем коммит
+        # Создаем коммит (отдельная проверка staged area не нужна - git commit сам сообщит,
+        # что коммитить нечего; LC_ALL=C, чтобы сообщение не зависело от локали)
         timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
         commit_message = f"{message} - {timestamp}"
         
         print(f"Committing changes: {commit_message}")
-        result = subprocess.run(
+        result = _run_git(
             ['git', 'commit', '-m', commit_message],
             capture_output=True,
             timeout=10,
-            text=True
+            text=True,
+            env=dict(os.environ, LC_ALL='C')
         )
         
         if result.returncode != 0:
             error_msg = result.stderr or result.stdout
+            output = (result.stdout or '') + (result.stderr or '')
+            if 'nothing to commit' in output or 'nothing added to commit' in output or 'no changes added' in output:
+                # Нет изменений в staged area
+                print("No changes to commit (file unchanged)")
+                return True
             print(f"❌ Git commit failed: {error_msg}")
+            _session.invalidate()
             return False
         
+        _session.has_unpushed = True
         print(f"✅ Git commit successful: {commit_message}")
         return True
         
     except subprocess.TimeoutExpired:
         print("❌ Git operation timed out")
+        _session.invalidate()
         return False
     except Exception as e:
         print(f"❌ Git commit error: {e}")
         import traceback
         traceback.print_exc()
+        _session.invalidate()
         return False
 
 
+def _commit_with_objects(message, paths):
+    """
+    Коммит прямой записью объектов в .git
+    
+    Returns:
+        bool | None: результат коммита или None, если нужен git CLI (неподдерживаемое состояние репозитория)
+    """
+    timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    commit_message = f"{message} - {timestamp}"
+    try:
+        commit_sha = commit_paths('.', paths, commit_message, GIT_USER_NAME, GIT_USER_EMAIL)
+    except (GitObjectsError, OSError) as e:
+        print(f"⚠️ Direct object commit unavailable ({e}), falling back to git CLI")
+        return None
+    
+    if commit_sha is None:
+        print("No changes to commit (file unchanged)")
+        return True
+    
+    _session.has_unpushed = True
+    print(f"✅ Git commit successful: {commit_message} ({commit_sha[:8]})")
+    return True
+
+
+def _build_push_env():
+    """Окружение для push/pull: без интерактивных запросов, с токеном GitHub при наличии"""
+    # Настраиваем окружение для Git операций
+    env = os.environ.copy()
+    env['GIT_TERMINAL_PROMPT'] = '0'
+    env['GIT_SSH_COMMAND'] = 'ssh -o StrictHostKeyChecking=no -o UserKnownHostsFile=/dev/null'
+    
+    # Пробуем получить GitHub token из переменных окружения или Streamlit secrets
+    github_token = None
+
+    # Сначала проверяем переменные окружения
+    github_token = os.getenv('GITHUB_TOKEN') or os.getenv('GH_TOKEN')
+
+    # Если не найден в переменных окружения, проверяем Streamlit secrets
+    if not github_token and STREAMLIT_AVAILABLE:
+        try:
+            if hasattr(st, 'secrets'):
+                # Пробуем разные способы доступа к secrets
+                try:
+                    # Способ 1: Прямой доступ через st.secrets['GITHUB_TOKEN']
+                    github_token = str(st.secrets['GITHUB_TOKEN']).strip()
+                except (KeyError, AttributeError, TypeError):
+                    try:
+                        # Способ 2: Через get метод
+                        github_token = str(st.secrets.get('GITHUB_TOKEN', '')).strip()
+                    except (AttributeError, TypeError):
+                        try:
+                            # Способ 3: Через dict конвертацию
+                            secrets_dict = dict(st.secrets) if hasattr(st.secrets, '__iter__') else {}
+                            github_token = str(secrets_dict.get('GITHUB_TOKEN', '')).strip()
+                        except Exception:
+                            github_token = None
+
+                if github_token:
+                    # Удаляем кавычки, если они есть (Streamlit может их добавить)
+                    if github_token.startswith('"') and github_token.endswith('"'):
+                        github_token = github_token[1:-1]
+                    elif github_token.startswith("'") and github_token.endswith("'"):
+                        github_token = github_token[1:-1]
+                    if github_token and len(github_token) > 10:  # Минимальная длина токена
+                        # Проверяем формат токена (должен начинаться с ghp_)
+                        if github_token.startswith('ghp_'):
+                            print(f"✅ GitHub token found in Streamlit secrets (length: {len(github_token)})")
+                        else:
+                            print(f"⚠️ GITHUB_TOKEN found but format may be incorrect (should start with 'ghp_')")
+                            print(f"   Token starts with: {github_token[:4]}...")
+                    else:
+                        print(f"⚠️ GITHUB_TOKEN found but appears to be empty or invalid (length: {len(github_token) if github_token else 0})")
+                        github_token = None
+                else:
+                    # Диагностика: проверяем, какие ключи доступны в secrets
+                    try:
+                        if hasattr(st.secrets, 'keys'):
+                            available_keys = list(st.secrets.keys())
+                            print(f"⚠️ GITHUB_TOKEN not found. Available secrets keys: {available_keys}")
+                        else:
+                            print(f"⚠️ GITHUB_TOKEN not found in Streamlit secrets")
+                    except Exception:
+                        print(f"⚠️ GITHUB_TOKEN not found in Streamlit secrets")
+        except Exception as e:
+            print(f"Warning: Could not read GITHUB_TOKEN from secrets: {e}")
+            import traceback
+            traceback.print_exc()
+
+    if github_token:
+        # Используем токен для аутентификации
+        # Вместо добавления токена в URL, используем переменную окружения
+        # Это более безопасный и надежный способ
+        env['GIT_ASKPASS'] = 'echo'
+        env['GITHUB_TOKEN'] = github_token
+
+        # Также пробуем обновить remote URL с токеном для совместимости
+        try:
+            result_url = _run_git(
+                ['git', 'remote', 'get-url', GIT_REMOTE],
+                capture_output=True,
+                timeout=5,
+                text=True
+            )
+            if result_url.returncode == 0:
+                current_remote_url = result_url.stdout.strip()
+                # Удаляем старый токен из URL если есть
+                if '@' in current_remote_url and 'github.com' in current_remote_url:
+                    # Извлекаем чистый URL без токена
+                    url_parts = current_remote_url.split('@')
+                    if len(url_parts) > 1:
+                        clean_url = 'https://' + url_parts[-1] if not url_parts[-1].startswith('http') else url_parts[-1]
+                    else:
+                        clean_url = current_remote_url
+                else:
+                    clean_url = current_remote_url
+
+                # Убеждаемся, что URL правильный формат
+                if not clean_url.startswith('http'):
+                    if 'github.com' in clean_url:
+                        clean_url = f"https://{clean_url}"
+
+                # Добавляем новый токен в URL (формат: https://token@github.com/user/repo.git)
+                if 'github.com' in clean_url:
+                    # Удаляем https:// если есть
+                    repo_path = clean_url.replace('https://', '').replace('http://', '')
+                    new_url = f"https://{github_token}@{repo_path}"
+
+                    print(f"Updating remote URL with token authentication")
+                    result_set = _run_git(
+                        ['git', 'remote', 'set-url', GIT_REMOTE, new_url],
+                        capture_output=True,
+                        timeout=5,
+                        text=True
+                    )
+                    if result_set.returncode == 0:
+                        print(f"✅ Remote URL updated with token")
+                        # Проверяем, что URL обновился правильно
+                        verify_url = _run_git(
+                            ['git', 'remote', 'get-url', GIT_REMOTE],
+                            capture_output=True,
+                            timeout=5,
+                            text=True
+                        )
+                        if verify_url.returncode == 0:
+                            print(f"✅ Verified: Remote URL is {verify_url.stdout.strip()[:50]}...")
+                    else:
+                        print(f"Warning: Could not update remote URL: {result_set.stderr}")
+        except Exception as e:
+            print(f"Warning: Could not update remote URL: {e}")
+            import traceback
+            traceback.print_exc()
+
+    return env
+
+
 def git_push():
-    """Отправить изменения в удаленный репозиторий"""
+    """
+    Отправить изменения в удаленный репозиторий
+    
+    Сначала выполняется push; pull делается только если remote ушел вперед (push отклонен).
+    """
     if not GIT_SYNC_ENABLED:
         print("Git sync is disabled, skipping push")
         return False
     
-    if not is_git_repo():
+    if not _session.is_repo():
         print("Not a git repository, skipping push")
         return False
     
     try:
-        # Настройка Git
-        setup_git_config()
+        # Настройка Git (один раз за процесс)
+        _session.ensure_configured()
         
-        # Получаем текущую ветку
-        result = subprocess.run(
-            ['git', 'rev-parse', '--abbrev-ref', 'HEAD'],
-            capture_output=True,
-            timeout=5,
-            text=True
-        )
-        
-        if result.returncode != 0:
-            print(f"Could not get current branch: {result.stderr}")
+        # Текущая ветка (кешируется)
+        current_branch = _session.current_branch()
+        if not current_branch:
             return False
         
-        current_branch = result.stdout.strip()
-        print(f"Current branch: {current_branch}")
+        if not _session.has_unpushed:
+            print("Nothing to push")
+            return True
+        
+        env = _session.push_env()
         
-        # Проверяем, есть ли что коммитить
-        result = subprocess.run(
-            ['git', 'status', '--porcelain'],
+        # Пушим изменения
+        print(f"Pushing to {GIT_REMOTE}/{current_branch}...")
+        result = _run_git(
+            ['git', 'push', GIT_REMOTE, current_branch],
             capture_output=True,
-            timeout=5,
-            text=True
+            timeout=30,
+            text=True,
+            env=env
         )
         
-        if result.returncode == 0 and not result.stdout.strip():
-            # Нет изменений для коммита
-            print("No changes to commit")
-            # Но все равно проверяем, есть ли что пушить
-            result = subprocess.run(
-                ['git', 'log', '--oneline', f'{GIT_REMOTE}/{current_branch}..HEAD'],
-                capture_output=True,
-                timeout=5,
-                text=True
-            )
-            if not result.stdout.strip():
-                print("Nothing to push")
-                return True
-        
-        # Сначала делаем pull, чтобы избежать конфликтов
-        print("Pulling latest changes...")
-        try:
-            # Используем GIT_TERMINAL_PROMPT=0 для автоматической аутентификации
-            env = os.environ.copy()
-            env['GIT_TERMINAL_PROMPT'] = '0'
-            env['GIT_SSH_COMMAND'] = 'ssh -o StrictHostKeyChecking=no -o UserKnownHostsFile=/dev/null'
-            
-            pull_result = subprocess.run(
+        if result.returncode != 0 and 'rejected' in (result.stderr or ''):
+            # Remote ушел вперед - подтягиваем изменения и пробуем еще раз
+            print("Push rejected, pulling latest changes...")
+            # Журнал до pull: новые дельты remote нужно применить к локальной БД
+            known_log = log_files() if PERSISTENCE_BACKEND == 'changelog' else None
+            pull_result = _run_git(
                 ['git', 'pull', GIT_REMOTE, current_branch, '--no-edit', '--no-rebase', '--no-ff'],
                 capture_output=True,
                 timeout=20,
@@ -364,149 +698,17 @@ def git_push():
             )
             if pull_result.returncode != 0:
                 print(f"Pull warning: {pull_result.stderr}")
-                # Если pull не удался, продолжаем - возможно, нет изменений
             else:
                 print("Pull successful")
-        except Exception as e:
-            print(f"Pull error (continuing anyway): {e}")
-        
-        # Пушим изменения
-        print(f"Pushing to {GIT_REMOTE}/{current_branch}...")
-        
-        # Настраиваем окружение для Git операций
-        env = os.environ.copy()
-        env['GIT_TERMINAL_PROMPT'] = '0'
-        env['GIT_SSH_COMMAND'] = 'ssh -o StrictHostKeyChecking=no -o UserKnownHostsFile=/dev/null'
-        
-        # Пробуем получить GitHub token из переменных окружения или Streamlit secrets
-        github_token = None
-        
-        # Сначала проверяем переменные окружения
-        github_token = os.getenv('GITHUB_TOKEN') or os.getenv('GH_TOKEN')
-        
-        # Если не найден в переменных окружения, проверяем Streamlit secrets
-        if not github_token and STREAMLIT_AVAILABLE:
-            try:
-                if hasattr(st, 'secrets'):
-                    # Пробуем разные способы доступа к secrets
-                    try:
-                        # Способ 1: Прямой доступ через st.secrets['GITHUB_TOKEN']
-                        github_token = str(st.secrets['GITHUB_TOKEN']).strip()
-                    except (KeyError, AttributeError, TypeError):
-                        try:
-                            # Способ 2: Через get метод
-                            github_token = str(st.secrets.get('GITHUB_TOKEN', '')).strip()
-                        except (AttributeError, TypeError):
-                            try:
-                                # Способ 3: Через dict конвертацию
-                                secrets_dict = dict(st.secrets) if hasattr(st.secrets, '__iter__') else {}
-                                github_token = str(secrets_dict.get('GITHUB_TOKEN', '')).strip()
-                            except Exception:
-                                github_token = None
-                    
-                    if github_token:
-                        # Удаляем кавычки, если они есть (Streamlit может их добавить)
-                        if github_token.startswith('"') and github_token.endswith('"'):
-                            github_token = github_token[1:-1]
-                        elif github_token.startswith("'") and github_token.endswith("'"):
-                            github_token = github_token[1:-1]
-                        if github_token and len(github_token) > 10:  # Минимальная длина токена
-                            # Проверяем формат токена (должен начинаться с ghp_)
-                            if github_token.startswith('ghp_'):
-                                print(f"✅ GitHub token found in Streamlit secrets (length: {len(github_token)})")
-                            else:
-                                print(f"⚠️ GITHUB_TOKEN found but format may be incorrect (should start with 'ghp_')")
-                                print(f"   Token starts with: {github_token[:4]}...")
-                        else:
-                            print(f"⚠️ GITHUB_TOKEN found but appears to be empty or invalid (length: {len(github_token) if github_token else 0})")
-                            github_token = None
-                    else:
-                        # Диагностика: проверяем, какие ключи доступны в secrets
-                        try:
-                            if hasattr(st.secrets, 'keys'):
-                                available_keys = list(st.secrets.keys())
-                                print(f"⚠️ GITHUB_TOKEN not found. Available secrets keys: {available_keys}")
-                            else:
-                                print(f"⚠️ GITHUB_TOKEN not found in Streamlit secrets")
-                        except Exception:
-                            print(f"⚠️ GITHUB_TOKEN not found in Streamlit secrets")
-            except Exception as e:
-                print(f"Warning: Could not read GITHUB_TOKEN from secrets: {e}")
-                import traceback
-                traceback.print_exc()
-        
-        if github_token:
-            # Используем токен для аутентификации
-            # Вместо добавления токена в URL, используем переменную окружения
-            # Это более безопасный и надежный способ
-            env['GIT_ASKPASS'] = 'echo'
-            env['GITHUB_TOKEN'] = github_token
-            
-            # Также пробуем обновить remote URL с токеном для совместимости
-            try:
-                result_url = subprocess.run(
-                    ['git', 'remote', 'get-url', GIT_REMOTE],
+                if known_log is not None:
+                    apply_pulled_changes(known_log, DB_FILE)
+                result = _run_git(
+                    ['git', 'push', GIT_REMOTE, current_branch],
                     capture_output=True,
-                    timeout=5,
-                    text=True
+                    timeout=30,
+                    text=True,
+                    env=env
                 )
-                if result_url.returncode == 0:
-                    current_remote_url = result_url.stdout.strip()
-                    # Удаляем старый токен из URL если есть
-                    if '@' in current_remote_url and 'github.com' in current_remote_url:
-                        # Извлекаем чистый URL без токена
-                        url_parts = current_remote_url.split('@')
-                        if len(url_parts) > 1:
-                            clean_url = 'https://' + url_parts[-1] if not url_parts[-1].startswith('http') else url_parts[-1]
-                        else:
-                            clean_url = current_remote_url
-                    else:
-                        clean_url = current_remote_url
-                    
-                    # Убеждаемся, что URL правильный формат
-                    if not clean_url.startswith('http'):
-                        if 'github.com' in clean_url:
-                            clean_url = f"https://{clean_url}"
-                    
-                    # Добавляем новый токен в URL (формат: https://token@github.com/user/repo.git)
-                    if 'github.com' in clean_url:
-                        # Удаляем https:// если есть
-                        repo_path = clean_url.replace('https://', '').replace('http://', '')
-                        new_url = f"https://{github_token}@{repo_path}"
-                        
-                        print(f"Updating remote URL with token authentication")
-                        result_set = subprocess.run(
-                            ['git', 'remote', 'set-url', GIT_REMOTE, new_url],
-                            capture_output=True,
-                            timeout=5,
-                            text=True
-                        )
-                        if result_set.returncode == 0:
-                            print(f"✅ Remote URL updated with token")
-                            # Проверяем, что URL обновился правильно
-                            verify_url = subprocess.run(
-                                ['git', 'remote', 'get-url', GIT_REMOTE],
-                                capture_output=True,
-                                timeout=5,
-                                text=True
-                            )
-                            if verify_url.returncode == 0:
-                                print(f"✅ Verified: Remote URL is {verify_url.stdout.strip()[:50]}...")
-                        else:
-                            print(f"Warning: Could not update remote URL: {result_set.stderr}")
-            except Exception as e:
-                print(f"Warning: Could not update remote URL: {e}")
-                import traceback
-                traceback.print_exc()
-        
-        # Пробуем push с HTTPS аутентификацией
-        result = subprocess.run(
-            ['git', 'push', GIT_REMOTE, current_branch],
-            capture_output=True,
-            timeout=30,
-            text=True,
-            env=env
-        )
         
         if result.returncode != 0:
             error_msg = result.stderr or result.stdout
@@ -518,18 +720,23 @@ def git_push():
                 print("⚠️ Authentication issue detected. Streamlit Cloud should use GitHub token automatically.")
                 print("💡 Make sure the repository is connected to Streamlit Cloud properly.")
             
+            # Настройки и токен будут проверены заново при следующей синхронизации
+            _session.invalidate()
             return False
         
+        _session.has_unpushed = False
         print(f"✅ Git push successful!")
         return True
         
     except subprocess.TimeoutExpired:
         print("❌ Git push timed out")
+        _session.invalidate()
         return False
     except Exception as e:
         print(f"❌ Git push error: {e}")
         import traceback
         traceback.print_exc()
+        _session.invalidate()
         return False
 
 
@@ -544,6 +751,11 @@ def sync_database_to_git(message="Auto-commit: Database update", push=True):
     Returns:
         bool: Успешно ли выполнена синхронизация
     """
+    with _git_lock, _session.trace(message):
+        return _sync_database_to_git(message, push)
+
+
+def _sync_database_to_git(message, push):
     print(f"\n{'='*60}")
     print(f"🔄 Starting Git sync: {message}")
     print(f"{'='*60}")
@@ -558,8 +770,20 @@ def sync_database_to_git(message="Auto-commit: Database update", push=True):
         print(f"{'='*60}\n")
         return False
     
-    # Коммитим изменения
-    commit_success = git_add_and_commit(message)
+    if PERSISTENCE_BACKEND == 'changelog':
+        # Выгружаем только изменившиеся строки
+        try:
+            shipped = ship_changes()
+        except Exception as e:
+            print(f"❌ Failed to ship change log: {e}")
+            print(f"{'='*60}\n")
+            return False
+        if not shipped:
+            print("No row changes to ship")
+        commit_success = git_add_and_commit(message, paths=[SYNC_DIR])
+    else:
+        # Коммитим изменения
+        commit_success = git_add_and_commit(message)
     if not commit_success:
         print(f"❌ Failed to commit changes: {message}")
         print(f"{'='*60}\n")
@@ -567,8 +791,6 @@ def sync_database_to_git(message="Auto-commit: Database update", push=True):
     
     # Пушим изменения, если требуется
     if push:
-        # Небольшая задержка перед push (на случай множественных операций)
-        time.sleep(0.5)
         push_result = git_push()
         if push_result:
             print(f"✅ Successfully synced to Git: {message}")
@@ -583,28 +805,302 @@ def sync_database_to_git(message="Auto-commit: Database update", push=True):
     return True
 
 
-def sync_database_to_git_async(message="Auto-commit: Database update", push=True):
+class SyncJournal:
     """
-    Асинхронная синхронизация (не блокирует основной поток)
-    Запускается в фоновом режиме
-    """
-    import threading
+    Локальный журнал несинхронизированных запросов
     
-    def sync_thread():
-        try:
-            result = sync_database_to_git(message, push)
-            if result:
-                print(f"✅ Git sync successful: {message}")
+    Каждый запрос дописывается строкой JSON с fsync до возврата из записи.
+    После успешной синхронизации подтвержденные записи удаляются (атомарная перезапись файла).
+    Если процесс упал, при следующем старте журнал не пуст и синхронизация запускается повторно.
+    """
+
+    def __init__(self, path=SYNC_JOURNAL_FILE):
+        self.path = path
+        self._lock = threading.Lock()
+        entries = self._read()
+        self.last_seq = entries[-1]['seq'] if entries else 0
+        self.pending_count = len(entries)
+
+    def _read(self):
+        if not os.path.exists(self.path):
+            return []
+        entries = []
+        with open(self.path, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    entries.append(json.loads(line))
+                except ValueError:
+                    # Оборванная последняя строка после сбоя
+                    continue
+        return entries
+
+    def append(self, message, push=True):
+        with self._lock:
+            self.last_seq += 1
+            entry = {'seq': self.last_seq, 'message': message, 'push': push, 'ts': time.time()}
+            with open(self.path, 'a', encoding='utf-8') as f:
+                f.write(json.dumps(entry, ensure_ascii=False) + '\n')
+                f.flush()
+                os.fsync(f.fileno())
+            self.pending_count += 1
+            return self.last_seq
+
+    def pending(self):
+        with self._lock:
+            return self._read()
+
+    def acknowledge(self, seq):
+        """Удалить записи до seq включительно"""
+        with self._lock:
+            remaining = [entry for entry in self._read() if entry['seq'] > seq]
+            if not remaining:
+                if os.path.exists(self.path):
+                    os.unlink(self.path)
             else:
-                print(f"⚠️ Git sync failed: {message}")
-        except Exception as e:
-            print(f"❌ Async git sync error: {e}")
-            import traceback
-            traceback.print_exc()
+                directory = os.path.dirname(os.path.abspath(self.path))
+                handle, tmp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+                with os.fdopen(handle, 'w', encoding='utf-8') as f:
+                    for entry in remaining:
+                        f.write(json.dumps(entry, ensure_ascii=False) + '\n')
+                    f.flush()
+                    os.fsync(f.fileno())
+                os.replace(tmp_path, self.path)
+            self.pending_count = len(remaining)
+
+
+class SyncWorker:
+    """
+    Единственный фоновый поток синхронизации с Git
+    
+    Запросы складываются в ограниченную очередь. Серия запросов в пределах окна debounce
+    склеивается в один коммит и один push. При ошибке синхронизация повторяется
+    с экспоненциальной задержкой, пока не пройдет успешно или пока worker не остановлен.
+    """
+
+    def __init__(self, sync_func=None, debounce=SYNC_DEBOUNCE_SECONDS, max_queue=SYNC_QUEUE_SIZE,
+                 retry_base=SYNC_RETRY_BASE_SECONDS, retry_max=SYNC_RETRY_MAX_SECONDS, journal=None):
+        self.sync_func = sync_func or sync_database_to_git
+        self.journal = journal
+        self.debounce = debounce
+        self.retry_base = retry_base
+        self.retry_max = retry_max
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._lock = threading.Lock()
+        self._idle = threading.Condition(self._lock)
+        self._stop = threading.Event()
+        self._flush_now = threading.Event()
+        self._thread = None
+
+        # Запросы, уже забранные из очереди, но еще не синхронизированные
+        self._pending = []
+        # Пришли запросы при переполненной очереди - их изменения войдут в следующий коммит
+        self._overflow = False
+        self._oldest_pending = None
+
+        self.requests = 0
+        self.coalesced = 0
+        self.syncs = 0
+        self.failures = 0
+        self.retries = 0
+        self.last_success = None
+        self.last_error = None
+        self.last_duration = None
+
+    def start(self):
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name='git-sync-worker', daemon=True)
+            self._thread.start()
+
+    def submit(self, message="Auto-commit: Database update", push=True, journaled=True):
+        """Поставить синхронизацию в очередь (не блокирует)"""
+        if self.journal is not None and journaled:
+            self.journal.append(message, push)
+        with self._lock:
+            self.requests += 1
+            if self._oldest_pending is None:
+                self._oldest_pending = time.time()
+            try:
+                self._queue.put_nowait((message, push))
+            except queue.Full:
+                # Очередь переполнена: отдельный запрос не нужен, изменения уйдут в ближайший коммит
+                self._overflow = True
+                self.coalesced += 1
+        self.start()
+        return True
+
+    def _drain(self):
+        drained = 0
+        while True:
+            try:
+                self._pending.append(self._queue.get_nowait())
+                drained += 1
+            except queue.Empty:
+                return drained
+
+    def _has_work(self):
+        return bool(self._pending) or self._overflow or not self._queue.empty()
+
+    def _run(self):
+        while True:
+            try:
+                self._pending.append(self._queue.get(timeout=0.5))
+            except queue.Empty:
+                if self._stop.is_set():
+                    break
+                continue
+
+            # Окно склейки: ждем, пока поток запросов не утихнет
+            deadline = time.time() + self.debounce
+            while time.time() < deadline and not self._stop.is_set() and not self._flush_now.is_set():
+                if self._drain():
+                    deadline = time.time() + self.debounce
+                time.sleep(min(0.05, max(0.0, deadline - time.time())))
+
+            self._sync_pending()
+
+            with self._lock:
+                if not self._has_work():
+                    self._flush_now.clear()
+                    self._idle.notify_all()
+
+    def _sync_pending(self):
+        attempt = 0
+        while True:
+            self._drain()
+            with self._lock:
+                batch = list(self._pending)
+                self._overflow = False
+            if not batch:
+                return
+
+            messages = list(dict.fromkeys(message for message, _ in batch))
+            message = messages[0] if len(messages) == 1 else f"{messages[0]} (+{len(batch) - 1} more)"
+            push = any(push for _, push in batch)
+            # Коммит включает все записи, сделанные до его начала
+            journal_seq = self.journal.last_seq if self.journal is not None else 0
+
+            started = time.time()
+            try:
+                success = self.sync_func(message, push)
+            except Exception as e:
+                print(f"❌ Sync worker error: {e}")
+                success = False
+            self.last_duration = time.time() - started
+
+            if success:
+                if self.journal is not None:
+                    self.journal.acknowledge(journal_seq)
+                with self._lock:
+                    del self._pending[:len(batch)]
+                    self.syncs += 1
+                    self.coalesced += len(batch) - 1
+                    self.last_success = time.time()
+                    self.last_error = None
+                    if not self._pending and not self._overflow and self._queue.empty():
+                        self._oldest_pending = None
+                return
+
+            self.failures += 1
+            self.last_error = time.time()
+            if self._stop.is_set() and attempt > 0:
+                # При остановке одна повторная попытка, дальше изменения останутся до следующего запуска
+                print(f"⚠️ Sync worker stopped with {len(batch)} unsynced requests")
+                return
+            delay = min(self.retry_max, self.retry_base * (2 ** attempt))
+            attempt += 1
+            self.retries += 1
+            print(f"⚠️ Git sync failed, retry #{attempt} in {delay:.0f}s")
+            self._stop.wait(delay)
+
+    def flush(self, timeout=None):
+        """Синхронизировать накопленное без ожидания окна склейки"""
+        self._flush_now.set()
+        deadline = None if timeout is None else time.time() + timeout
+        with self._lock:
+            while self._has_work():
+                remaining = None if deadline is None else deadline - time.time()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._idle.wait(remaining if remaining is not None else 0.5)
+        return True
+
+    def stop(self, timeout=30):
+        """Синхронизировать накопленное без ожидания окна склейки и остановить worker"""
+        if self._thread is None:
+            return
+        self._flush_now.set()
+        self._stop.set()
+        self._thread.join(timeout)
+
+    def metrics(self):
+        """Метрики очереди синхронизации"""
+        with self._lock:
+            pending = len(self._pending) + self._queue.qsize()
+            lag = time.time() - self._oldest_pending if self._oldest_pending else 0.0
+            return {
+                'queue_depth': pending,
+                'requests': self.requests,
+                'coalesced': self.coalesced,
+                'syncs': self.syncs,
+                'failures': self.failures,
+                'retries': self.retries,
+                'last_success': self.last_success,
+                'last_error': self.last_error,
+                'last_duration': self.last_duration,
+                'lag_seconds': lag,
+                'journal_pending': self.journal.pending_count if self.journal is not None else 0,
+            }
+
+
+_sync_worker = None
+_sync_worker_lock = threading.Lock()
+
+
+def get_sync_worker():
+    """Общий фоновый worker синхронизации"""
+    global _sync_worker
+    with _sync_worker_lock:
+        if _sync_worker is None:
+            _sync_worker = SyncWorker(journal=SyncJournal())
+            # Несинхронизированные изменения отправляются при остановке процесса
+            atexit.register(_sync_worker.stop)
+        return _sync_worker
+
+
+def get_sync_metrics():
+    """Метрики фоновой синхронизации"""
+    return get_sync_worker().metrics()
+
+
+def resume_pending_sync():
+    """
+    Отправить запросы, оставшиеся в журнале после падения процесса
     
-    thread = threading.Thread(target=sync_thread, daemon=True)
-    thread.start()
-    return thread
+    Returns:
+        int: количество восстановленных запросов
+    """
+    if not GIT_SYNC_ENABLED:
+        return 0
+    worker = get_sync_worker()
+    entries = worker.journal.pending()
+    for entry in entries:
+        worker.submit(entry['message'], entry.get('push', True), journaled=False)
+    if entries:
+        print(f"🔁 Resuming {len(entries)} unsynced requests from journal")
+    return len(entries)
+
+
+def sync_database_to_git_async(message="Auto-commit: Database update", push=True):
+    """
+    Асинхронная синхронизация (не блокирует основной поток)
+    Запрос ставится в очередь фонового worker, серии запросов склеиваются в один коммит
+    """
+    if not GIT_SYNC_ENABLED:
+        return False
+    return get_sync_worker().submit(message, push)
 
 
 def sync_database_to_git_sync(message="Auto-commit: Database update", push=True):
@@ -615,6 +1111,18 @@ def sync_database_to_git_sync(message="Auto-commit: Database update", push=True)
     return sync_database_to_git(message, push)
 
 
+def sync_database_to_git_durable(message="Auto-commit: Database update", push=True):
+    """
+    Синхронизация критической записи в режиме GIT_SYNC_DURABILITY
+    
+    'sync' - блокирует до commit и push (как sync_database_to_git_sync),
+    'async' - запрос записывается в локальный журнал и отправляется фоновым worker
+    """
+    if GIT_SYNC_DURABILITY == 'sync':
+        return sync_database_to_git_sync(message, push)
+    return sync_database_to_git_async(message, push)
+
+
 def pull_database_from_git():
     """
     Получить последнюю версию базы данных из Git
@@ -623,20 +1131,25 @@ def pull_database_from_git():
     if not GIT_SYNC_ENABLED:
         return False
     
-    if not is_git_repo():
+    if not _session.is_repo():
         return False
     
     try:
-        # Настройка Git
-        setup_git_config()
+        # Настройка Git (один раз за процесс)
+        _session.ensure_configured()
         
         # Настраиваем окружение для Git операций
         env = os.environ.copy()
         env['GIT_TERMINAL_PROMPT'] = '0'
         env['GIT_SSH_COMMAND'] = 'ssh -o StrictHostKeyChecking=no -o UserKnownHostsFile=/dev/null'
         
+        # Файл БД может быть заменен: сначала переносим WAL в файл и закрываем соединения,
+        # иначе старый WAL будет применен к новому файлу
+        checkpoint_database(DB_FILE)
+        reset_pool(DB_FILE)
+        
         # Получаем изменения из удаленного репозитория
-        result = subprocess.run(
+        result = _run_git(
             ['git', 'pull', GIT_REMOTE, GIT_BRANCH, '--no-edit'],
             capture_output=True,
             timeout=30,
@@ -648,6 +1161,10 @@ def pull_database_from_git():
             print(f"Git pull failed: {result.stderr}")
             return False
         
+        # Собираем БД из снимка и дельт вместо бинарного файла из Git
+        if PERSISTENCE_BACKEND == 'changelog':
+            restore_database_from_log(DB_FILE)
+        
         return True
         
     except subprocess.TimeoutExpired:
@@ -661,7 +1178,7 @@ def pull_database_from_git():
 # Проверка доступности Git при импорте модуля
 if GIT_SYNC_ENABLED:
     try:
-        result = subprocess.run(
+        result = _run_git(
             ['git', '--version'],
             capture_output=True,
             timeout=5
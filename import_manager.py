@@ -157,12 +157,12 @@ def import_client(row, skip_duplicates):
         # Проверка дубликатов
         if skip_duplicates:
             conn = get_connection()
-            cursor = conn.cursor()
-            cursor.execute('SELECT id FROM clients WHERE phone = ?', (row['phone'],))
-            if cursor.fetchone():
+            try:
+                duplicate = conn.execute('SELECT id FROM clients WHERE phone = ?', (row['phone'],)).fetchone()
+            finally:
                 conn.close()
+            if duplicate:
                 return "skip"
-            conn.close()
         
         # Импорт
         client_id = create_client(
@@ -6,7 +6,7 @@
 """
 
 import pandas as pd
-import sqlite3
+from db_pool import get_pool
 from datetime import datetime
 import re
 
@@ -64,7 +64,7 @@ def import_saulemai_data():
     print("=" * 80)
     
     # Подключение к базе данных
-    conn = sqlite3.connect('medical_center.db')
+    conn = get_pool().acquire()
     cursor = conn.cursor()
     
     try:
@@ -5,8 +5,91 @@
 """
 
 import sqlite3
+from db_pool import get_pool
+from client_search import fts_migration_statements
+from analytics_rollup import (
+    rollup_migration_statements, revenue_migration_statements, month_version_migration_statements,
+    service_migration_statements
+)
+from analytics_cache import generation_migration_statements
+from appointment_balance import balance_migration_statements
 import os
 
+# Версионированные миграции схемы. Номер последней примененной версии хранится
+# в PRAGMA user_version, поэтому каждая версия выполняется один раз. Шаг - SQL или
+# функция conn -> None для того, что нельзя записать идемпотентным SQL (ADD COLUMN).
+SCHEMA_MIGRATIONS = [
+    (1, "Индексы для календаря, проверки конфликтов, аналитики и аудита", [
+        # get_appointments_by_date_range, аналитика: диапазон дат + сортировка по времени
+        "CREATE INDEX IF NOT EXISTS idx_appointments_date_time ON appointments (appointment_date, appointment_time)",
+        # create_appointment: проверка занятости врача
+        "CREATE INDEX IF NOT EXISTS idx_appointments_doctor_date_time ON appointments (doctor_id, appointment_date, appointment_time)",
+        # Услуги приема, подзапрос методов оплаты в аналитике
+        "CREATE INDEX IF NOT EXISTS idx_appointment_services_appointment ON appointment_services (appointment_id)",
+        # Оплаты услуги приема
+        "CREATE INDEX IF NOT EXISTS idx_asp_appointment_service ON appointment_service_payments (appointment_service_id)",
+        # Фильтр по периоду в журнале аудита
+        "CREATE INDEX IF NOT EXISTS idx_audit_log_timestamp ON audit_log (timestamp)",
+    ]),
+    (2, "Версии данных для инкрементального обновления календаря", [
+        # Версия справочников, которые видны в ячейках календаря (имена клиентов, врачей, услуги)
+        "CREATE TABLE IF NOT EXISTS _data_version (name TEXT PRIMARY KEY, version INTEGER NOT NULL DEFAULT 0)",
+        "INSERT OR IGNORE INTO _data_version (name, version) VALUES ('reference', 0)",
+        # Измененные приемы: MAX(seq) - водяной знак календаря
+        "CREATE TABLE IF NOT EXISTS _appointment_changes ("
+        "seq INTEGER PRIMARY KEY AUTOINCREMENT, appointment_id INTEGER NOT NULL)",
+        "CREATE TRIGGER IF NOT EXISTS _dv_appointments_ins AFTER INSERT ON appointments BEGIN "
+        "INSERT INTO _appointment_changes (appointment_id) VALUES (NEW.id); END",
+        "CREATE TRIGGER IF NOT EXISTS _dv_appointments_upd AFTER UPDATE ON appointments BEGIN "
+        "INSERT INTO _appointment_changes (appointment_id) VALUES (NEW.id); END",
+        "CREATE TRIGGER IF NOT EXISTS _dv_appointments_del AFTER DELETE ON appointments BEGIN "
+        "INSERT INTO _appointment_changes (appointment_id) VALUES (OLD.id); END",
+        # Хранится только хвост журнала; кто отстал сильнее - перечитывает неделю целиком
+        "CREATE TRIGGER IF NOT EXISTS _dv_appointment_changes_trim AFTER INSERT ON _appointment_changes BEGIN "
+        "DELETE FROM _appointment_changes WHERE seq <= NEW.seq - 10000; END",
+    ] + [
+        f"CREATE TRIGGER IF NOT EXISTS _dv_{table}_{suffix} AFTER {op} ON {table} BEGIN "
+        f"UPDATE _data_version SET version = version + 1 WHERE name = 'reference'; END"
+        for table in ('clients', 'doctors', 'services')
+        for op, suffix in (('UPDATE', 'upd'), ('DELETE', 'del'))
+    ]),
+    (3, "Полнотекстовый индекс клиентов (FTS5 trigram) для поиска по имени и телефону",
+     fts_migration_statements()),
+    (4, "Дневная сводка аналитики (analytics_daily) и триггеры измененных дней",
+     rollup_migration_statements()),
+    (5, "Выручка в сводке аналитики по сумме услуг приема", revenue_migration_statements()),
+    (6, "Версии месяцев для снимков аналитики закрытых периодов", month_version_migration_statements()),
+    (7, "Поколение записи для кеша аналитики", generation_migration_statements()),
+    (8, "Стоимость, оплачено и статус оплаты в строке приема (триггеры) и индекс неоплаченных",
+     balance_migration_statements()),
+    (9, "Услуга приема - измерение дневной сводки аналитики", service_migration_statements()),
+]
+
+def get_schema_version(conn):
+    """Текущая версия схемы"""
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+def apply_schema_migrations(conn):
+    """Применить версионированные миграции, которые еще не выполнялись"""
+    current_version = get_schema_version(conn)
+    applied = []
+    
+    for version, description, statements in SCHEMA_MIGRATIONS:
+        if version <= current_version:
+            continue
+        
+        for statement in statements:
+            if callable(statement):
+                statement(conn)
+            else:
+                conn.execute(statement)
+        conn.execute(f"PRAGMA user_version = {version}")
+        conn.commit()
+        applied.append(version)
+        print(f"✅ Миграция схемы v{version}: {description}")
+    
+    return applied
+
 def migrate_database():
     """Выполнить миграции базы данных"""
     db_path = 'medical_center.db'
@@ -15,8 +98,9 @@ def migrate_database():
         print("❌ База данных не найдена!")
         return False
     
+    conn = None
     try:
-        conn = sqlite3.connect(db_path)
+        conn = get_pool(db_path).acquire()
         cursor = conn.cursor()
         
         print("🔄 Выполнение миграций базы данных...")
@@ -95,7 +179,9 @@ def migrate_database():
             print("ℹ️ Колонка last_login уже существует в таблице users")
         
         conn.commit()
-        conn.close()
+        
+        # Версионированные миграции (индексы и т.д.)
+        apply_schema_migrations(conn)
         
         print("✅ Все миграции выполнены успешно!")
         return True
@@ -103,6 +189,9 @@ def migrate_database():
     except Exception as e:
         print(f"❌ Ошибка выполнения миграций: {e}")
         return False
+    finally:
+        if conn is not None:
+            conn.close()
 
 if __name__ == "__main__":
     migrate_database()
\ No newline at end of file
@@ -220,34 +220,38 @@ def show_notification_history():
 def get_all_clients():
     """Получить всех клиентов"""
     conn = get_connection()
-    cursor = conn.cursor()
-    
-    cursor.execute('''
-        SELECT id, first_name, last_name, phone, email
-        FROM clients
-        ORDER BY last_name, first_name
-    ''')
-    
-    results = cursor.fetchall()
-    conn.close()
-    return results
+    try:
+        cursor = conn.cursor()
+    
+        cursor.execute('''
+            SELECT id, first_name, last_name, phone, email
+            FROM clients
+            ORDER BY last_name, first_name
+        ''')
+    
+        results = cursor.fetchall()
+        return results
+    finally:
+        conn.close()
 
 def get_clients_with_appointments(appointment_date):
     """Получить клиентов с приемами на указанную дату"""
     conn = get_connection()
-    cursor = conn.cursor()
-    
-    cursor.execute('''
-        SELECT DISTINCT c.id, c.first_name, c.last_name, c.phone, c.email
-        FROM clients c
-        JOIN appointments a ON c.id = a.client_id
-        WHERE a.appointment_date = ? AND a.status = 'записан'
-        ORDER BY c.last_name, c.first_name
-    ''', (appointment_date,))
-    
-    results = cursor.fetchall()
-    conn.close()
-    return results
+    try:
+        cursor = conn.cursor()
+    
+        cursor.execute('''
+            SELECT DISTINCT c.id, c.first_name, c.last_name, c.phone, c.email
+            FROM clients c
+            JOIN appointments a ON c.id = a.client_id
+            WHERE a.appointment_date = ? AND a.status = 'записан'
+            ORDER BY c.last_name, c.first_name
+        ''', (appointment_date,))
+    
+        results = cursor.fetchall()
+        return results
+    finally:
+        conn.close()
 
 def get_template_text(template_name):
     """Получить текст шаблона"""
@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+"""
+Проведение оплаты приема несколькими методами одной транзакцией
+
+Форма оплаты вызывала add_payment_to_service для каждой пары услуга × метод
+(свое соединение, свой commit и свой поток синхронизации с Git), а затем
+update_appointment_payment_status еще в одном соединении. Параллельные кассиры
+могли оба увидеть один и тот же остаток и провести переплату.
+
+post_payment_rows под блокировкой записи (BEGIN IMMEDIATE) читает услуги и уже
+внесенные оплаты, проверяет остаток, раскладывает каждый метод по услугам
+пропорционально их цене, вставляет все строки одним executemany и обновляет
+payment_status. Второй кассир ждет завершения первой транзакции и видит
+актуальный остаток.
+"""
+
+from db_pool import write_transaction
+from validators import ValidationError
+
+# Допуск сравнения денежных сумм (копейки/тиыны)
+MONEY_EPSILON = 0.005
+
+
+def payment_status_for(total_paid, total_cost):
+    """Статус оплаты приема по внесенной сумме"""
+    if total_paid == 0:
+        return 'не оплачено'
+    if total_paid >= total_cost - MONEY_EPSILON:
+        return 'оплачено'
+    return 'частично оплачено'
+
+
+def split_payment(lines, amounts):
+    """
+    Разложить оплату по услугам пропорционально цене
+
+    Args:
+        lines: [(appointment_service_id, цена), ...]
+        amounts: {метод оплаты: сумма}
+
+    Returns:
+        list: [(appointment_service_id, метод, сумма), ...]; суммы округлены до 0.01,
+              остаток округления метода уходит самой дорогой услуге - сумма по методу точная
+    """
+    total_cost = sum(price for _, price in lines)
+    largest = max(range(len(lines)), key=lambda index: lines[index][1])
+    rows = []
+    for method, amount in amounts.items():
+        if amount <= 0:
+            continue
+        shares = [round(amount * price / total_cost, 2) for _, price in lines]
+        shares[largest] = round(shares[largest] + amount - sum(shares), 2)
+        rows.extend((line_id, method, share) for (line_id, _), share in zip(lines, shares) if share)
+    return rows
+
+
+def post_payment_rows(conn, appointment_id, amounts):
+    """
+    Провести оплату приема {метод: сумма} одной транзакцией
+
+    Raises:
+        ValidationError: пустая или отрицательная оплата, у приема нет услуг,
+                         сумма превышает остаток
+
+    Returns:
+        dict: paid (проведено), total_paid, total_cost, remaining, payment_status, rows
+    """
+    amounts = {method: float(amount) for method, amount in amounts.items() if amount}
+    if not amounts or any(not method for method in amounts):
+        raise ValidationError("Укажите метод и сумму оплаты")
+    if any(amount < 0 for amount in amounts.values()):
+        raise ValidationError("Сумма оплаты не может быть отрицательной")
+    paid = sum(amounts.values())
+
+    with write_transaction(conn, 'post_payment'):
+        lines = conn.execute('''
+            SELECT id, COALESCE(price, 0) FROM appointment_services
+            WHERE appointment_id = ?
+            ORDER BY id
+        ''', (appointment_id,)).fetchall()
+        total_cost = sum(price for _, price in lines)
+        if not lines or total_cost <= 0:
+            raise ValidationError("У приема нет услуг с ценой - оплату не к чему привязать")
+
+        already_paid = conn.execute('''
+            SELECT COALESCE(SUM(asp.amount), 0)
+            FROM appointment_service_payments asp
+            JOIN appointment_services aps ON asp.appointment_service_id = aps.id
+            WHERE aps.appointment_id = ?
+        ''', (appointment_id,)).fetchone()[0]
+        remaining = total_cost - already_paid
+        if paid > remaining + MONEY_EPSILON:
+            raise ValidationError(f"Сумма оплаты {paid:,.0f} ₸ превышает остаток {remaining:,.0f} ₸")
+
+        rows = split_payment(lines, amounts)
+        conn.executemany('''
+            INSERT INTO appointment_service_payments (appointment_service_id, payment_method, amount)
+            VALUES (?, ?, ?)
+        ''', rows)
+
+        total_paid = already_paid + paid
+        status = payment_status_for(total_paid, total_cost)
+        conn.execute("UPDATE appointments SET payment_status = ? WHERE id = ?", (status, appointment_id))
+
+    return {
+        'paid': paid,
+        'total_paid': total_paid,
+        'total_cost': total_cost,
+        'remaining': total_cost - total_paid,
+        'payment_status': status,
+        'rows': len(rows),
+    }
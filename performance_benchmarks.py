@@ -0,0 +1,1289 @@
+#!/usr/bin/env python3
+"""
+Бенчмарки производительности Jardem Medical Center
+Запуск: python performance_benchmarks.py [имя_бенчмарка ...]
+"""
+
+import os
+import sys
+import shutil
+import subprocess
+import tempfile
+import threading
+import time
+
+# Добавляем путь к модулям
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from db_pool import ConnectionPool, get_pragma_profile, apply_database_profile
+
+
+def _percentile(values, pct):
+    """Перцентиль по отсортированному списку"""
+    if not values:
+        return 0.0
+    values = sorted(values)
+    index = min(len(values) - 1, int(round(pct / 100 * (len(values) - 1))))
+    return values[index]
+
+
+def _temp_db_path():
+    handle, path = tempfile.mkstemp(suffix='.db')
+    os.close(handle)
+    return path
+
+
+def _remove_db(path):
+    for suffix in ('', '-wal', '-shm'):
+        if os.path.exists(path + suffix):
+            os.unlink(path + suffix)
+
+
+# ==================== WAL: ЧТЕНИЯ ВО ВРЕМЯ ЗАПИСИ ====================
+
+def _run_concurrent_reads(profile_name, duration=3.0, readers=4, rows=20000):
+    """Читатели выполняют запросы по диапазону дат, пока писатель вставляет строки"""
+    path = _temp_db_path()
+    profile = get_pragma_profile(profile_name)
+    pool = ConnectionPool(path, max_size=readers + 2, profile=profile)
+
+    with pool.connection() as conn:
+        apply_database_profile(conn, profile)
+        conn.execute('''
+            CREATE TABLE appointments (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                doctor_id INTEGER NOT NULL,
+                appointment_date DATE NOT NULL,
+                appointment_time TIME NOT NULL,
+                status TEXT
+            )
+        ''')
+        conn.execute('CREATE INDEX idx_bench_date ON appointments (appointment_date)')
+        conn.executemany(
+            'INSERT INTO appointments (doctor_id, appointment_date, appointment_time, status) VALUES (?, ?, ?, ?)',
+            [(i % 20, f"2025-{(i % 12) + 1:02d}-{(i % 28) + 1:02d}", '10:00:00', 'записан') for i in range(rows)]
+        )
+        conn.commit()
+
+    stop = threading.Event()
+    latencies = []
+    latencies_lock = threading.Lock()
+    writes = [0]
+
+    def writer():
+        with pool.connection() as conn:
+            i = 0
+            while not stop.is_set():
+                conn.execute(
+                    'INSERT INTO appointments (doctor_id, appointment_date, appointment_time, status) VALUES (?, ?, ?, ?)',
+                    (i % 20, '2025-06-15', '11:00:00', 'записан')
+                )
+                conn.commit()
+                writes[0] += 1
+                i += 1
+
+    def reader():
+        local = []
+        with pool.connection() as conn:
+            while not stop.is_set():
+                started = time.perf_counter()
+                conn.execute(
+                    'SELECT COUNT(*) FROM appointments WHERE appointment_date BETWEEN ? AND ?',
+                    ('2025-06-01', '2025-06-30')
+                ).fetchone()
+                local.append(time.perf_counter() - started)
+        with latencies_lock:
+            latencies.extend(local)
+
+    threads = [threading.Thread(target=writer)] + [threading.Thread(target=reader) for _ in range(readers)]
+    for thread in threads:
+        thread.start()
+    time.sleep(duration)
+    stop.set()
+    for thread in threads:
+        thread.join()
+
+    pool.close_all()
+    _remove_db(path)
+
+    return {
+        'profile': profile_name,
+        'reads': len(latencies),
+        'writes': writes[0],
+        'reads_per_sec': len(latencies) / duration,
+        'p50_ms': _percentile(latencies, 50) * 1000,
+        'p95_ms': _percentile(latencies, 95) * 1000,
+        'max_ms': max(latencies) * 1000 if latencies else 0.0,
+    }
+
+
+def benchmark_wal_concurrent_reads(duration=3.0):
+    """Чтения во время записи: журнал отката (default) против WAL (performance)"""
+    results = [_run_concurrent_reads('default', duration), _run_concurrent_reads('performance', duration)]
+    for result in results:
+        print(
+            f"  {result['profile']:<12} чтений: {result['reads']:>7} ({result['reads_per_sec']:,.0f}/с)  "
+            f"записей: {result['writes']:>6}  p50: {result['p50_ms']:.2f} мс  "
+            f"p95: {result['p95_ms']:.2f} мс  max: {result['max_ms']:.1f} мс"
+        )
+    return results
+
+
+# ==================== GIT: ЗАДЕРЖКА ЗАПИСИ В РЕЖИМАХ SYNC/ASYNC ====================
+
+def _init_git_sandbox(root):
+    """Временный репозиторий с bare remote; глобальный git config изолирован"""
+    remote = os.path.join(root, 'remote.git')
+    work = os.path.join(root, 'work')
+    env = dict(os.environ, GIT_CONFIG_GLOBAL=os.path.join(root, 'gitconfig'), GIT_CONFIG_NOSYSTEM='1')
+    subprocess.run(['git', 'init', '-q', '--bare', '-b', 'main', remote], check=True, env=env)
+    subprocess.run(['git', 'init', '-q', '-b', 'main', work], check=True, env=env)
+    for args in (['config', 'user.name', 'bench'], ['config', 'user.email', 'bench@example.com'],
+                 ['remote', 'add', 'origin', remote]):
+        subprocess.run(['git'] + args, cwd=work, check=True, env=env)
+    with open(os.path.join(work, 'README'), 'w') as f:
+        f.write('bench\n')
+    subprocess.run(['git', 'add', 'README'], cwd=work, check=True, env=env)
+    subprocess.run(['git', 'commit', '-q', '-m', 'init'], cwd=work, check=True, env=env)
+    subprocess.run(['git', 'push', '-q', '-u', 'origin', 'main'], cwd=work, check=True, env=env,
+                   capture_output=True)
+    return work, env
+
+
+def benchmark_git_durability(writes=15):
+    """Задержка записи клиента: ожидание commit+push (sync) против локального журнала (async)"""
+    import contextlib
+    import io
+    import git_sync
+    from db_pool import get_pool, reset_pool
+    from change_log import install_change_tracking
+
+    root = tempfile.mkdtemp()
+    saved_cwd, saved_env = os.getcwd(), dict(os.environ)
+    results = {}
+    try:
+        work, env = _init_git_sandbox(root)
+        os.environ.update(env)
+        os.chdir(work)
+        git_sync.GIT_SYNC_ENABLED = True
+
+        with get_pool(git_sync.DB_FILE).connection() as conn:
+            conn.execute("CREATE TABLE clients (id INTEGER PRIMARY KEY AUTOINCREMENT, first_name TEXT, phone TEXT)")
+            conn.commit()
+            install_change_tracking(conn)
+
+        def commit_count():
+            result = subprocess.run(['git', 'rev-list', '--count', 'HEAD'], capture_output=True, text=True)
+            return int(result.stdout.strip())
+
+        def write_client(i):
+            with get_pool(git_sync.DB_FILE).connection() as conn:
+                conn.execute("INSERT INTO clients (first_name, phone) VALUES (?, ?)", (f"Клиент {i}", f"+7 700 {i:07d}"))
+                conn.commit()
+
+        for mode in ('sync', 'async'):
+            git_sync.GIT_SYNC_DURABILITY = mode
+            worker = git_sync.SyncWorker(debounce=0.5, journal=git_sync.SyncJournal())
+            git_sync._sync_worker = worker
+            latencies = []
+            commits_before = commit_count()
+            # Вывод git_sync подавляется, чтобы не смешивался с результатами
+            with contextlib.redirect_stdout(io.StringIO()):
+                started_all = time.perf_counter()
+                for i in range(writes):
+                    started = time.perf_counter()
+                    write_client(i)
+                    git_sync.sync_database_to_git_durable(f"Bench client {i}", push=True)
+                    latencies.append(time.perf_counter() - started)
+                worker.flush(timeout=120)
+                total = time.perf_counter() - started_all
+                worker.stop()
+            results[mode] = {
+                'p50_ms': _percentile(latencies, 50) * 1000,
+                'p95_ms': _percentile(latencies, 95) * 1000,
+                'until_remote_s': total,
+                'commits': commit_count() - commits_before,
+            }
+            print(
+                f"  {mode:<6} запись p50: {results[mode]['p50_ms']:8.2f} мс  p95: {results[mode]['p95_ms']:8.2f} мс  "
+                f"до remote: {total:6.2f} с  коммитов: {results[mode]['commits']}"
+            )
+    finally:
+        git_sync._sync_worker = None
+        reset_pool(git_sync.DB_FILE)
+        os.chdir(saved_cwd)
+        os.environ.clear()
+        os.environ.update(saved_env)
+        shutil.rmtree(root, ignore_errors=True)
+    return results
+
+
+# ==================== GIT: ЗАДЕРЖКА КОММИТА CLI ПРОТИВ ПРЯМОЙ ЗАПИСИ ОБЪЕКТОВ ====================
+
+def benchmark_git_commit_backends(commits=30):
+    """Задержка коммита дельты: git add + git commit против записи объектов в .git"""
+    import contextlib
+    import io
+    import git_sync
+
+    root = tempfile.mkdtemp()
+    saved_cwd, saved_env = os.getcwd(), dict(os.environ)
+    saved_backend, saved_session = git_sync.GIT_COMMIT_BACKEND, git_sync._session
+    results = {}
+    try:
+        work, env = _init_git_sandbox(root)
+        os.environ.update(env)
+        os.chdir(work)
+        git_sync.GIT_SYNC_ENABLED = True
+        # История, сопоставимая с рабочим репозиторием (объекты в pack-файлах)
+        os.makedirs(os.path.join('sync', 'changes'))
+        for i in range(200):
+            with open(os.path.join('src_%03d.py' % i), 'w') as f:
+                f.write(f"# module {i}\n" * 50)
+        subprocess.run(['git', 'add', '-A'], check=True)
+        subprocess.run(['git', 'commit', '-q', '-m', 'history'], check=True)
+        subprocess.run(['git', 'gc', '-q'], check=True)
+
+        for backend in ('cli', 'objects'):
+            git_sync.GIT_COMMIT_BACKEND = backend
+            git_sync._session = git_sync.GitSession()
+            latencies = []
+            with contextlib.redirect_stdout(io.StringIO()):
+                git_sync._session.ensure_configured()
+                processes_before = git_sync._session.subprocess_count
+                for i in range(commits):
+                    with open(os.path.join('sync', 'changes', f'{backend}_{i:06d}.jsonl'), 'w') as f:
+                        f.write(f'{{"seq": {i}, "t": "clients", "op": "U"}}\n')
+                    started = time.perf_counter()
+                    git_sync.git_add_and_commit(f"Bench {backend} {i}", paths=['sync'])
+                    latencies.append(time.perf_counter() - started)
+            processes = git_sync._session.subprocess_count - processes_before
+            results[backend] = {
+                'p50_ms': _percentile(latencies, 50) * 1000,
+                'p95_ms': _percentile(latencies, 95) * 1000,
+                'git_processes_per_commit': processes / commits,
+            }
+            print(
+                f"  {backend:<8} коммит p50: {results[backend]['p50_ms']:7.2f} мс  "
+                f"p95: {results[backend]['p95_ms']:7.2f} мс  процессов git на коммит: {processes / commits:.1f}"
+            )
+        status = subprocess.run(['git', 'status', '--porcelain'], capture_output=True, text=True).stdout
+        fsck = subprocess.run(['git', 'fsck', '--strict'], capture_output=True, text=True)
+        print(f"  git status чистый: {'да' if not status.strip() else 'нет'}, git fsck: {'ok' if fsck.returncode == 0 else 'ошибка'}")
+    finally:
+        git_sync.GIT_COMMIT_BACKEND, git_sync._session = saved_backend, saved_session
+        os.chdir(saved_cwd)
+        os.environ.clear()
+        os.environ.update(saved_env)
+        shutil.rmtree(root, ignore_errors=True)
+    return results
+
+
+# ==================== КАЛЕНДАРЬ: ПОИСК ПРИЕМОВ ПО ЯЧЕЙКАМ ====================
+
+def _make_week_appointments(week_start, appointments, doctors, slot_minutes=15, seed=11):
+    """Строки в формате get_appointments_by_date_range на неделю (равномерно по врачам и слотам)"""
+    import random
+    from datetime import timedelta
+    from calendar_index import build_time_slots
+
+    rng = random.Random(seed)
+    slots = build_time_slots(slot_minutes)
+    rows = []
+    for apt_id in range(1, appointments + 1):
+        day = week_start + timedelta(days=rng.randrange(7))
+        slot = rng.choice(slots)
+        doctor_id = rng.randint(1, doctors)
+        rows.append((
+            apt_id, rng.randint(1, 5000), doctor_id, 1, day.strftime('%Y-%m-%d'),
+            slot.strftime('%H:%M:%S'), 'записан', None, None, None,
+            f"Клиент{apt_id}", "Тестовый", "+7 700 000 0000",
+            f"Врач{doctor_id}", "Тестовый", "Терапевт", "Консультация", 5000, 30,
+        ))
+    return rows
+
+
+def _legacy_week_cells(rows, week_start, time_slots):
+    """Прежний алгоритм show_week_appointments: strptime всех приемов дня в каждой ячейке"""
+    from datetime import datetime, timedelta
+
+    appointments_dict = {}
+    for apt in rows:
+        apt_date = datetime.strptime(apt[4], '%Y-%m-%d').date()
+        appointments_dict.setdefault(apt_date, {}).setdefault(apt[5], []).append(apt)
+
+    found = 0
+    for time_slot in time_slots:
+        for i in range(7):
+            day_appointments = appointments_dict.get(week_start + timedelta(days=i), {})
+            slot_appointments = []
+            for apt_time, appointment_list in day_appointments.items():
+                if datetime.strptime(apt_time, '%H:%M:%S').time() == time_slot:
+                    slot_appointments.extend(appointment_list)
+            found += len(slot_appointments)
+    return found
+
+
+def _indexed_week_cells(rows, week_start, slot_minutes):
+    """Новый алгоритм: индекс (дата, слот) строится один раз, ячейка - один поиск в словаре"""
+    from datetime import timedelta
+    from calendar_index import CalendarIndex
+
+    index = CalendarIndex(rows, slot_minutes=slot_minutes)
+    found = 0
+    for time_slot in index.time_slots:
+        for i in range(7):
+            found += len(index.get(week_start + timedelta(days=i), time_slot))
+    return found
+
+
+def benchmark_calendar_week(appointments=1000, doctors=20, renders=20):
+    """Раскладка недели по ячейкам календаря: 1000 приемов, 20 врачей"""
+    from datetime import date
+    from calendar_index import build_time_slots
+
+    week_start = date(2025, 3, 3)
+    rows = _make_week_appointments(week_start, appointments, doctors)
+    results = {}
+    for name, render in (
+        ('legacy', lambda: _legacy_week_cells(rows, week_start, build_time_slots(15))),
+        ('index', lambda: _indexed_week_cells(rows, week_start, 15)),
+    ):
+        timings = []
+        for _ in range(renders):
+            started = time.perf_counter()
+            found = render()
+            timings.append(time.perf_counter() - started)
+        results[name] = {'p50_ms': _percentile(timings, 50) * 1000, 'found': found}
+        print(f"  {name:<8} неделя p50: {results[name]['p50_ms']:8.2f} мс  приемов в сетке: {found}")
+    print(f"  ускорение: ×{results['legacy']['p50_ms'] / max(results['index']['p50_ms'], 1e-9):.0f}")
+    return results
+
+
+def _create_calendar_database(path, doctors, appointments_per_week, weeks=4, seed=12):
+    """БД клиники: схема приемов с индексами миграций и приемы на несколько недель"""
+    import random
+    from datetime import date, timedelta
+    from migrate_database import apply_schema_migrations
+
+    rng = random.Random(seed)
+    pool = ConnectionPool(path, profile={})
+    with pool.connection() as conn:
+        conn.executescript('''
+            CREATE TABLE clients (id INTEGER PRIMARY KEY, first_name TEXT, last_name TEXT, phone TEXT);
+            CREATE TABLE doctors (id INTEGER PRIMARY KEY, first_name TEXT, last_name TEXT, specialization TEXT);
+            CREATE TABLE services (id INTEGER PRIMARY KEY, name TEXT, price REAL, duration_minutes INTEGER);
+            CREATE TABLE appointments (id INTEGER PRIMARY KEY, client_id INTEGER, doctor_id INTEGER,
+                service_id INTEGER, appointment_date DATE, appointment_time TIME, status TEXT, notes TEXT,
+                start_time TIMESTAMP, end_time TIMESTAMP);
+            CREATE TABLE appointment_services (id INTEGER PRIMARY KEY, appointment_id INTEGER, service_id INTEGER);
+            CREATE TABLE appointment_service_payments (id INTEGER PRIMARY KEY, appointment_service_id INTEGER,
+                payment_method TEXT, amount REAL);
+            CREATE TABLE audit_log (id INTEGER PRIMARY KEY, timestamp TIMESTAMP);
+        ''')
+        conn.executemany("INSERT INTO clients VALUES (?, ?, 'Тестовый', '+7 700 000 0000')",
+                         [(i, f"Клиент{i}") for i in range(1, 5001)])
+        conn.executemany("INSERT INTO doctors VALUES (?, ?, 'Тестовый', 'Терапевт')",
+                         [(i, f"Врач{i}") for i in range(1, doctors + 1)])
+        conn.execute("INSERT INTO services VALUES (1, 'Консультация', 5000, 30)")
+        start = date(2025, 3, 3)
+        statuses = ['записан'] * 6 + ['завершен', 'отменен']
+        conn.executemany(
+            "INSERT INTO appointments (client_id, doctor_id, service_id, appointment_date, appointment_time, status) "
+            "VALUES (?, ?, 1, ?, ?, ?)",
+            [
+                (rng.randint(1, 5000), rng.randint(1, doctors),
+                 (start + timedelta(days=rng.randrange(weeks * 7))).isoformat(),
+                 f"{rng.randint(9, 17):02d}:{rng.choice((0, 15, 30, 45)):02d}:00", rng.choice(statuses))
+                for _ in range(appointments_per_week * weeks)
+            ]
+        )
+        conn.commit()
+        apply_schema_migrations(conn)
+    return pool, start
+
+
+def benchmark_calendar_doctor_filter(doctors=50, appointments_per_week=5000, repeats=20):
+    """Неделя календаря с фильтром врачей: фильтр в Python по списку против фильтра в SQL"""
+    import contextlib
+    import io
+    from datetime import timedelta
+    from calendar_index import fetch_appointments
+
+    path = _temp_db_path()
+    results = {}
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            pool, start = _create_calendar_database(path, doctors, appointments_per_week)
+        week = (start + timedelta(days=7), start + timedelta(days=13))
+
+        def legacy(selected):
+            rows = fetch_appointments(conn, *week)
+            return [apt for apt in rows if apt[2] in selected]
+
+        def in_sql(selected):
+            return fetch_appointments(conn, *week, doctor_ids=set(selected))
+
+        with pool.connection() as conn:
+            for label, selected in (('5 врачей', list(range(1, 6))), ('все врачи', list(range(1, doctors + 1)))):
+                for name, func in (('python', legacy), ('sql', in_sql)):
+                    timings = []
+                    for _ in range(repeats):
+                        started = time.perf_counter()
+                        rows = func(selected)
+                        timings.append(time.perf_counter() - started)
+                    key = f"{name}/{label}"
+                    results[key] = {'p50_ms': _percentile(timings, 50) * 1000, 'rows': len(rows)}
+                    print(f"  {name:<7} {label:<10} p50: {results[key]['p50_ms']:7.2f} мс  строк: {len(rows)}")
+        pool.close_all()
+    finally:
+        _remove_db(path)
+    return results
+
+
+def benchmark_calendar_cache(doctors=50, appointments_per_week=5000, reruns=20):
+    """Перезапуск страницы календаря: чтение недели заново, из кеша и после одной записи"""
+    import contextlib
+    import io
+    from datetime import timedelta
+    from calendar_cache import CalendarCache
+    from calendar_index import CalendarIndex, fetch_appointments
+
+    path = _temp_db_path()
+    results = {}
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            pool, start = _create_calendar_database(path, doctors, appointments_per_week)
+        week = (start + timedelta(days=7), start + timedelta(days=13))
+        cache = CalendarCache()
+
+        with pool.connection() as conn:
+            def uncached():
+                CalendarIndex(fetch_appointments(conn, *week))
+
+            def cached():
+                cache.get_week(conn, *week)
+
+            def after_write():
+                conn.execute(
+                    "UPDATE appointments SET status = 'завершен' WHERE id = "
+                    "(SELECT id FROM appointments WHERE appointment_date = ? LIMIT 1)", (week[0].isoformat(),)
+                )
+                conn.commit()
+                cache.get_week(conn, *week)
+
+            cache.get_week(conn, *week)
+            for name, func in (('без кеша', uncached), ('из кеша', cached), ('после записи', after_write)):
+                timings = []
+                for _ in range(reruns):
+                    started = time.perf_counter()
+                    func()
+                    timings.append(time.perf_counter() - started)
+                results[name] = {'p50_ms': _percentile(timings, 50) * 1000}
+                print(f"  {name:<13} p50: {results[name]['p50_ms']:7.2f} мс")
+        stats = cache.stats()
+        print(f"  кеш: из кеша {stats['hits']}, дочитано {stats['refreshes']}, прочитано заново {stats['misses']}")
+        pool.close_all()
+    finally:
+        _remove_db(path)
+    return results
+
+
+# ==================== ПОИСК КЛИЕНТОВ ====================
+
+FIRST_NAMES = ['Иван', 'Петр', 'Алексей', 'Марина', 'Айгерим', 'Нурлан', 'Дана', 'Ерлан', 'Ольга', 'Асель',
+               'Aigerim', 'Daniyar', 'Timur', 'Madina', 'Sergey', 'Anna']
+LAST_NAMES = ['Петров', 'Иванова', 'Сидоренко', 'Нурланов', 'Ахметова', 'Ким', 'Жумабаев', 'Смагулова',
+              'Kim', 'Nurlanova', 'Akhmetov', 'Seitkali', 'Bekova', 'Omarov']
+
+
+def _create_clients_database(path, clients, seed=14):
+    """БД с clients и всеми миграциями (включая clients_fts)"""
+    import random
+    from migrate_database import apply_schema_migrations
+
+    rng = random.Random(seed)
+    pool = ConnectionPool(path, profile={})
+    with pool.connection() as conn:
+        conn.executescript('''
+            CREATE TABLE clients (id INTEGER PRIMARY KEY AUTOINCREMENT, first_name TEXT NOT NULL, last_name TEXT,
+                birth_date DATE, phone TEXT NOT NULL, email TEXT, is_active BOOLEAN DEFAULT 1);
+            CREATE TABLE doctors (id INTEGER PRIMARY KEY, first_name TEXT, last_name TEXT, specialization TEXT);
+            CREATE TABLE services (id INTEGER PRIMARY KEY, name TEXT, price REAL, duration_minutes INTEGER);
+            CREATE TABLE appointments (id INTEGER PRIMARY KEY, client_id INTEGER, doctor_id INTEGER,
+                service_id INTEGER, appointment_date DATE, appointment_time TIME, status TEXT);
+            CREATE TABLE appointment_services (id INTEGER PRIMARY KEY, appointment_id INTEGER, service_id INTEGER);
+            CREATE TABLE appointment_service_payments (id INTEGER PRIMARY KEY, appointment_service_id INTEGER,
+                payment_method TEXT, amount REAL);
+            CREATE TABLE audit_log (id INTEGER PRIMARY KEY, timestamp TIMESTAMP);
+        ''')
+        conn.executemany(
+            "INSERT INTO clients (first_name, last_name, phone) VALUES (?, ?, ?)",
+            [
+                (rng.choice(FIRST_NAMES), rng.choice(LAST_NAMES) + ('' if i % 7 else str(i)),
+                 f"+7 7{rng.randint(0, 99):02d} {rng.randint(0, 999):03d} {rng.randint(0, 99):02d} {rng.randint(0, 99):02d}")
+                for i in range(clients)
+            ]
+        )
+        conn.commit()
+        apply_schema_migrations(conn)
+    return pool
+
+
+def benchmark_client_search(clients=200000, repeats=10):
+    """Поиск при наборе (typeahead) среди 200 000 клиентов: LIKE '%...%' против FTS5 trigram"""
+    import contextlib
+    import io
+    from client_search import search_client_rows
+
+    path = _temp_db_path()
+    results = {}
+    keystrokes = ['ива', 'иван', 'Ivan', 'сидор', 'nurlan', 'айгер', '701 555', '87015']
+    try:
+        started = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            pool = _create_clients_database(path, clients)
+        print(f"  БД: {clients} клиентов, {time.perf_counter() - started:.1f} с (с построением индекса)")
+
+        with pool.connection() as conn:
+            def like(query):
+                pattern = f"%{query}%"
+                return conn.execute('''
+                    SELECT id, first_name, last_name, birth_date, phone, email FROM clients
+                    WHERE first_name LIKE ? OR last_name LIKE ? OR phone LIKE ?
+                    ORDER BY last_name, first_name LIMIT 10
+                ''', (pattern, pattern, pattern)).fetchall()
+
+            def fts(query):
+                return search_client_rows(conn, query)
+
+            for name, func in (('like', like), ('fts5', fts)):
+                timings = []
+                for _ in range(repeats):
+                    for query in keystrokes:
+                        query_started = time.perf_counter()
+                        func(query)
+                        timings.append(time.perf_counter() - query_started)
+                results[name] = {
+                    'p50_ms': _percentile(timings, 50) * 1000,
+                    'p95_ms': _percentile(timings, 95) * 1000,
+                }
+                print(f"  {name:<6} p50: {results[name]['p50_ms']:7.2f} мс  p95: {results[name]['p95_ms']:7.2f} мс")
+            for query in ('Ivan', 'айгер', '87015'):
+                print(f"  '{query}' -> like: {len(like(query))}, fts5: {len(fts(query))} (первые 10)")
+        pool.close_all()
+    finally:
+        _remove_db(path)
+    return results
+
+
+def benchmark_client_picker(sizes=(10000, 50000, 200000), page_size=20):
+    """Выбор пациента в форме приема: полный список в selectbox против поиска первых N"""
+    import contextlib
+    import io
+    import tracemalloc
+    from client_search import search_client_rows
+
+    results = {}
+    for clients in sizes:
+        path = _temp_db_path()
+        try:
+            with contextlib.redirect_stdout(io.StringIO()):
+                pool = _create_clients_database(path, clients)
+            with pool.connection() as conn:
+                def full_list():
+                    all_clients = conn.execute(
+                        'SELECT id, first_name, last_name, phone FROM clients ORDER BY last_name, first_name'
+                    ).fetchall()
+                    options = ["-- Выберите пациента или начните печатать --"] + [
+                        f"{client[1]} {client[2]} ({client[3]})" for client in all_clients
+                    ]
+                    ids = {f"{client[1]} {client[2]} ({client[3]})": client[0] for client in all_clients}
+                    return len(options) + len(ids)
+
+                def picker():
+                    found = search_client_rows(conn, 'иван', limit=page_size)
+                    return [(client[0], f"{client[1]} {client[2]} ({client[4]})") for client in found]
+
+                for name, func in (('список', full_list), ('поиск', picker)):
+                    tracemalloc.start()
+                    started = time.perf_counter()
+                    func()
+                    elapsed = time.perf_counter() - started
+                    peak = tracemalloc.get_traced_memory()[1]
+                    tracemalloc.stop()
+                    results[f"{name}/{clients}"] = {'ms': elapsed * 1000, 'peak_mb': peak / (1024 * 1024)}
+                    print(f"  {clients:>7} клиентов  {name:<7} {elapsed * 1000:8.2f} мс  память: {peak / (1024 * 1024):6.2f} МБ")
+            pool.close_all()
+        finally:
+            _remove_db(path)
+    return results
+
+
+# ==================== АНАЛИТИКА ====================
+
+PAYMENT_METHODS = ['Kaspi QR', 'Наличные', 'Карта', 'Перевод']
+SOURCES = ['instagram', '2gis', 'рекомендация', 'прямой', None]
+
+
+def _create_analytics_database(path, appointments, doctors=20, services=30, days=365, seed=16):
+    """БД клиники за период: приемы с услугами и оплатами (часть приемов оплачена двумя методами)"""
+    import random
+    from datetime import date, timedelta
+    from migrate_database import apply_schema_migrations
+
+    rng = random.Random(seed)
+    pool = ConnectionPool(path, profile={})
+    with pool.connection() as conn:
+        conn.executescript('''
+            CREATE TABLE clients (id INTEGER PRIMARY KEY, first_name TEXT, last_name TEXT, phone TEXT);
+            CREATE TABLE doctors (id INTEGER PRIMARY KEY, first_name TEXT, last_name TEXT, specialization TEXT,
+                is_active BOOLEAN DEFAULT 1);
+            CREATE TABLE services (id INTEGER PRIMARY KEY, name TEXT, price REAL, duration_minutes INTEGER);
+            CREATE TABLE appointments (id INTEGER PRIMARY KEY, client_id INTEGER, doctor_id INTEGER,
+                service_id INTEGER, appointment_date DATE, appointment_time TIME, status TEXT, notes TEXT,
+                start_time TIMESTAMP, end_time TIMESTAMP, actual_duration_minutes INTEGER, source TEXT,
+                payment_status TEXT DEFAULT 'не оплачен');
+            CREATE TABLE appointment_services (id INTEGER PRIMARY KEY, appointment_id INTEGER, service_id INTEGER,
+                price REAL);
+            CREATE TABLE appointment_service_payments (id INTEGER PRIMARY KEY, appointment_service_id INTEGER,
+                payment_method TEXT, amount REAL);
+            CREATE TABLE audit_log (id INTEGER PRIMARY KEY, timestamp TIMESTAMP);
+        ''')
+        conn.executemany("INSERT INTO clients VALUES (?, ?, 'Тестовый', '+7 700 000 0000')",
+                         [(i, f"Клиент{i}") for i in range(1, 5001)])
+        conn.executemany("INSERT INTO doctors (id, first_name, last_name, specialization) VALUES (?, ?, 'Тестовый', 'Терапевт')",
+                         [(i, f"Врач{i}") for i in range(1, doctors + 1)])
+        prices = {i: rng.choice((3000, 5000, 8000, 12000, 20000)) for i in range(1, services + 1)}
+        conn.executemany("INSERT INTO services VALUES (?, ?, ?, 30)",
+                         [(i, f"Услуга{i}", price) for i, price in prices.items()])
+        start = date(2024, 1, 1)
+        statuses = ['прием завершен'] * 6 + ['записан', 'не явился']
+        # Приемы записываются незадолго до даты: id растут вместе с датой приема
+        offsets = sorted(rng.randrange(days) for _ in range(appointments))
+        appointment_rows, service_rows, payment_rows = [], [], []
+        for appointment_id, offset in enumerate(offsets, start=1):
+            service_id = rng.randint(1, services)
+            status = rng.choice(statuses)
+            appointment_rows.append((
+                appointment_id, rng.randint(1, 5000), rng.randint(1, doctors), service_id,
+                (start + timedelta(days=offset)).isoformat(),
+                f"{rng.randint(9, 17):02d}:{rng.choice((0, 15, 30, 45)):02d}:00", status,
+                rng.randint(15, 60) if status == 'прием завершен' else None, rng.choice(SOURCES),
+            ))
+            service_rows.append((appointment_id, appointment_id, service_id, prices[service_id]))
+            if status == 'прием завершен':
+                if rng.random() < 0.2:
+                    half = prices[service_id] / 2
+                    payment_rows.append((appointment_id, PAYMENT_METHODS[0], half))
+                    payment_rows.append((appointment_id, rng.choice(PAYMENT_METHODS[1:]), half))
+                else:
+                    payment_rows.append((appointment_id, rng.choice(PAYMENT_METHODS), prices[service_id]))
+        conn.executemany(
+            "INSERT INTO appointments (id, client_id, doctor_id, service_id, appointment_date, appointment_time, "
+            "status, actual_duration_minutes, source) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", appointment_rows
+        )
+        conn.executemany("INSERT INTO appointment_services VALUES (?, ?, ?, ?)", service_rows)
+        conn.executemany(
+            "INSERT INTO appointment_service_payments (appointment_service_id, payment_method, amount) VALUES (?, ?, ?)",
+            payment_rows
+        )
+        conn.commit()
+        apply_schema_migrations(conn)
+    return pool, start
+
+
+def benchmark_analytics_rollup(appointments=100000, repeats=5):
+    """Дашборд за год: построчный запрос приемов с подзапросом оплат против дневной сводки"""
+    import contextlib
+    import io
+    from datetime import timedelta
+    from analytics_rollup import query_rollup, refresh_rollup
+
+    path = _temp_db_path()
+    results = {}
+    try:
+        started = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            pool, start = _create_analytics_database(path, appointments)
+        print(f"  БД: {appointments} приемов за год, {time.perf_counter() - started:.1f} с")
+        period = (start, start + timedelta(days=364))
+
+        with pool.connection() as conn:
+            started = time.perf_counter()
+            refresh_rollup(conn)
+            rows = conn.execute("SELECT COUNT(*) FROM analytics_daily").fetchone()[0]
+            print(f"  первое построение сводки: {(time.perf_counter() - started) * 1000:.0f} мс, строк: {rows}")
+
+            def row_level():
+                return conn.execute('''
+                    SELECT a.id, a.appointment_date, a.status, d.first_name || ' ' || d.last_name, s.name,
+                           COALESCE(s.price, 0), a.source,
+                           COALESCE((SELECT GROUP_CONCAT(asp.payment_method, ', ')
+                                     FROM appointment_services aps
+                                     LEFT JOIN appointment_service_payments asp ON aps.id = asp.appointment_service_id
+                                     WHERE aps.appointment_id = a.id AND asp.payment_method IS NOT NULL), 'Kaspi QR')
+                    FROM appointments a
+                    JOIN doctors d ON a.doctor_id = d.id
+                    LEFT JOIN services s ON a.service_id = s.id
+                    WHERE a.appointment_date BETWEEN ? AND ?
+                    ORDER BY a.appointment_date DESC
+                ''', (period[0].isoformat(), period[1].isoformat())).fetchall()
+
+            def rollup():
+                return query_rollup(conn, *period)
+
+            def after_write():
+                conn.execute("UPDATE appointments SET status = 'не явился' WHERE id = ?", (appointments // 2,))
+                conn.commit()
+                return query_rollup(conn, *period)
+
+            for name, func in (('приемы', row_level), ('сводка', rollup), ('сводка+запись', after_write)):
+                timings = []
+                for _ in range(repeats):
+                    query_started = time.perf_counter()
+                    rows = func()
+                    timings.append(time.perf_counter() - query_started)
+                results[name] = {'p50_ms': _percentile(timings, 50) * 1000, 'rows': len(rows)}
+                print(f"  {name:<14} p50: {results[name]['p50_ms']:8.2f} мс  строк: {len(rows)}")
+        pool.close_all()
+    finally:
+        _remove_db(path)
+    return results
+
+
+def benchmark_analytics_query(appointments=100000, repeats=5):
+    """Построчная аналитика: коррелированные подзапросы стоимости и оплат против агрегатов, присоединенных по приему"""
+    import contextlib
+    import io
+    from datetime import timedelta
+    from analytics_queries import fetch_analytics_rows
+
+    path = _temp_db_path()
+    results = {}
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            pool, start = _create_analytics_database(path, appointments)
+
+        with pool.connection() as conn:
+            # Те же колонки, что у fetch_analytics_rows, но подзапросами на каждую строку приема
+            def correlated(period):
+                return conn.execute('''
+                    SELECT a.id, a.appointment_date, a.appointment_time, a.status, a.actual_duration_minutes,
+                           c.first_name || ' ' || c.last_name, a.doctor_id, d.first_name || ' ' || d.last_name,
+                           d.specialization, s.name, s.price,
+                           (SELECT COALESCE(SUM(price), 0) FROM appointment_services WHERE appointment_id = a.id),
+                           (SELECT COALESCE(SUM(asp.amount), 0) FROM appointment_services aps
+                            JOIN appointment_service_payments asp ON aps.id = asp.appointment_service_id
+                            WHERE aps.appointment_id = a.id),
+                           a.source,
+                           COALESCE((SELECT GROUP_CONCAT(asp.payment_method, ', ')
+                                     FROM appointment_services aps
+                                     LEFT JOIN appointment_service_payments asp ON aps.id = asp.appointment_service_id
+                                     WHERE aps.appointment_id = a.id AND asp.payment_method IS NOT NULL), 'Kaspi QR')
+                    FROM appointments a
+                    JOIN clients c ON a.client_id = c.id
+                    JOIN doctors d ON a.doctor_id = d.id
+                    JOIN services s ON a.service_id = s.id
+                    WHERE a.appointment_date BETWEEN ? AND ?
+                    ORDER BY a.appointment_date, a.appointment_time
+                ''', (period[0].isoformat(), period[1].isoformat())).fetchall()
+
+            def set_based(period):
+                return fetch_analytics_rows(conn, *period)
+
+            for label, days in (('месяц', 30), ('год', 365)):
+                period = (start, start + timedelta(days=days - 1))
+                for name, func in (('подзапросы', correlated), ('group by', set_based)):
+                    timings = []
+                    for _ in range(repeats):
+                        started = time.perf_counter()
+                        rows = func(period)
+                        timings.append(time.perf_counter() - started)
+                    key = f"{name}/{label}"
+                    results[key] = {'p50_ms': _percentile(timings, 50) * 1000, 'rows': len(rows)}
+                    print(f"  {name:<11} {label:<6} p50: {results[key]['p50_ms']:8.2f} мс  строк: {len(rows)}")
+                mismatched = sum(1 for old, new in zip(correlated(period), set_based(period)) if old != new)
+                print(f"  расхождений за {label}: {mismatched}")
+        pool.close_all()
+    finally:
+        _remove_db(path)
+    return results
+
+def benchmark_analytics_snapshots(appointments=200000, days=730, repeats=3):
+    """Аналитика за два года: все строки из SQLite против снимков Parquet закрытых месяцев"""
+    import contextlib
+    import io
+    import shutil
+    import tempfile
+    from datetime import timedelta
+    import analytics_snapshots
+    from analytics_queries import fetch_analytics_rows, ANALYTICS_COLUMNS
+
+    if not analytics_snapshots.SNAPSHOTS_AVAILABLE:
+        print("  ⚠️ pandas/pyarrow не установлены - бенчмарк пропущен")
+        return {}
+    pd = analytics_snapshots.pd
+
+    path = _temp_db_path()
+    snapshot_dir = tempfile.mkdtemp()
+    results = {}
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            pool, start = _create_analytics_database(path, appointments, days=days)
+        end = start + timedelta(days=days - 1)
+        today = end - timedelta(days=10)
+
+        with pool.connection() as conn:
+            def live():
+                return pd.DataFrame(fetch_analytics_rows(conn, start, end), columns=ANALYTICS_COLUMNS)
+
+            def snapshots():
+                return analytics_snapshots.load_analytics_period(conn, start, end, snapshot_dir=snapshot_dir,
+                                                                 today=today)
+
+            started = time.perf_counter()
+            snapshots()
+            stats = analytics_snapshots.snapshot_stats(snapshot_dir)
+            print(f"  запись снимков: {(time.perf_counter() - started) * 1000:.0f} мс, "
+                  f"файлов: {stats['files']}, {stats['bytes'] / (1024 * 1024):.1f} МБ")
+
+            for name, func in (('sqlite', live), ('parquet', snapshots)):
+                timings = []
+                for _ in range(repeats):
+                    started = time.perf_counter()
+                    df = func()
+                    timings.append(time.perf_counter() - started)
+                memory = df.memory_usage(deep=True).sum() / (1024 * 1024)
+                results[name] = {'p50_ms': _percentile(timings, 50) * 1000, 'memory_mb': memory, 'rows': len(df)}
+                print(f"  {name:<8} p50: {results[name]['p50_ms']:8.2f} мс  память: {memory:7.1f} МБ  строк: {len(df)}")
+        pool.close_all()
+    finally:
+        _remove_db(path)
+        shutil.rmtree(snapshot_dir, ignore_errors=True)
+    return results
+
+
+def benchmark_analytics_kpi(rows=1000000, repeats=5):
+    """KPI и разрезы дашборда по кадру из 1 000 000 строк: группировка на каждый график против одного прохода"""
+    try:
+        import numpy as np
+        import pandas as pd
+        from analytics_kpi import compute_kpis
+        from analytics_rollup import ROLLUP_COLUMNS
+    except ImportError:
+        print("  ⚠️ pandas/numpy не установлены - бенчмарк пропущен")
+        return {}
+
+    rng = np.random.default_rng(19)
+    days = pd.date_range('2024-01-01', periods=365).strftime('%Y-%m-%d').to_numpy()
+    doctors = np.array([f"Врач {i}" for i in range(50)])
+    statuses = np.array(['прием завершен', 'записан', 'не явился', 'на приеме'])
+    methods = np.array(['', '', '', 'Kaspi QR', 'Наличные', 'Карта'])
+    is_payment = rng.integers(0, len(methods), rows)
+    df = pd.DataFrame({
+        'day': days[rng.integers(0, len(days), rows)],
+        'doctor_id': rng.integers(1, 51, rows),
+        'doctor_name': doctors[rng.integers(0, len(doctors), rows)],
+        'service_id': rng.integers(1, 21, rows),
+        'service_name': np.array([f"Услуга {i}" for i in range(20)])[rng.integers(0, 20, rows)],
+        'source': np.array(['', 'instagram', '2gis', 'прямой'])[rng.integers(0, 4, rows)],
+        'status': statuses[rng.integers(0, len(statuses), rows)],
+        'payment_method': methods[is_payment],
+    })
+    appointments = np.where(methods[is_payment] == '', rng.integers(1, 5, rows), 0)
+    df['appointments'] = appointments
+    df['revenue'] = appointments * 5000.0
+    df['duration_sum'] = appointments * 30
+    df['duration_count'] = appointments
+    df['paid_amount'] = np.where(appointments == 0, 5000.0, 0.0)
+    df['paid_appointments'] = (appointments == 0).astype(int)
+    df = df[ROLLUP_COLUMNS].copy()
+    previous = df.sample(frac=0.5, random_state=1).copy()
+
+    def per_chart():
+        results = []
+        for frame in (df, previous):
+            total = frame['appointments'].sum()
+            revenue = frame['revenue'].sum()
+            completed = frame.loc[frame['status'] == 'прием завершен', 'appointments'].sum()
+            results.append((total, revenue, revenue / total, completed / total))
+        results.append(df.groupby('status')['appointments'].sum())
+        results.append(df.groupby('doctor_name')['appointments'].sum())
+        results.append(df.groupby('doctor_name')['revenue'].sum())
+        results.append(df.groupby('day')['appointments'].sum())
+        sources = df[df['source'] != '']
+        results.append(sources.groupby('source').agg({'appointments': 'sum', 'revenue': 'sum'}))
+        payments = df[df['payment_method'] != '']
+        results.append(payments.groupby('payment_method').agg(
+            total_amount=('paid_amount', 'sum'), appointment_count=('paid_appointments', 'sum')))
+        return results
+
+    def single_pass():
+        return compute_kpis(df, previous=previous)
+
+    results = {}
+    for label, frame_dtype in (('object', None), ('category', 'category')):
+        if frame_dtype:
+            for column in ('day', 'doctor_name', 'source', 'status', 'payment_method'):
+                df[column] = df[column].astype(frame_dtype)
+                previous[column] = previous[column].astype(frame_dtype)
+        for name, func in (('по графикам', per_chart), ('один проход', single_pass)):
+            timings = []
+            for _ in range(repeats):
+                started = time.perf_counter()
+                func()
+                timings.append(time.perf_counter() - started)
+            key = f"{name}/{label}"
+            results[key] = {'p50_ms': _percentile(timings, 50) * 1000}
+            print(f"  {name:<12} {label:<9} p50: {results[key]['p50_ms']:8.2f} мс")
+    kpis = single_pass()
+    print(f"  приемов: {kpis.totals['appointments']}, память кадра: "
+          f"{df.memory_usage(deep=True).sum() / (1024 * 1024):.1f} МБ (category)")
+    return results
+
+
+def benchmark_analytics_cache(appointments=100000, repeats=20):
+    """Повторные открытия аналитики за год: пересчет каждый раз против кеша с поколением записи"""
+    import contextlib
+    import io
+    from datetime import timedelta
+    from analytics_queries import fetch_analytics_rows
+    from analytics_cache import AnalyticsCache
+
+    path = _temp_db_path()
+    results = {}
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            pool, start = _create_analytics_database(path, appointments)
+
+        with pool.connection() as conn:
+            params = (start, start + timedelta(days=364), None)
+            cache = AnalyticsCache()
+
+            def uncached():
+                return fetch_analytics_rows(conn, *params)
+
+            def cached():
+                return cache.get(conn, 'details', params, uncached)
+
+            cached()
+            for name, func in (('без кеша', uncached), ('кеш', cached)):
+                timings = []
+                for _ in range(repeats):
+                    started = time.perf_counter()
+                    func()
+                    timings.append(time.perf_counter() - started)
+                results[name] = {'p50_ms': _percentile(timings, 50) * 1000}
+                print(f"  {name:<9} p50: {results[name]['p50_ms']:8.3f} мс")
+
+            conn.execute("UPDATE appointments SET status = 'отменен' WHERE id = 1")
+            conn.commit()
+            started = time.perf_counter()
+            rows = cached()
+            results['после записи'] = {'ms': (time.perf_counter() - started) * 1000}
+            stale = sum(1 for row in rows if row[0] == 1 and row[3] != 'отменен')
+            print(f"  после записи: {results['после записи']['ms']:8.2f} мс, устаревших строк: {stale}")
+            stats = cache.stats()
+            print(f"  попаданий: {stats['hits']}, сбросов: {stats['invalidations']}, "
+                  f"память: {stats['bytes'] / (1024 * 1024):.1f} МБ")
+        pool.close_all()
+    finally:
+        _remove_db(path)
+    return results
+
+
+def benchmark_appointment_balance(appointments=100000, repeats=200):
+    """Остаток приема и список неоплаченных: пересчет по услугам и оплатам против колонок приема"""
+    import contextlib
+    import io
+    import random
+    from appointment_balance import fetch_unpaid
+
+    path = _temp_db_path()
+    results = {}
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            pool, _ = _create_analytics_database(path, appointments)
+
+        with pool.connection() as conn:
+            ids = random.Random(23).sample(range(1, appointments + 1), repeats)
+
+            def aggregated(appointment_id):
+                return conn.execute('''
+                    SELECT (SELECT COALESCE(SUM(price), 0) FROM appointment_services WHERE appointment_id = ?),
+                           (SELECT COALESCE(SUM(asp.amount), 0) FROM appointment_service_payments asp
+                            JOIN appointment_services aps ON asp.appointment_service_id = aps.id
+                            WHERE aps.appointment_id = ?)
+                ''', (appointment_id, appointment_id)).fetchone()
+
+            def stored(appointment_id):
+                return conn.execute("SELECT total_cost, total_paid FROM appointments WHERE id = ?",
+                                    (appointment_id,)).fetchone()
+
+            for name, func in (('пересчет', aggregated), ('колонки', stored)):
+                timings = []
+                for appointment_id in ids:
+                    started = time.perf_counter()
+                    func(appointment_id)
+                    timings.append(time.perf_counter() - started)
+                results[f"остаток/{name}"] = {'p50_us': _percentile(timings, 50) * 1e6}
+                print(f"  остаток {name:<9} p50: {results[f'остаток/{name}']['p50_us']:8.1f} мкс")
+            mismatched = sum(1 for appointment_id in ids
+                             if abs(aggregated(appointment_id)[0] - stored(appointment_id)[0]) > 0.005
+                             or abs(aggregated(appointment_id)[1] - stored(appointment_id)[1]) > 0.005)
+            print(f"  расхождений: {mismatched}")
+
+            def unpaid_aggregated():
+                return conn.execute('''
+                    SELECT a.id, t.cost - COALESCE(p.paid, 0)
+                    FROM appointments a
+                    JOIN (SELECT appointment_id, SUM(price) AS cost FROM appointment_services
+                          GROUP BY appointment_id) t ON t.appointment_id = a.id
+                    LEFT JOIN (SELECT aps.appointment_id, SUM(asp.amount) AS paid
+                               FROM appointment_service_payments asp
+                               JOIN appointment_services aps ON asp.appointment_service_id = aps.id
+                               GROUP BY aps.appointment_id) p ON p.appointment_id = a.id
+                    WHERE t.cost - COALESCE(p.paid, 0) > 0.005
+                    ORDER BY a.appointment_date DESC, a.appointment_time DESC
+                    LIMIT 50
+                ''').fetchall()
+
+            for name, func in (('пересчет', unpaid_aggregated), ('индекс', lambda: fetch_unpaid(conn))):
+                timings = []
+                for _ in range(5):
+                    started = time.perf_counter()
+                    rows = func()
+                    timings.append(time.perf_counter() - started)
+                results[f"неоплаченные/{name}"] = {'p50_ms': _percentile(timings, 50) * 1000}
+                print(f"  неоплаченные {name:<9} p50: {results[f'неоплаченные/{name}']['p50_ms']:8.2f} мс  строк: {len(rows)}")
+        pool.close_all()
+    finally:
+        _remove_db(path)
+    return results
+
+
+def benchmark_availability(doctors=20, days=365, repeats=500):
+    """Год записей: проверка пересечения и поиск свободных окон по индексу интервалов против перебора"""
+    import random
+    from datetime import date, datetime, timedelta
+    from availability import load_availability, to_minutes, MINUTES_PER_DAY
+
+    rng = random.Random(24)
+    path = _temp_db_path()
+    results = {}
+    try:
+        pool = ConnectionPool(path, profile={})
+        with pool.connection() as conn:
+            conn.executescript('''
+                CREATE TABLE doctors (id INTEGER PRIMARY KEY, specialization TEXT, is_active BOOLEAN DEFAULT 1);
+                CREATE TABLE services (id INTEGER PRIMARY KEY, duration_minutes INTEGER);
+                CREATE TABLE appointments (id INTEGER PRIMARY KEY, doctor_id INTEGER, service_id INTEGER,
+                    appointment_date DATE, appointment_time TIME, status TEXT);
+                CREATE INDEX idx_appointments_doctor_date_time ON appointments (doctor_id, appointment_date, appointment_time);
+            ''')
+            conn.executemany("INSERT INTO doctors (id, specialization) VALUES (?, ?)",
+                             [(i, ('терапевт', 'гинеколог', 'хирург', 'кардиолог')[i % 4]) for i in range(1, doctors + 1)])
+            durations = {1: 15, 2: 30, 3: 45, 4: 60}
+            conn.executemany("INSERT INTO services VALUES (?, ?)", list(durations.items()))
+            # Плотное расписание: приемы идут подряд с редкими окнами, рабочий день 9-18
+            start = date(2024, 1, 1)
+            rows = []
+            for doctor_id in range(1, doctors + 1):
+                for offset in range(days):
+                    clock = 9 * 60
+                    while True:
+                        service_id = rng.randint(1, 4)
+                        if clock + durations[service_id] > 18 * 60:
+                            break
+                        if rng.random() < 0.9:
+                            rows.append((doctor_id, service_id, (start + timedelta(days=offset)).isoformat(),
+                                         f"{clock // 60:02d}:{clock % 60:02d}:00", 'записан'))
+                        clock += durations[service_id]
+            conn.executemany("INSERT INTO appointments (doctor_id, service_id, appointment_date, appointment_time, "
+                             "status) VALUES (?, ?, ?, ?, ?)", rows)
+            conn.commit()
+            print(f"  приемов: {len(rows)}")
+
+            started = time.perf_counter()
+            engine = load_availability(conn, start, start + timedelta(days=days - 1))
+            results['build_ms'] = (time.perf_counter() - started) * 1000
+            print(f"  построение индекса: {results['build_ms']:.0f} мс")
+
+            # Перебор: интервалы врача списком, как без индекса
+            lists = {doctor_id: list(zip(busy.starts, busy.ends)) for doctor_id, busy in engine.busy.items()}
+
+            def linear_free(doctor_id, begin, end):
+                return not any(s < end and e > begin for s, e in lists[doctor_id])
+
+            def sql_free(doctor_id, begin, end):
+                moment = datetime(1, 1, 1) + timedelta(minutes=begin - MINUTES_PER_DAY)
+                return conn.execute('''
+                    SELECT 1 FROM appointments a JOIN services s ON s.id = a.service_id
+                    WHERE a.doctor_id = ? AND a.appointment_date = ? AND a.appointment_time < ?
+                      AND time(a.appointment_time, '+' || s.duration_minutes || ' minutes') > ?
+                    LIMIT 1
+                ''', (doctor_id, moment.date().isoformat(), (moment + timedelta(minutes=end - begin)).strftime('%H:%M:%S'),
+                      moment.strftime('%H:%M:%S'))).fetchone() is None
+
+            queries = []
+            for _ in range(repeats):
+                doctor_id = rng.randint(1, doctors)
+                day = start + timedelta(days=rng.randrange(days))
+                begin = to_minutes(day, f"{rng.randint(9, 16):02d}:{rng.choice((0, 15, 30, 45)):02d}")
+                queries.append((doctor_id, begin, begin + 30))
+            mismatched = sum(1 for q in queries
+                             if engine.busy[q[0]].is_free(q[1], q[2]) != linear_free(*q) or sql_free(*q) != linear_free(*q))
+            for name, func in (('перебор', linear_free), ('sql', sql_free),
+                               ('индекс', lambda d, b, e: engine.busy[d].is_free(b, e))):
+                timings = []
+                for query in queries:
+                    started = time.perf_counter()
+                    func(*query)
+                    timings.append(time.perf_counter() - started)
+                results[f"свободно/{name}"] = {'p50_us': _percentile(timings, 50) * 1e6}
+                print(f"  интервал свободен? {name:<8} p50: {results[f'свободно/{name}']['p50_us']:9.1f} мкс")
+            print(f"  расхождений: {mismatched}")
+
+            def linear_slots(doctor_id, after, count=5):
+                # Слот за слотом по сетке 15 минут с проверкой перебором
+                found, value = [], after
+                while len(found) < count:
+                    clock = value % MINUTES_PER_DAY
+                    if 9 * 60 <= clock and clock + 30 <= 18 * 60 and linear_free(doctor_id, value, value + 30):
+                        found.append(value)
+                    value += 15
+                return found
+
+            timings = {'перебор': [], 'индекс': []}
+            for doctor_id, begin, _ in queries[:100]:
+                after = datetime(1, 1, 1) + timedelta(minutes=begin - MINUTES_PER_DAY)
+                started = time.perf_counter()
+                fast = engine.next_free_slots(doctor_id, 30, after, count=5)
+                timings['индекс'].append(time.perf_counter() - started)
+                started = time.perf_counter()
+                slow = linear_slots(doctor_id, begin)
+                timings['перебор'].append(time.perf_counter() - started)
+                assert [to_minutes(slot.date(), slot.time()) for slot in fast] == slow
+            for name, values in timings.items():
+                results[f"5 окон/{name}"] = {'p50_us': _percentile(values, 50) * 1e6}
+                print(f"  5 ближайших окон {name:<8} p50: {results[f'5 окон/{name}']['p50_us']:9.1f} мкс")
+
+            timings = []
+            for doctor_id, begin, _ in queries[:100]:
+                after = datetime(1, 1, 1) + timedelta(minutes=begin - MINUTES_PER_DAY)
+                started = time.perf_counter()
+                engine.first_free_slot('гинеколог', 60, after)
+                timings.append(time.perf_counter() - started)
+            results['первое окно специальности'] = {'p50_us': _percentile(timings, 50) * 1e6}
+            print(f"  первое окно среди гинекологов p50: {results['первое окно специальности']['p50_us']:9.1f} мкс")
+        pool.close_all()
+    finally:
+        _remove_db(path)
+    return results
+
+
+def benchmark_appointment_series(doctors=20, days=120, courses=50, occurrences=10):
+    """Курс из occurrences сеансов: запись по одному приему против серии одной транзакцией (без git)"""
+    import random
+    from datetime import date, timedelta
+    from availability import load_availability, service_duration
+    from appointment_series import expand_recurrence, create_series_rows
+
+    rng = random.Random(25)
+    path = _temp_db_path()
+    results = {}
+    try:
+        pool = ConnectionPool(path)
+        with pool.connection() as conn:
+            conn.executescript('''
+                CREATE TABLE doctors (id INTEGER PRIMARY KEY, specialization TEXT, is_active BOOLEAN DEFAULT 1);
+                CREATE TABLE services (id INTEGER PRIMARY KEY, price REAL, duration_minutes INTEGER);
+                CREATE TABLE appointments (id INTEGER PRIMARY KEY, client_id INTEGER, doctor_id INTEGER,
+                    service_id INTEGER, appointment_date DATE, appointment_time TIME, status TEXT DEFAULT 'записан',
+                    notes TEXT, source TEXT);
+                CREATE TABLE appointment_services (id INTEGER PRIMARY KEY, appointment_id INTEGER, service_id INTEGER,
+                    price REAL);
+                CREATE INDEX idx_appointments_doctor_date_time ON appointments (doctor_id, appointment_date, appointment_time);
+            ''')
+            conn.executemany("INSERT INTO doctors (id, specialization) VALUES (?, 'физиотерапевт')",
+                             [(i,) for i in range(1, doctors + 1)])
+            conn.execute("INSERT INTO services VALUES (1, 4000, 45)")
+            start = date(2024, 1, 1)
+            conn.executemany("INSERT INTO appointments (client_id, doctor_id, service_id, appointment_date, "
+                             "appointment_time) VALUES (1, ?, 1, ?, ?)",
+                             [(doctor_id, (start + timedelta(days=offset)).isoformat(), f"{hour:02d}:00:00")
+                              for doctor_id in range(1, doctors + 1) for offset in range(days)
+                              for hour in range(9, 18) if rng.random() < 0.5])
+            conn.commit()
+
+            def book_one_by_one(doctor_id, dates, appointment_time):
+                # Как create_appointment в цикле: проверка, вставка и commit на каждый прием
+                for day in dates:
+                    conn.execute("BEGIN IMMEDIATE")
+                    engine = load_availability(conn, day, day, doctor_ids=[doctor_id])
+                    if engine.is_free(doctor_id, day, appointment_time, service_duration(conn, 1)):
+                        cursor = conn.execute("INSERT INTO appointments (client_id, doctor_id, service_id, "
+                                              "appointment_date, appointment_time) VALUES (2, ?, 1, ?, ?)",
+                                              (doctor_id, day.isoformat(), appointment_time))
+                        conn.execute("INSERT INTO appointment_services (appointment_id, service_id, price) "
+                                     "VALUES (?, 1, 4000)", (cursor.lastrowid,))
+                    conn.commit()
+
+            def book_series(doctor_id, dates, appointment_time):
+                create_series_rows(conn, 2, doctor_id, 1, dates, appointment_time, skip_conflicts=True)
+
+            for name, func in (('по одному', book_one_by_one), ('серия', book_series)):
+                timings = []
+                for _ in range(courses):
+                    dates = expand_recurrence(start + timedelta(days=rng.randrange(days - 21)), count=occurrences,
+                                              frequency='daily', interval=2)
+                    started = time.perf_counter()
+                    func(rng.randint(1, doctors), dates, f"{rng.randint(9, 17):02d}:30:00")
+                    timings.append(time.perf_counter() - started)
+                results[name] = {'p50_ms': _percentile(timings, 50) * 1000}
+                print(f"  курс из {occurrences} приемов {name:<10} p50: {results[name]['p50_ms']:7.2f} мс")
+        pool.close_all()
+    finally:
+        _remove_db(path)
+    return results
+
+
+BENCHMARKS = {
+    'wal': ("💾 WAL: чтения во время записи", benchmark_wal_concurrent_reads),
+    'durability': ("🔄 Git: задержка записи sync против async", benchmark_git_durability),
+    'git_commit': ("📦 Git: коммит через CLI против прямой записи объектов", benchmark_git_commit_backends),
+    'calendar_week': ("📅 Календарь: неделя из 1000 приемов по ячейкам", benchmark_calendar_week),
+    'calendar_filter': ("👨‍⚕️ Календарь: 50 врачей, 5000 приемов в неделю, фильтр врачей", benchmark_calendar_doctor_filter),
+    'calendar_cache': ("⚡ Календарь: перезапуск страницы с кешем недели", benchmark_calendar_cache),
+    'client_search': ("🔎 Поиск клиентов: 200 000 записей, LIKE против FTS5", benchmark_client_search),
+    'client_picker': ("👤 Выбор пациента: весь список против поиска первых 20", benchmark_client_picker),
+    'analytics_query': ("🧾 Аналитика: 100 000 приемов, подзапрос оплат против GROUP BY", benchmark_analytics_query),
+    'analytics_snapshots': ("🗄️ Аналитика: два года из SQLite против снимков Parquet", benchmark_analytics_snapshots),
+    'analytics_kpi': ("🧮 Аналитика: KPI по 1 000 000 строк, группировки против одного прохода", benchmark_analytics_kpi),
+    'analytics_cache': ("♻️ Аналитика: повторные открытия года с кешем по поколению записи", benchmark_analytics_cache),
+    'appointment_balance': ("💳 Остаток приема: пересчет по услугам и оплатам против колонок приема", benchmark_appointment_balance),
+    'availability': ("🗓️ Свободное время: год записей, индекс интервалов против перебора", benchmark_availability),
+    'appointment_series': ("🔁 Курс приемов: запись по одному против серии одной транзакцией", benchmark_appointment_series),
+    'analytics_rollup': ("📊 Аналитика: год приемов построчно против дневной сводки", benchmark_analytics_rollup),
+}
+
+
+def run_benchmarks(names=None):
+    """Запуск бенчмарков"""
+    print("⏱️ БЕНЧМАРКИ ПРОИЗВОДИТЕЛЬНОСТИ JARDEM")
+    print("=" * 60)
+
+    results = {}
+    for name, (title, func) in BENCHMARKS.items():
+        if names and name not in names:
+            continue
+        print(f"\n{title}")
+        results[name] = func()
+
+    print("\n" + "=" * 60)
+    return results
+
+
+if __name__ == "__main__":
+    run_benchmarks(sys.argv[1:])
@@ -0,0 +1,1849 @@
+#!/usr/bin/env python3
+"""
+Регрессионные тесты производительности Jardem Medical Center
+Пул соединений, индексы и планы запросов, журнал изменений, резервные копии, фоновая синхронизация, вызовы git, календарь
+"""
+
+import unittest
+import gzip
+import json
+import os
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+import shutil
+import subprocess
+from unittest import mock
+
+# Добавляем путь к модулям
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from db_pool import ConnectionPool, get_pool, reset_pool
+from migrate_database import apply_schema_migrations
+import change_log
+import backup_store
+import git_sync
+import git_objects
+import calendar_index
+import calendar_cache
+import client_search
+import analytics_rollup
+import analytics_queries
+import analytics_snapshots
+import analytics_cache
+import appointment_details
+import payments
+import appointment_balance
+import availability
+import appointment_series
+import analytics_kpi
+from git_sync import SyncWorker, SyncJournal
+
+# Минимальная схема таблиц, участвующих в горячих запросах (как в database.init_database)
+TEST_SCHEMA = [
+    "CREATE TABLE users (id INTEGER PRIMARY KEY AUTOINCREMENT, username TEXT, name TEXT)",
+    "CREATE TABLE clients (id INTEGER PRIMARY KEY AUTOINCREMENT, first_name TEXT NOT NULL, last_name TEXT, "
+    "birth_date DATE, phone TEXT NOT NULL, email TEXT, is_active BOOLEAN DEFAULT 1)",
+    "CREATE TABLE doctors (id INTEGER PRIMARY KEY AUTOINCREMENT, first_name TEXT NOT NULL, last_name TEXT NOT NULL, "
+    "specialization TEXT NOT NULL, phone TEXT, email TEXT, is_active BOOLEAN DEFAULT 1)",
+    "CREATE TABLE services (id INTEGER PRIMARY KEY AUTOINCREMENT, name TEXT NOT NULL, description TEXT, "
+    "price DECIMAL(10,2) NOT NULL, duration_minutes INTEGER DEFAULT 30, doctor_id INTEGER, is_active BOOLEAN DEFAULT 1)",
+    "CREATE TABLE appointments (id INTEGER PRIMARY KEY AUTOINCREMENT, client_id INTEGER NOT NULL, "
+    "doctor_id INTEGER NOT NULL, service_id INTEGER NOT NULL, appointment_date DATE NOT NULL, "
+    "appointment_time TIME NOT NULL, status TEXT DEFAULT 'записан', notes TEXT, start_time TIMESTAMP, "
+    "end_time TIMESTAMP, actual_duration_minutes INTEGER, source TEXT DEFAULT 'прямой', "
+    "payment_status TEXT DEFAULT 'не оплачен', created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP, "
+    "updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP)",
+    "CREATE TABLE appointment_services (id INTEGER PRIMARY KEY AUTOINCREMENT, appointment_id INTEGER NOT NULL, "
+    "service_id INTEGER NOT NULL, price DECIMAL(10,2), created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP, "
+    "FOREIGN KEY (appointment_id) REFERENCES appointments (id) ON DELETE CASCADE, UNIQUE(appointment_id, service_id))",
+    "CREATE TABLE appointment_service_payments (id INTEGER PRIMARY KEY AUTOINCREMENT, "
+    "appointment_service_id INTEGER NOT NULL, payment_method TEXT NOT NULL, amount DECIMAL(10,2) NOT NULL, "
+    "payment_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP, notes TEXT, "
+    "FOREIGN KEY (appointment_service_id) REFERENCES appointment_services (id) ON DELETE CASCADE)",
+    "CREATE TABLE audit_log (id INTEGER PRIMARY KEY AUTOINCREMENT, user_id INTEGER, action TEXT NOT NULL, "
+    "table_name TEXT, record_id INTEGER, old_values TEXT, new_values TEXT, "
+    "timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP)",
+]
+
+
+def create_test_database(path):
+    """Создать тестовую БД со схемой и всеми миграциями"""
+    pool = ConnectionPool(path, profile={})
+    with pool.connection() as conn:
+        for statement in TEST_SCHEMA:
+            conn.execute(statement)
+        conn.commit()
+        apply_schema_migrations(conn)
+    return pool
+
+
+class TestConnectionPool(unittest.TestCase):
+    """Тесты пула соединений"""
+
+    def setUp(self):
+        """Временная БД для пула"""
+        self.test_db = tempfile.NamedTemporaryFile(delete=False, suffix='.db')
+        self.test_db.close()
+        self.pool = ConnectionPool(self.test_db.name, max_size=2, acquire_timeout=0.2)
+
+    def tearDown(self):
+        """Очистка после тестов"""
+        self.pool.close_all()
+        if os.path.exists(self.test_db.name):
+            os.unlink(self.test_db.name)
+
+    def test_connection_is_reused(self):
+        """Закрытое соединение возвращается в пул и переиспользуется"""
+        conn = self.pool.acquire()
+        conn.close()
+        conn_again = self.pool.acquire()
+        conn_again.close()
+
+        self.assertIs(conn, conn_again, "Соединение должно переиспользоваться")
+        stats = self.pool.stats()
+        self.assertEqual(stats['opens'], 1)
+        self.assertEqual(stats['reuses'], 1)
+
+    def test_foreign_keys_enabled_once(self):
+        """PRAGMA foreign_keys включается при открытии соединения"""
+        with self.pool.connection() as conn:
+            self.assertEqual(conn.execute("PRAGMA foreign_keys").fetchone()[0], 1)
+
+    def test_nested_acquire_same_thread(self):
+        """Вложенные вызовы в одном потоке получают то же соединение"""
+        outer = self.pool.acquire()
+        inner = self.pool.acquire()
+        self.assertIs(outer, inner)
+        inner.close()
+        self.assertEqual(self.pool.stats()['in_use'], 1, "Внешний вызов еще держит соединение")
+        outer.close()
+        self.assertEqual(self.pool.stats()['in_use'], 0)
+
+    def test_uncommitted_changes_rolled_back_on_release(self):
+        """Незакоммиченная транзакция откатывается при возврате в пул"""
+        with self.pool.connection() as conn:
+            conn.execute("CREATE TABLE t (x INTEGER)")
+            conn.commit()
+            conn.execute("INSERT INTO t VALUES (1)")
+
+        with self.pool.connection() as conn:
+            self.assertEqual(conn.execute("SELECT COUNT(*) FROM t").fetchone()[0], 0)
+
+    def test_max_size_timeout(self):
+        """При исчерпании пула ожидание ограничено таймаутом"""
+        held = []
+        release = threading.Event()
+        acquired = threading.Barrier(3)
+
+        def hold():
+            conn = self.pool.acquire()
+            held.append(conn)
+            acquired.wait()
+            release.wait()
+            conn.close()
+
+        threads = [threading.Thread(target=hold) for _ in range(2)]
+        for thread in threads:
+            thread.start()
+        acquired.wait()
+
+        with self.assertRaises(Exception):
+            self.pool.acquire()
+        self.assertEqual(self.pool.stats()['waits'], 1)
+
+        release.set()
+        for thread in threads:
+            thread.join()
+
+    def test_dead_thread_connection_reclaimed(self):
+        """Соединение, не закрытое завершившимся потоком, возвращается в пул"""
+        def leak():
+            self.pool.acquire()
+
+        for _ in range(3):
+            thread = threading.Thread(target=leak)
+            thread.start()
+            thread.join()
+
+        self.assertGreaterEqual(self.pool.stats()['reclaimed'], 1)
+
+    def test_dead_thread_write_lock_released(self):
+        """Транзакция потока, упавшего без close(), не блокирует запись других потоков"""
+        self.pool.profile = {'busy_timeout': 100}
+        with self.pool.connection() as conn:
+            conn.execute("CREATE TABLE t (x INTEGER UNIQUE)")
+            conn.execute("INSERT INTO t VALUES (1)")
+            conn.commit()
+
+        def failed_write():
+            # Вызывающий код без try/finally: исключение, close() не вызван
+            conn = self.pool.acquire()
+            try:
+                conn.execute("INSERT INTO t VALUES (2)")
+                conn.execute("INSERT INTO t VALUES (1)")
+            except sqlite3.IntegrityError:
+                pass
+
+        thread = threading.Thread(target=failed_write)
+        thread.start()
+        thread.join()
+
+        # Пул не исчерпан, но соединение мертвого потока возвращается при следующей выдаче
+        with self.pool.connection() as conn:
+            conn.execute("INSERT INTO t VALUES (3)")
+            conn.commit()
+            self.assertEqual(conn.execute("SELECT x FROM t ORDER BY x").fetchall(), [(1,), (3,)])
+        self.assertEqual(self.pool.stats()['in_use'], 0)
+
+    def test_nested_acquire_uses_savepoint(self):
+        """commit/rollback вложенного вызова не завершают транзакцию внешнего"""
+        with self.pool.connection() as conn:
+            conn.execute("CREATE TABLE t (x INTEGER UNIQUE)")
+            conn.commit()
+
+        outer = self.pool.acquire()
+        outer.execute("INSERT INTO t VALUES (1)")
+
+        inner = self.pool.acquire()
+        inner.execute("INSERT INTO t VALUES (2)")
+        inner.rollback()
+        with self.assertRaises(sqlite3.IntegrityError):
+            with inner:
+                inner.execute("INSERT INTO t VALUES (1)")
+        inner.execute("INSERT INTO t VALUES (3)")
+        inner.commit()
+        inner.execute("INSERT INTO t VALUES (4)")  # не зафиксировано - откатывается при close()
+        inner.close()
+
+        self.assertTrue(outer.in_transaction, "Транзакция внешнего вызова продолжается")
+        outer.rollback()
+        self.assertEqual(outer.execute("SELECT COUNT(*) FROM t").fetchone()[0], 0,
+                         "Откат внешнего вызова отменяет и зафиксированное вложенным")
+        outer.execute("INSERT INTO t VALUES (1)")
+        with self.pool.connection() as conn:
+            conn.execute("INSERT INTO t VALUES (3)")
+            conn.commit()
+        outer.commit()
+        outer.close()
+
+        with self.pool.connection() as conn:
+            self.assertEqual(conn.execute("SELECT x FROM t ORDER BY x").fetchall(), [(1,), (3,)])
+
+    def test_idle_eviction(self):
+        """Простаивающие соединения закрываются по таймауту"""
+        self.pool.idle_timeout = 0
+        conn = self.pool.acquire()
+        conn.close()
+        self.pool.evict_idle()
+        stats = self.pool.stats()
+        self.assertEqual(stats['idle'], 0)
+        self.assertGreaterEqual(stats['evictions'], 1)
+
+
+class TestQueryPlans(unittest.TestCase):
+    """EXPLAIN QUERY PLAN: горячие запросы не должны сканировать таблицы целиком"""
+
+    def setUp(self):
+        """Тестовая БД с миграциями"""
+        self.test_db = tempfile.NamedTemporaryFile(delete=False, suffix='.db')
+        self.test_db.close()
+        self.pool = create_test_database(self.test_db.name)
+
+    def tearDown(self):
+        """Очистка после тестов"""
+        self.pool.close_all()
+        if os.path.exists(self.test_db.name):
+            os.unlink(self.test_db.name)
+
+    def query_plan(self, query, params=()):
+        with self.pool.connection() as conn:
+            rows = conn.execute(f"EXPLAIN QUERY PLAN {query}", params).fetchall()
+        return [row[3] for row in rows]
+
+    def assertNoFullScan(self, plan, alias):
+        """В плане нет полного сканирования таблицы alias"""
+        for detail in plan:
+            self.assertFalse(
+                detail == f"SCAN {alias}" or detail.startswith(f"SCAN {alias} "),
+                f"Полное сканирование {alias}: {plan}"
+            )
+
+    def assertUsesIndex(self, plan, index_name):
+        self.assertTrue(any(index_name in detail for detail in plan), f"Не используется {index_name}: {plan}")
+
+    def test_schema_version(self):
+        """Миграции записывают версию схемы и не выполняются повторно"""
+        with self.pool.connection() as conn:
+            self.assertGreaterEqual(conn.execute("PRAGMA user_version").fetchone()[0], 1)
+            self.assertEqual(apply_schema_migrations(conn), [])
+
+    def test_appointments_by_date_range(self):
+        """get_appointments_by_date_range: поиск по индексу даты"""
+        plan = self.query_plan('''
+            SELECT a.id, c.first_name, d.first_name, s.name
+            FROM appointments a
+            JOIN clients c ON a.client_id = c.id
+            JOIN doctors d ON a.doctor_id = d.id
+            JOIN services s ON a.service_id = s.id
+            WHERE a.appointment_date BETWEEN ? AND ?
+            ORDER BY a.appointment_date, a.appointment_time
+        ''', ('2025-01-01', '2025-01-07'))
+        self.assertNoFullScan(plan, 'a')
+        self.assertUsesIndex(plan, 'idx_appointments_date_time')
+        self.assertFalse(any('TEMP B-TREE' in detail for detail in plan), f"Лишняя сортировка: {plan}")
+
+    def test_appointments_doctor_filter(self):
+        """Календарь с выбранными врачами: фильтр doctor_id IN (...) по индексу врача"""
+        plan = self.query_plan(
+            calendar_index.APPOINTMENTS_QUERY + " AND a.doctor_id IN (?, ?, ?) AND a.status IN (?)"
+            " ORDER BY a.appointment_date, a.appointment_time",
+            ('2025-01-01', '2025-01-07', 1, 2, 3, 'записан')
+        )
+        self.assertNoFullScan(plan, 'a')
+        self.assertUsesIndex(plan, 'idx_appointments_doctor_date_time')
+
+        # Выбраны почти все врачи: неделя по индексу даты, без пересортировки
+        many = list(range(1, calendar_index.DOCTOR_INDEX_MAX_IDS + 2))
+        plan = self.query_plan(
+            calendar_index.APPOINTMENTS_QUERY + f" AND +a.doctor_id IN ({', '.join('?' * len(many))})"
+            " ORDER BY a.appointment_date, a.appointment_time",
+            ('2025-01-01', '2025-01-07', *many)
+        )
+        self.assertUsesIndex(plan, 'idx_appointments_date_time')
+        self.assertFalse(any('TEMP B-TREE' in detail for detail in plan), f"Лишняя сортировка: {plan}")
+
+    def test_appointment_conflict_check(self):
+        """create_appointment: проверка занятости врача по индексу"""
+        plan = self.query_plan('''
+            SELECT a.id, c.first_name, c.last_name
+            FROM appointments a
+            JOIN clients c ON a.client_id = c.id
+            WHERE a.doctor_id = ?
+            AND a.appointment_date = ?
+            AND a.appointment_time = ?
+            AND a.status NOT IN ('отменен', 'не явился')
+        ''', (1, '2025-01-01', '10:00:00'))
+        self.assertNoFullScan(plan, 'a')
+        self.assertUsesIndex(plan, 'idx_appointments_doctor_date_time')
+
+    def test_analytics_payment_methods_subquery(self):
+        """get_analytics_data: коррелированный подзапрос по индексам"""
+        plan = self.query_plan('''
+            SELECT a.id,
+                (SELECT GROUP_CONCAT(asp.payment_method, ', ')
+                 FROM appointment_services aps
+                 LEFT JOIN appointment_service_payments asp ON aps.id = asp.appointment_service_id
+                 WHERE aps.appointment_id = a.id AND asp.payment_method IS NOT NULL)
+            FROM appointments a
+            WHERE a.appointment_date BETWEEN ? AND ?
+        ''', ('2025-01-01', '2025-01-31'))
+        self.assertNoFullScan(plan, 'a')
+        self.assertNoFullScan(plan, 'aps')
+        self.assertNoFullScan(plan, 'asp')
+        self.assertUsesIndex(plan, 'idx_asp_appointment_service')
+
+    def test_audit_log_period(self):
+        """audit_viewer.get_audit_data: фильтр периода по индексу"""
+        plan = self.query_plan('''
+            SELECT al.id, al.timestamp, u.name
+            FROM audit_log al
+            LEFT JOIN users u ON al.user_id = u.id
+            WHERE al.timestamp >= ? AND al.timestamp < ?
+            ORDER BY al.timestamp DESC
+        ''', ('2025-01-01', '2025-01-08'))
+        self.assertNoFullScan(plan, 'al')
+        self.assertUsesIndex(plan, 'idx_audit_log_timestamp')
+
+
+class TestChangeLog(unittest.TestCase):
+    """Журнал изменений: выгрузка дельт, свертка и сборка БД"""
+
+    def setUp(self):
+        """БД с триггерами журнала и каталог sync во временной директории"""
+        self.tmp_dir = tempfile.mkdtemp()
+        self.db_path = os.path.join(self.tmp_dir, 'medical_center.db')
+        sync_dir = os.path.join(self.tmp_dir, 'sync')
+        self.patches = [
+            mock.patch.object(change_log, 'SYNC_DIR', sync_dir),
+            mock.patch.object(change_log, 'DELTAS_DIR', os.path.join(sync_dir, 'changes')),
+            mock.patch.object(change_log, 'SNAPSHOT_FILE', os.path.join(sync_dir, 'snapshot.json.gz')),
+        ]
+        for patch in self.patches:
+            patch.start()
+
+        with get_pool(self.db_path).connection() as conn:
+            for statement in TEST_SCHEMA:
+                conn.execute(statement)
+            conn.commit()
+            change_log.install_change_tracking(conn)
+            conn.execute("INSERT INTO clients (first_name, last_name, phone) VALUES ('Айжан', 'Нурланова', '+7 701 111 1111')")
+            conn.commit()
+        # Начальный снимок
+        change_log.ship_changes(self.db_path)
+
+    def tearDown(self):
+        """Очистка после тестов"""
+        for patch in self.patches:
+            patch.stop()
+        reset_pool(self.db_path)
+        shutil.rmtree(self.tmp_dir, ignore_errors=True)
+
+    def make_changes(self):
+        with get_pool(self.db_path).connection() as conn:
+            conn.execute("INSERT INTO clients (first_name, last_name, phone) VALUES ('Марат', 'Ахметов', '+7 701 222 2222')")
+            conn.execute("INSERT INTO doctors (first_name, last_name, specialization) VALUES ('Айгуль', 'Нурланова', 'Терапевт')")
+            conn.execute("INSERT INTO services (name, price, doctor_id) VALUES ('ЭКГ', 3000, 1)")
+            conn.execute(
+                "INSERT INTO appointments (client_id, doctor_id, service_id, appointment_date, appointment_time) "
+                "VALUES (2, 1, 1, '2025-06-02', '10:00')"
+            )
+            conn.execute("UPDATE clients SET phone = '+7 701 999 9999' WHERE id = 1")
+            conn.execute("INSERT INTO clients (first_name, last_name, phone) VALUES ('Удалить', 'Клиента', '0')")
+            conn.execute("DELETE FROM clients WHERE first_name = 'Удалить'")
+            conn.commit()
+
+    def dump(self):
+        with get_pool(self.db_path).connection() as conn:
+            return {
+                table: conn.execute(f"SELECT * FROM {table} ORDER BY id").fetchall()
+                for table in ('clients', 'doctors', 'services', 'appointments')
+            }
+
+    def test_initial_snapshot_written(self):
+        self.assertTrue(os.path.exists(change_log.SNAPSHOT_FILE))
+        self.assertEqual(change_log.pending_changes_count(self.db_path), 0)
+
+    def test_ship_only_changed_rows(self):
+        self.make_changes()
+        changed = change_log.ship_changes(self.db_path)
+        self.assertEqual(len(changed), 1)
+        records = list(change_log._read_delta(changed[0]))
+        self.assertEqual(len(records), 7)
+        self.assertEqual(records[-1]['op'], 'D')
+        self.assertEqual(change_log.pending_changes_count(self.db_path), 0)
+        self.assertEqual(change_log.ship_changes(self.db_path), [])
+
+    def test_rebuild_from_snapshot_and_deltas(self):
+        self.make_changes()
+        change_log.ship_changes(self.db_path)
+        expected = self.dump()
+
+        reset_pool(self.db_path)
+        os.unlink(self.db_path)
+        self.assertTrue(change_log.restore_database_from_log(self.db_path))
+        self.assertEqual(self.dump(), expected)
+        # Воспроизведение не должно попадать в журнал повторно
+        self.assertEqual(change_log.pending_changes_count(self.db_path), 0)
+
+    def test_incremental_apply_on_stale_database(self):
+        reset_pool(self.db_path)
+        stale_copy = os.path.join(self.tmp_dir, 'stale.db')
+        shutil.copy2(self.db_path, stale_copy)
+
+        self.make_changes()
+        change_log.ship_changes(self.db_path)
+        expected = self.dump()
+
+        reset_pool(self.db_path)
+        shutil.copy2(stale_copy, self.db_path)
+        self.assertTrue(change_log.restore_database_from_log(self.db_path))
+        self.assertEqual(self.dump(), expected)
+        # Нечего применять повторно
+        self.assertFalse(change_log.restore_database_from_log(self.db_path))
+
+    def test_compaction_removes_old_deltas(self):
+        with mock.patch.object(change_log, 'SNAPSHOT_EVERY', 2):
+            self.make_changes()
+            change_log.ship_changes(self.db_path)
+            with get_pool(self.db_path).connection() as conn:
+                conn.execute("UPDATE clients SET last_name = 'Сериков' WHERE id = 2")
+                conn.commit()
+            changed = change_log.ship_changes(self.db_path)
+
+        self.assertIn(change_log.SNAPSHOT_FILE, changed)
+        self.assertEqual(change_log._delta_files(), [])
+        expected = self.dump()
+        reset_pool(self.db_path)
+        os.unlink(self.db_path)
+        change_log.restore_database_from_log(self.db_path)
+        self.assertEqual(self.dump(), expected)
+
+    def test_rebase_after_backup_restore(self):
+        self.make_changes()
+        change_log.ship_changes(self.db_path)
+        with get_pool(self.db_path).connection() as conn:
+            conn.execute("DELETE FROM appointments")
+            conn.commit()
+        # Восстановленная БД становится новым снимком - старые дельты не применяются поверх нее
+        change_log.rebase_log_on_database(self.db_path)
+        expected = self.dump()
+        self.assertEqual(change_log._delta_files(), [])
+
+        reset_pool(self.db_path)
+        os.unlink(self.db_path)
+        change_log.restore_database_from_log(self.db_path)
+        self.assertEqual(self.dump(), expected)
+
+    def test_rebuild_keeps_schema_version_and_derived_schema(self):
+        """Собранная из снимка БД получает user_version и производную схему, миграции не повторяются"""
+        def schema(conn):
+            return conn.execute("SELECT type, name FROM sqlite_master WHERE name NOT LIKE '_cl_%' "
+                                "AND name NOT LIKE 'sqlite_%' ORDER BY type, name").fetchall()
+
+        with get_pool(self.db_path).connection() as conn:
+            apply_schema_migrations(conn)
+            change_log.install_change_tracking(conn)
+        self.make_changes()
+        change_log.ship_changes(self.db_path)
+        change_log.rebase_log_on_database(self.db_path)
+        # Изменение после снимка: при сборке воспроизводится с работающими триггерами
+        with get_pool(self.db_path).connection() as conn:
+            conn.execute("INSERT INTO appointment_services (appointment_id, service_id, price) VALUES (1, 1, 3000)")
+            conn.commit()
+            expected_schema = schema(conn)
+            version = conn.execute("PRAGMA user_version").fetchone()[0]
+        change_log.ship_changes(self.db_path)
+        expected = self.dump()
+
+        reset_pool(self.db_path)
+        os.unlink(self.db_path)
+        self.assertTrue(change_log.restore_database_from_log(self.db_path))
+        self.assertEqual(self.dump(), expected)
+        with get_pool(self.db_path).connection() as conn:
+            self.assertEqual(conn.execute("PRAGMA user_version").fetchone()[0], version)
+            self.assertEqual(schema(conn), expected_schema)
+            self.assertEqual(apply_schema_migrations(conn), [])
+            self.assertEqual(conn.execute("SELECT COUNT(*) FROM clients_fts").fetchone()[0],
+                             conn.execute("SELECT COUNT(*) FROM clients").fetchone()[0])
+            self.assertEqual(appointment_balance.check_balances(conn), [])
+
+    def test_pulled_deltas_with_overlapping_seq_applied(self):
+        """После отклоненного push применяются все новые дельты remote, даже с уже занятыми номерами"""
+        self.make_changes()
+        change_log.ship_changes(self.db_path)
+        known = change_log.log_files()
+
+        # Другой экземпляр выгрузил изменения с теми же номерами
+        remote = {'seq': 2, 't': 'clients', 'op': 'U', 'id': 50,
+                  'row': {'id': 50, 'first_name': 'Удаленный', 'last_name': 'Клиент', 'phone': '5'}}
+        change_log._atomic_write_gzip(os.path.join(change_log.DELTAS_DIR, f"{2:012d}-{2:012d}.jsonl.gz"),
+                                      [json.dumps(remote, ensure_ascii=False)])
+        self.assertTrue(change_log.apply_pulled_changes(known, self.db_path))
+        with get_pool(self.db_path).connection() as conn:
+            self.assertEqual(conn.execute("SELECT first_name FROM clients WHERE id = 50").fetchone(), ('Удаленный',))
+        self.assertEqual(change_log.pending_changes_count(self.db_path), 0)
+        self.assertFalse(change_log.apply_pulled_changes(change_log.log_files(), self.db_path))
+
+    def test_pulled_snapshot_keeps_local_deltas(self):
+        """Pull принес новый снимок remote: локальные дельты, которых в нем нет, сохраняются"""
+        with gzip.open(change_log.SNAPSHOT_FILE, 'rt', encoding='utf-8') as f:
+            remote = json.load(f)
+        self.make_changes()
+        change_log.ship_changes(self.db_path)
+        known = change_log.log_files()
+        expected = self.dump()
+
+        clients = remote['tables']['clients']
+        clients['rows'].append([100 if column == 'id' else {'first_name': 'Удаленный', 'phone': '5'}.get(column)
+                                for column in clients['columns']])
+        remote['seq'] = 20
+        change_log._atomic_write_gzip(change_log.SNAPSHOT_FILE, [json.dumps(remote, ensure_ascii=False)])
+
+        self.assertTrue(change_log.apply_pulled_changes(known, self.db_path))
+        dump = self.dump()
+        self.assertEqual([row[0] for row in dump['clients']], [row[0] for row in expected['clients']] + [100])
+        for table in ('doctors', 'services', 'appointments'):
+            self.assertEqual(dump[table], expected[table])
+
+
+class TestBackupStore(unittest.TestCase):
+    """Резервные копии через backup API: согласованность, манифест, атомарное восстановление"""
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.db_path = os.path.join(self.tmp_dir, 'medical_center.db')
+        self.backup_dir = os.path.join(self.tmp_dir, 'backups')
+        self.pool = create_test_database(self.db_path)
+        with self.pool.connection() as conn:
+            conn.executemany(
+                "INSERT INTO clients (first_name, last_name, phone) VALUES (?, ?, ?)",
+                [(f"Клиент {i}", "Тестов", f"+7 700 {i:07d}") for i in range(5000)]
+            )
+            conn.commit()
+
+    def tearDown(self):
+        """Очистка после тестов"""
+        self.pool.close_all()
+        reset_pool(self.db_path)
+        shutil.rmtree(self.tmp_dir, ignore_errors=True)
+
+    def count_clients(self):
+        with get_pool(self.db_path).connection() as conn:
+            return conn.execute("SELECT COUNT(*) FROM clients").fetchone()[0]
+
+    def test_backup_during_writes_is_consistent(self):
+        stop = threading.Event()
+
+        def writer():
+            with self.pool.connection() as conn:
+                while not stop.is_set():
+                    conn.execute("INSERT INTO clients (first_name, phone) VALUES ('Запись', '0')")
+                    conn.commit()
+
+        thread = threading.Thread(target=writer)
+        thread.start()
+        try:
+            backup_path = backup_store.create_backup_file(self.db_path, self.backup_dir)
+        finally:
+            stop.set()
+            thread.join()
+
+        manifest = backup_store.read_manifest(backup_path)
+        self.assertEqual(manifest['integrity'], 'ok')
+        self.assertGreaterEqual(manifest['row_counts']['clients'], 5000)
+        self.assertEqual(backup_store.verify_backup(backup_path)[0], True)
+
+    def test_compressed_backup_restore(self):
+        backup_path = backup_store.create_backup_file(self.db_path, self.backup_dir, compress=True)
+        manifest = backup_store.read_manifest(backup_path)
+        self.assertTrue(backup_path.endswith('.db.gz'))
+        self.assertLess(manifest['size'], manifest['db_size'])
+
+        with self.pool.connection() as conn:
+            conn.execute("DELETE FROM clients")
+            conn.commit()
+        self.pool.close_all()
+
+        self.assertTrue(backup_store.restore_backup_file(backup_path, self.db_path))
+        self.assertEqual(self.count_clients(), 5000)
+        # Текущая БД сохранена перед восстановлением
+        labels = [b['filename'] for b in backup_store.list_backup_files(self.backup_dir)]
+        self.assertTrue(any('before_restore' in name for name in labels))
+
+    def test_corrupted_backup_not_restored(self):
+        backup_path = backup_store.create_backup_file(self.db_path, self.backup_dir)
+        with open(backup_path, 'r+b') as f:
+            f.seek(4096)
+            f.write(b'corrupted')
+        with self.assertRaises(ValueError):
+            backup_store.restore_backup_file(backup_path, self.db_path)
+        self.assertEqual(self.count_clients(), 5000)
+
+    def test_snapshots_deduplicated(self):
+        first = backup_store.create_snapshot(self.db_path, self.backup_dir)
+        with self.pool.connection() as conn:
+            conn.execute("UPDATE clients SET phone = '+7 777 000 0000' WHERE id = 42")
+            conn.commit()
+        second = backup_store.create_snapshot(self.db_path, self.backup_dir)
+
+        self.assertLess(second['stored_bytes'], first['stored_bytes'] / 4)
+        stats = backup_store.storage_stats(self.backup_dir)
+        self.assertEqual(stats['snapshots'], 2)
+        self.assertGreater(stats['dedup_ratio'], 1.5)
+        # Неизмененная БД не дает нового снимка
+        self.assertIsNone(backup_store.create_snapshot(self.db_path, self.backup_dir, skip_unchanged=True))
+        # Индекс читается из кеша
+        self.assertIs(backup_store.load_index(self.backup_dir), backup_store.load_index(self.backup_dir))
+
+    def test_restore_snapshot_and_delete_chunks(self):
+        snapshot = backup_store.create_snapshot(self.db_path, self.backup_dir)
+        with self.pool.connection() as conn:
+            conn.execute("DELETE FROM clients WHERE id > 100")
+            conn.commit()
+        self.pool.close_all()
+
+        self.assertTrue(backup_store.restore_snapshot(snapshot['id'], self.db_path, self.backup_dir))
+        self.assertEqual(self.count_clients(), 5000)
+        kinds = [s['kind'] for s in backup_store.list_snapshots(self.backup_dir)]
+        self.assertEqual(sorted(kinds), ['before_restore', 'manual'])
+
+        backup_store.delete_snapshots([s['id'] for s in backup_store.list_snapshots(self.backup_dir)], self.backup_dir)
+        chunk_files = [f for _, _, files in os.walk(os.path.join(self.backup_dir, 'chunks')) for f in files]
+        self.assertEqual(chunk_files, [])
+        self.assertEqual(backup_store.storage_stats(self.backup_dir)['chunks'], 0)
+
+    def test_retention_policy(self):
+        from datetime import datetime, timedelta
+        now = datetime(2025, 6, 30, 12, 30)
+        # Автоматический снимок каждый час за 60 дней и один ручной
+        snapshots = [
+            {'id': f"auto{h}", 'kind': 'auto', 'created': (now - timedelta(hours=h)).isoformat()}
+            for h in range(60 * 24)
+        ]
+        snapshots.append({'id': 'manual', 'kind': 'manual', 'created': (now - timedelta(days=59)).isoformat()})
+        policy = {'hourly': 24, 'daily': 7, 'weekly': 4}
+
+        expired = set(backup_store.select_expired(snapshots, policy, now))
+        kept = {s['id'] for s in snapshots} - expired
+        self.assertNotIn('manual', expired)
+        self.assertIn('auto0', kept)
+        self.assertIn('auto23', kept)
+        self.assertNotIn('auto24', kept)
+        # 24 почасовых + до 7 ежедневных + до 4 еженедельных (частично совпадают) + ручной
+        self.assertLessEqual(len(kept), 24 + 7 + 4 + 1)
+        self.assertGreaterEqual(len(kept), 24 + 5 + 2)
+        # Старше четырех недель остаются только ручные снимки
+        old = {f"auto{h}" for h in range(29 * 24, 60 * 24)}
+        self.assertTrue(old <= expired)
+
+
+class TestSyncWorker(unittest.TestCase):
+    """Фоновая синхронизация: склейка запросов, повторы, метрики"""
+
+    def setUp(self):
+        self.calls = []
+        self.results = []
+
+    def fake_sync(self, message, push):
+        self.calls.append((message, push))
+        return self.results.pop(0) if self.results else True
+
+    def test_burst_coalesced_into_one_sync(self):
+        worker = SyncWorker(self.fake_sync, debounce=0.2)
+        for i in range(10):
+            worker.submit(f"Auto-commit: Added payment {i % 2}", push=i == 5)
+        self.assertTrue(worker.flush(timeout=5))
+        worker.stop()
+
+        self.assertEqual(len(self.calls), 1)
+        message, push = self.calls[0]
+        self.assertIn("(+9 more)", message)
+        self.assertTrue(push)
+        metrics = worker.metrics()
+        self.assertEqual(metrics['requests'], 10)
+        self.assertEqual(metrics['coalesced'], 9)
+        self.assertEqual(metrics['queue_depth'], 0)
+        self.assertEqual(metrics['lag_seconds'], 0.0)
+        self.assertIsNotNone(metrics['last_success'])
+
+    def test_retry_with_backoff(self):
+        self.results = [False, False, True]
+        worker = SyncWorker(self.fake_sync, debounce=0.01, retry_base=0.05)
+        worker.submit("Auto-commit: Deleted appointment")
+        self.assertTrue(worker.flush(timeout=5))
+        worker.stop()
+
+        self.assertEqual(len(self.calls), 3)
+        metrics = worker.metrics()
+        self.assertEqual(metrics['failures'], 2)
+        self.assertEqual(metrics['retries'], 2)
+        self.assertEqual(metrics['syncs'], 1)
+
+    def test_bounded_queue_overflow_still_synced(self):
+        release = threading.Event()
+
+        def slow_sync(message, push):
+            release.wait(5)
+            self.calls.append(message)
+            return True
+
+        worker = SyncWorker(slow_sync, debounce=0.01, max_queue=3)
+        worker.submit("first")
+        time.sleep(0.2)  # worker занят первым запросом
+        for i in range(10):
+            worker.submit(f"burst {i}")
+        self.assertLessEqual(worker.metrics()['queue_depth'], 4)
+        release.set()
+        self.assertTrue(worker.flush(timeout=5))
+        worker.stop()
+        self.assertEqual(len(self.calls), 2)
+        self.assertEqual(worker.metrics()['requests'], 11)
+
+    def test_journal_survives_failed_sync(self):
+        journal_path = os.path.join(tempfile.mkdtemp(), 'journal')
+        self.results = [False, False]
+        worker = SyncWorker(self.fake_sync, debounce=0.01, retry_base=60, journal=SyncJournal(journal_path))
+        worker.submit("Auto-commit: Added new client")
+        time.sleep(0.3)
+        worker._stop.set()  # имитация падения процесса во время ожидания повтора
+        worker._thread.join(5)
+
+        # Оборванная строка после сбоя не мешает чтению журнала
+        with open(journal_path, 'a', encoding='utf-8') as f:
+            f.write('{"seq": 2, "mess')
+        recovered = SyncJournal(journal_path)
+        self.assertEqual([entry['message'] for entry in recovered.pending()], ["Auto-commit: Added new client"])
+
+        worker = SyncWorker(self.fake_sync, debounce=0.01, journal=recovered)
+        for entry in recovered.pending():
+            worker.submit(entry['message'], entry['push'], journaled=False)
+        self.assertTrue(worker.flush(timeout=5))
+        worker.stop()
+        self.assertEqual(recovered.pending(), [])
+        self.assertFalse(os.path.exists(journal_path))
+
+    def test_stop_flushes_pending(self):
+        worker = SyncWorker(self.fake_sync, debounce=60)
+        worker.submit("Auto-commit: Added payment")
+        time.sleep(0.1)
+        worker.stop(timeout=5)
+        self.assertEqual(len(self.calls), 1)
+
+
+class TestGitSession(unittest.TestCase):
+    """Кеш проверок Git: после первой синхронизации - только add, commit и push"""
+
+    def setUp(self):
+        """Временный репозиторий с bare remote, глобальный git config изолирован"""
+        self.tmp_dir = tempfile.mkdtemp()
+        self.saved_cwd, self.saved_env = os.getcwd(), dict(os.environ)
+        os.environ['GIT_CONFIG_GLOBAL'] = os.path.join(self.tmp_dir, 'gitconfig')
+        os.environ['GIT_CONFIG_NOSYSTEM'] = '1'
+        remote = os.path.join(self.tmp_dir, 'remote.git')
+        work = os.path.join(self.tmp_dir, 'work')
+        subprocess.run(['git', 'init', '-q', '--bare', '-b', 'main', remote], check=True)
+        subprocess.run(['git', 'init', '-q', '-b', 'main', work], check=True)
+        subprocess.run(['git', 'remote', 'add', 'origin', remote], cwd=work, check=True)
+        os.chdir(work)
+
+        self.patches = [
+            mock.patch.object(git_sync, 'GIT_SYNC_ENABLED', True),
+            mock.patch.object(git_sync, 'PERSISTENCE_BACKEND', 'database_file'),
+            mock.patch.object(git_sync, '_session', git_sync.GitSession()),
+        ]
+        for patch in self.patches:
+            patch.start()
+
+    def tearDown(self):
+        """Очистка после тестов"""
+        for patch in self.patches:
+            patch.stop()
+        os.chdir(self.saved_cwd)
+        os.environ.clear()
+        os.environ.update(self.saved_env)
+        shutil.rmtree(self.tmp_dir, ignore_errors=True)
+
+    def write_db(self, content):
+        with open(git_sync.DB_FILE, 'w') as f:
+            f.write(content)
+
+    def test_repeated_sync_uses_cached_probes(self):
+        self.write_db('v1')
+        self.assertTrue(git_sync.sync_database_to_git("first", push=True))
+        first = git_sync.get_git_stats()['last_sync']
+
+        self.write_db('v2')
+        self.assertTrue(git_sync.sync_database_to_git("second", push=True))
+        second = git_sync.get_git_stats()['last_sync']
+
+        self.assertGreater(first['subprocesses'], second['subprocesses'])
+        self.assertEqual(second['commands'], ['git add', 'git commit', 'git push'])
+        self.assertGreater(second['wall_time'], 0)
+
+    def test_unchanged_database_skips_push(self):
+        self.write_db('v1')
+        git_sync.sync_database_to_git("first", push=True)
+        self.assertTrue(git_sync.sync_database_to_git("no changes", push=True))
+        self.assertEqual(git_sync.get_git_stats()['last_sync']['commands'], ['git add', 'git commit'])
+
+
+class TestGitObjects(unittest.TestCase):
+    """Прямая запись коммитов: результат должен быть неотличим от git add + git commit"""
+
+    def setUp(self):
+        """Репозиторий с упакованной историей (pack-файлы с дельтами)"""
+        self.tmp_dir = tempfile.mkdtemp()
+        self.saved_env = dict(os.environ)
+        os.environ['GIT_CONFIG_GLOBAL'] = os.path.join(self.tmp_dir, 'gitconfig')
+        os.environ['GIT_CONFIG_NOSYSTEM'] = '1'
+        self.repo = os.path.join(self.tmp_dir, 'work')
+        self.git('init', '-q', '-b', 'main', self.repo, cwd=self.tmp_dir)
+        self.git('config', 'user.name', 'test')
+        self.git('config', 'user.email', 'test@example.com')
+        os.makedirs(os.path.join(self.repo, 'sync', 'changes'))
+        for i in range(5):
+            self.write('app.py', 'print("hello")\n' * 200 + f'# version {i}\n')
+            self.write('sync/changes/000001.jsonl', f'{{"seq": {i}}}\n')
+            self.git('add', '-A')
+            self.git('commit', '-q', '-m', f'commit {i}')
+        self.git('gc', '-q', '--aggressive')
+
+    def tearDown(self):
+        """Очистка после тестов"""
+        os.environ.clear()
+        os.environ.update(self.saved_env)
+        shutil.rmtree(self.tmp_dir, ignore_errors=True)
+
+    def git(self, *args, cwd=None):
+        result = subprocess.run(['git'] + list(args), cwd=cwd or self.repo, capture_output=True, text=True)
+        self.assertEqual(result.returncode, 0, result.stderr)
+        return result.stdout
+
+    def write(self, rel_path, content):
+        with open(os.path.join(self.repo, rel_path), 'w', encoding='utf-8') as f:
+            f.write(content)
+
+    def test_read_packed_objects(self):
+        git_dir = git_objects.find_git_dir(self.repo)
+        reader = git_objects.ObjectReader(git_dir)
+        head = git_objects.resolve_ref(git_dir, git_objects.read_head(git_dir))
+        self.assertFalse(os.path.exists(os.path.join(git_dir, 'objects', head[:2], head[2:])))
+        for rev in ('HEAD', 'HEAD~4'):
+            sha = self.git('rev-parse', f'{rev}:app.py').strip()
+            self.assertEqual(reader.read(sha)[1].decode(), self.git('cat-file', 'blob', sha))
+
+    def test_commit_directory_matches_cli(self):
+        self.write('sync/changes/000002.jsonl', '{"seq": 10}\n')
+        os.unlink(os.path.join(self.repo, 'sync', 'changes', '000001.jsonl'))
+        self.write('sync/snapshot.json', '{}\n')
+
+        sha = git_objects.commit_paths(self.repo, ['sync'], 'Auto-commit: test', 'test', 'test@example.com')
+        self.assertEqual(self.git('rev-parse', 'HEAD').strip(), sha)
+        self.assertEqual(
+            sorted(self.git('ls-tree', '-r', '--name-only', 'HEAD').split()),
+            ['app.py', 'sync/changes/000002.jsonl', 'sync/snapshot.json']
+        )
+        # index и рабочая копия согласованы с новым коммитом
+        self.assertEqual(self.git('status', '--porcelain'), '')
+        self.git('fsck', '--strict')
+
+        # Повторный коммит без изменений не создается
+        self.assertIsNone(git_objects.commit_paths(self.repo, ['sync'], 'noop', 'test', 'test@example.com'))
+
+    def test_ref_moved_concurrently(self):
+        git_dir = git_objects.find_git_dir(self.repo)
+        with self.assertRaises(git_objects.GitObjectsError):
+            git_objects.update_ref(git_dir, 'refs/heads/main', '0' * 40, '1' * 40, 'test <t@e> 0 +0000', 'x')
+
+
+class TestCalendarIndex(unittest.TestCase):
+    """Индекс календаря: каждый прием попадает ровно в одну ячейку (дата, слот)"""
+
+    @staticmethod
+    def make_row(apt_id, apt_date, apt_time, doctor_id=1):
+        return (apt_id, 1, doctor_id, 1, apt_date, apt_time, 'записан')
+
+    def test_slots_follow_granularity(self):
+        from datetime import time as dtime
+        self.assertEqual(len(calendar_index.build_time_slots(15, 9, 18)), 36)
+        slots = calendar_index.build_time_slots(30, 9, 18)
+        self.assertEqual(len(slots), 18)
+        self.assertEqual((slots[0], slots[-1]), (dtime(9, 0), dtime(17, 30)))
+        with self.assertRaises(ValueError):
+            calendar_index.build_time_slots(0)
+
+    def test_appointments_bucketed_by_slot(self):
+        from datetime import date as ddate, time as dtime
+        rows = [
+            self.make_row(1, '2025-03-03', '09:00:00'),
+            self.make_row(2, '2025-03-03', '09:00:00', doctor_id=2),
+            self.make_row(3, '2025-03-03', '09:10:00'),
+            self.make_row(4, '2025-03-04', '17:59'),
+            self.make_row(5, '2025-03-04', '08:30:00'),
+            self.make_row(6, '2025-03-04', '18:00:00'),
+        ]
+        index = calendar_index.CalendarIndex(rows, slot_minutes=15, day_start=9, day_end=18)
+        monday, tuesday = ddate(2025, 3, 3), ddate(2025, 3, 4)
+
+        self.assertEqual([r[0] for r in index.get(monday, dtime(9, 0))], [1, 2, 3])
+        self.assertEqual([r[0] for r in index.get(tuesday, dtime(17, 45))], [4])
+        self.assertEqual([r[0] for r in index.outside_hours], [5, 6])
+        self.assertEqual(index.get(tuesday, dtime(9, 0)), [])
+        self.assertEqual((len(index), index.count_for_day(monday)), (6, 3))
+        # С шагом 10 минут 09:10 - отдельный слот
+        fine = calendar_index.CalendarIndex(rows, slot_minutes=10, day_start=9, day_end=18)
+        self.assertEqual([r[0] for r in fine.get(monday, dtime(9, 10))], [3])
+        self.assertEqual([r[0] for r in fine.get(tuesday, dtime(17, 50))], [4])
+
+    def test_fetch_appointments_filters(self):
+        handle, path = tempfile.mkstemp(suffix='.db')
+        os.close(handle)
+        pool = create_test_database(path)
+        try:
+            with pool.connection() as conn:
+                conn.execute("INSERT INTO clients (first_name, last_name, phone) VALUES ('Иван', 'Петров', '1')")
+                conn.executemany(
+                    "INSERT INTO doctors (first_name, last_name, specialization) VALUES (?, 'Врач', 'Терапевт')",
+                    [('А',), ('Б',), ('В',)]
+                )
+                conn.execute("INSERT INTO services (name, price) VALUES ('Прием', 1000)")
+                conn.executemany(
+                    "INSERT INTO appointments (client_id, doctor_id, service_id, appointment_date, appointment_time, status) "
+                    "VALUES (1, ?, 1, ?, ?, ?)",
+                    [
+                        (1, '2025-03-03', '10:00:00', 'записан'),
+                        (2, '2025-03-03', '09:00:00', 'отменен'),
+                        (3, '2025-03-04', '09:00:00', 'записан'),
+                        (1, '2025-03-10', '09:00:00', 'записан'),
+                    ]
+                )
+                conn.commit()
+
+                rows = calendar_index.fetch_appointments(conn, '2025-03-03', '2025-03-09')
+                self.assertEqual([(r.doctor_id, r.appointment_time) for r in rows],
+                                 [(2, '09:00:00'), (1, '10:00:00'), (3, '09:00:00')])
+                self.assertEqual(rows[0][13], rows[0].doctor_first_name)
+
+                rows = calendar_index.fetch_appointments(conn, '2025-03-03', '2025-03-09', doctor_ids={1, 3})
+                self.assertEqual(sorted(r.doctor_id for r in rows), [1, 3])
+                rows = calendar_index.fetch_appointments(
+                    conn, '2025-03-03', '2025-03-09', doctor_ids={1, 2, 3}, statuses=['записан']
+                )
+                self.assertEqual(sorted(r.doctor_id for r in rows), [1, 3])
+                self.assertEqual(calendar_index.fetch_appointments(conn, '2025-03-03', '2025-03-09', doctor_ids=set()), [])
+        finally:
+            pool.close_all()
+            os.unlink(path)
+
+
+class TestCalendarCache(unittest.TestCase):
+    """Кеш недели календаря: повторный показ без чтения приемов, дочитывание изменений"""
+
+    def setUp(self):
+        handle, self.path = tempfile.mkstemp(suffix='.db')
+        os.close(handle)
+        self.pool = create_test_database(self.path)
+        self.conn = self.pool.acquire()
+        self.conn.execute("INSERT INTO clients (first_name, last_name, phone) VALUES ('Иван', 'Петров', '1')")
+        self.conn.executemany(
+            "INSERT INTO doctors (first_name, last_name, specialization) VALUES (?, 'Врач', 'Терапевт')", [('А',), ('Б',)]
+        )
+        self.conn.execute("INSERT INTO services (name, price) VALUES ('Прием', 1000)")
+        for day in range(3, 8):
+            self.add_appointment(f'2025-03-0{day}', '10:00:00', doctor_id=1 + day % 2)
+        self.conn.commit()
+        self.cache = calendar_cache.CalendarCache(max_entries=2)
+        self.week = ('2025-03-03', '2025-03-09')
+
+    def tearDown(self):
+        self.conn.close()
+        self.pool.close_all()
+        os.unlink(self.path)
+
+    def add_appointment(self, apt_date, apt_time, doctor_id=1):
+        cursor = self.conn.execute(
+            "INSERT INTO appointments (client_id, doctor_id, service_id, appointment_date, appointment_time) "
+            "VALUES (1, ?, 1, ?, ?)", (doctor_id, apt_date, apt_time)
+        )
+        return cursor.lastrowid
+
+    def test_hit_when_nothing_changed(self):
+        first = self.cache.get_week(self.conn, *self.week)
+        second = self.cache.get_week(self.conn, *self.week)
+        self.assertIs(first, second)
+        self.assertEqual(len(first), 5)
+        stats = self.cache.stats()
+        self.assertEqual((stats['misses'], stats['hits'], stats['refreshes']), (1, 1, 0))
+
+    def test_incremental_refresh_after_writes(self):
+        from datetime import date as ddate, time as dtime
+        self.cache.get_week(self.conn, *self.week, doctor_ids={1})
+        new_id = self.add_appointment('2025-03-04', '11:00:00', doctor_id=1)
+        self.add_appointment('2025-03-04', '12:00:00', doctor_id=2)
+        self.add_appointment('2025-03-20', '12:00:00', doctor_id=1)
+        self.conn.execute("DELETE FROM appointments WHERE id = 2")
+        self.conn.commit()
+
+        with mock.patch.object(calendar_cache, 'fetch_appointments', wraps=calendar_cache.fetch_appointments) as fetch:
+            grid = self.cache.get_week(self.conn, *self.week, doctor_ids={1})
+        # Дочитаны только измененные приемы
+        self.assertEqual(fetch.call_args.kwargs['appointment_ids'], {new_id, new_id + 1, new_id + 2, 2})
+        expected = self.cache.make_key(*self.week, {1})
+        self.assertIn(expected, self.cache._entries)
+        fresh = calendar_index.fetch_appointments(self.conn, *self.week, doctor_ids={1})
+        self.assertEqual([r.id for r in grid.cells[(ddate(2025, 3, 4), dtime(11, 0))]], [new_id])
+        self.assertEqual(sorted(r.id for c in grid.cells.values() for r in c), sorted(r.id for r in fresh))
+        self.assertEqual(self.cache.stats()['refreshes'], 1)
+
+    def test_reference_change_and_force_reread(self):
+        self.cache.get_week(self.conn, *self.week)
+        self.conn.execute("UPDATE clients SET first_name = 'Пётр' WHERE id = 1")
+        self.conn.commit()
+        grid = self.cache.get_week(self.conn, *self.week)
+        self.assertTrue(all(r.client_first_name == 'Пётр' for c in grid.cells.values() for r in c))
+        self.cache.get_week(self.conn, *self.week, force=True)
+        self.assertEqual(self.cache.stats()['misses'], 3)
+
+    def test_lru_bound(self):
+        for doctors in ({1}, {2}, {1, 2}):
+            self.cache.get_week(self.conn, *self.week, doctor_ids=doctors)
+        self.assertEqual(self.cache.stats()['entries'], 2)
+        self.assertNotIn(self.cache.make_key(*self.week, {1}), self.cache._entries)
+
+
+class TestClientSearch(unittest.TestCase):
+    """Поиск клиентов по FTS5: индекс следует за таблицей, транслитерация, телефоны, ранжирование"""
+
+    CLIENTS = [
+        ('Иван', 'Петров', '+7 (701) 555-12-34'),
+        ('Aigerim', 'Nurlanova', '87015551111'),
+        ('Петр', 'Иванов', '+7 777 000 0000'),
+        ('Марина', 'Иванова', '+7 702 123 4567'),
+        ('Ли', 'Мин', '+7 705 000 1122'),
+        ('Давид', 'Ливанов', '+7 707 000 3344'),
+    ]
+
+    def setUp(self):
+        handle, self.path = tempfile.mkstemp(suffix='.db')
+        os.close(handle)
+        self.pool = create_test_database(self.path)
+        self.conn = self.pool.acquire()
+        self.conn.executemany("INSERT INTO clients (first_name, last_name, phone) VALUES (?, ?, ?)", self.CLIENTS)
+        self.conn.commit()
+
+    def tearDown(self):
+        self.conn.close()
+        self.pool.close_all()
+        os.unlink(self.path)
+
+    def names(self, query, **kwargs):
+        return [f"{row[1]} {row[2]}" for row in client_search.search_client_rows(self.conn, query, **kwargs)]
+
+    def test_substring_and_ranking(self):
+        # Слово целиком, затем начало имени или фамилии (короче - выше), затем подстрока
+        self.assertEqual(self.names('иван')[0], 'Иван Петров')
+        self.assertEqual(self.names('ива'), ['Петр Иванов', 'Иван Петров', 'Марина Иванова', 'Давид Ливанов'])
+        self.assertEqual(self.names('ива', limit=2, offset=2), ['Марина Иванова', 'Давид Ливанов'])
+        self.assertEqual(self.names('ИВАНОВА'), ['Марина Иванова'])
+        self.assertEqual(self.names('иван петр'), ['Иван Петров', 'Петр Иванов'])
+
+    def test_transliteration(self):
+        self.assertEqual(self.names('Ivan')[0], 'Иван Петров')
+        self.assertEqual(self.names('айгерим'), ['Aigerim Nurlanova'])
+        self.assertEqual(self.names('nurlan'), ['Aigerim Nurlanova'])
+
+    def test_phone_digits(self):
+        self.assertEqual(self.names('555-12'), ['Иван Петров'])
+        self.assertEqual(self.names('8 701 555 12 34'), ['Иван Петров'])
+        self.assertEqual(self.names('+7 701 555 11 11'), ['Aigerim Nurlanova'])
+
+    def test_short_query_falls_back_to_like(self):
+        self.assertIsNone(client_search.build_match_expression('Ли'))
+        self.assertEqual(set(self.names('Ли')), {'Ли Мин', 'Давид Ливанов'})
+
+    def test_index_follows_table(self):
+        self.conn.execute("UPDATE clients SET last_name = 'Сидоров' WHERE id = 1")
+        self.conn.execute("DELETE FROM clients WHERE id = 3")
+        self.conn.execute("INSERT INTO clients (first_name, last_name, phone) VALUES ('Олег', 'Сидоренко', '1')")
+        self.conn.commit()
+        self.assertEqual(set(self.names('сидор')), {'Иван Сидоров', 'Олег Сидоренко'})
+        self.assertEqual(self.names('петров'), [])
+        self.assertNotIn('Петр Иванов', self.names('иванов'))
+        fts_rows = self.conn.execute("SELECT COUNT(*) FROM clients_fts").fetchone()[0]
+        self.assertEqual(fts_rows, self.conn.execute("SELECT COUNT(*) FROM clients").fetchone()[0])
+
+    def test_query_uses_index(self):
+        expression = client_search.build_match_expression('иван')
+        plan = [row[3] for row in self.conn.execute(
+            "EXPLAIN QUERY PLAN SELECT c.id FROM clients_fts f JOIN clients c ON c.id = f.rowid "
+            "WHERE clients_fts MATCH ? LIMIT 2000", (expression,)
+        )]
+        self.assertTrue(any('VIRTUAL TABLE INDEX' in detail for detail in plan), plan)
+        self.assertFalse(any(detail.startswith('SCAN c') for detail in plan), plan)
+
+
+class TestAnalyticsRollup(unittest.TestCase):
+    """Дневная сводка аналитики: пересчет измененных дней, оплаты по методам, совпадение с прямым запросом"""
+
+    def setUp(self):
+        handle, self.path = tempfile.mkstemp(suffix='.db')
+        os.close(handle)
+        self.pool = create_test_database(self.path)
+        self.conn = self.pool.acquire()
+        self.conn.executemany(
+            "INSERT INTO doctors (first_name, last_name, specialization) VALUES (?, ?, 'терапевт')",
+            [('Анна', 'Смирнова'), ('Олег', 'Ким')]
+        )
+        self.conn.executemany("INSERT INTO services (name, price) VALUES (?, ?)", [('Осмотр', 5000), ('УЗИ', 8000)])
+        self.conn.execute("INSERT INTO clients (first_name, phone) VALUES ('Иван', '1')")
+        appointments = [
+            (1, 1, '2024-03-01', 'прием завершен', 'instagram', 30),
+            (1, 2, '2024-03-01', 'прием завершен', 'instagram', 40),
+            (2, 1, '2024-03-01', 'записан', None, None),
+            (2, 2, '2024-03-02', 'не явился', '2gis', None),
+        ]
+        self.conn.executemany(
+            "INSERT INTO appointments (client_id, doctor_id, service_id, appointment_date, appointment_time, "
+            "status, source, actual_duration_minutes) VALUES (1, ?, ?, ?, '10:00', ?, ?, ?)", appointments
+        )
+        self.conn.execute("INSERT INTO appointment_services (appointment_id, service_id, price) VALUES (1, 1, 5000)")
+        self.conn.execute("INSERT INTO appointment_services (appointment_id, service_id, price) VALUES (2, 2, 8000)")
+        self.conn.executemany(
+            "INSERT INTO appointment_service_payments (appointment_service_id, payment_method, amount) VALUES (?, ?, ?)",
+            [(1, 'Kaspi QR', 3000), (1, 'Наличные', 2000), (2, 'Kaspi QR', 8000)]
+        )
+        self.conn.commit()
+
+    def tearDown(self):
+        self.conn.close()
+        self.pool.close_all()
+        os.unlink(self.path)
+
+    def totals(self, start='2024-03-01', end='2024-03-31', doctor_ids=None):
+        rows = analytics_rollup.query_rollup(self.conn, start, end, doctor_ids)
+        columns = analytics_rollup.ROLLUP_COLUMNS
+        result = {}
+        for row in rows:
+            record = dict(zip(columns, row))
+            for field in ('appointments', 'revenue', 'paid_amount', 'paid_appointments'):
+                result[field] = result.get(field, 0) + record[field]
+            if record['payment_method']:
+                result.setdefault('methods', {})
+                result['methods'][record['payment_method']] = (
+                    result['methods'].get(record['payment_method'], 0) + record['paid_amount']
+                )
+        return result
+
+    def test_matches_direct_aggregation(self):
+        totals = self.totals()
+        direct = self.conn.execute(
+            "SELECT (SELECT COUNT(*) FROM appointments), (SELECT SUM(price) FROM appointment_services)"
+        ).fetchone()
+        self.assertEqual((totals['appointments'], totals['revenue']), direct)
+        self.assertEqual(totals['paid_amount'], 13000)
+        # Прием 1 оплачен двумя методами, но в строках без метода считается один раз
+        self.assertEqual(totals['methods'], {'Kaspi QR': 11000, 'Наличные': 2000})
+        self.assertEqual(self.totals(doctor_ids=[2])['appointments'], 2)
+        self.assertEqual(self.totals('2024-03-02', '2024-03-02')['appointments'], 1)
+        by_day = analytics_rollup.query_rollup(self.conn, '2024-03-01', '2024-03-31', dimensions=['day'])
+        appointments = analytics_rollup.ROLLUP_COLUMNS.index('appointments')
+        self.assertEqual([(row[0], row[appointments]) for row in by_day], [('2024-03-01', 3), ('2024-03-02', 1)])
+        by_service = analytics_rollup.query_rollup(self.conn, '2024-03-01', '2024-03-31', dimensions=['service_id'])
+        service_name = analytics_rollup.ROLLUP_COLUMNS.index('service_name')
+        self.assertEqual(sorted((row[service_name], row[appointments]) for row in by_service),
+                         [('Осмотр', 2), ('УЗИ', 2)])
+
+    def test_detail_rows_totals_and_payments(self):
+        self.conn.execute("INSERT INTO appointment_services (appointment_id, service_id, price) VALUES (1, 2, 1500)")
+        self.conn.commit()
+        rows = analytics_queries.fetch_analytics_rows(self.conn, '2024-03-01', '2024-03-31')
+        columns = analytics_queries.ANALYTICS_COLUMNS
+        by_id = {row[0]: dict(zip(columns, row)) for row in rows}
+        self.assertEqual(len(rows), 4)
+        # Стоимость - сумма всех услуг приема, а не цена основной услуги
+        self.assertEqual(by_id[1]['total_cost'], 6500)
+        self.assertEqual(by_id[1]['paid_amount'], 5000)
+        self.assertEqual(sorted(by_id[1]['payment_methods'].split(', ')), ['Kaspi QR', 'Наличные'])
+        self.assertEqual((by_id[3]['total_cost'], by_id[3]['payment_methods']),
+                         (0, analytics_queries.DEFAULT_PAYMENT_METHOD))
+        filtered = analytics_queries.fetch_analytics_rows(self.conn, '2024-03-01', '2024-03-31', doctor_ids=[2])
+        self.assertEqual([row[0] for row in filtered], [3, 4])
+
+    def test_only_dirty_days_refreshed(self):
+        self.totals()
+        self.assertEqual(analytics_rollup.refresh_rollup(self.conn), 0)
+        self.conn.execute("UPDATE appointments SET status = 'прием завершен' WHERE id = 4")
+        self.conn.commit()
+        self.assertEqual(
+            [row[0] for row in self.conn.execute("SELECT day FROM _analytics_dirty_days")], ['2024-03-02']
+        )
+        self.assertEqual(analytics_rollup.refresh_rollup(self.conn), 1)
+        statuses = self.conn.execute(
+            "SELECT status FROM analytics_daily WHERE day = '2024-03-02' AND payment_method = ''"
+        ).fetchall()
+        self.assertEqual(statuses, [('прием завершен',)])
+
+    def test_refresh_inside_open_transaction(self):
+        """Пересчет внутри транзакции вызывающего не фиксирует и не откатывает его изменения"""
+        self.totals()
+        self.conn.execute("UPDATE appointments SET status = 'прием завершен' WHERE id = 4")
+        self.assertEqual(analytics_rollup.refresh_rollup(self.conn), 1)
+        self.assertTrue(self.conn.in_transaction)
+        self.conn.rollback()
+        status = self.conn.execute("SELECT status FROM appointments WHERE id = 4").fetchone()[0]
+        self.assertEqual(status, 'не явился')
+        self.assertEqual(analytics_rollup.refresh_rollup(self.conn), 0)
+        self.assertEqual(self.totals('2024-03-02', '2024-03-02')['appointments'], 1)
+
+    def test_moved_appointment_leaves_old_day(self):
+        self.totals()
+        self.conn.execute("UPDATE appointments SET appointment_date = '2024-03-05' WHERE id = 1")
+        self.conn.commit()
+        self.assertEqual(self.totals('2024-03-01', '2024-03-01')['appointments'], 2)
+        moved = self.totals('2024-03-05', '2024-03-05')
+        self.assertEqual((moved['appointments'], moved['paid_amount']), (1, 5000))
+
+    def test_payments_and_deletes_mark_day(self):
+        self.totals()
+        self.conn.execute(
+            "INSERT INTO appointment_service_payments (appointment_service_id, payment_method, amount) "
+            "VALUES (2, 'Карта', 500)"
+        )
+        self.conn.commit()
+        self.assertEqual(self.totals()['methods']['Карта'], 500)
+        self.conn.execute("DELETE FROM appointment_service_payments WHERE appointment_service_id = 2")
+        self.conn.execute("DELETE FROM appointments WHERE id = 3")
+        self.conn.commit()
+        totals = self.totals()
+        self.assertEqual((totals['appointments'], totals['paid_amount']), (3, 5000))
+
+    def test_revenue_follows_appointment_services(self):
+        self.totals()
+        # Цена в справочнике не меняет выручку уже записанных приемов
+        self.conn.execute("UPDATE services SET price = 6000 WHERE id = 1")
+        self.conn.execute("UPDATE appointment_services SET price = 4500 WHERE id = 1")
+        self.conn.execute("INSERT INTO appointment_services (appointment_id, service_id, price) VALUES (1, 2, 1000)")
+        self.conn.commit()
+        self.assertEqual(analytics_rollup.refresh_rollup(self.conn), 1)
+        self.assertEqual(self.totals()['revenue'], 4500 + 1000 + 8000)
+        self.assertEqual(analytics_rollup.rebuild_rollup(self.conn), -1)
+        self.assertEqual(self.totals()['revenue'], 4500 + 1000 + 8000)
+
+class TestAnalyticsSnapshots(unittest.TestCase):
+    """Снимки закрытых месяцев: разбиение периода, версии месяцев, чтение снимка вместо БД"""
+
+    def setUp(self):
+        handle, self.path = tempfile.mkstemp(suffix='.db')
+        os.close(handle)
+        self.snapshot_dir = tempfile.mkdtemp()
+        self.pool = create_test_database(self.path)
+        self.conn = self.pool.acquire()
+        self.conn.execute("INSERT INTO doctors (first_name, last_name, specialization) VALUES ('Анна', 'Смирнова', 'терапевт')")
+        self.conn.execute("INSERT INTO services (name, price) VALUES ('Осмотр', 5000)")
+        self.conn.execute("INSERT INTO clients (first_name, last_name, phone) VALUES ('Иван', 'Петров', '1')")
+        self.conn.executemany(
+            "INSERT INTO appointments (client_id, doctor_id, service_id, appointment_date, appointment_time) "
+            "VALUES (1, 1, 1, ?, '10:00')", [('2024-02-10',), ('2024-03-05',), ('2024-04-02',)]
+        )
+        self.conn.commit()
+
+    def tearDown(self):
+        self.conn.close()
+        self.pool.close_all()
+        os.unlink(self.path)
+        shutil.rmtree(self.snapshot_dir, ignore_errors=True)
+
+    def test_split_period(self):
+        from datetime import date as ddate
+        months, live = analytics_snapshots.split_period(ddate(2024, 1, 15), ddate(2024, 4, 10), today=ddate(2024, 4, 3))
+        self.assertEqual(months, [ddate(2024, 1, 1), ddate(2024, 2, 1), ddate(2024, 3, 1)])
+        self.assertEqual(live, (ddate(2024, 4, 1), ddate(2024, 4, 10)))
+        months, live = analytics_snapshots.split_period(ddate(2023, 12, 1), ddate(2023, 12, 31), today=ddate(2024, 4, 3))
+        self.assertEqual((months, live), ([ddate(2023, 12, 1)], None))
+
+    def test_month_key_changes_only_for_touched_month(self):
+        from datetime import date as ddate
+        february = analytics_snapshots.snapshot_key(self.conn, ddate(2024, 2, 1))
+        march = analytics_snapshots.snapshot_key(self.conn, ddate(2024, 3, 1))
+        self.conn.execute("UPDATE appointments SET status = 'прием завершен' WHERE appointment_date = '2024-03-05'")
+        self.conn.commit()
+        self.assertEqual(analytics_snapshots.snapshot_key(self.conn, ddate(2024, 2, 1)), february)
+        self.assertNotEqual(analytics_snapshots.snapshot_key(self.conn, ddate(2024, 3, 1)), march)
+        # Имя клиента видно в строках всех месяцев
+        self.conn.execute("UPDATE clients SET last_name = 'Сидоров' WHERE id = 1")
+        self.conn.commit()
+        self.assertNotEqual(analytics_snapshots.snapshot_key(self.conn, ddate(2024, 2, 1)), february)
+
+    @unittest.skipUnless(analytics_snapshots.SNAPSHOTS_AVAILABLE, "pandas/pyarrow не установлены")
+    def test_closed_months_served_from_snapshot(self):
+        from datetime import date as ddate
+        def load():
+            return analytics_snapshots.load_analytics_period(
+                self.conn, ddate(2024, 2, 1), ddate(2024, 4, 30), snapshot_dir=self.snapshot_dir, today=ddate(2024, 4, 3)
+            )
+
+        self.assertEqual(len(load()), 3)
+        self.assertEqual(analytics_snapshots.snapshot_stats(self.snapshot_dir)['files'], 2)
+        df, from_snapshot = analytics_snapshots.load_month(self.conn, ddate(2024, 2, 1), self.snapshot_dir)
+        self.assertTrue(from_snapshot)
+        self.assertEqual(str(df['doctor_name'].dtype), 'category')
+
+        self.conn.execute("DELETE FROM appointments WHERE appointment_date = '2024-03-05'")
+        self.conn.commit()
+        self.assertEqual(list(load()['appointment_date']), ['2024-02-10', '2024-04-02'])
+        self.assertEqual(analytics_snapshots.snapshot_stats(self.snapshot_dir)['files'], 2)
+
+class TestAnalyticsCache(unittest.TestCase):
+    """Кеш аналитики: попадание без записи, сброс ровно после записи, ограничение по объему"""
+
+    def setUp(self):
+        handle, self.path = tempfile.mkstemp(suffix='.db')
+        os.close(handle)
+        self.pool = create_test_database(self.path)
+        self.conn = self.pool.acquire()
+        self.conn.execute("INSERT INTO doctors (first_name, last_name, specialization) VALUES ('Анна', 'Смирнова', 'терапевт')")
+        self.conn.execute("INSERT INTO services (name, price) VALUES ('Осмотр', 5000)")
+        self.conn.execute("INSERT INTO clients (first_name, last_name, phone) VALUES ('Иван', 'Петров', '1')")
+        self.conn.execute(
+            "INSERT INTO appointments (client_id, doctor_id, service_id, appointment_date, appointment_time) "
+            "VALUES (1, 1, 1, '2024-03-01', '10:00')"
+        )
+        self.conn.execute("INSERT INTO appointment_services (appointment_id, service_id, price) VALUES (1, 1, 5000)")
+        self.conn.commit()
+        self.cache = analytics_cache.AnalyticsCache()
+        self.loads = 0
+
+    def tearDown(self):
+        self.conn.close()
+        self.pool.close_all()
+        os.unlink(self.path)
+
+    def get(self, params=('2024-03-01', '2024-03-31', [1])):
+        def loader():
+            self.loads += 1
+            return analytics_queries.fetch_analytics_rows(self.conn, *params)
+        return self.cache.get(self.conn, 'details', params, loader)
+
+    def test_hit_until_write(self):
+        self.get()
+        self.get(('2024-03-01', '2024-03-31', {1}))
+        self.assertEqual(self.loads, 1)
+
+        writes = [
+            "INSERT INTO appointment_service_payments (appointment_service_id, payment_method, amount) "
+            "VALUES (1, 'Наличные', 5000)",
+            "UPDATE appointments SET status = 'прием завершен' WHERE id = 1",
+            "UPDATE clients SET last_name = 'Сидоров' WHERE id = 1",
+            "DELETE FROM appointments WHERE id = 1",
+        ]
+        for expected_loads, statement in enumerate(writes, start=2):
+            self.conn.execute(statement)
+            self.conn.commit()
+            self.get()
+            self.get()
+            self.assertEqual(self.loads, expected_loads, statement)
+        self.assertEqual(self.get(), [])
+        stats = self.cache.stats()
+        self.assertEqual((stats['misses'], stats['invalidations']), (1, len(writes)))
+
+    def test_lru_bounds(self):
+        cache = analytics_cache.AnalyticsCache(max_entries=2, max_bytes=10 ** 6)
+        for day in ('01', '02', '03'):
+            cache.get(self.conn, 'details', (day,), lambda: [('x',)])
+        self.assertEqual(cache.stats()['entries'], 2)
+        self.assertEqual(cache.stats()['evictions'], 1)
+
+        small = analytics_cache.AnalyticsCache(max_entries=10, max_bytes=20000)
+        for day in ('01', '02', '03'):
+            small.get(self.conn, 'details', (day,), lambda: ['x' * 8000])
+        self.assertLessEqual(small.stats()['bytes'], 20000)
+        self.assertEqual(small.stats()['entries'], 2)
+
+
+class TestAnalyticsKpi(unittest.TestCase):
+    """KPI за один проход совпадают с группировками по отдельности"""
+
+    def frame(self, rows):
+        import pandas as pd
+        return pd.DataFrame(rows, columns=analytics_rollup.ROLLUP_COLUMNS)
+
+    def setUp(self):
+        # day, doctor_id, doctor_name, service_id, service_name, source, status, payment_method, показатели
+        self.current = self.frame([
+            (None, 1, 'Анна С', 1, 'Осмотр', 'instagram', 'прием завершен', '', 3, 15000, 90, 3, 0, 0),
+            (None, 1, 'Анна С', 1, 'Осмотр', 'instagram', 'прием завершен', 'Kaspi QR', 0, 0, 0, 0, 9000, 2),
+            (None, 1, 'Анна С', 1, 'Осмотр', 'instagram', 'прием завершен', 'Наличные', 0, 0, 0, 0, 6000, 1),
+            (None, 2, 'Олег К', 2, 'УЗИ', '', 'записан', '', 1, 8000, 0, 0, 0, 0),
+        ])
+        self.previous = self.frame([(None, 1, 'Анна С', 1, 'Осмотр', '', 'прием завершен', '', 2, 10000, 0, 0, 0, 0)])
+        self.timeline = self.frame([
+            ('2024-03-01', None, None, None, None, None, None, None, 3, 15000, 0, 0, 0, 0),
+            ('2024-03-02', None, None, None, None, None, None, None, 1, 8000, 0, 0, 0, 0),
+        ])
+
+    def test_totals_and_breakdowns(self):
+        kpis = analytics_kpi.compute_kpis(self.current, self.previous, self.timeline)
+        self.assertEqual(kpis.totals['appointments'], 4)
+        self.assertEqual(kpis.totals['revenue'], 23000)
+        self.assertEqual(kpis.totals['completed'], 3)
+        self.assertEqual(dict(kpis.by_status), {'прием завершен': 3, 'записан': 1})
+        self.assertEqual(dict(kpis.by_doctor), {'Анна С': 3, 'Олег К': 1})
+        self.assertEqual(list(kpis.sources.index), ['instagram'])
+        self.assertEqual(dict(kpis.payments['total_amount']), {'Kaspi QR': 9000, 'Наличные': 6000})
+        self.assertEqual(dict(kpis.timeline), {'2024-03-01': 3, '2024-03-02': 1})
+
+    def test_deltas(self):
+        kpis = analytics_kpi.compute_kpis(self.current, self.previous, self.timeline)
+        self.assertAlmostEqual(kpis.deltas['appointments'], 100.0)
+        self.assertAlmostEqual(kpis.deltas['completion_rate'], 75.0 - 100.0)
+        no_previous = analytics_kpi.compute_kpis(self.current, self.frame([]), self.timeline)
+        self.assertIsNone(no_previous.deltas['revenue'])
+
+
+class TestAppointmentDetails(unittest.TestCase):
+    """Загрузка формы приема: постоянное число запросов на одном соединении, итоги как у отдельных функций"""
+
+    def setUp(self):
+        handle, self.path = tempfile.mkstemp(suffix='.db')
+        os.close(handle)
+        self.pool = create_test_database(self.path)
+        self.conn = self.pool.acquire()
+        self.conn.execute("INSERT INTO doctors (first_name, last_name, specialization) VALUES ('Анна', 'Смирнова', 'гинеколог')")
+        self.conn.execute("INSERT INTO doctors (first_name, last_name, specialization, is_active) "
+                          "VALUES ('Олег', 'Ким', 'терапевт', 0)")
+        for index in range(12):
+            self.conn.execute("INSERT INTO services (name, price, doctor_id) VALUES (?, ?, ?)",
+                              (f"Услуга {index:02d}", 1000 * (index + 1), 1 if index < 10 else 2))
+        self.conn.execute("INSERT INTO clients (first_name, last_name, phone) VALUES ('Иван', 'Петров', '1')")
+        self.conn.commit()
+
+    def tearDown(self):
+        self.conn.close()
+        self.pool.close_all()
+        os.unlink(self.path)
+
+    def add_appointment(self, service_count):
+        cursor = self.conn.execute(
+            "INSERT INTO appointments (client_id, doctor_id, service_id, appointment_date, appointment_time) "
+            "VALUES (1, 1, 1, '2024-03-01', '10:00:00')"
+        )
+        appointment_id = cursor.lastrowid
+        for service_id in range(1, service_count + 1):
+            line = self.conn.execute(
+                "INSERT INTO appointment_services (appointment_id, service_id, price) VALUES (?, ?, 500)",
+                (appointment_id, service_id),
+            ).lastrowid
+            self.conn.execute(
+                "INSERT INTO appointment_service_payments (appointment_service_id, payment_method, amount) "
+                "VALUES (?, ?, 200)", (line, 'Наличные' if service_id % 2 else 'Карта'),
+            )
+        self.conn.commit()
+        return appointment_id
+
+    def test_aggregate(self):
+        details = appointment_details.load_appointment_details(self.conn, self.add_appointment(3))
+        self.assertEqual(details.appointment.client_first_name, 'Иван')
+        self.assertEqual(details.appointment[10], 'Иван')
+        self.assertEqual([line.service_id for line in details.services], [1, 2, 3])
+        self.assertEqual((details.total_cost, details.total_paid, details.remaining), (1500, 600, 900))
+        self.assertEqual(dict(details.payments), {'Наличные': 400, 'Карта': 200})
+        self.assertEqual([doctor.id for doctor in details.doctors], [1])
+        self.assertEqual(len(details.doctor_services), 10)
+        self.assertEqual({service.doctor_last_name for service in details.all_services}, {'Смирнова'})
+        self.assertIsNone(appointment_details.load_appointment_details(self.conn, 999))
+
+    def test_query_count_does_not_grow_with_services(self):
+        few = appointment_details.load_appointment_details(self.conn, self.add_appointment(1))
+        many = appointment_details.load_appointment_details(self.conn, self.add_appointment(10))
+        self.assertEqual(few.query_count, many.query_count)
+        self.assertLessEqual(many.query_count, 5)
+        self.assertFalse(self.conn.in_transaction)
+
+        # Счетчик снимается с соединения после загрузки
+        with appointment_details.QueryCounter(self.conn) as counter:
+            self.conn.execute("SELECT 1").fetchone()
+        self.conn.execute("SELECT 2").fetchone()
+        self.assertEqual(counter.count, 1)
+
+
+class TestPayments(unittest.TestCase):
+    """Оплата приема: точная раскладка по услугам, одна транзакция, без переплаты при параллельных кассирах"""
+
+    def setUp(self):
+        handle, self.path = tempfile.mkstemp(suffix='.db')
+        os.close(handle)
+        self.pool = create_test_database(self.path)
+        with self.pool.connection() as conn:
+            conn.execute("INSERT INTO appointments (client_id, doctor_id, service_id, appointment_date, appointment_time) "
+                         "VALUES (1, 1, 1, '2024-03-01', '10:00:00')")
+            conn.executemany("INSERT INTO appointment_services (appointment_id, service_id, price) VALUES (1, ?, ?)",
+                             [(1, 1000), (2, 1000), (3, 1000)])
+            conn.commit()
+
+    def tearDown(self):
+        self.pool.close_all()
+        for suffix in ('', '-wal', '-shm'):
+            if os.path.exists(self.path + suffix):
+                os.unlink(self.path + suffix)
+
+    def payment_rows(self, conn):
+        return conn.execute("SELECT appointment_service_id, payment_method, amount "
+                            "FROM appointment_service_payments ORDER BY id").fetchall()
+
+    def test_split_is_exact(self):
+        rows = payments.split_payment([(1, 1000), (2, 1000), (3, 1000)], {'Карта': 1000, 'Наличные': 0})
+        self.assertEqual([row[2] for row in rows], [333.34, 333.33, 333.33])
+        self.assertEqual(sum(row[2] for row in rows), 1000)
+        rows = payments.split_payment([(1, 0), (2, 500)], {'Kaspi QR': 100})
+        self.assertEqual(rows, [(2, 'Kaspi QR', 100)])
+
+    def test_post_payment_single_transaction(self):
+        with self.pool.connection() as conn:
+            result = payments.post_payment_rows(conn, 1, {'Карта': 1000, 'Наличные': 500})
+            self.assertEqual((result['total_paid'], result['remaining'], result['rows']), (1500, 1500, 6))
+            self.assertEqual(result['payment_status'], 'частично оплачено')
+            self.assertEqual(len(self.payment_rows(conn)), 6)
+
+            with self.assertRaises(payments.ValidationError):
+                payments.post_payment_rows(conn, 1, {'Карта': 2000})
+            self.assertFalse(conn.in_transaction)
+            self.assertEqual(len(self.payment_rows(conn)), 6)
+
+            result = payments.post_payment_rows(conn, 1, {'Kaspi QR': 1500})
+            status = conn.execute("SELECT payment_status FROM appointments WHERE id = 1").fetchone()[0]
+            self.assertEqual((result['remaining'], status), (0, 'оплачено'))
+
+    def test_concurrent_cashiers_cannot_overpay(self):
+        outcomes = []
+        barrier = threading.Barrier(4)
+
+        def cashier(method):
+            with self.pool.connection() as conn:
+                barrier.wait()
+                try:
+                    payments.post_payment_rows(conn, 1, {method: 3000})
+                    outcomes.append('ok')
+                except payments.ValidationError:
+                    outcomes.append('rejected')
+
+        threads = [threading.Thread(target=cashier, args=(method,))
+                   for method in ('Карта', 'Наличные', 'Kaspi QR', 'Перевод')]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(sorted(outcomes), ['ok', 'rejected', 'rejected', 'rejected'])
+        with self.pool.connection() as conn:
+            self.assertEqual(sum(row[2] for row in self.payment_rows(conn)), 3000)
+
+    def test_post_payment_inside_open_transaction(self):
+        """Во вложенном соединении оплата идет в точке сохранения и не ломает внешнюю транзакцию"""
+        with self.pool.connection() as outer:
+            outer.execute("UPDATE appointments SET notes = 'касса' WHERE id = 1")
+            with self.pool.connection() as conn:
+                payments.post_payment_rows(conn, 1, {'Карта': 1000})
+                with self.assertRaises(payments.ValidationError):
+                    payments.post_payment_rows(conn, 1, {'Карта': 5000})
+                self.assertTrue(conn.in_transaction)
+                conn.commit()
+            outer.commit()
+            row = outer.execute("SELECT notes, payment_status FROM appointments WHERE id = 1").fetchone()
+            self.assertEqual(row, ('касса', 'частично оплачено'))
+            self.assertEqual(len(self.payment_rows(outer)), 3)
+
+
+class TestAppointmentBalance(unittest.TestCase):
+    """Итоги приема в строке appointments: триггеры, индекс неоплаченных, проверка и исправление"""
+
+    def setUp(self):
+        handle, self.path = tempfile.mkstemp(suffix='.db')
+        os.close(handle)
+        self.pool = create_test_database(self.path)
+        self.conn = self.pool.acquire()
+        self.conn.execute("INSERT INTO clients (first_name, last_name, phone) VALUES ('Иван', 'Петров', '1')")
+        for day in ('2024-03-01', '2024-03-02'):
+            self.conn.execute("INSERT INTO appointments (client_id, doctor_id, service_id, appointment_date, "
+                              "appointment_time) VALUES (1, 1, 1, ?, '10:00:00')", (day,))
+        self.conn.executemany("INSERT INTO appointment_services (appointment_id, service_id, price) VALUES (?, ?, ?)",
+                              [(1, 1, 3000), (1, 2, 2000), (2, 1, 1000)])
+        self.conn.commit()
+
+    def tearDown(self):
+        self.conn.close()
+        self.pool.close_all()
+        os.unlink(self.path)
+
+    def balance(self, appointment_id=1):
+        return self.conn.execute("SELECT total_cost, total_paid, payment_status FROM appointments WHERE id = ?",
+                                 (appointment_id,)).fetchone()
+
+    def test_triggers_keep_totals(self):
+        self.assertEqual(self.balance(), (5000, 0, 'не оплачено'))
+        payments.post_payment_rows(self.conn, 1, {'Карта': 1000})
+        self.assertEqual(self.balance(), (5000, 1000, 'частично оплачено'))
+
+        self.conn.execute("UPDATE appointment_services SET price = 0 WHERE appointment_id = 1 AND service_id = 2")
+        self.assertEqual(self.balance()[0], 3000)
+        # Строка переносится в другой прием вместе со своими оплатами
+        self.conn.execute("UPDATE appointment_services SET appointment_id = 2 WHERE appointment_id = 1 AND service_id = 2")
+        self.assertEqual(self.balance(2)[:2], (1000, 400))
+        self.assertEqual(self.balance()[:2], (3000, 600))
+
+        self.conn.execute("DELETE FROM appointment_service_payments WHERE amount = 600")
+        self.assertEqual(self.balance(), (3000, 0, 'не оплачено'))
+        self.conn.execute("DELETE FROM appointment_services WHERE appointment_id = 2 AND service_id = 2")
+        self.assertEqual(self.balance(2), (1000, 0, 'не оплачено'))
+        self.conn.commit()
+        self.assertEqual(appointment_balance.check_balances(self.conn), [])
+
+    def test_unpaid_list_uses_index(self):
+        payments.post_payment_rows(self.conn, 2, {'Наличные': 1000})
+        unpaid = appointment_balance.fetch_unpaid(self.conn)
+        self.assertEqual([(row[0], row[7]) for row in unpaid], [(1, 5000)])
+        plan = ' '.join(row[3] for row in self.conn.execute(
+            "EXPLAIN QUERY PLAN SELECT id FROM appointments WHERE total_cost - total_paid > "
+            f"{appointment_balance.BALANCE_EPSILON} ORDER BY appointment_date DESC, appointment_time DESC"
+        ))
+        self.assertIn('idx_appointments_unpaid', plan)
+
+    def test_check_and_repair(self):
+        self.conn.execute("DROP TRIGGER _bal_payments_ins")
+        self.conn.execute("INSERT INTO appointment_service_payments (appointment_service_id, payment_method, amount) "
+                          "VALUES (3, 'Карта', 1000)")
+        self.conn.commit()
+        mismatches = appointment_balance.check_balances(self.conn)
+        self.assertEqual(mismatches, [(2, (1000, 0, 'не оплачено'), (1000, 1000, 'оплачено'))])
+        appointment_balance.check_balances(self.conn, repair=True)
+        self.assertEqual(self.balance(2), (1000, 1000, 'оплачено'))
+        self.assertEqual(appointment_balance.check_balances(self.conn), [])
+
+    def test_migration_reruns_over_existing_columns(self):
+        """v8 повторно (файл с колонками итогов и user_version ниже 8) не падает на ADD COLUMN"""
+        self.conn.execute("UPDATE appointments SET total_cost = 0")
+        self.conn.execute("PRAGMA user_version = 7")
+        self.conn.commit()
+        self.assertEqual(apply_schema_migrations(self.conn)[0], 8)
+        self.assertEqual(self.balance(), (5000, 0, 'не оплачено'))
+        self.assertEqual(appointment_balance.check_balances(self.conn), [])
+
+
+class TestAvailability(unittest.TestCase):
+    """Свободное время врачей: пересечения с учетом длительности и поиск окон"""
+
+    def setUp(self):
+        handle, self.path = tempfile.mkstemp(suffix='.db')
+        os.close(handle)
+        self.pool = create_test_database(self.path)
+        self.conn = self.pool.acquire()
+        self.conn.executemany("INSERT INTO doctors (first_name, last_name, specialization) VALUES (?, ?, ?)",
+                              [('Анна', 'Смирнова', 'гинеколог'), ('Олег', 'Ким', 'гинеколог'),
+                               ('Ирина', 'Ли', 'терапевт')])
+        self.conn.executemany("INSERT INTO services (name, price, duration_minutes, doctor_id) VALUES (?, 1000, ?, 1)",
+                              [('Прием', 60), ('УЗИ', 30)])
+        self.conn.executemany(
+            "INSERT INTO appointments (client_id, doctor_id, service_id, appointment_date, appointment_time, status) "
+            "VALUES (1, ?, ?, ?, ?, ?)",
+            [(1, 1, '2024-03-01', '10:00:00', 'записан'), (1, 2, '2024-03-01', '11:00:00', 'записан'),
+             (1, 1, '2024-03-01', '12:00:00', 'отменен'), (2, 1, '2024-03-01', '09:00:00', 'записан')]
+        )
+        self.conn.commit()
+        self.engine = availability.load_availability(self.conn, '2024-03-01', '2024-03-31')
+
+    def tearDown(self):
+        self.conn.close()
+        self.pool.close_all()
+        os.unlink(self.path)
+
+    def test_overlaps_use_duration(self):
+        self.assertEqual(self.engine.conflict(1, '2024-03-01', '10:30', 30), 1)
+        self.assertEqual(self.engine.conflict(1, '2024-03-01', '09:45', 30), 1)
+        self.assertEqual(self.engine.conflict(1, '2024-03-01', '11:15', 30), 2)
+        self.assertTrue(self.engine.is_free(1, '2024-03-01', '11:30', 30))
+        self.assertTrue(self.engine.is_free(1, '2024-03-01', '09:30', 30))
+        # Отмененный прием время не занимает
+        self.assertTrue(self.engine.is_free(1, '2024-03-01', '12:00', 60))
+        self.assertTrue(self.engine.is_free(2, '2024-03-01', '10:00', 60))
+
+    def test_next_free_slots(self):
+        from datetime import datetime as ddatetime
+        slots = self.engine.next_free_slots(1, 60, ddatetime(2024, 3, 1, 8, 0), count=3)
+        self.assertEqual([slot.strftime('%H:%M') for slot in slots], ['09:00', '11:30', '11:45'])
+        late = self.engine.next_free_slots(1, 60, ddatetime(2024, 3, 1, 17, 10), count=1)
+        self.assertEqual(late, [ddatetime(2024, 3, 2, 9, 0)])
+
+        first = self.engine.first_free_slot('гинеколог', 60, ddatetime(2024, 3, 1, 9, 30))
+        self.assertEqual(first, (ddatetime(2024, 3, 1, 10, 0), 2))
+        self.assertIsNone(self.engine.first_free_slot('хирург', 60, ddatetime(2024, 3, 1, 9, 0)))
+
+    def test_matches_linear_scan(self):
+        import random
+        rng = random.Random(24)
+        intervals = []
+        busy = availability.BusyIntervals()
+        for appointment_id in range(300):
+            start = rng.randrange(0, 20000)
+            end = start + rng.choice((15, 30, 60, 240))
+            intervals.append((start, end, appointment_id))
+            busy.add(start, end, appointment_id)
+        for _ in range(2000):
+            start = rng.randrange(0, 20500)
+            end = start + rng.choice((10, 30, 90))
+            overlapping = any(s < end and e > start for s, e, _ in intervals)
+            self.assertEqual(busy.is_free(start, end), not overlapping)
+
+
+class TestAppointmentSeries(unittest.TestCase):
+    """Курс приемов: правила повторения, одна транзакция, конфликты по каждой дате"""
+
+    def setUp(self):
+        handle, self.path = tempfile.mkstemp(suffix='.db')
+        os.close(handle)
+        self.pool = create_test_database(self.path)
+        self.conn = self.pool.acquire()
+        self.conn.execute("INSERT INTO clients (first_name, last_name, phone) VALUES ('Иван', 'Петров', '1')")
+        self.conn.execute("INSERT INTO doctors (first_name, last_name, specialization) VALUES ('Анна', 'Ли', 'физиотерапевт')")
+        self.conn.execute("INSERT INTO services (name, price, duration_minutes, doctor_id) VALUES ('Сеанс', 4000, 45, 1)")
+        self.conn.commit()
+
+    def tearDown(self):
+        self.conn.close()
+        self.pool.close_all()
+        os.unlink(self.path)
+
+    def test_expand_recurrence(self):
+        from datetime import date as ddate
+        weekly = appointment_series.expand_recurrence(ddate(2024, 3, 6), count=4, weekdays=[0, 2])
+        self.assertEqual(weekly, [ddate(2024, 3, 6), ddate(2024, 3, 11), ddate(2024, 3, 13), ddate(2024, 3, 18)])
+        every_other = appointment_series.expand_recurrence('2024-03-01', frequency='daily', interval=2,
+                                                           until='2024-03-07')
+        self.assertEqual([day.day for day in every_other], [1, 3, 5, 7])
+        fortnightly = appointment_series.expand_recurrence(ddate(2024, 3, 1), count=3, interval=2)
+        self.assertEqual([day.isoformat() for day in fortnightly], ['2024-03-01', '2024-03-15', '2024-03-29'])
+        with self.assertRaises(ValueError):
+            appointment_series.expand_recurrence(ddate(2024, 3, 1))
+
+    def test_series_is_all_or_nothing(self):
+        from datetime import date as ddate
+        dates = appointment_series.expand_recurrence(ddate(2024, 3, 1), count=10, frequency='daily')
+        self.conn.execute("INSERT INTO appointments (client_id, doctor_id, service_id, appointment_date, appointment_time) "
+                          "VALUES (1, 1, 1, '2024-03-04', '10:30:00')")
+        self.conn.commit()
+
+        result = appointment_series.create_series_rows(self.conn, 1, 1, 1, dates, '10:00:00')
+        self.assertEqual(result, {'created': [], 'conflicts': [(ddate(2024, 3, 4), 1)]})
+        self.assertFalse(self.conn.in_transaction)
+        self.assertEqual(self.conn.execute("SELECT COUNT(*) FROM appointments").fetchone()[0], 1)
+
+        result = appointment_series.create_series_rows(self.conn, 1, 1, 1, dates, '10:00:00', skip_conflicts=True)
+        self.assertEqual(len(result['created']), 9)
+        rows = self.conn.execute("SELECT COUNT(*), SUM(total_cost) FROM appointments WHERE appointment_time = '10:00:00'"
+                                 ).fetchone()
+        self.assertEqual(rows, (9, 36000))
+
+        # Повторная серия в то же время целиком занята
+        again = appointment_series.create_series_rows(self.conn, 1, 1, 1, dates[:3], '10:15:00')
+        self.assertEqual([conflict_id is not None for _, conflict_id in again['conflicts']], [True] * 3)
+
+    def test_series_inside_open_transaction(self):
+        from datetime import date as ddate
+        dates = appointment_series.expand_recurrence(ddate(2024, 3, 1), count=3, frequency='daily')
+        self.conn.execute("UPDATE clients SET phone = '2' WHERE id = 1")
+        result = appointment_series.create_series_rows(self.conn, 1, 1, 1, dates, '10:00:00')
+        self.assertEqual(len(result['created']), 3)
+        self.assertTrue(self.conn.in_transaction)
+        self.conn.rollback()
+        self.assertEqual(self.conn.execute("SELECT COUNT(*) FROM appointments").fetchone()[0], 0)
+
+
+def run_performance_tests():
+    """Запуск регрессионных тестов производительности"""
+    print("🧪 РЕГРЕССИОННЫЕ ТЕСТЫ ПРОИЗВОДИТЕЛЬНОСТИ JARDEM")
+    print("=" * 60)
+
+    loader = unittest.TestLoader()
+    suite = unittest.TestSuite()
+    suite.addTests(loader.loadTestsFromTestCase(TestConnectionPool))
+    suite.addTests(loader.loadTestsFromTestCase(TestQueryPlans))
+    suite.addTests(loader.loadTestsFromTestCase(TestChangeLog))
+    suite.addTests(loader.loadTestsFromTestCase(TestBackupStore))
+    suite.addTests(loader.loadTestsFromTestCase(TestSyncWorker))
+    suite.addTests(loader.loadTestsFromTestCase(TestGitSession))
+    suite.addTests(loader.loadTestsFromTestCase(TestGitObjects))
+    suite.addTests(loader.loadTestsFromTestCase(TestCalendarIndex))
+    suite.addTests(loader.loadTestsFromTestCase(TestCalendarCache))
+    suite.addTests(loader.loadTestsFromTestCase(TestClientSearch))
+    suite.addTests(loader.loadTestsFromTestCase(TestAnalyticsRollup))
+    suite.addTests(loader.loadTestsFromTestCase(TestAnalyticsSnapshots))
+    suite.addTests(loader.loadTestsFromTestCase(TestAnalyticsCache))
+    suite.addTests(loader.loadTestsFromTestCase(TestAnalyticsKpi))
+    suite.addTests(loader.loadTestsFromTestCase(TestAppointmentDetails))
+    suite.addTests(loader.loadTestsFromTestCase(TestPayments))
+    suite.addTests(loader.loadTestsFromTestCase(TestAppointmentBalance))
+    suite.addTests(loader.loadTestsFromTestCase(TestAvailability))
+    suite.addTests(loader.loadTestsFromTestCase(TestAppointmentSeries))
+
+    runner = unittest.TextTestRunner(verbosity=2)
+    result = runner.run(suite)
+
+    print("\n" + "=" * 60)
+    print(f"📊 Успешно: {result.testsRun - len(result.failures) - len(result.errors)} из {result.testsRun}")
+    return result
+
+
+if __name__ == "__main__":
+    result = run_performance_tests()
+    sys.exit(0 if result.wasSuccessful() else 1)
@@ -3,7 +3,7 @@
 Скрипт для обновления паролей существующих пользователей в базе данных
 """
 
-import sqlite3
+from db_pool import get_pool
 import bcrypt
 import os
 
@@ -19,61 +19,63 @@ def update_user_passwords():
     print("=" * 80)
     
     # Подключение к базе данных
-    conn = sqlite3.connect('medical_center.db')
-    cursor = conn.cursor()
+    conn = get_pool().acquire()
+    try:
+        cursor = conn.cursor()
     
-    # Список пользователей для обновления
-    users_to_update = [
-        ('owner', OWNER_PASSWORD, 'Владелец системы'),
-        ('admin', ADMIN_PASSWORD, 'Администратор'),
-        ('crm_user', CRM_PASSWORD, 'CRM Пользователь'),
-    ]
+        # Список пользователей для обновления
+        users_to_update = [
+            ('owner', OWNER_PASSWORD, 'Владелец системы'),
+            ('admin', ADMIN_PASSWORD, 'Администратор'),
+            ('crm_user', CRM_PASSWORD, 'CRM Пользователь'),
+        ]
     
-    updated_count = 0
+        updated_count = 0
     
-    for username, password, name in users_to_update:
-        # Проверяем, существует ли пользователь
-        cursor.execute('SELECT id, username FROM users WHERE username = ?', (username,))
-        user = cursor.fetchone()
+        for username, password, name in users_to_update:
+            # Проверяем, существует ли пользователь
+            cursor.execute('SELECT id, username FROM users WHERE username = ?', (username,))
+            user = cursor.fetchone()
         
-        if user:
-            # Хешируем новый пароль
-            salt = bcrypt.gensalt()
-            password_hash = bcrypt.hashpw(password.encode('utf-8'), salt).decode('utf-8')
-            
-            # Обновляем пароль
-            cursor.execute('''
-                UPDATE users 
-                SET password_hash = ?, updated_at = datetime('now')
-                WHERE username = ?
-            ''', (password_hash, username))
+            if user:
+                # Хешируем новый пароль
+                salt = bcrypt.gensalt()
+                password_hash = bcrypt.hashpw(password.encode('utf-8'), salt).decode('utf-8')
             
-            print(f"✅ Обновлен пароль для пользователя: {username} ({name})")
-            updated_count += 1
-        else:
-            # Если пользователь не существует, создаем его
-            salt = bcrypt.gensalt()
-            password_hash = bcrypt.hashpw(password.encode('utf-8'), salt).decode('utf-8')
+                # Обновляем пароль
+                cursor.execute('''
+                    UPDATE users 
+                    SET password_hash = ?, updated_at = datetime('now')
+                    WHERE username = ?
+                ''', (password_hash, username))
             
-            # Определяем уровень доступа
-            if username == 'owner':
-                access_level = 'owner'
-            elif username == 'admin':
-                access_level = 'admin'
+                print(f"✅ Обновлен пароль для пользователя: {username} ({name})")
+                updated_count += 1
             else:
-                access_level = 'crm'
+                # Если пользователь не существует, создаем его
+                salt = bcrypt.gensalt()
+                password_hash = bcrypt.hashpw(password.encode('utf-8'), salt).decode('utf-8')
+            
+                # Определяем уровень доступа
+                if username == 'owner':
+                    access_level = 'owner'
+                elif username == 'admin':
+                    access_level = 'admin'
+                else:
+                    access_level = 'crm'
             
-            cursor.execute('''
-                INSERT INTO users (username, password_hash, name, access_level, created_at)
-                VALUES (?, ?, ?, ?, datetime('now'))
-            ''', (username, password_hash, name, access_level))
+                cursor.execute('''
+                    INSERT INTO users (username, password_hash, name, access_level, created_at)
+                    VALUES (?, ?, ?, ?, datetime('now'))
+                ''', (username, password_hash, name, access_level))
             
-            print(f"✅ Создан новый пользователь: {username} ({name})")
-            updated_count += 1
+                print(f"✅ Создан новый пользователь: {username} ({name})")
+                updated_count += 1
     
-    # Сохраняем изменения
-    conn.commit()
-    conn.close()
+        # Сохраняем изменения
+        conn.commit()
+    finally:
+        conn.close()
     
     print("\n" + "=" * 80)
     print(f"✅ Успешно обновлено/создано пользователей: {updated_count}")